@@ -7,17 +7,23 @@ Endpoints:
 - POST /format_input          Format and enhance lyrics/caption via LLM
 - GET  /v1/models             List available models
 - GET  /v1/audio              Download audio file
+- GET  /v1/stream             Stream audio while it is being decoded
+- POST /v1/cancel             Cancel queued or running tasks
 - GET  /health                Health check
 
 NOTE:
-- In-memory queue and job store -> run uvicorn with workers=1.
+- In-memory queue -> run uvicorn with workers=1.
+- Job store is in-memory by default; set ACESTEP_JOB_STORE=sqlite (and optionally
+  ACESTEP_JOB_STORE_PATH) to persist jobs and re-enqueue queued ones on restart.
 """
 
 from __future__ import annotations
 
 import asyncio
 import glob
+import itertools
 import json
+import math
 import os
 import random
 import sys
@@ -29,22 +35,30 @@ import aiofiles
 from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
 from threading import Lock
 from typing import Any, Dict, List, Literal, Optional
-from uuid import uuid4
 
 try:
     from dotenv import load_dotenv
 except ImportError:  # Optional dependency
     load_dotenv = None  # type: ignore
 
-from fastapi import FastAPI, HTTPException, Request, Depends, Header
+from fastapi import FastAPI, HTTPException, Request, Depends, Header, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel, Field
 from starlette.datastructures import UploadFile as StarletteUploadFile
 
 from acestep.handler import AceStepHandler
+from acestep.job_store import InMemoryJobStore, JobRecord, create_job_store
+from acestep.embedding_cache import get_text_embedding_cache
+from acestep.dit_batching import create_dit_batch_scheduler, request_duration
+from acestep.job_cost_model import JobFeatures, create_job_cost_model
+from acestep.result_cache import create_generation_result_cache
+from acestep.job_events import TERMINAL_STATUSES, JobEventBus, create_job_event_bus
+from acestep.dit_registry import DiTModelRegistry, create_dit_model_registry
+from acestep.cancellation import CancellationToken, JobCancelledError
+from acestep.model_residency import module_nbytes, residency_budget_bytes
 from acestep.llm_inference import LLMHandler
 from acestep.constants import (
     DEFAULT_DIT_INSTRUCTION,
@@ -203,6 +217,7 @@ def _get_project_root() -> str:
 
 RESULT_KEY_PREFIX = "ace_step_v1.5_"
 RESULT_EXPIRE_SECONDS = 7 * 24 * 60 * 60  # 7 days
+MAX_EVENT_TASK_IDS = 100  # task IDs per /v1/events subscription
 TASK_TIMEOUT_SECONDS = 3600  # 1 hour
 JOB_STORE_CLEANUP_INTERVAL = 300  # 5 minutes - interval for cleaning up old jobs
 JOB_STORE_MAX_AGE_SECONDS = 86400  # 24 hours - completed jobs older than this will be cleaned
@@ -435,6 +450,10 @@ class GenerateMusicRequest(BaseModel):
     use_format: bool = Field(default=False, description="Use format_sample() to enhance input (default: False)")
     # Model name for multi-model support (select which DiT model to use)
     model: Optional[str] = Field(default=None, description="Model name to use (e.g., 'acestep-v15-turbo')")
+    # Deadline: the job is cancelled (queued or running) once this many seconds passed since submission
+    timeout_seconds: Optional[float] = Field(
+        default=None, description="Cancel the job if it has not finished this many seconds after submission"
+    )
 
     bpm: Optional[int] = None
     # Accept common client keys via manual parsing (see RequestParser).
@@ -542,111 +561,63 @@ class JobResponse(BaseModel):
     error: Optional[str] = None
 
 
-@dataclass
-class _JobRecord:
-    job_id: str
-    status: JobStatus
-    created_at: float
-    started_at: Optional[float] = None
-    finished_at: Optional[float] = None
-    result: Optional[Dict[str, Any]] = None
-    error: Optional[str] = None
-    env: str = "development"
-
-
-class _JobStore:
-    def __init__(self, max_age_seconds: int = JOB_STORE_MAX_AGE_SECONDS) -> None:
-        self._lock = Lock()
-        self._jobs: Dict[str, _JobRecord] = {}
-        self._max_age = max_age_seconds
-
-    def create(self) -> _JobRecord:
-        job_id = str(uuid4())
-        rec = _JobRecord(job_id=job_id, status="queued", created_at=time.time())
-        with self._lock:
-            self._jobs[job_id] = rec
-        return rec
-
-    def create_with_id(self, job_id: str, env: str = "development") -> _JobRecord:
-        """Create job record with specified ID"""
-        rec = _JobRecord(
-            job_id=job_id,
-            status="queued",
-            created_at=time.time(),
-            env=env
-        )
-        with self._lock:
-            self._jobs[job_id] = rec
-        return rec
-
-    def get(self, job_id: str) -> Optional[_JobRecord]:
-        with self._lock:
-            return self._jobs.get(job_id)
-
-    def mark_running(self, job_id: str) -> None:
-        with self._lock:
-            rec = self._jobs[job_id]
-            rec.status = "running"
-            rec.started_at = time.time()
-
-    def mark_succeeded(self, job_id: str, result: Dict[str, Any]) -> None:
-        with self._lock:
-            rec = self._jobs[job_id]
-            rec.status = "succeeded"
-            rec.finished_at = time.time()
-            rec.result = result
-            rec.error = None
-
-    def mark_failed(self, job_id: str, error: str) -> None:
-        with self._lock:
-            rec = self._jobs[job_id]
-            rec.status = "failed"
-            rec.finished_at = time.time()
-            rec.result = None
-            rec.error = error
-
-    def cleanup_old_jobs(self, max_age_seconds: Optional[int] = None) -> int:
-        """
-        Clean up completed jobs older than max_age_seconds.
+# Job store backends live in acestep.job_store; keep the historical private names.
+_JobRecord = JobRecord
+_JobStore = InMemoryJobStore
 
-        Only removes jobs with status 'succeeded' or 'failed'.
-        Jobs that are 'queued' or 'running' are never removed.
 
-        Returns the number of jobs removed.
-        """
-        max_age = max_age_seconds if max_age_seconds is not None else self._max_age
-        now = time.time()
-        removed = 0
-
-        with self._lock:
-            to_remove = []
-            for job_id, rec in self._jobs.items():
-                if rec.status in ("succeeded", "failed"):
-                    finish_time = rec.finished_at or rec.created_at
-                    age = now - finish_time
-                    if age > max_age:
-                        to_remove.append(job_id)
-
-            for job_id in to_remove:
-                del self._jobs[job_id]
-                removed += 1
-
-        return removed
-
-    def get_stats(self) -> Dict[str, int]:
-        """Get statistics about jobs in the store."""
-        with self._lock:
-            stats = {
-                "total": len(self._jobs),
-                "queued": 0,
-                "running": 0,
-                "succeeded": 0,
-                "failed": 0,
-            }
-            for rec in self._jobs.values():
-                if rec.status in stats:
-                    stats[rec.status] += 1
-            return stats
+def _request_to_dict(req: GenerateMusicRequest) -> Dict[str, Any]:
+    """Serialize a request for persistent job stores (pydantic v1/v2 compatible)."""
+    dump = getattr(req, "model_dump", None)
+    return dump() if dump is not None else req.dict()
+
+
+class _JobAudioStream:
+    """
+    Live decoded audio for a running job.
+
+    The generation thread pushes VAE-decoded segments [batch, channels, samples]
+    as soon as each tile is ready; any number of HTTP clients can follow along
+    from the start of the track via iter_segments().
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, audio_format: str) -> None:
+        self.audio_format = audio_format
+        self.sample_rate = 48000
+        self.segments: List[Any] = []
+        self.done = False
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def _wake(self) -> None:
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    def push(self, segment: Any, sample_rate: int) -> None:
+        """Append a decoded segment (called from the generation thread)."""
+        self.sample_rate = sample_rate
+        self.segments.append(segment)
+        self._loop.call_soon_threadsafe(self._wake)
+
+    def close(self) -> None:
+        """Mark the stream finished (thread-safe)."""
+        self.done = True
+        self._loop.call_soon_threadsafe(self._wake)
+
+    async def iter_segments(self, index: int):
+        """Yield [channels, samples] segments of one batch item until the job finishes."""
+        pos = 0
+        while True:
+            event = self._event
+            if pos < len(self.segments):
+                segment = self.segments[pos]
+                pos += 1
+                if index < segment.shape[0]:
+                    yield segment[index]
+                continue
+            if self.done:
+                return
+            await event.wait()
 
 
 def _env_bool(name: str, default: bool) -> bool:
@@ -833,13 +804,19 @@ async def _save_upload_to_temp(upload: StarletteUploadFile, *, prefix: str) -> s
 
 
 def create_app() -> FastAPI:
-    store = _JobStore()
+    store = create_job_store(max_age_seconds=JOB_STORE_MAX_AGE_SECONDS)
+    # Identical fixed-seed requests share one job (in flight or recently finished)
+    result_cache = create_generation_result_cache()
+    # Per-stage cost predictions for ETAs and queue admission
+    cost_model = create_job_cost_model()
 
     # API Key authentication (from environment variable)
     api_key = os.getenv("ACESTEP_API_KEY", None)
     set_api_key(api_key)
 
     QUEUE_MAXSIZE = int(os.getenv("ACESTEP_QUEUE_MAXSIZE", "200"))
+    # Longest a job may take from submission to completion (0 disables the server-side deadline)
+    JOB_DEADLINE_SECONDS = float(os.getenv("ACESTEP_JOB_DEADLINE_SECONDS", str(TASK_TIMEOUT_SECONDS)))
     WORKER_COUNT = int(os.getenv("ACESTEP_QUEUE_WORKERS", "1"))  # Single GPU recommended
 
     INITIAL_AVG_JOB_SECONDS = float(os.getenv("ACESTEP_AVG_JOB_SECONDS", "5.0"))
@@ -854,6 +831,13 @@ def create_app() -> FastAPI:
         encoded_path = urllib.parse.quote(path, safe="")
         return f"/v1/audio?path={encoded_path}"
 
+    def _audio_url_to_path(url: str) -> Optional[str]:
+        """Local file path of a URL made by _path_to_audio_url, or None for remote URLs"""
+        prefix = "/v1/audio?path="
+        if not url or not url.startswith(prefix):
+            return None
+        return urllib.parse.unquote(url[len(prefix):])
+
     @asynccontextmanager
     async def lifespan(app: FastAPI):
         # Clear proxy env that may affect downstream libs
@@ -900,26 +884,18 @@ def create_app() -> FastAPI:
         app.state._llm_init_error = None
         app.state._llm_init_lock = Lock()
 
-        # Multi-model support: secondary DiT handlers
-        handler2 = None
-        handler3 = None
-        config_path2 = os.getenv("ACESTEP_CONFIG_PATH2", "").strip()
-        config_path3 = os.getenv("ACESTEP_CONFIG_PATH3", "").strip()
-        
-        if config_path2:
-            handler2 = AceStepHandler()
-        if config_path3:
-            handler3 = AceStepHandler()
-        
-        app.state.handler2 = handler2
-        app.state.handler3 = handler3
-        app.state._initialized2 = False
-        app.state._initialized3 = False
+        # Multi-model support: DiT handlers by model name, loaded on demand (set up at startup)
+        app.state.dit_registry = None
         app.state._config_path = os.getenv("ACESTEP_CONFIG_PATH", "acestep-v15-turbo")
-        app.state._config_path2 = config_path2
-        app.state._config_path3 = config_path3
 
         max_workers = int(os.getenv("ACESTEP_API_WORKERS", "1"))
+
+        # DiT batching: run up to max_batch_size jobs concurrently so their DiT stages
+        # can be merged; the scheduler's session keeps GPU work serialized.
+        dit_scheduler = create_dit_batch_scheduler()
+        use_dit_batching = dit_scheduler.enabled
+        if use_dit_batching:
+            max_workers = max(max_workers, dit_scheduler.max_batch_size)
         executor = ThreadPoolExecutor(max_workers=max_workers)
 
         # Queue & observability
@@ -929,6 +905,10 @@ def create_app() -> FastAPI:
 
         # temp files per job (from multipart uploads)
         app.state.job_temp_files = {}  # job_id -> list[path]
+        app.state.job_streams = {}  # job_id -> _JobAudioStream (while queued/running)
+        app.state.job_cancel_tokens = {}  # job_id -> CancellationToken (while queued/running)
+        app.state.job_clients = {}  # job_id -> clients sharing the job (coalesced requests), if more than one
+        app.state.job_events = create_job_event_bus(asyncio.get_running_loop())
         app.state.job_temp_files_lock = asyncio.Lock()
 
         # stats
@@ -938,6 +918,7 @@ def create_app() -> FastAPI:
 
         app.state.handler = handler
         app.state.executor = executor
+        app.state.dit_scheduler = dit_scheduler
         app.state.job_store = store
         app.state._python_executable = sys.executable
         
@@ -1047,50 +1028,27 @@ def create_app() -> FastAPI:
             result_key = f"{RESULT_KEY_PREFIX}{job_id}"
             local_cache.set(result_key, result_data, ex=RESULT_EXPIRE_SECONDS)
 
-        async def _run_one_job(job_id: str, req: GenerateMusicRequest) -> None:
+        async def _run_one_job(job_id: str, req: GenerateMusicRequest, h: AceStepHandler, selected_model_name: str) -> None:
             job_store: _JobStore = app.state.job_store
             llm: LLMHandler = app.state.llm_handler
             executor: ThreadPoolExecutor = app.state.executor
 
-            await _ensure_initialized()
             job_store.mark_running(job_id)
+            cost_model.start(job_id)
+            features = _job_features(req)
+            events: JobEventBus = app.state.job_events
+            events.publish(job_id, "running")
+            cancel_token: Optional[CancellationToken] = app.state.job_cancel_tokens.get(job_id)
             
-            # Select DiT handler based on user's model choice
-            # Default: use primary handler
-            selected_handler: AceStepHandler = app.state.handler
-            selected_model_name = _get_model_name(app.state._config_path)
-            
-            if req.model:
-                model_matched = False
-                
-                # Check if it matches the second model
-                if app.state.handler2 and getattr(app.state, "_initialized2", False):
-                    model2_name = _get_model_name(app.state._config_path2)
-                    if req.model == model2_name:
-                        selected_handler = app.state.handler2
-                        selected_model_name = model2_name
-                        model_matched = True
-                        print(f"[API Server] Job {job_id}: Using second model: {model2_name}")
-                
-                # Check if it matches the third model
-                if not model_matched and app.state.handler3 and getattr(app.state, "_initialized3", False):
-                    model3_name = _get_model_name(app.state._config_path3)
-                    if req.model == model3_name:
-                        selected_handler = app.state.handler3
-                        selected_model_name = model3_name
-                        model_matched = True
-                        print(f"[API Server] Job {job_id}: Using third model: {model3_name}")
-                
-                if not model_matched:
-                    available_models = [_get_model_name(app.state._config_path)]
-                    if app.state.handler2 and getattr(app.state, "_initialized2", False):
-                        available_models.append(_get_model_name(app.state._config_path2))
-                    if app.state.handler3 and getattr(app.state, "_initialized3", False):
-                        available_models.append(_get_model_name(app.state._config_path3))
-                    print(f"[API Server] Job {job_id}: Model '{req.model}' not found in {available_models}, using primary: {selected_model_name}")
-            
-            # Use selected handler for generation
-            h: AceStepHandler = selected_handler
+            audio_stream: Optional[_JobAudioStream] = app.state.job_streams.get(job_id)
+
+            def _report_progress(value: Any, desc: Optional[str] = None, *args, **kwargs) -> None:
+                """generate_music() progress callback (generation thread) -> job events."""
+                try:
+                    value = round(float(value), 3)
+                except (TypeError, ValueError):
+                    value = None
+                events.publish_threadsafe(job_id, "progress", progress=value, stage=desc)
 
             def _blocking_generate() -> Dict[str, Any]:
                 """Generate music using unified inference logic from acestep.inference"""
@@ -1203,6 +1161,8 @@ def create_app() -> FastAPI:
                     else:
                         sample_language = parsed_language
 
+                    if cancel_token is not None:
+                        cancel_token.check()
                     sample_result = create_sample(
                         llm_handler=llm,
                         query=sample_query,
@@ -1246,6 +1206,8 @@ def create_app() -> FastAPI:
                     if req.vocal_language and req.vocal_language != "unknown":
                         user_metadata_for_format['language'] = req.vocal_language
                     
+                    if cancel_token is not None:
+                        cancel_token.check()
                     format_result = format_sample(
                         llm_handler=llm,
                         caption=caption,
@@ -1335,7 +1297,8 @@ def create_app() -> FastAPI:
                     batch_size=batch_size,
                     allow_lm_batch=req.allow_lm_batch,
                     use_random_seed=req.use_random_seed,
-                    seeds=None,  # Let unified logic handle seed generation
+                    # A fixed seed pins the first audio; the unified logic fills in the rest
+                    seeds=None if req.use_random_seed or req.seed < 0 else req.seed,
                     audio_format=req.audio_format,
                     constrained_decoding_debug=req.constrained_decoding_debug,
                 )
@@ -1345,13 +1308,18 @@ def create_app() -> FastAPI:
                 llm_to_pass = llm if llm_is_initialized else None
 
                 # Generate music using unified interface
+                if cancel_token is not None:
+                    cancel_token.check()
                 result = generate_music(
                     dit_handler=h,
                     llm_handler=llm_to_pass,
                     params=params,
                     config=config,
                     save_dir=app.state.temp_audio_dir,
-                    progress=None,
+                    progress=_report_progress,
+                    audio_chunk_callback=audio_stream.push if audio_stream is not None else None,
+                    dit_generate_fn=partial(dit_scheduler.submit, h) if use_dit_batching else None,
+                    cancel_token=cancel_token,
                 )
 
                 if not result.success:
@@ -1420,7 +1388,7 @@ def create_app() -> FastAPI:
 
                 # Get model information
                 lm_model_name = os.getenv("ACESTEP_LM_MODEL_PATH", "acestep-5Hz-lm-0.6B")
-                # Use selected_model_name (set at the beginning of _run_one_job)
+                # The DiT model the job runs on (resolved by the DiT model registry)
                 dit_model_name = selected_model_name
                 
                 return {
@@ -1442,21 +1410,51 @@ def create_app() -> FastAPI:
                     "timesignature": _none_if_na_str(metas_out.get("timesignature")),
                     "lm_model": lm_model_name,
                     "dit_model": dit_model_name,
+                    "time_costs": time_costs,
                 }
 
+            # Execution start: time spent waiting for an executor thread or the session
+            # slot is queueing, not part of the job's cost
+            exec_start: List[float] = []
+
+            def _blocking_generate_timed() -> Dict[str, Any]:
+                exec_start.append(time.time())
+                cost_model.start(job_id)
+                return _blocking_generate()
+
+            def _blocking_generate_in_session() -> Dict[str, Any]:
+                with dit_scheduler.session():
+                    return _blocking_generate_timed()
+
             t0 = time.time()
             try:
                 loop = asyncio.get_running_loop()
-                result = await loop.run_in_executor(executor, _blocking_generate)
+                result = await loop.run_in_executor(
+                    executor, _blocking_generate_in_session if use_dit_batching else _blocking_generate_timed
+                )
                 job_store.mark_succeeded(job_id, result)
+                cost_model.observe(
+                    features, result.get("time_costs") or {}, time.time() - exec_start[0], result.get("duration")
+                )
 
                 # Update local cache
                 _update_local_cache(job_id, result, "succeeded")
-            except Exception:
+                audio_files = [_audio_url_to_path(u) for u in result.get("audio_paths", [])]
+                result_cache.finish(job_id, result, files=[p for p in audio_files if p])
+                events.publish(job_id, "succeeded", result=result)
+            except JobCancelledError as e:
+                print(f"[API Server] Job {job_id}: Cancelled while running ({e})")
+                job_store.mark_failed(job_id, f"Job cancelled: {e}")
+                _update_local_cache(job_id, None, "failed")
+                result_cache.finish(job_id)
+                events.publish(job_id, "failed", error=f"Job cancelled: {e}", cancelled=True)
+            except Exception as e:
                 job_store.mark_failed(job_id, traceback.format_exc())
 
                 # Update local cache
                 _update_local_cache(job_id, None, "failed")
+                result_cache.finish(job_id)
+                events.publish(job_id, "failed", error=str(e))
             finally:
                 dt = max(0.0, time.time() - t0)
                 async with app.state.stats_lock:
@@ -1464,20 +1462,98 @@ def create_app() -> FastAPI:
                     if app.state.recent_durations:
                         app.state.avg_job_seconds = sum(app.state.recent_durations) / len(app.state.recent_durations)
 
+        async def _finish_job(job_id: str) -> None:
+            # Clients already streaming keep their reference; new ones fall back to /v1/audio
+            audio_stream = app.state.job_streams.pop(job_id, None)
+            if audio_stream is not None:
+                audio_stream.close()
+            cost_model.finish(job_id)
+            app.state.job_cancel_tokens.pop(job_id, None)
+            app.state.job_clients.pop(job_id, None)
+            await _cleanup_job_temp_files(job_id)
+
+        async def _skip_cancelled(job_id: str) -> bool:
+            """Fail a job cancelled (or past its deadline) before it started; True if it must not run."""
+            token: Optional[CancellationToken] = app.state.job_cancel_tokens.get(job_id)
+            if token is None or not token.cancelled:
+                return False
+            if await _mark_job_cancelled(job_id, token.reason):
+                print(f"[API Server] Job {job_id}: Cancelled before running ({token.reason})")
+            _update_local_cache(job_id, None, "failed")
+            return True
+
+        async def _run_with_model(
+            job_id: str, req: GenerateMusicRequest, model_name: str, h: Optional[AceStepHandler] = None
+        ) -> None:
+            """Run a job on a resident DiT model (h: already acquired handler); the model is held for the whole job."""
+            registry: DiTModelRegistry = app.state.dit_registry
+            if h is None:
+                h = registry.try_acquire(model_name)
+            try:
+                while h is None:
+                    # Evicted again between the load and this acquire: load once more
+                    await asyncio.wrap_future(registry.load(model_name))
+                    h = registry.try_acquire(model_name)
+                await _run_one_job(job_id, req, h, model_name)
+            finally:
+                if h is not None:
+                    registry.release(model_name)
+
+        async def _run_after_load(job_id: str, req: GenerateMusicRequest, model_name: str) -> None:
+            """Wait for a DiT model to load off the worker, then run the job (cold-model path)."""
+            try:
+                try:
+                    await asyncio.wrap_future(app.state.dit_registry.load(model_name))
+                except Exception as e:
+                    print(f"[API Server] Job {job_id}: Failed to load model {model_name}: {e}")
+                    app.state.job_store.mark_failed(job_id, f"Failed to load model {model_name}: {e}")
+                    _update_local_cache(job_id, None, "failed")
+                    result_cache.finish(job_id)
+                    app.state.job_events.publish(job_id, "failed", error=f"Failed to load model {model_name}: {e}")
+                    return
+                # Count against the workers' limit of concurrently running jobs
+                async with app.state.job_slots:
+                    if not await _skip_cancelled(job_id):
+                        await _run_with_model(job_id, req, model_name)
+            finally:
+                await _finish_job(job_id)
+                app.state.job_queue.task_done()
+
         async def _queue_worker(worker_idx: int) -> None:
             while True:
                 job_id, req = await app.state.job_queue.get()
+                handed_off = False
                 try:
                     async with app.state.pending_lock:
                         try:
                             app.state.pending_ids.remove(job_id)
                         except ValueError:
                             pass
-
-                    await _run_one_job(job_id, req)
+                    await _publish_queue_positions()
+                    if await _skip_cancelled(job_id):
+                        continue
+
+                    await _ensure_initialized()
+                    registry: DiTModelRegistry = app.state.dit_registry
+                    model_name = registry.resolve(req.model)
+                    if req.model and not registry.is_known(req.model):
+                        print(f"[API Server] Job {job_id}: Model '{req.model}' not found in {registry.names()}, using primary: {model_name}")
+                    h = registry.try_acquire(model_name)
+                    if h is None:
+                        # Cold model: load it in the background and keep serving warm jobs meanwhile
+                        print(f"[API Server] Job {job_id}: Loading model {model_name}")
+                        app.state.job_events.publish(job_id, "queued", queue_position=0, loading_model=model_name)
+                        task = asyncio.create_task(_run_after_load(job_id, req, model_name))
+                        app.state.load_tasks.add(task)
+                        task.add_done_callback(app.state.load_tasks.discard)
+                        handed_off = True
+                        continue
+                    async with app.state.job_slots:
+                        await _run_with_model(job_id, req, model_name, h)
                 finally:
-                    await _cleanup_job_temp_files(job_id)
-                    app.state.job_queue.task_done()
+                    if not handed_off:
+                        await _finish_job(job_id)
+                        app.state.job_queue.task_done()
 
         async def _job_store_cleanup_worker() -> None:
             """Background task to periodically clean up old completed jobs."""
@@ -1494,6 +1570,15 @@ def create_app() -> FastAPI:
                     print(f"[API Server] Job cleanup error: {e}")
 
         worker_count = max(1, WORKER_COUNT)
+        if use_dit_batching:
+            worker_count = max(worker_count, dit_scheduler.max_batch_size)
+        # ETAs spread the work ahead over the jobs that execute at once. With DiT batching
+        # the session serializes GPU work and merged DiT time is split per job instead.
+        cost_model.concurrency = 1 if use_dit_batching else max(1, min(worker_count, max_workers))
+        # Jobs handed off to a model load run outside their worker; the semaphore keeps
+        # the number of running jobs at worker_count
+        app.state.job_slots = asyncio.Semaphore(worker_count)
+        app.state.load_tasks = set()
         workers = [asyncio.create_task(_queue_worker(i)) for i in range(worker_count)]
         cleanup_task = asyncio.create_task(_job_store_cleanup_worker())
         app.state.worker_tasks = workers
@@ -1508,6 +1593,9 @@ def create_app() -> FastAPI:
         gpu_config = get_gpu_config()
         set_global_gpu_config(gpu_config)
         app.state.gpu_config = gpu_config
+        if not os.getenv("ACESTEP_DIT_BATCH_MAX"):
+            # Merged DiT batches must fit the GPU tier
+            dit_scheduler.max_batch_size = max(1, min(dit_scheduler.max_batch_size, gpu_config.max_batch_size_without_lm))
 
         gpu_memory_gb = gpu_config.gpu_memory_gb
         auto_offload = gpu_memory_gb > 0 and gpu_memory_gb < 16
@@ -1584,63 +1672,42 @@ def create_app() -> FastAPI:
         app.state._initialized = True
         print(f"[API Server] Primary model loaded: {_get_model_name(config_path)}")
 
-        # Initialize secondary model if configured
-        if handler2 and config_path2:
-            model2_name = _get_model_name(config_path2)
-            if model2_name:
-                try:
-                    _ensure_model_downloaded(model2_name, checkpoint_dir)
-                except Exception as e:
-                    print(f"[API Server] Warning: Failed to download secondary model: {e}")
-
-            print(f"[API Server] Loading secondary DiT model: {config_path2}")
-            try:
-                status_msg2, ok2 = handler2.initialize_service(
-                    project_root=project_root,
-                    config_path=config_path2,
-                    device=device,
-                    use_flash_attention=use_flash_attention,
-                    compile_model=False,
-                    offload_to_cpu=offload_to_cpu,
-                    offload_dit_to_cpu=offload_dit_to_cpu,
-                )
-                app.state._initialized2 = ok2
-                if ok2:
-                    print(f"[API Server] Secondary model loaded: {model2_name}")
-                else:
-                    print(f"[API Server] Warning: Secondary model failed: {status_msg2}")
-            except Exception as e:
-                print(f"[API Server] Warning: Failed to initialize secondary model: {e}")
-                app.state._initialized2 = False
-
-        # Initialize third model if configured
-        if handler3 and config_path3:
-            model3_name = _get_model_name(config_path3)
-            if model3_name:
+        def _load_dit_model(model_config_path: str) -> AceStepHandler:
+            """Create a handler for another DiT model, sharing the primary's VAE / text encoder (loader thread)."""
+            model_name = _get_model_name(model_config_path)
+            if model_name:
                 try:
-                    _ensure_model_downloaded(model3_name, checkpoint_dir)
+                    _ensure_model_downloaded(model_name, checkpoint_dir)
                 except Exception as e:
-                    print(f"[API Server] Warning: Failed to download third model: {e}")
-
-            print(f"[API Server] Loading third DiT model: {config_path3}")
-            try:
-                status_msg3, ok3 = handler3.initialize_service(
-                    project_root=project_root,
-                    config_path=config_path3,
-                    device=device,
-                    use_flash_attention=use_flash_attention,
-                    compile_model=False,
-                    offload_to_cpu=offload_to_cpu,
-                    offload_dit_to_cpu=offload_dit_to_cpu,
-                )
-                app.state._initialized3 = ok3
-                if ok3:
-                    print(f"[API Server] Third model loaded: {model3_name}")
-                else:
-                    print(f"[API Server] Warning: Third model failed: {status_msg3}")
-            except Exception as e:
-                print(f"[API Server] Warning: Failed to initialize third model: {e}")
-                app.state._initialized3 = False
+                    print(f"[API Server] Warning: Failed to download DiT model {model_name}: {e}")
+            print(f"[API Server] Loading DiT model: {model_config_path}")
+            model_handler = AceStepHandler()
+            model_status, model_ok = model_handler.initialize_service(
+                project_root=project_root,
+                config_path=model_config_path,
+                device=device,
+                use_flash_attention=use_flash_attention,
+                compile_model=False,
+                offload_to_cpu=offload_to_cpu,
+                offload_dit_to_cpu=offload_dit_to_cpu,
+                shared_components=handler,
+            )
+            if not model_ok:
+                raise RuntimeError(model_status)
+            return model_handler
+
+        # Other DiT models (ACESTEP_CONFIG_PATH2/3, ACESTEP_DIT_MODELS) load on first use. Without
+        # offload the DiTs stay on the GPU, so they share what the residency budget leaves after
+        # the VAE / text encoder; with offload the residency manager already bounds VRAM.
+        dit_budget = None
+        if not offload_to_cpu and str(handler.device).startswith("cuda"):
+            dit_budget = max(
+                0, residency_budget_bytes(gpu_config) - module_nbytes(handler.vae) - module_nbytes(handler.text_encoder)
+            )
+        dit_registry = create_dit_model_registry(_load_dit_model, config_path, checkpoint_dir, dit_budget)
+        dit_registry.add_loaded(config_path, handler)
+        app.state.dit_registry = dit_registry
+        print(f"[API Server] DiT models available on demand: {dit_registry.names()}")
 
         # Initialize LLM model based on GPU configuration
         # Auto-determine whether to initialize LM based on GPU config
@@ -1719,13 +1786,52 @@ def create_app() -> FastAPI:
 
         print("[API Server] All models initialized successfully!")
 
+        # Re-enqueue jobs that were queued (or interrupted) before a restart.
+        # Only persistent job stores return anything here.
+        recovered = 0
+        for job_id, request_data in store.recover_pending():
+            try:
+                recovered_req = GenerateMusicRequest(**request_data)
+            except Exception as e:
+                store.mark_failed(job_id, f"Job could not be recovered after restart: {e}")
+                continue
+            # Uploaded audio lives in temp files that may not survive the restart
+            missing = [
+                path for path in (recovered_req.reference_audio_path, recovered_req.src_audio_path)
+                if path and not os.path.exists(path)
+            ]
+            if missing:
+                store.mark_failed(job_id, f"Job inputs lost on restart: {', '.join(missing)} no longer exist")
+                continue
+            if app.state.job_queue.full():
+                store.mark_failed(job_id, "Job could not be recovered after restart: queue is full")
+                continue
+            app.state.job_streams[job_id] = _JobAudioStream(asyncio.get_running_loop(), recovered_req.audio_format)
+            rec = store.get(job_id)
+            app.state.job_cancel_tokens[job_id] = _new_cancel_token(
+                recovered_req, rec.created_at if rec is not None else time.time()
+            )
+            cost_model.enqueue(job_id, cost_model.predict(_job_features(recovered_req)))
+            async with app.state.pending_lock:
+                app.state.pending_ids.append(job_id)
+            app.state.job_queue.put_nowait((job_id, recovered_req))
+            recovered += 1
+        if recovered:
+            print(f"[API Server] Recovered {recovered} queued jobs from job store")
+
         try:
             yield
         finally:
             cleanup_task.cancel()
             for t in workers:
                 t.cancel()
+            load_tasks = list(app.state.load_tasks)
+            for t in load_tasks:
+                t.cancel()
+            await asyncio.gather(*load_tasks, return_exceptions=True)
             executor.shutdown(wait=False, cancel_futures=True)
+            dit_registry.shutdown()
+            store.close()
 
     app = FastAPI(title="ACE-Step API", version="1.0", lifespan=lifespan)
 
@@ -1736,12 +1842,98 @@ def create_app() -> FastAPI:
             except ValueError:
                 return 0
 
+    def _new_cancel_token(req: GenerateMusicRequest, created_at: float) -> CancellationToken:
+        """Cancellation token of a job, with its deadline (request timeout_seconds capped by the server's)."""
+        timeouts = [t for t in (req.timeout_seconds, JOB_DEADLINE_SECONDS) if t is not None and t > 0]
+        return CancellationToken(deadline=created_at + min(timeouts) if timeouts else None)
+
+    async def _mark_job_cancelled(job_id: str, reason: str) -> bool:
+        """Fail a job that was cancelled before it started running; False if it is running or finished."""
+        rec = store.get(job_id)
+        if rec is None or rec.status != "queued":
+            return False
+        store.mark_failed(job_id, f"Job cancelled: {reason}")
+        result_cache.finish(job_id)
+        cost_model.finish(job_id)
+        async with app.state.pending_lock:
+            try:
+                app.state.pending_ids.remove(job_id)
+            except ValueError:
+                pass
+        app.state.job_events.publish(job_id, "failed", error=f"Job cancelled: {reason}", cancelled=True)
+        await _publish_queue_positions()
+        return True
+
+    def _attach_job_client(job_id: str) -> None:
+        """Count one more client sharing an unfinished job (a coalesced request)."""
+        if job_id in app.state.job_cancel_tokens:
+            app.state.job_clients[job_id] = app.state.job_clients.get(job_id, 1) + 1
+
+    def _detach_job_client(job_id: str) -> bool:
+        """Drop one client of a job; True if it was the last one, so the job may be cancelled."""
+        clients = app.state.job_clients.get(job_id, 1) - 1
+        if clients > 0:
+            app.state.job_clients[job_id] = clients
+            return False
+        app.state.job_clients.pop(job_id, None)
+        return True
+
+    async def _cancel_job(job_id: str, reason: str) -> str:
+        """
+        Cancel a job: a queued job fails right away, a running one stops at its next
+        LM decode step, DiT step or VAE tile. A job shared by coalesced requests is
+        only cancelled once every client sharing it has cancelled or disconnected.
+
+        Returns:
+            "cancelled", "cancelling" (running), "detached" (other clients still wait for it),
+            the final status if already finished, or "not_found"
+        """
+        rec = store.get(job_id)
+        token: Optional[CancellationToken] = app.state.job_cancel_tokens.get(job_id)
+        if rec is None:
+            return "not_found"
+        if rec.status in TERMINAL_STATUSES or token is None:
+            return rec.status
+        if not _detach_job_client(job_id):
+            return "detached"
+        token.cancel(reason)
+        if await _mark_job_cancelled(job_id, reason):
+            return "cancelled"
+        return "cancelling"
+
     async def _eta_seconds_for_position(pos: int) -> Optional[float]:
+        """Predicted seconds until the job at queue position pos finishes."""
         if pos <= 0:
             return None
-        async with app.state.stats_lock:
-            avg = float(getattr(app.state, "avg_job_seconds", INITIAL_AVG_JOB_SECONDS))
-        return pos * avg
+        async with app.state.pending_lock:
+            queued = list(itertools.islice(app.state.pending_ids, pos))
+        return round(cost_model.wait_seconds(queued), 1)
+
+    def _job_features(req: GenerateMusicRequest) -> JobFeatures:
+        """Shape of a request for the cost model (mirrors the LM decisions of _run_one_job)."""
+        timesteps = _parse_timesteps(req.timesteps)
+        use_lm = getattr(app.state, "_llm_initialized", False) and req.task_type not in ("cover", "repaint")
+        return JobFeatures(
+            model=app.state.dit_registry.resolve(req.model) if app.state.dit_registry else _get_model_name(app.state._config_path),
+            duration=request_duration({"audio_code_string": req.audio_code_string, "audio_duration": req.audio_duration}),
+            batch_size=req.batch_size if req.batch_size is not None else 2,
+            steps=len(timesteps) if timesteps else req.inference_steps,
+            lm_cot=use_lm and (req.thinking or req.use_cot_caption or req.use_cot_language or not req.sample_mode),
+            lm_codes=use_lm and req.thinking and not req.audio_code_string,
+            lm_calls=int(req.sample_mode) + int(req.use_format),
+        )
+
+    async def _publish_queue_positions() -> None:
+        """Push fresh queue positions / ETAs to the subscribers of queued jobs."""
+        events: JobEventBus = app.state.job_events
+        async with app.state.pending_lock:
+            queued = [
+                (pos, job_id)
+                for pos, job_id in enumerate(app.state.pending_ids, start=1)
+                if events.has_subscribers(job_id)
+            ]
+        for pos, job_id in queued:
+            events.publish(job_id, "queued", queue_position=pos, eta_seconds=await _eta_seconds_for_position(pos))
 
     @app.post("/release_task")
     async def create_music_generate_job(request: Request, authorization: Optional[str] = Header(None)):
@@ -1758,6 +1950,7 @@ def create_app() -> FastAPI:
                 sample_query=p.str("sample_query"),
                 use_format=p.bool("use_format"),
                 model=p.str("model") or None,
+                timeout_seconds=p.float("timeout_seconds"),
                 bpm=p.int("bpm"),
                 key_scale=p.str("key_scale"),
                 time_signature=p.str("time_signature"),
@@ -1894,17 +2087,66 @@ def create_app() -> FastAPI:
                     ),
                 )
 
-        rec = store.create()
-
-        q: asyncio.Queue = app.state.job_queue
-        if q.full():
+        # Fixed-seed requests join an identical queued/running job or reuse its finished result
+        cache_key = None
+        if not temp_files:
+            batch_size = req.batch_size if req.batch_size is not None else 2
+            cache_key = result_cache.request_key(_request_to_dict(req), batch_size)
+        if cache_key is not None:
+            job_id = result_cache.attach(cache_key)
+            if job_id is not None:
+                # The job is only cancelled once every client sharing it gives up
+                _attach_job_client(job_id)
+                rec = store.get(job_id)
+                return _wrap_response({
+                    "task_id": job_id,
+                    "status": rec.status if rec else "queued",
+                    "queue_position": await _queue_position(job_id),
+                })
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                rec = store.get(cached[0])
+                if rec is not None and rec.status == "succeeded":
+                    return _wrap_response({"task_id": rec.job_id, "status": "succeeded", "queue_position": 0})
+                # Job record was cleaned up; generate again
+                result_cache.discard(cache_key)
+
+        def _discard_temp_files() -> None:
             for p in temp_files:
                 try:
                     os.remove(p)
                 except Exception:
                     pass
+
+        q: asyncio.Queue = app.state.job_queue
+        if q.full():
+            _discard_temp_files()
             raise HTTPException(status_code=429, detail="Server busy: queue is full")
 
+        # Admission control: predicted wait + own cost must fit ACESTEP_QUEUE_SLA_SECONDS
+        predicted_seconds = cost_model.predict(_job_features(req))
+        async with app.state.pending_lock:
+            queued = list(app.state.pending_ids)
+        wait_seconds = cost_model.wait_seconds(queued)
+        retry_after = cost_model.admit(wait_seconds, predicted_seconds)
+        if retry_after is not None:
+            _discard_temp_files()
+            raise HTTPException(
+                status_code=429,
+                detail=(
+                    f"Server busy: predicted completion in {wait_seconds + predicted_seconds:.0f}s "
+                    f"exceeds the {cost_model.sla_seconds:.0f}s SLA"
+                ),
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+        rec = store.create(request=_request_to_dict(req))
+        app.state.job_cancel_tokens[rec.job_id] = _new_cancel_token(req, rec.created_at)
+        cost_model.enqueue(rec.job_id, predicted_seconds)
+        if cache_key is not None:
+            result_cache.register(cache_key, rec.job_id)
+        app.state.job_streams[rec.job_id] = _JobAudioStream(asyncio.get_running_loop(), req.audio_format)
+
         if temp_files:
             async with app.state.job_temp_files_lock:
                 app.state.job_temp_files[rec.job_id] = temp_files
@@ -1914,6 +2156,9 @@ def create_app() -> FastAPI:
             position = len(app.state.pending_ids)
 
         await q.put((rec.job_id, req))
+        app.state.job_events.publish(
+            rec.job_id, "queued", queue_position=position, eta_seconds=await _eta_seconds_for_position(position)
+        )
         return _wrap_response({"task_id": rec.job_id, "status": "queued", "queue_position": position})
 
     @app.post("/query_result")
@@ -1943,35 +2188,40 @@ def create_app() -> FastAPI:
         data_list = []
         current_time = time.time()
 
-        for task_id in task_id_list:
-            result_key = f"{RESULT_KEY_PREFIX}{task_id}"
-
-            # Read from local cache first
-            if local_cache:
-                data = local_cache.get(result_key)
+        # Read from local cache first, then resolve all misses with one job store lookup
+        cached: Dict[str, Any] = {}
+        if local_cache:
+            for task_id in task_id_list:
+                data = local_cache.get(f"{RESULT_KEY_PREFIX}{task_id}")
                 if data:
-                    try:
-                        data_json = json.loads(data)
-                    except Exception:
-                        data_json = []
+                    cached[task_id] = data
+        records = store.get_many(task_id for task_id in task_id_list if task_id not in cached)
 
-                    if len(data_json) <= 0:
+        for task_id in task_id_list:
+            data = cached.get(task_id)
+            if data:
+                try:
+                    data_json = json.loads(data)
+                except Exception:
+                    data_json = []
+
+                if len(data_json) <= 0:
+                    data_list.append({"task_id": task_id, "result": data, "status": 2})
+                else:
+                    status = data_json[0].get("status")
+                    create_time = data_json[0].get("create_time", 0)
+                    if status == 0 and (current_time - create_time) > TASK_TIMEOUT_SECONDS:
                         data_list.append({"task_id": task_id, "result": data, "status": 2})
                     else:
-                        status = data_json[0].get("status")
-                        create_time = data_json[0].get("create_time", 0)
-                        if status == 0 and (current_time - create_time) > TASK_TIMEOUT_SECONDS:
-                            data_list.append({"task_id": task_id, "result": data, "status": 2})
-                        else:
-                            data_list.append({
-                                "task_id": task_id,
-                                "result": data,
-                                "status": int(status) if status is not None else 1,
-                            })
-                    continue
+                        data_list.append({
+                            "task_id": task_id,
+                            "result": data,
+                            "status": int(status) if status is not None else 1,
+                        })
+                continue
 
             # Fallback to job_store query
-            rec = store.get(task_id)
+            rec = records.get(task_id)
             if rec:
                 env = getattr(rec, 'env', 'development')
                 create_time = rec.created_at
@@ -2039,6 +2289,7 @@ def create_app() -> FastAPI:
     async def get_stats(_: None = Depends(verify_api_key)):
         """Get server statistics including job store stats."""
         job_stats = store.get_stats()
+        text_embedding_cache = get_text_embedding_cache()
         async with app.state.stats_lock:
             avg_job_seconds = getattr(app.state, "avg_job_seconds", INITIAL_AVG_JOB_SECONDS)
         return _wrap_response({
@@ -2046,43 +2297,31 @@ def create_app() -> FastAPI:
             "queue_size": app.state.job_queue.qsize(),
             "queue_maxsize": QUEUE_MAXSIZE,
             "avg_job_seconds": avg_job_seconds,
+            "cost_model": cost_model.get_stats(),
+            "model_residency": app.state.handler.get_residency_stats(),
+            "dit_models": app.state.dit_registry.get_stats() if app.state.dit_registry else None,
+            "dit_batching": app.state.dit_scheduler.get_stats(),
+            "lm_prefix_cache": app.state.llm_handler.get_prefix_cache_stats(),
+            "text_embedding_cache": text_embedding_cache.get_stats() if text_embedding_cache is not None else None,
+            "result_cache": result_cache.get_stats(),
+            "job_events": app.state.job_events.get_stats(),
         })
 
     @app.get("/v1/models")
     async def list_models(_: None = Depends(verify_api_key)):
-        """List available DiT models."""
+        """List available DiT models (loaded on first use if not resident)."""
+        registry: Optional[DiTModelRegistry] = app.state.dit_registry
         models = []
-        
-        # Primary model (always available if initialized)
-        if getattr(app.state, "_initialized", False):
-            primary_model = _get_model_name(app.state._config_path)
-            if primary_model:
-                models.append({
-                    "name": primary_model,
-                    "is_default": True,
-                })
-        
-        # Secondary model
-        if getattr(app.state, "_initialized2", False) and app.state._config_path2:
-            secondary_model = _get_model_name(app.state._config_path2)
-            if secondary_model:
-                models.append({
-                    "name": secondary_model,
-                    "is_default": False,
-                })
-        
-        # Third model
-        if getattr(app.state, "_initialized3", False) and app.state._config_path3:
-            third_model = _get_model_name(app.state._config_path3)
-            if third_model:
-                models.append({
-                    "name": third_model,
-                    "is_default": False,
-                })
-        
+        if registry is not None:
+            states = registry.get_stats()["models"]
+            models = [
+                {"name": name, "is_default": name == registry.primary, "state": states[name]["state"]}
+                for name in registry.names()
+            ]
+
         return _wrap_response({
             "models": models,
-            "default_model": models[0]["name"] if models else None,
+            "default_model": registry.primary if registry is not None else None,
         })
 
     @app.post("/create_random_sample")
@@ -2241,6 +2480,214 @@ def create_app() -> FastAPI:
         except Exception as e:
             return _wrap_response(None, code=500, error=f"format_sample error: {str(e)}")
 
+    @app.get("/v1/stream")
+    async def stream_audio(
+        task_id: str,
+        index: int = 0,
+        format: Optional[str] = None,
+        _: None = Depends(verify_api_key),
+    ):
+        """
+        Stream a task's audio while it is being decoded.
+
+        Chunked response that starts as soon as the first VAE tile is decoded.
+        Available while the task is queued or running; afterwards use the
+        file URL from /query_result.
+        """
+        from fastapi.responses import StreamingResponse
+        from acestep.audio_utils import StreamingAudioEncoder
+
+        audio_stream: Optional[_JobAudioStream] = app.state.job_streams.get(task_id)
+        if audio_stream is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Stream not available for this task (unknown or already finished); use /query_result",
+            )
+
+        audio_format = (format or audio_stream.audio_format or "mp3").lower()
+        if audio_format not in StreamingAudioEncoder.MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"Unsupported stream format: {audio_format}")
+
+        async def _body():
+            loop = asyncio.get_running_loop()
+            encoder = None
+            try:
+                async for segment in audio_stream.iter_segments(index):
+                    if encoder is None:
+                        encoder = await loop.run_in_executor(
+                            None, StreamingAudioEncoder, audio_format, audio_stream.sample_rate, segment.shape[0]
+                        )
+                    data = await loop.run_in_executor(None, encoder.encode, segment)
+                    if data:
+                        yield data
+                if encoder is not None:
+                    data = await loop.run_in_executor(None, encoder.finish)
+                    if data:
+                        yield data
+            finally:
+                if encoder is not None:
+                    encoder.close()
+
+        return StreamingResponse(_body(), media_type=StreamingAudioEncoder.MEDIA_TYPES[audio_format])
+
+    def _parse_task_ids(task_id: str) -> List[str]:
+        task_ids = list(dict.fromkeys(t.strip() for t in (task_id or "").split(",") if t.strip()))
+        if not task_ids:
+            raise HTTPException(status_code=400, detail="task_id is required (comma-separated for several tasks)")
+        if len(task_ids) > MAX_EVENT_TASK_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_EVENT_TASK_IDS} task IDs per subscription")
+        return task_ids
+
+    async def _job_state_event(rec: JobRecord) -> Dict[str, Any]:
+        """Current state of a job as an event, for clients that subscribe mid-way."""
+        if rec.status == "succeeded":
+            return {"task_id": rec.job_id, "status": "succeeded", "result": rec.result}
+        if rec.status == "failed":
+            error = (rec.error or "").strip().splitlines()
+            return {"task_id": rec.job_id, "status": "failed", "error": error[-1] if error else ""}
+        if rec.status == "running":
+            latest = app.state.job_events.latest(rec.job_id)
+            if latest is not None and latest["status"] == "progress":
+                return latest
+            return {"task_id": rec.job_id, "status": "running"}
+        pos = await _queue_position(rec.job_id)
+        return {
+            "task_id": rec.job_id,
+            "status": "queued",
+            "queue_position": pos,
+            "eta_seconds": await _eta_seconds_for_position(pos),
+        }
+
+    async def _job_event_stream(task_ids: List[str], cancel_on_disconnect: bool = False):
+        """
+        Yield the current state of each task, then its events until all tasks finish.
+
+        Yields None when nothing happened for keepalive_seconds (send a keepalive).
+        Unknown task IDs get a single "not_found" event. With cancel_on_disconnect,
+        tasks still unfinished when the client goes away are cancelled.
+        """
+        events: JobEventBus = app.state.job_events
+        pending = set()
+        running = set()
+        try:
+            # Subscribe before reading the job store so no transition is missed
+            with events.subscribe(task_ids) as subscription:
+                records = store.get_many(task_ids)
+                for task_id in task_ids:
+                    rec = records.get(task_id)
+                    if rec is None:
+                        yield {"task_id": task_id, "status": "not_found"}
+                        continue
+                    event = await _job_state_event(rec)
+                    yield event
+                    if event["status"] not in TERMINAL_STATUSES:
+                        pending.add(task_id)
+                        if event["status"] != "queued":
+                            running.add(task_id)
+
+                while pending:
+                    event = await subscription.get(timeout=events.keepalive_seconds)
+                    if event is None:
+                        yield None
+                        continue
+                    task_id = event["task_id"]
+                    # Skip events older than the state already sent
+                    if task_id not in pending or (event["status"] == "queued" and task_id in running):
+                        continue
+                    yield event
+                    if event["status"] in TERMINAL_STATUSES:
+                        pending.discard(task_id)
+                    elif event["status"] != "queued":
+                        running.add(task_id)
+        finally:
+            if cancel_on_disconnect:
+                # Closed before every task finished: trip the tokens (queued jobs are skipped when
+                # dequeued), unless other clients of a coalesced request still wait for the task
+                for task_id in pending:
+                    token: Optional[CancellationToken] = app.state.job_cancel_tokens.get(task_id)
+                    if token is not None and _detach_job_client(task_id):
+                        token.cancel("client disconnected")
+
+    @app.get("/v1/events")
+    async def job_events_sse(
+        task_id: str,
+        ai_token: Optional[str] = None,
+        cancel_on_disconnect: bool = False,
+        authorization: Optional[str] = Header(None),
+    ):
+        """
+        Server-sent events with the status of one or more tasks.
+
+        Pushes queued (queue_position, eta_seconds), running, progress (progress,
+        stage) and finally succeeded (result) or failed (error) for each task;
+        the stream ends once every task has finished. Replaces /query_result polling.
+        With cancel_on_disconnect=true, unfinished tasks are cancelled if the client disconnects.
+        """
+        from fastapi.responses import StreamingResponse
+
+        verify_token_from_request({"ai_token": ai_token}, authorization)
+        task_ids = _parse_task_ids(task_id)
+
+        async def _body():
+            async for event in _job_event_stream(task_ids, cancel_on_disconnect):
+                if event is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"event: {event['status']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+        return StreamingResponse(
+            _body(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.websocket("/v1/events/ws")
+    async def job_events_ws(
+        websocket: WebSocket, task_id: str = "", ai_token: Optional[str] = None, cancel_on_disconnect: bool = False
+    ):
+        """WebSocket variant of /v1/events: one JSON message per event, closed once every task finished."""
+        try:
+            verify_token_from_request({"ai_token": ai_token}, websocket.headers.get("authorization"))
+            task_ids = _parse_task_ids(task_id)
+        except HTTPException as e:
+            await websocket.close(code=1008, reason=str(e.detail))
+            return
+
+        await websocket.accept()
+        try:
+            events = _job_event_stream(task_ids, cancel_on_disconnect)
+            try:
+                async for event in events:
+                    await websocket.send_json(event if event is not None else {"status": "keepalive"})
+            finally:
+                await events.aclose()
+            await websocket.close()
+        except WebSocketDisconnect:
+            pass
+
+    @app.post("/v1/cancel")
+    async def cancel_jobs(request: Request, authorization: Optional[str] = Header(None)):
+        """
+        Cancel one or more tasks (task_id, comma-separated for several).
+
+        Queued tasks fail right away; running tasks stop at their next LM decode
+        step, DiT step or VAE tile and then fail with "Job cancelled: ...".
+        """
+        content_type = (request.headers.get("content-type") or "").lower()
+        if "json" in content_type:
+            body = await request.json()
+        else:
+            form = await request.form()
+            body = {k: v for k, v in form.items()}
+
+        verify_token_from_request(body, authorization)
+        task_ids = _parse_task_ids(str(body.get("task_id") or ""))
+        data = [
+            {"task_id": task_id, "status": await _cancel_job(task_id, "cancelled by client")}
+            for task_id in task_ids
+        ]
+        return _wrap_response(data)
+
     @app.get("/v1/audio")
     async def get_audio(path: str, _: None = Depends(verify_api_key)):
         """Serve audio file by path."""
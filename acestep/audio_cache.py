@@ -0,0 +1,261 @@
+"""Content-addressed cache for source/reference audio features
+
+Repeated cover/repaint requests reuse the same few source tracks; this cache
+lets them skip audio decoding, resampling, VAE encoding and code tokenization.
+
+Entries are keyed by content hash and stored in two tiers:
+- memory: LRU with a byte cap
+- disk: one safetensors file per entry (loaded via mmap) with a byte cap,
+  evicted by least recent access
+
+Kinds of entries:
+- "waveform": normalized 48kHz stereo audio, keyed by the source file hash
+- "latents":  VAE latents, keyed by the waveform hash + VAE identity
+- "codes":    5Hz audio code string, keyed by the source file hash + DiT identity
+
+Configuration (environment):
+- ACESTEP_AUDIO_CACHE: set to 0/false to disable
+- ACESTEP_AUDIO_CACHE_DIR: disk tier directory (default .cache/acestep/audio_cache)
+- ACESTEP_AUDIO_CACHE_MEMORY_MB: memory tier cap (default 1024)
+- ACESTEP_AUDIO_CACHE_DISK_GB: disk tier cap (default 8, 0 disables the disk tier)
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Union
+
+import torch
+from loguru import logger
+
+try:
+    from safetensors.torch import load_file, save_file
+    HAS_SAFETENSORS = True
+except ImportError:
+    HAS_SAFETENSORS = False
+
+CacheValue = Union[torch.Tensor, str]
+
+_CODES_METADATA_KEY = "codes"
+
+
+def cache_key(*parts: str) -> str:
+    """Combine key parts (content hashes, model identities) into one cache key."""
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class AudioFeatureCache:
+    """
+    Two-tier (memory LRU + safetensors on disk) cache for audio features.
+
+    Tensors are stored on CPU; callers move them to the target device/dtype.
+    """
+
+    KINDS = ("waveform", "latents", "codes")
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        max_memory_bytes: int = 1024 * 1024**2,
+        max_disk_bytes: int = 8 * 1024**3,
+    ):
+        if cache_dir is None:
+            cache_dir = os.path.join(
+                os.path.dirname(os.path.dirname(__file__)),
+                ".cache",
+                "acestep",
+                "audio_cache",
+            )
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes if HAS_SAFETENSORS else 0
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, CacheValue]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: Optional[int] = None  # computed lazily
+        self.stats: Dict[str, Dict[str, int]] = {
+            kind: {"memory_hits": 0, "disk_hits": 0, "misses": 0} for kind in self.KINDS
+        }
+
+    @staticmethod
+    def _nbytes(value: CacheValue) -> int:
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        return len(value)
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.cache_dir, kind, f"{key}.safetensors")
+
+    def get(self, kind: str, key: str) -> Optional[CacheValue]:
+        """
+        Look up an entry.
+
+        Args:
+            kind: Entry kind ("waveform", "latents", "codes")
+            key: Content key (see cache_key())
+
+        Returns:
+            CPU tensor or code string, or None on miss
+        """
+        mem_key = f"{kind}:{key}"
+        with self._lock:
+            value = self._memory.get(mem_key)
+            if value is not None:
+                self._memory.move_to_end(mem_key)
+                self.stats[kind]["memory_hits"] += 1
+                return value
+
+        value = self._read_disk(kind, key)
+        with self._lock:
+            if value is None:
+                self.stats[kind]["misses"] += 1
+                return None
+            self.stats[kind]["disk_hits"] += 1
+            self._put_memory(mem_key, value)
+        return value
+
+    def put(self, kind: str, key: str, value: CacheValue) -> None:
+        """
+        Store an entry in both tiers.
+
+        Args:
+            kind: Entry kind ("waveform", "latents", "codes")
+            key: Content key (see cache_key())
+            value: Tensor (stored on CPU) or code string
+        """
+        if isinstance(value, torch.Tensor):
+            value = value.detach().to("cpu").contiguous()
+        with self._lock:
+            self._put_memory(f"{kind}:{key}", value)
+        self._write_disk(kind, key, value)
+
+    def _put_memory(self, mem_key: str, value: CacheValue) -> None:
+        size = self._nbytes(value)
+        if size > self.max_memory_bytes:
+            return
+        old = self._memory.pop(mem_key, None)
+        if old is not None:
+            self._memory_bytes -= self._nbytes(old)
+        self._memory[mem_key] = value
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= self._nbytes(evicted)
+
+    def _read_disk(self, kind: str, key: str) -> Optional[CacheValue]:
+        if self.max_disk_bytes <= 0:
+            return None
+        path = self._path(kind, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            if kind == "codes":
+                from safetensors import safe_open
+                with safe_open(path, framework="pt") as f:
+                    value = f.metadata()[_CODES_METADATA_KEY]
+            else:
+                value = load_file(path, device="cpu")["value"]
+            # Access time drives disk eviction
+            os.utime(path, None)
+            return value
+        except Exception as e:
+            logger.warning(f"[AudioFeatureCache] Dropping unreadable cache entry {path}: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _write_disk(self, kind: str, key: str, value: CacheValue) -> None:
+        if self.max_disk_bytes <= 0:
+            return
+        path = self._path(kind, key)
+        if os.path.exists(path):
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            if kind == "codes":
+                save_file({"value": torch.zeros(0, dtype=torch.uint8)}, tmp_path, metadata={_CODES_METADATA_KEY: value})
+            else:
+                save_file({"value": value}, tmp_path)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except Exception as e:
+            logger.warning(f"[AudioFeatureCache] Failed to write cache entry {path}: {e}")
+            return
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += size
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _disk_entries(self):
+        for kind in self.KINDS:
+            kind_dir = os.path.join(self.cache_dir, kind)
+            if not os.path.isdir(kind_dir):
+                continue
+            for name in os.listdir(kind_dir):
+                if name.endswith(".safetensors"):
+                    path = os.path.join(kind_dir, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, max(st.st_atime, st.st_mtime)
+
+    def _scan_disk_bytes(self) -> int:
+        return sum(size for _, size, _ in self._disk_entries())
+
+    def _evict_disk(self) -> None:
+        """Remove least recently accessed files until the disk tier is under 90% of its cap."""
+        target = int(self.max_disk_bytes * 0.9)
+        entries = sorted(self._disk_entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def get_stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "memory_bytes": self._memory_bytes,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+                "kinds": {kind: dict(counts) for kind, counts in self.stats.items()},
+            }
+
+
+# Lazily initialized global instance
+_audio_cache: Optional[AudioFeatureCache] = None
+_audio_cache_lock = threading.Lock()
+
+
+def get_audio_cache() -> Optional[AudioFeatureCache]:
+    """Get the process-wide audio feature cache, or None if disabled via ACESTEP_AUDIO_CACHE."""
+    global _audio_cache
+    if os.environ.get("ACESTEP_AUDIO_CACHE", "true").strip().lower() in {"0", "false", "no", "off"}:
+        return None
+    if _audio_cache is None:
+        with _audio_cache_lock:
+            if _audio_cache is None:
+                _audio_cache = AudioFeatureCache(
+                    cache_dir=os.environ.get("ACESTEP_AUDIO_CACHE_DIR") or None,
+                    max_memory_bytes=int(float(os.environ.get("ACESTEP_AUDIO_CACHE_MEMORY_MB", "1024")) * 1024**2),
+                    max_disk_bytes=int(float(os.environ.get("ACESTEP_AUDIO_CACHE_DISK_GB", "8")) * 1024**3),
+                )
+    return _audio_cache
@@ -222,6 +222,216 @@ class AudioSaver:
         return saved_paths
 
 
+class _StreamSink:
+    """
+    Write-only file-like object for soundfile that hands out bytes as they are written.
+
+    Encoders may seek back to patch headers on close (e.g. FLAC STREAMINFO);
+    bytes that were already handed out cannot be changed, so such rewrites
+    are dropped and the stream keeps its "length unknown" header.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._base = 0  # absolute offset of self._buf[0]
+        self._pos = 0
+        self._size = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        written = len(data)
+        start = self._pos - self._base
+        if start < 0:
+            # Rewrite of bytes that were already handed out: keep only the new tail
+            data = data[-start:]
+            start = 0
+        end = start + len(data)
+        if end > len(self._buf):
+            self._buf.extend(b"\0" * (end - len(self._buf)))
+        self._buf[start:end] = data
+        self._pos += written
+        self._size = max(self._size, self._pos)
+        return written
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        else:
+            self._pos = self._size + offset
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        return b""
+
+    def take(self) -> bytes:
+        """Return bytes written since the last call."""
+        data = bytes(self._buf)
+        self._base += len(self._buf)
+        self._buf = bytearray()
+        return data
+
+
+class StreamingAudioEncoder:
+    """
+    Incremental audio encoder for HTTP streaming.
+
+    Feed [channels, samples] float chunks to encode() and send the returned
+    bytes as they come; finish() flushes the encoder. Supported formats:
+    - wav: 16-bit PCM with a "length unknown" RIFF header
+    - flac: libsndfile FLAC frames via soundfile
+    - mp3: ffmpeg subprocess pipe
+    """
+
+    MEDIA_TYPES = {"wav": "audio/wav", "flac": "audio/flac", "mp3": "audio/mpeg"}
+
+    def __init__(self, format: str = "mp3", sample_rate: int = 48000, channels: int = 2, mp3_bitrate: str = "192k"):
+        """
+        Initialize streaming encoder
+        
+        Args:
+            format: Output format ('wav', 'flac', 'mp3')
+            sample_rate: Sample rate of the incoming chunks
+            channels: Number of channels of the incoming chunks
+            mp3_bitrate: Bitrate passed to ffmpeg for mp3
+        """
+        self.format = format.lower()
+        if self.format not in self.MEDIA_TYPES:
+            raise ValueError(f"Unsupported streaming format: {format}")
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._header_sent = False
+        self._sink = None
+        self._sf_file = None
+        self._ffmpeg = None
+        self._ffmpeg_reader = None
+        self._ffmpeg_chunks: List[bytes] = []
+
+        if self.format == "flac":
+            import soundfile as sf
+            self._sink = _StreamSink()
+            self._sf_file = sf.SoundFile(
+                self._sink, mode="w", samplerate=sample_rate, channels=channels,
+                format="FLAC", subtype="PCM_16",
+            )
+        elif self.format == "mp3":
+            self._start_ffmpeg(mp3_bitrate)
+
+    @property
+    def media_type(self) -> str:
+        return self.MEDIA_TYPES[self.format]
+
+    def _start_ffmpeg(self, bitrate: str):
+        import subprocess
+        import threading
+
+        self._ffmpeg = subprocess.Popen(
+            [
+                "ffmpeg", "-hide_banner", "-loglevel", "error",
+                "-f", "f32le", "-ar", str(self.sample_rate), "-ac", str(self.channels), "-i", "pipe:0",
+                "-f", "mp3", "-b:a", bitrate, "pipe:1",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self._ffmpeg_lock = threading.Lock()
+        stdout = self._ffmpeg.stdout
+
+        # ffmpeg output is drained on a thread so writes to stdin never block on a full pipe
+        def _reader():
+            while True:
+                data = stdout.read1(65536)
+                if not data:
+                    break
+                with self._ffmpeg_lock:
+                    self._ffmpeg_chunks.append(data)
+
+        self._ffmpeg_reader = threading.Thread(target=_reader, daemon=True)
+        self._ffmpeg_reader.start()
+
+    def _drain_ffmpeg(self) -> bytes:
+        with self._ffmpeg_lock:
+            data = b"".join(self._ffmpeg_chunks)
+            self._ffmpeg_chunks.clear()
+        return data
+
+    def _wav_header(self) -> bytes:
+        import struct
+        block_align = self.channels * 2
+        # 0xFFFFFFFF sizes mark the stream length as unknown
+        return (
+            b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, self.channels, self.sample_rate,
+                                    self.sample_rate * block_align, block_align, 16)
+            + b"data" + struct.pack("<I", 0xFFFFFFFF)
+        )
+
+    def encode(self, chunk: Union[torch.Tensor, np.ndarray]) -> bytes:
+        """
+        Encode one audio chunk
+        
+        Args:
+            chunk: Audio chunk [channels, samples], float in [-1, 1]
+        
+        Returns:
+            Encoded bytes ready to send (may be empty while the encoder buffers)
+        """
+        if isinstance(chunk, torch.Tensor):
+            chunk = chunk.detach().cpu().float().numpy()
+        # [channels, samples] -> interleaved [samples, channels]
+        frames = np.ascontiguousarray(np.clip(chunk, -1.0, 1.0).T, dtype=np.float32)
+
+        if self.format == "wav":
+            out = b"" if self._header_sent else self._wav_header()
+            self._header_sent = True
+            return out + (frames * 32767.0).astype("<i2").tobytes()
+        if self.format == "flac":
+            self._sf_file.write(frames)
+            return self._sink.take()
+        self._ffmpeg.stdin.write(frames.tobytes())
+        self._ffmpeg.stdin.flush()
+        return self._drain_ffmpeg()
+
+    def finish(self) -> bytes:
+        """Flush the encoder and return the remaining bytes."""
+        if self.format == "wav":
+            out = b"" if self._header_sent else self._wav_header()
+            self._header_sent = True
+            return out
+        if self.format == "flac":
+            if self._sf_file is not None:
+                self._sf_file.close()
+                self._sf_file = None
+            return self._sink.take()
+        if self._ffmpeg is not None:
+            self._ffmpeg.stdin.close()
+            self._ffmpeg_reader.join()
+            self._ffmpeg.wait()
+            self._ffmpeg = None
+        return self._drain_ffmpeg()
+
+    def close(self):
+        """Release encoder resources without flushing (e.g. client disconnected)."""
+        if self._sf_file is not None:
+            try:
+                self._sf_file.close()
+            except Exception:
+                pass
+            self._sf_file = None
+        if self._ffmpeg is not None:
+            try:
+                self._ffmpeg.kill()
+                self._ffmpeg.wait()
+            except Exception:
+                pass
+            self._ffmpeg = None
+
+
 def get_audio_file_hash(audio_file) -> str:
     """
     Get hash identifier for an audio file.
@@ -248,6 +458,23 @@ def get_audio_file_hash(audio_file) -> str:
         return hashlib.md5(str(audio_file).encode('utf-8')).hexdigest()
 
 
+def get_audio_tensor_hash(audio: torch.Tensor) -> str:
+    """
+    Get a content hash for an audio (or latent) tensor.
+    
+    Args:
+        audio: Tensor on any device
+    
+    Returns:
+        Hex digest covering shape, dtype and data
+    """
+    data = audio.detach().to("cpu").contiguous()
+    h = hashlib.sha1(f"{tuple(data.shape)}|{data.dtype}".encode("utf-8"))
+    # Byte view also covers dtypes numpy lacks (bfloat16)
+    h.update(data.reshape(-1).view(torch.uint8).numpy())
+    return h.hexdigest()
+
+
 def generate_uuid_from_params(params_dict) -> str:
     """
     Generate deterministic UUID from generation parameters.
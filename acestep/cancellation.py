@@ -0,0 +1,93 @@
+"""Cooperative cancellation of generation jobs
+
+Once a job reaches generate_music() nothing used to be able to stop it: a
+client that gave up still cost the full LM code generation, DiT and VAE
+decode. A CancellationToken is created per job and passed down the
+pipeline, which checks it at safe points and unwinds with
+JobCancelledError:
+- LM: before every decode step (nano-vllm engine loop, PyTorch loops)
+- DiT: before every diffusion step
+- VAE: before every decoded tile
+
+A token trips when cancel() is called (e.g. the /v1/cancel endpoint) or
+once its deadline passes. Checking is a lock-free flag / clock read, cheap
+enough for every decode step.
+"""
+
+import threading
+import time
+from typing import Iterable, Optional
+
+
+class JobCancelledError(Exception):
+    """Raised inside the generation pipeline once the job's token has tripped."""
+
+
+class CancellationToken:
+    """Cancellation flag of one job, with an optional deadline."""
+
+    def __init__(self, deadline: Optional[float] = None):
+        """
+        Args:
+            deadline: time.time() after which the token counts as cancelled (None for no deadline)
+        """
+        self.deadline = deadline
+        self._event = threading.Event()
+        self._reason = ""
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """Trip the token (thread-safe; the first reason wins)."""
+        if not self._event.is_set():
+            self._reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.time() >= self.deadline:
+            self.cancel("deadline exceeded")
+            return True
+        return False
+
+    @property
+    def reason(self) -> str:
+        return self._reason if self.cancelled else ""
+
+    def check(self) -> None:
+        """Raise JobCancelledError if the token has tripped."""
+        if self.cancelled:
+            raise JobCancelledError(self._reason)
+
+
+class _AllCancelledToken(CancellationToken):
+    """Trips only once every member token has (work shared by several jobs)."""
+
+    def __init__(self, tokens: Iterable[CancellationToken]):
+        super().__init__()
+        self._tokens = list(tokens)
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self._tokens and all(t.cancelled for t in self._tokens):
+            self.cancel(self._tokens[0].reason)
+        return self._event.is_set()
+
+
+def all_cancelled(tokens: Iterable[Optional[CancellationToken]]) -> Optional[CancellationToken]:
+    """
+    Token for work shared by several jobs (e.g. a merged DiT batch).
+
+    Returns:
+        A token that trips once all given tokens have, or None if any job is not cancellable
+    """
+    tokens = list(tokens)
+    if not tokens or any(t is None for t in tokens):
+        return None
+    return tokens[0] if len(tokens) == 1 else _AllCancelledToken(tokens)
+
+
+def check_cancelled(cancel_token: Optional[CancellationToken]) -> None:
+    """cancel_token.check() for optional tokens."""
+    if cancel_token is not None:
+        cancel_token.check()
@@ -6,6 +6,7 @@ from transformers import AutoTokenizer
 from transformers.generation.logits_process import LogitsProcessor
 import os
 import torch
+from acestep.constrained_vocab_cache import get_constrained_vocab_tables
 from acestep.constants import (
     VALID_LANGUAGES,
     KEYSCALE_NOTES,
@@ -51,6 +52,31 @@ class FSMState(Enum):
     COMPLETED = auto()           # Generation completed
 
 
+def _to_device(values: List[Any], dtype: torch.dtype, device: torch.device) -> torch.Tensor:
+    """Small host list -> device tensor; CUDA copies go through pinned memory without a stream sync."""
+    tensor = torch.tensor(values, dtype=dtype)
+    if device.type != "cuda":
+        return tensor.to(device)
+    return tensor.pin_memory().to(device, non_blocking=True)
+
+
+# Per-sequence FSM fields. Everything else on the processor is configuration or
+# precomputed vocabulary tables shared by all sequences of a batch.
+SEQUENCE_STATE_FIELDS = (
+    "state",
+    "position_in_state",
+    "accumulated_value",
+    "accumulated_token_ids",
+    "codes_count",
+    "user_field_token_queue",
+    "current_user_field",
+    "caption_after_newline",
+    "caption_token_count",
+    "caption_ending",
+    "pending_field_name",
+)
+
+
 class MetadataConstrainedLogitsProcessor(LogitsProcessor):
     """
     FSM-driven LogitsProcessor that constrains generation to produce valid metadata.
@@ -153,6 +179,13 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         self.user_field_token_queue: List[int] = []
         self.current_user_field: Optional[str] = None  # Current field being injected
         
+        # Per-sequence FSM states for batched decoding (seq_id -> SEQUENCE_STATE_FIELDS values)
+        self._sequence_states: Dict[Any, Dict[str, Any]] = {}
+        self._think_end_tokens: Optional[List[int]] = None
+        
+        # Vocabulary tables shared by all processors of this tokenizer (compiled once, cached on disk)
+        self._vocab_tables = get_constrained_vocab_tables(tokenizer)
+
         # Pre-compute token IDs for efficiency
         self._precompute_tokens()
 
@@ -168,7 +201,7 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         
         self._char_to_tokens: Dict[str, set] = {}  # Precomputed char -> token IDs mapping
         
-        # Precompute token mappings once (O(vocab_size), runs once at init)
+        # Precomputed token mappings (shared tables, no vocabulary scan)
         self._precompute_char_token_mapping()
         
         # Field definitions (needed before building prefix trees)
@@ -185,30 +218,20 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         self.valid_duration_values = [str(v) for v in range(self.field_specs["duration"]["min"], self.field_specs["duration"]["max"] + 1)]
         self.valid_timesig_values = [str(v) for v in self.field_specs["timesignature"]["valid_values"]]
         
-        # Build keyscale prefix tree (requires _char_to_tokens to be initialized)
-        self.keyscale_prefix_tree = self._build_keyscale_prefix_tree()
-        
-        # Build numeric prefix trees (BPM, Duration, Timesignature) with context
-        # IMPORTANT: State machine generates "bpm:" (no space), but tokenizer sees "bpm: " (with space)
-        # Use same logic as keyscale: context_prefix_for_matching (no space) and context_prefix_for_tokenization (with space)
-        self.bpm_prefix_tree = self._build_numeric_prefix_tree(
-            self.valid_bpm_values, 
-            context_prefix_for_matching="bpm:",
-            context_prefix_for_tokenization="bpm: "
-        )
-        self.duration_prefix_tree = self._build_numeric_prefix_tree(
-            self.valid_duration_values,
-            context_prefix_for_matching="duration:",
-            context_prefix_for_tokenization="duration: "
-        )
-        self.timesig_prefix_tree = self._build_numeric_prefix_tree(
-            self.valid_timesig_values,
-            context_prefix_for_matching="timesignature:",
-            context_prefix_for_tokenization="timesignature: "
-        )
-        
-        # Build language prefix tree (similar to keyscale but for language codes)
-        self.language_prefix_tree = self._build_language_prefix_tree()
+        # Prefix trees (token ID sequence prefix -> allowed next tokens) for keyscale, BPM,
+        # Duration, Timesignature and language values, built from the actual tokenization
+        # of each value in its "field: value" context (see ConstrainedVocabTables.prefix_tree)
+        self.keyscale_prefix_tree = self._vocab_tables.prefix_tree("keyscale")
+        self.bpm_prefix_tree = self._vocab_tables.prefix_tree("bpm")
+        self.duration_prefix_tree = self._vocab_tables.prefix_tree("duration", self.max_duration)
+        self.timesig_prefix_tree = self._vocab_tables.prefix_tree("timesignature")
+        self.language_prefix_tree = self._vocab_tables.prefix_tree("language")
+        if self.debug:
+            logger.debug(
+                f"Prefix trees: keyscale={len(self.keyscale_prefix_tree)}, bpm={len(self.bpm_prefix_tree)}, "
+                f"duration={len(self.duration_prefix_tree)}, timesignature={len(self.timesig_prefix_tree)}, "
+                f"language={len(self.language_prefix_tree)} token sequence prefixes"
+            )
 
         self._load_genres_vocab()
         
@@ -432,169 +455,58 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
                 logger.debug("No user-provided metadata, all fields will be generated")
     
     def _precompute_tokens(self):
-        """Pre-compute commonly used token IDs for efficiency."""
-        # Digit tokens (0-9)
-        self.digit_tokens = {}
-        for d in range(10):
-            tokens = self.tokenizer.encode(str(d), add_special_tokens=False)
-            if tokens:
-                self.digit_tokens[d] = tokens[-1]  # Take last token (in case of prefix)
-        
-        # Newline token
-        newline_tokens = self.tokenizer.encode("\n", add_special_tokens=False)
-        self.newline_token = newline_tokens[-1] if newline_tokens else None
-        
-        # Note tokens for keyscale (A-G)
-        self.note_tokens = {}
-        for note in KEYSCALE_NOTES:
-            tokens = self.tokenizer.encode(note, add_special_tokens=False)
-            if tokens:
-                self.note_tokens[note] = tokens[-1]
-        
-        # Sharp/flat tokens
-        self.sharp_tokens = []
-        for s in ["#", "♯"]:
-            tokens = self.tokenizer.encode(s, add_special_tokens=False)
-            if tokens:
-                self.sharp_tokens.append(tokens[-1])
-        
-        self.flat_tokens = []
-        for f in ["b", "♭"]:
-            tokens = self.tokenizer.encode(f, add_special_tokens=False)
-            if tokens:
-                self.flat_tokens.append(tokens[-1])
-        
-        # Space token
-        space_tokens = self.tokenizer.encode(" ", add_special_tokens=False)
-        self.space_token = space_tokens[-1] if space_tokens else None
-        
-        # Major/minor tokens (we'll encode the full words)
-        self.major_start_tokens = []
-        self.minor_start_tokens = []
-        for prefix in ["m", "M"]:
-            tokens = self.tokenizer.encode(prefix, add_special_tokens=False)
-            if tokens:
-                if prefix.lower() == "m":
-                    self.minor_start_tokens.append(tokens[-1])
-                    self.major_start_tokens.append(tokens[-1])  # "major" also starts with m
-        
-        # Vocab size
-        self.vocab_size = len(self.tokenizer)
+        """
+        Pick up commonly used token IDs, the audio code masks and the valid value sets.
 
+        Token IDs and masks come from the tokenizer's shared ConstrainedVocabTables
+        (compiled once per tokenizer and cached on disk), so no vocabulary scan happens here.
+        """
+        tables = self._vocab_tables
+        special = tables.special
+        self.vocab_size = tables.vocab_size
+
+        # Digit tokens (0-9), note tokens for keyscale (A-G), sharp/flat tokens
+        self.digit_tokens = dict(special["digit_tokens"])
+        self.note_tokens = dict(special["note_tokens"])
+        self.sharp_tokens = list(special["sharp_tokens"])
+        self.flat_tokens = list(special["flat_tokens"])
+        # Major/minor both start with m
+        self.major_start_tokens = list(special["major_start_tokens"])
+        self.minor_start_tokens = list(special["minor_start_tokens"])
+
+        self.newline_token = special["newline_token"]
+        self.space_token = special["space_token"]
         # Comma token for multi-genre support
-        comma_tokens = self.tokenizer.encode(",", add_special_tokens=False)
-        self.comma_token = comma_tokens[-1] if comma_tokens else None
-        
-        # EOS token for duration-constrained codes generation
+        self.comma_token = special["comma_token"]
+        # Period token for caption field transition logic
+        self.period_token = special["period_token"]
+        # Backtick token for blocking code blocks in caption
+        self.backtick_token = special["backtick_token"]
+
+        # EOS token for duration-constrained codes generation, plus additional stop
+        # tokens (e.g., <|im_end|>, <|endoftext|>)
         self.eos_token_id = self.tokenizer.eos_token_id
-        
-        # Detect additional stop tokens (e.g., <|im_end|>, <|endoftext|>)
-        self.additional_stop_token_ids = []
-        for token in ["<|im_end|>", "<|endoftext|>"]:
-            ids = self.tokenizer.encode(token, add_special_tokens=False)
-            if ids:
-                self.additional_stop_token_ids.append(ids[-1])
-        if self.additional_stop_token_ids:
-            if self.debug:
-                logger.debug(f"Registered additional stop token IDs: {self.additional_stop_token_ids}")
+        self.additional_stop_token_ids = list(special["additional_stop_token_ids"])
+        if self.additional_stop_token_ids and self.debug:
+            logger.debug(f"Registered additional stop token IDs: {self.additional_stop_token_ids}")
 
-        # Period token for caption field transition logic
-        period_tokens = self.tokenizer.encode(".", add_special_tokens=False)
-        self.period_token = period_tokens[-1] if period_tokens else None
-        
-        # Backtick tokens for blocking code blocks in caption
-        backtick_tokens = self.tokenizer.encode("`", add_special_tokens=False)
-        self.backtick_token = backtick_tokens[-1] if backtick_tokens else None
-        
         # Valid language codes (ISO 639-1 and common variants)
         self.valid_languages = VALID_LANGUAGES
-        
-        # Precompute audio code token IDs (tokens matching <|audio_code_\d+|>)
-        # These should be blocked during caption generation
-        self.audio_code_token_ids: Set[int] = set()
-        self._precompute_audio_code_tokens()
-        
-        # Precompute audio code mask for efficient blocking (O(1) instead of O(n))
-        # This mask will be added to scores during caption generation
-        self.audio_code_mask: Optional[torch.Tensor] = None
-        # Inverse mask: block all non-audio-code tokens (for CODES_GENERATION state)
-        self.non_audio_code_mask: Optional[torch.Tensor] = None
-        self._build_audio_code_mask()
-        
-        # Build valid keyscales set (prefix tree will be built after _char_to_tokens is initialized)
-        # 7 notes × 5 accidentals (none, #, b, ♯, ♭) × 2 modes = 70 valid combinations
-        self.valid_keyscales = VALID_KEYSCALES.copy()
-        
-        # keyscale_prefix_tree will be built in _precompute_char_token_mapping() after _char_to_tokens is ready
-        # Numeric prefix trees will be built after field_specs is defined
-    
-    def _precompute_audio_code_tokens(self):
-        """
-        Precompute audio code token IDs (tokens matching <|audio_code_\\d+|>).
-        These tokens should be blocked during caption generation.
-        """
-        import re
-        audio_code_pattern = re.compile(r'^<\|audio_code_\d+\|>$')
-        
-        # Iterate through vocabulary to find audio code tokens
-        for token_id in range(self.vocab_size):
-            try:
-                token_text = self.tokenizer.decode([token_id])
-                if audio_code_pattern.match(token_text):
-                    self.audio_code_token_ids.add(token_id)
-            except Exception:
-                continue
-        
-        if self.debug:
-            logger.debug(f"Found {len(self.audio_code_token_ids)} audio code tokens")
-    
-    def _build_audio_code_mask(self):
-        """
-        Build a precomputed mask tensor for blocking audio code tokens.
-        This mask can be added to scores in O(1) time instead of O(n) loop.
-        
-        The mask is [1, vocab_size] tensor with -inf at audio code token positions.
-        
-        Also builds the inverse mask (non_audio_code_mask) for CODES_GENERATION state,
-        which blocks all non-audio-code tokens.
-        """
-        if not self.audio_code_token_ids:
-            self.audio_code_mask = None
-            self.non_audio_code_mask = None
-            return
-        
-        # Create mask tensor: 0 everywhere, -inf at audio code positions
-        # Use float32 for compatibility with most model dtypes
-        mask = torch.zeros(1, self.vocab_size, dtype=torch.float32)
-        
-        # Convert set to list for indexing
-        audio_code_indices = list(self.audio_code_token_ids)
-        
-        # Set -inf at audio code token positions
-        mask[0, audio_code_indices] = float('-inf')
-        
-        self.audio_code_mask = mask
-        
-        # Build inverse mask: -inf everywhere EXCEPT at audio code positions
-        # This is used in CODES_GENERATION state to only allow audio codes
-        inverse_mask = torch.full((1, self.vocab_size), float('-inf'), dtype=torch.float32)
-        inverse_mask[0, audio_code_indices] = 0
-        
-        # Also allow EOS token in codes generation (will be controlled by duration constraint)
-        if self.eos_token_id is not None:
-            inverse_mask[0, self.eos_token_id] = 0
-        
-        # Also allow additional stop tokens (will be aliased to EOS token in __call__)
-        if hasattr(self, 'additional_stop_token_ids') and self.additional_stop_token_ids:
-            for stop_id in self.additional_stop_token_ids:
-                if stop_id < self.vocab_size:
-                    inverse_mask[0, stop_id] = 0
 
-        self.non_audio_code_mask = inverse_mask
-        
+        # Audio code token IDs (tokens matching <|audio_code_\d+|>), blocked during caption
+        # generation by adding audio_code_mask to the scores (O(1) instead of O(n)).
+        # non_audio_code_mask is the inverse for CODES_GENERATION: only audio codes, EOS
+        # and the additional stop tokens stay open. Both are shared CPU masks; decoding
+        # uses their device copies from the tables (_vocab_tables.mask()).
+        self.audio_code_token_ids: Set[int] = tables.audio_code_token_ids
+        self.audio_code_mask: Optional[torch.Tensor] = tables.audio_code_mask
+        self.non_audio_code_mask: Optional[torch.Tensor] = tables.non_audio_code_mask
         if self.debug:
-            logger.debug(f"Built audio code masks for {len(self.audio_code_token_ids)} tokens")
+            logger.debug(f"Found {len(self.audio_code_token_ids)} audio code tokens")
 
+        # 7 notes × 5 accidentals (none, #, b, ♯, ♭) × 2 modes = 70 valid combinations
+        self.valid_keyscales = VALID_KEYSCALES.copy()
+    
     def _apply_whitelist_inplace(self, scores: torch.Tensor, allowed_tokens: List[int]) -> None:
         """
         Apply whitelist constraint inplace: only allow specified tokens, block all others.
@@ -602,6 +514,7 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         This is more efficient than creating a mask tensor because:
         1. No memory allocation for mask
         2. No tensor addition operation
+        3. No host-to-device copy: the index tensor of each allowed token set is cached
         
         Args:
             scores: [1, vocab_size] scores tensor to modify inplace
@@ -612,8 +525,8 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
             scores.fill_(float('-inf'))
             return
         
-        # Save the original values of allowed tokens
-        allowed_indices = torch.tensor(allowed_tokens, device=scores.device, dtype=torch.long)
+        # Save the original values of allowed tokens (index tensor shared per token set and device)
+        allowed_indices = self._vocab_tables.token_index(tuple(allowed_tokens), scores.device)
         saved_values = scores[0, allowed_indices].clone()
         
         # Set all scores to -inf
@@ -622,243 +535,6 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         # Restore allowed token values
         scores[0, allowed_indices] = saved_values
 
-    def _build_keyscale_prefix_tree(self) -> Dict[Tuple[int, ...], Set[int]]:
-        """
-        Build keyscale prefix to allowed tokens mapping based on ACTUAL tokenization.
-        
-        IMPORTANT: Uses token ID sequences as keys, NOT strings, to avoid tokenization mismatches.
-        
-        CRITICAL FIX: The tokenizer may merge the context's trailing space into the next token.
-        For example:
-        - "keyscale: " tokenizes to [10563, 2246, 25, 220] -> ['keys', 'cale', ':', ' ']
-        - "keyscale: G major" tokenizes to [10563, 2246, 25, 479, 3598] -> ['keys', 'cale', ':', ' G', ' major']
-        The space ' ' (220) is merged into ' G' (479), so we can't use simple slicing.
-        
-        Strategy:
-        1. For each keyscale (e.g., "G major"), encode the FULL string "keyscale: G major"
-        2. Tokenize to get: [10563, 2246, 25, 479, 3598] -> ['keys', 'cale', ':', ' G', ' major']
-        3. Find where context prefix ends by matching token sequences (handling space merging)
-        4. Extract keyscale value tokens: [479, 3598] (for "G major")
-        5. Build prefix tree using token ID sequences as keys
-        
-        This ensures we get the exact tokenization that occurs during generation.
-        """
-        prefix_to_tokens: Dict[Tuple[int, ...], Set[int]] = {}
-        
-        # Context prefix that appears before keyscale value
-        # IMPORTANT: The state machine generates "keyscale:" (no space), but when tokenizing
-        # the full string "keyscale: G major", the tokenizer includes space, so we need to
-        # match the actual tokenization behavior.
-        # 
-        # Strategy:
-        # 1. Use "keyscale:" (no space) to match the state machine's output
-        # 2. But when building prefix tree, use "keyscale: " (with space) + keyscale to match actual tokenization
-        context_prefix_for_matching = "keyscale:"  # What state machine generates
-        context_prefix_for_tokenization = "keyscale: "  # What tokenizer sees in full string
-        
-        # First, tokenize the context (without space) to know its token sequence for matching
-        context_token_ids = self.tokenizer.encode(context_prefix_for_matching, add_special_tokens=False)
-        
-        if self.debug:
-            context_tokens_str = [self.tokenizer.decode([t]) for t in context_token_ids]
-            logger.debug(f"Context for matching 'keyscale:' tokenizes to {context_token_ids} -> {context_tokens_str}")
-        
-        # For each valid keyscale, encode full string and extract value tokens
-        for keyscale in self.valid_keyscales:
-            # Step 1: Encode full string "keyscale: {keyscale}" (with space, as tokenizer sees it)
-            full_text = context_prefix_for_tokenization + keyscale
-            full_token_ids = self.tokenizer.encode(full_text, add_special_tokens=False)
-            
-            # Step 2: Find where context ends in full_token_ids
-            # We match using context_prefix_for_matching ("keyscale:") token sequence
-            # because that's what the state machine actually generates
-            context_end_idx = None
-            
-            # Try exact prefix match using context_prefix_for_matching token sequence
-            if len(full_token_ids) >= len(context_token_ids):
-                if full_token_ids[:len(context_token_ids)] == context_token_ids:
-                    context_end_idx = len(context_token_ids)
-            
-            if context_end_idx is None:
-                if self.debug:
-                    logger.warning(f"Could not find context prefix in full tokenization of '{full_text}', skipping")
-                continue
-            
-            # Step 3: Extract keyscale value tokens (everything after context)
-            keyscale_token_ids = full_token_ids[context_end_idx:]
-            
-            # Step 4: Verify we extracted some tokens (sanity check)
-            if not keyscale_token_ids:
-                if self.debug:
-                    logger.warning(f"No tokens extracted for keyscale '{keyscale}', skipping")
-                continue
-            
-            # Step 5: Verify first token is a note (A-G)
-            # This is critical: the first token of keyscale value must be a note
-            first_token_id = keyscale_token_ids[0]
-            first_token_str = self.tokenizer.decode([first_token_id])
-            # Check if first token starts with a note (A-G, case insensitive, with optional leading space)
-            first_char = first_token_str.lstrip()[0].upper() if first_token_str.lstrip() else ""
-            if first_char not in "ABCDEFG":
-                # This keyscale's first token is not a note - skip it
-                if self.debug:
-                    logger.debug(f"Skipping keyscale '{keyscale}': first token is '{first_token_str}' (id={first_token_id}), not a note")
-                continue
-            
-            # Step 6: Build prefix mappings from keyscale value tokens
-            # Use token ID sequences as keys (not strings) to avoid tokenization mismatches
-            for i in range(len(keyscale_token_ids) + 1):
-                # Current token sequence prefix (empty tuple for start)
-                token_prefix = tuple(keyscale_token_ids[:i])
-                
-                if token_prefix not in prefix_to_tokens:
-                    prefix_to_tokens[token_prefix] = set()
-                
-                if i < len(keyscale_token_ids):
-                    # Add next token as allowed for current prefix
-                    next_token_id = keyscale_token_ids[i]
-                    prefix_to_tokens[token_prefix].add(next_token_id)
-                else:
-                    # Complete keyscale should allow newline
-                    if self.newline_token:
-                        prefix_to_tokens[token_prefix].add(self.newline_token)
-        
-        if self.debug:
-            logger.debug(f"Built keyscale prefix tree with {len(prefix_to_tokens)} token sequence prefixes")
-            # Check empty prefix (start of keyscale value)
-            empty_prefix = tuple()
-            if empty_prefix in prefix_to_tokens:
-                first_tokens = prefix_to_tokens[empty_prefix]
-                decoded_first = [(t, repr(self.tokenizer.decode([t]))) for t in sorted(first_tokens)]
-                logger.debug(f"First tokens allowed (empty prefix): {decoded_first}")
-        
-        return prefix_to_tokens
-    
-    def _build_numeric_prefix_tree(
-        self, 
-        valid_values: List[str], 
-        context_prefix_for_matching: str = "",
-        context_prefix_for_tokenization: str = ""
-    ) -> Dict[Tuple[int, ...], Set[int]]:
-        """
-        Build prefix tree for numeric field based on actual tokenization with context.
-        
-        IMPORTANT: Uses token ID sequences as keys, NOT strings, to avoid tokenization mismatches.
-        
-        Args:
-            valid_values: List of valid numeric strings (e.g., ["30", "31", ..., "300"])
-            context_prefix_for_matching: Context string that state machine generates (e.g., "bpm:") - no space
-            context_prefix_for_tokenization: Context string for tokenization (e.g., "bpm: ") - with space
-            
-        Returns:
-            Dict mapping token ID sequence prefix -> set of allowed token IDs
-        """
-        prefix_to_tokens: Dict[Tuple[int, ...], Set[int]] = {}
-        
-        # Encode context for matching (what state machine generates, no space)
-        context_token_ids = self.tokenizer.encode(context_prefix_for_matching, add_special_tokens=False) if context_prefix_for_matching else []
-        
-        # For each valid value, encode it with context and build prefix mappings
-        for value_str in valid_values:
-            # Encode value WITH context (with space) to match actual tokenization
-            full_text = context_prefix_for_tokenization + value_str
-            token_ids = self.tokenizer.encode(full_text, add_special_tokens=False)
-            
-            # Find where context ends in full_token_ids using context_prefix_for_matching token sequence
-            context_end_idx = None
-            if len(token_ids) >= len(context_token_ids):
-                if token_ids[:len(context_token_ids)] == context_token_ids:
-                    context_end_idx = len(context_token_ids)
-            
-            if context_end_idx is None:
-                if self.debug:
-                    logger.warning(f"Could not find context prefix in full tokenization of '{full_text}', skipping")
-                continue
-            
-            # Extract only tokens that belong to the value itself (skip context tokens)
-            value_token_ids = token_ids[context_end_idx:]
-            
-            # Build prefix mappings using token ID sequences as keys
-            for i in range(len(value_token_ids) + 1):
-                # Current token sequence prefix (empty tuple for start)
-                token_prefix = tuple(value_token_ids[:i])
-                
-                if token_prefix not in prefix_to_tokens:
-                    prefix_to_tokens[token_prefix] = set()
-                
-                if i < len(value_token_ids):
-                    # Add next token as allowed for current prefix
-                    next_token_id = value_token_ids[i]
-                    prefix_to_tokens[token_prefix].add(next_token_id)
-                else:
-                    # Complete value should allow newline
-                    if self.newline_token:
-                        prefix_to_tokens[token_prefix].add(self.newline_token)
-        
-        return prefix_to_tokens
-    
-    def _build_language_prefix_tree(self) -> Dict[Tuple[int, ...], Set[int]]:
-        """
-        Build language prefix to allowed tokens mapping based on ACTUAL tokenization.
-        Similar to keyscale prefix tree but for language codes.
-        
-        Uses token ID sequences as keys, NOT strings, to avoid tokenization mismatches.
-        """
-        prefix_to_tokens: Dict[Tuple[int, ...], Set[int]] = {}
-        
-        context_prefix_for_matching = "language:"
-        context_prefix_for_tokenization = "language: "
-        
-        context_token_ids = self.tokenizer.encode(context_prefix_for_matching, add_special_tokens=False)
-        
-        if self.debug:
-            context_tokens_str = [self.tokenizer.decode([t]) for t in context_token_ids]
-            logger.debug(f"Context for matching 'language:' tokenizes to {context_token_ids} -> {context_tokens_str}")
-        
-        for lang in self.valid_languages:
-            full_text = context_prefix_for_tokenization + lang
-            full_token_ids = self.tokenizer.encode(full_text, add_special_tokens=False)
-            
-            context_end_idx = None
-            if len(full_token_ids) >= len(context_token_ids):
-                if full_token_ids[:len(context_token_ids)] == context_token_ids:
-                    context_end_idx = len(context_token_ids)
-            
-            if context_end_idx is None:
-                if self.debug:
-                    logger.warning(f"Could not find context prefix in full tokenization of '{full_text}', skipping")
-                continue
-            
-            lang_token_ids = full_token_ids[context_end_idx:]
-            
-            if not lang_token_ids:
-                if self.debug:
-                    logger.warning(f"No tokens extracted for language '{lang}', skipping")
-                continue
-            
-            for i in range(len(lang_token_ids) + 1):
-                token_prefix = tuple(lang_token_ids[:i])
-                
-                if token_prefix not in prefix_to_tokens:
-                    prefix_to_tokens[token_prefix] = set()
-                
-                if i < len(lang_token_ids):
-                    next_token_id = lang_token_ids[i]
-                    prefix_to_tokens[token_prefix].add(next_token_id)
-                else:
-                    if self.newline_token:
-                        prefix_to_tokens[token_prefix].add(self.newline_token)
-        
-        if self.debug:
-            logger.debug(f"Built language prefix tree with {len(prefix_to_tokens)} token sequence prefixes")
-            empty_prefix = tuple()
-            if empty_prefix in prefix_to_tokens:
-                first_tokens = prefix_to_tokens[empty_prefix]
-                decoded_first = [(t, repr(self.tokenizer.decode([t]))) for t in sorted(first_tokens)]
-                logger.debug(f"First tokens allowed for language (empty prefix): {decoded_first}")
-        
-        return prefix_to_tokens
-    
     def diagnose_keyscale_prefix_tree(self):
         """
         Diagnose the keyscale prefix tree to help debug generation bias.
@@ -1027,53 +703,16 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
     
     def _precompute_char_token_mapping(self):
         """
-        Precompute mapping from characters to token IDs and token decoded texts.
+        Pick up the shared mapping from characters to token IDs and token decoded texts.
         This allows O(1) lookup instead of calling tokenizer.encode()/decode() at runtime.
-        
-        Time complexity: O(vocab_size) - runs once during initialization
-        
-        Note: Many subword tokenizers (like Qwen) add space prefixes to tokens.
-        We need to handle both the raw first char and the first non-space char.
+
+        Tokens are indexed by their first character and, for space-prefixed tokens
+        (e.g., " pop"), by their first non-space character. Texts are lowercased with
+        leading spaces kept. Both tables are read-only.
         """
-        self._char_to_tokens: Dict[str, set] = {}
-        self._token_to_text: Dict[int, str] = {}  # Precomputed decoded text for each token
-        
-        # For each token in vocabulary, get its decoded text
-        for token_id in range(self.vocab_size):
-            try:
-                text = self.tokenizer.decode([token_id])
-                
-                if not text:
-                    continue
-                
-                # Store the decoded text (normalized to lowercase)
-                # Keep leading spaces for proper concatenation (e.g., " rock" in "pop rock")
-                # Only rstrip trailing whitespace, unless it's a pure whitespace token
-                text_lower = text.lower()
-                if text_lower.strip():  # Has non-whitespace content
-                    normalized_text = text_lower.rstrip()
-                else:  # Pure whitespace token
-                    normalized_text = " "  # Normalize to single space
-                self._token_to_text[token_id] = normalized_text
-                
-                # Map first character (including space) to this token
-                first_char = text[0].lower()
-                if first_char not in self._char_to_tokens:
-                    self._char_to_tokens[first_char] = set()
-                self._char_to_tokens[first_char].add(token_id)
-                
-                # Also map first non-space character to this token
-                # This handles tokenizers that add space prefixes (e.g., " pop" -> maps to 'p')
-                stripped_text = text.lstrip()
-                if stripped_text and stripped_text != text:
-                    first_nonspace_char = stripped_text[0].lower()
-                    if first_nonspace_char not in self._char_to_tokens:
-                        self._char_to_tokens[first_nonspace_char] = set()
-                    self._char_to_tokens[first_nonspace_char].add(token_id)
-                    
-            except Exception:
-                continue
-        
+        self._char_to_tokens: Dict[str, set] = self._vocab_tables.char_to_tokens
+        self._token_to_text: Dict[int, str] = self._vocab_tables.token_to_text
+
         if self.debug:
             logger.debug(f"Precomputed char->token mapping for {len(self._char_to_tokens)} unique characters")
     
@@ -1230,6 +869,7 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         self.caption_token_count = 0  # Reset caption token count
         self.caption_ending = False  # Reset caption ending tracking
         self.pending_field_name = ""  # Reset pending field name
+        self._sequence_states = {}  # Drop per-sequence states from batched decoding
     
     def set_target_duration(self, duration: Optional[float]):
         """
@@ -1271,12 +911,8 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         # Rebuild valid duration values
         self.valid_duration_values = [str(v) for v in range(self.field_specs["duration"]["min"], self.field_specs["duration"]["max"] + 1)]
         
-        # Rebuild duration prefix tree
-        self.duration_prefix_tree = self._build_numeric_prefix_tree(
-            self.valid_duration_values,
-            context_prefix_for_matching="duration:",
-            context_prefix_for_tokenization="duration: "
-        )
+        # Duration prefix tree for the new maximum (memoized per maximum in the shared tables)
+        self.duration_prefix_tree = self._vocab_tables.prefix_tree("duration", max_duration)
         
         if self.debug:
             logger.debug(f"Updated max duration: {old_max}s -> {max_duration}s, rebuilt prefix tree with {len(self.valid_duration_values)} values")
@@ -1287,69 +923,19 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         Returns list of allowed token IDs.
         
         Strategy: Find the longest prefix that encodes to a single token, and return that token.
-        This ensures we generate by tokens, not character-by-character.
+        This ensures we generate by tokens, not character-by-character. If there is none,
+        allow every first token matching the start of the remaining string, longest match first.
+        Results only depend on the remaining string and are memoized in the shared tables.
         """
         remaining = fixed_str[self.position_in_state:]
         if not remaining:
             return []
         
-        if self.debug:
-            logger.debug(f"_get_allowed_tokens_for_fixed_string: fixed_str={repr(fixed_str)}, position_in_state={self.position_in_state}, remaining={repr(remaining)}")
-        
-        # Try encoding progressively longer prefixes, from longest to shortest
-        # We want to find the longest prefix that encodes to a single token
-        best_token = None
-        best_prefix_len = 0
-        
-        # First pass: find the longest prefix that encodes to exactly one token
-        for end in range(len(remaining), 0, -1):  # Start from longest prefix
-            prefix = remaining[:end]
-            tokens = self.tokenizer.encode(prefix, add_special_tokens=False)
-            if tokens and len(tokens) == 1:
-                # Found a prefix that encodes to a single token
-                # Use this one (longest match)
-                best_token = tokens[0]
-                best_prefix_len = end
-                if self.debug:
-                    logger.debug(f"Found single-token match: prefix={repr(prefix)}, token_id={best_token}, token_text={repr(self.tokenizer.decode([best_token]))}")
-                break
-        
-        # If we found a single-token match, return it (this is the preferred case)
-        if best_token is not None:
-            return [best_token]
-        
-        # Fallback: if no single-token match found, collect all possible first tokens
-        # This handles edge cases where the string might need multiple tokens
-        # But we still want to prefer longer matches
-        # IMPORTANT: Only consider tokens that actually match the beginning of remaining string
-        # Decode each candidate token and verify it matches the prefix
-        allowed_tokens = {}
-        for end in range(1, min(len(remaining) + 1, 20)):  # Limit search to avoid too many iterations
-            prefix = remaining[:end]
-            tokens = self.tokenizer.encode(prefix, add_special_tokens=False)
-            if tokens:
-                first_token = tokens[0]
-                # Verify: decode the token and check it matches the prefix start
-                decoded_token = self.tokenizer.decode([first_token])
-                # Normalize both for comparison (strip and lower)
-                normalized_prefix = prefix.lstrip().lower()
-                normalized_decoded = decoded_token.lstrip().lower()
-                
-                # Check if decoded token matches the prefix start (allowing for space prefixes)
-                if normalized_decoded.startswith(normalized_prefix) or normalized_prefix.startswith(normalized_decoded):
-                    # Store the longest prefix length for each token
-                    if first_token not in allowed_tokens or end > allowed_tokens[first_token]:
-                        allowed_tokens[first_token] = end
-        
-        # Return tokens sorted by prefix length (longest first)
-        # This ensures we prefer longer matches
-        sorted_tokens = sorted(allowed_tokens.items(), key=lambda x: x[1], reverse=True)
-        result = [token for token, _ in sorted_tokens] if sorted_tokens else []
+        result = list(self._vocab_tables.fixed_string_tokens(remaining))
         
         if self.debug:
-            logger.debug(f"Fallback: returning {len(result)} tokens: {[(t, repr(self.tokenizer.decode([t]))) for t in result[:5]]}")
-            if result:
-                logger.debug(f"Fixed string: {repr(fixed_str)}, position: {self.position_in_state}, remaining: {repr(remaining)}")
+            logger.debug(f"_get_allowed_tokens_for_fixed_string: fixed_str={repr(fixed_str)}, position_in_state={self.position_in_state}, remaining={repr(remaining)}")
+            logger.debug(f"Allowed tokens: {[(t, repr(self.tokenizer.decode([t]))) for t in result[:5]]}")
         
         return result
     
@@ -1533,18 +1119,7 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
             return self._apply_temperature_scaling(scores)
         
         if self.state == FSMState.COMPLETED:
-            # If we just completed reasoning and want to stop, force EOS
-            if self.stop_at_reasoning and self.eos_token_id is not None:
-                self._apply_whitelist_inplace(scores, [self.eos_token_id])
-                return self._apply_temperature_scaling(scores)
-
-            # In understanding phase, block audio codes during lyrics generation (COMPLETED state)
-            if self.generation_phase == "understand" and self.audio_code_mask is not None:
-                # Move mask to same device/dtype as scores if needed
-                if self.audio_code_mask.device != scores.device or self.audio_code_mask.dtype != scores.dtype:
-                    self.audio_code_mask = self.audio_code_mask.to(device=scores.device, dtype=scores.dtype)
-                scores = scores + self.audio_code_mask
-            return self._apply_temperature_scaling(scores)
+            return self._apply_temperature_scaling(self._apply_completed_constraints(scores))
         
         # For codes phase, detect if input already contains </think> and skip to CODES_GENERATION
         if self.generation_phase == "codes" and self.state == FSMState.THINK_TAG:
@@ -1557,55 +1132,12 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
                     logger.debug("Codes phase: detected </think> in input, skipping to CODES_GENERATION")
         
         if self.state == FSMState.CODES_GENERATION:
-            # Block all non-audio-code tokens (only allow audio codes and EOS)
-            if self.non_audio_code_mask is not None:
-                # Move mask to same device/dtype as scores if needed
-                if self.non_audio_code_mask.device != scores.device or self.non_audio_code_mask.dtype != scores.dtype:
-                    self.non_audio_code_mask = self.non_audio_code_mask.to(device=scores.device, dtype=scores.dtype)
-                scores = scores + self.non_audio_code_mask
-            
-            # Alias additional stop tokens to EOS token (if not blocked by duration constraint)
-            # This ensures that if model generates <|im_end|>, we map it to EOS so vllm stops
-            if self.eos_token_id is not None and self.additional_stop_token_ids:
-                # Only alias if EOS is NOT blocked
-                eos_blocked = (scores[0, self.eos_token_id] == float('-inf'))
-
-                if not eos_blocked:
-                    # For each sequence in batch
-                    for b in range(scores.shape[0]):
-                        # Find max score among additional stop tokens for this sequence
-                        max_stop_score = float('-inf')
-                        found_valid_stop = False
-                        for stop_id in self.additional_stop_token_ids:
-                            if stop_id < scores.shape[1]:
-                                stop_score = scores[b, stop_id].item()
-                                if stop_score > float('-inf'):
-                                    max_stop_score = max(max_stop_score, stop_score)
-                                    found_valid_stop = True
-                                # Mask the additional stop token (so it's not sampled directly)
-                                scores[b, stop_id] = float('-inf')
-
-                        # If we found a valid stop token score that is higher than current EOS score,
-                        # boost EOS score to match it. This makes EOS token the likely sample.
-                        if found_valid_stop:
-                            current_eos_score = scores[b, self.eos_token_id].item()
-                            if max_stop_score > current_eos_score:
-                                scores[b, self.eos_token_id] = max_stop_score
-
-            # Apply duration constraint in codes generation phase
-            if self.target_codes is not None and self.eos_token_id is not None:
-                if self.codes_count < self.target_codes:
-                    # Block EOS token until target codes count is reached
-                    scores[:, self.eos_token_id] = float('-inf')
-                    if self.debug:
-                        logger.debug(f"Codes generation: {self.codes_count}/{self.target_codes}, blocking EOS")
-                else:
-                    # Force EOS token when target codes count is reached - inplace
-                    eos_scores = scores[:, self.eos_token_id].clone()
-                    scores.fill_(float('-inf'))
-                    scores[:, self.eos_token_id] = eos_scores
-                    if self.debug:
-                        logger.debug(f"Codes generation: {self.codes_count}/{self.target_codes}, forcing EOS")
+            # Only audio codes and EOS (additional stop tokens aliased to EOS), duration
+            # constraint on EOS; all rows share this processor's codes count
+            scores = self._apply_codes_constraints_batch(scores, [self.codes_count] * scores.shape[0])
+            if self.debug and self.target_codes is not None:
+                action = "blocking" if self.codes_count < self.target_codes else "forcing"
+                logger.debug(f"Codes generation: {self.codes_count}/{self.target_codes}, {action} EOS")
             return self._apply_temperature_scaling(scores)
         
         batch_size = scores.shape[0]
@@ -1618,6 +1150,241 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         # Apply temperature scaling after constraint masking
         return self._apply_temperature_scaling(scores)
     
+    def _apply_completed_constraints(self, scores: torch.FloatTensor) -> torch.FloatTensor:
+        """Apply constraints for the COMPLETED state (stop after reasoning / block codes when understanding)."""
+        # If we just completed reasoning and want to stop, force EOS
+        if self.stop_at_reasoning and self.eos_token_id is not None:
+            self._apply_whitelist_inplace(scores, [self.eos_token_id])
+            return scores
+
+        # In understanding phase, block audio codes during lyrics generation (COMPLETED state)
+        if self.generation_phase == "understand":
+            audio_code_mask = self._vocab_tables.mask("audio_code", scores.device, scores.dtype)
+            if audio_code_mask is not None:
+                scores = scores + audio_code_mask
+        return scores
+    
+    # ------------------------------------------------------------------
+    # Batched decoding with one FSM state per sequence
+    # ------------------------------------------------------------------
+    def _new_sequence_state(self) -> Dict[str, Any]:
+        """Create a fresh per-sequence FSM state (same defaults as reset())."""
+        return {
+            "state": FSMState.THINK_TAG,
+            "position_in_state": 0,
+            "accumulated_value": "",
+            "accumulated_token_ids": [],
+            "codes_count": 0,
+            "user_field_token_queue": [],
+            "current_user_field": None,
+            "caption_after_newline": False,
+            "caption_token_count": 0,
+            "caption_ending": False,
+            "pending_field_name": "",
+        }
+    
+    def _get_sequence_state(self, seq_id: Any) -> Dict[str, Any]:
+        """Get (or lazily create) the FSM state of a sequence in batched decoding."""
+        seq_state = self._sequence_states.get(seq_id)
+        if seq_state is None:
+            seq_state = self._new_sequence_state()
+            self._sequence_states[seq_id] = seq_state
+        return seq_state
+    
+    def release_sequence(self, seq_id: Any):
+        """Forget the FSM state of a finished sequence."""
+        self._sequence_states.pop(seq_id, None)
+    
+    def _load_sequence_state(self, seq_state: Dict[str, Any]) -> Dict[str, Any]:
+        """Swap a per-sequence state into the processor and return the displaced state."""
+        displaced = {name: getattr(self, name) for name in SEQUENCE_STATE_FIELDS}
+        for name in SEQUENCE_STATE_FIELDS:
+            setattr(self, name, seq_state[name])
+        return displaced
+    
+    def _store_sequence_state(self, seq_state: Dict[str, Any], displaced: Dict[str, Any]):
+        """Write the processor's current FSM fields back to seq_state and restore the displaced state."""
+        for name in SEQUENCE_STATE_FIELDS:
+            seq_state[name] = getattr(self, name)
+        for name, value in displaced.items():
+            setattr(self, name, value)
+    
+    def _get_stop_token_index(self, device: torch.device) -> Optional[torch.Tensor]:
+        """Device-resident index tensor of additional stop tokens (cached per device)."""
+        valid_ids = tuple(t for t in self.additional_stop_token_ids if t < self.vocab_size)
+        if not valid_ids:
+            return None
+        return self._vocab_tables.token_index(valid_ids, device)
+    
+    def _apply_codes_constraints_batch(
+        self,
+        scores: torch.FloatTensor,
+        codes_counts: List[int],
+    ) -> torch.FloatTensor:
+        """
+        Apply CODES_GENERATION constraints to a [R, vocab_size] block of rows at once.
+        
+        Uses one additive mask for audio codes, vectorized stop-token aliasing and
+        a per-row EOS block/force decision computed from host-side code counters.
+        Masks and indices are device-resident and per-row flags are copied from pinned
+        memory, so no GPU<->CPU synchronization happens here.
+        """
+        non_audio_code_mask = self._vocab_tables.mask("non_audio_code", scores.device, scores.dtype)
+        if non_audio_code_mask is not None:
+            scores = scores + non_audio_code_mask
+        
+        if self.eos_token_id is None:
+            return scores
+        
+        # Alias additional stop tokens to EOS (only for rows where EOS is not blocked)
+        stop_index = self._get_stop_token_index(scores.device)
+        if stop_index is not None:
+            eos_scores = scores[:, self.eos_token_id]
+            eos_allowed = eos_scores > float('-inf')
+            stop_scores = scores.index_select(1, stop_index)
+            max_stop_scores = stop_scores.max(dim=1).values
+            boosted_eos = torch.where(
+                eos_allowed & (max_stop_scores > eos_scores), max_stop_scores, eos_scores
+            )
+            masked_stop_scores = torch.where(
+                eos_allowed.unsqueeze(1), torch.full_like(stop_scores, float('-inf')), stop_scores
+            )
+            scores.index_copy_(1, stop_index, masked_stop_scores)
+            scores[:, self.eos_token_id] = boosted_eos
+        
+        # Duration constraint: block EOS before target, force EOS once reached
+        if self.target_codes is not None:
+            force_rows = [r for r, count in enumerate(codes_counts) if count >= self.target_codes]
+            if not force_rows:
+                scores[:, self.eos_token_id] = float('-inf')
+            elif len(force_rows) == len(codes_counts):
+                eos_scores = scores[:, self.eos_token_id].clone()
+                scores.fill_(float('-inf'))
+                scores[:, self.eos_token_id] = eos_scores
+            else:
+                force = _to_device([count >= self.target_codes for count in codes_counts], torch.bool, scores.device)
+                eos_scores = scores[:, self.eos_token_id].clone()
+                # Forced rows: everything but EOS blocked; other rows: EOS blocked
+                scores.masked_fill_(force.unsqueeze(1), float('-inf'))
+                scores[:, self.eos_token_id] = eos_scores.masked_fill(~force, float('-inf'))
+        return scores
+    
+    def process_batch(
+        self,
+        seq_ids: List[Any],
+        token_ids: List[List[int]],
+        scores: torch.FloatTensor,
+    ) -> torch.FloatTensor:
+        """
+        Apply constrained decoding to a batch where every row has its own FSM state.
+        
+        Rows in CODES_GENERATION (the bulk of decode steps) are masked together on
+        the scores' device; rows still generating metadata go through the regular
+        per-sequence FSM logic with their own state swapped in.
+        
+        Args:
+            seq_ids: Stable identifier per row (e.g. nano-vllm seq_id)
+            token_ids: Token history per row (only read on the first codes-phase step)
+            scores: [batch_size, vocab_size] logits for next token
+            
+        Returns:
+            Modified scores with per-row constraints and temperature scaling applied
+        """
+        if not self.enabled:
+            return self._apply_temperature_scaling(scores)
+        
+        seq_states = [self._get_sequence_state(seq_id) for seq_id in seq_ids]
+        codes_rows = []
+        other_rows = []
+        for b, seq_state in enumerate(seq_states):
+            if (
+                self.generation_phase == "codes"
+                and seq_state["state"] == FSMState.THINK_TAG
+                and self._token_list_contains_think_end_tag(token_ids[b])
+            ):
+                seq_state["state"] = FSMState.CODES_GENERATION
+                seq_state["codes_count"] = 0
+            if seq_state["state"] == FSMState.CODES_GENERATION:
+                codes_rows.append(b)
+            else:
+                other_rows.append(b)
+        
+        if codes_rows:
+            codes_counts = [seq_states[b]["codes_count"] for b in codes_rows]
+            if len(codes_rows) == scores.shape[0]:
+                scores = self._apply_codes_constraints_batch(scores, codes_counts)
+            else:
+                row_index = _to_device(codes_rows, torch.long, scores.device)
+                scores = scores.clone()
+                scores[row_index] = self._apply_codes_constraints_batch(scores[row_index], codes_counts)
+        
+        for b in other_rows:
+            displaced = self._load_sequence_state(seq_states[b])
+            try:
+                row = scores[b:b+1].clone()
+                if self.state == FSMState.COMPLETED:
+                    row = self._apply_completed_constraints(row)
+                else:
+                    row = self._process_single_sequence(None, row)
+                scores[b] = row[0]
+            finally:
+                self._store_sequence_state(seq_states[b], displaced)
+        
+        # Per-row temperature scaling (phase depends on each row's state)
+        if self.codes_temperature is None and self.metadata_temperature is None:
+            return scores
+        temperatures = []
+        for seq_state in seq_states:
+            if seq_state["state"] in (FSMState.CODES_GENERATION, FSMState.COMPLETED):
+                temperature = self.codes_temperature
+            else:
+                temperature = self.metadata_temperature
+            if temperature is None:
+                temperature = 1.0
+            temperatures.append(max(temperature, 1e-6))
+        if len(set(temperatures)) == 1:
+            return scores / temperatures[0]
+        temperatures = _to_device(temperatures, scores.dtype, scores.device)
+        return scores / temperatures.unsqueeze(1)
+    
+    def update_state_batch(self, seq_ids: List[Any], generated_token_ids: List[int]):
+        """
+        Update every sequence's FSM state after sampling, in one pass.
+        
+        Args:
+            seq_ids: Stable identifier per row (same order as in process_batch)
+            generated_token_ids: Sampled token per row
+        """
+        if not self.enabled:
+            return
+        for seq_id, token_id in zip(seq_ids, generated_token_ids):
+            seq_state = self._get_sequence_state(seq_id)
+            if seq_state["state"] == FSMState.CODES_GENERATION:
+                # Fast path: only the code counter changes
+                seq_state["codes_count"] += 1
+                continue
+            if seq_state["state"] == FSMState.COMPLETED:
+                continue
+            displaced = self._load_sequence_state(seq_state)
+            try:
+                self.update_state(token_id)
+            finally:
+                self._store_sequence_state(seq_state, displaced)
+    
+    def _token_list_contains_think_end_tag(self, token_ids: List[int]) -> bool:
+        """Check if a single token list contains the </think> token sequence."""
+        if self._think_end_tokens is None:
+            self._think_end_tokens = self.tokenizer.encode("</think>", add_special_tokens=False)
+        think_end_tokens = self._think_end_tokens
+        if not think_end_tokens:
+            return False
+        n = len(think_end_tokens)
+        first = think_end_tokens[0]
+        for i in range(len(token_ids) - n + 1):
+            if token_ids[i] == first and token_ids[i:i+n] == think_end_tokens:
+                return True
+        return False
+    
     def _input_contains_think_end_tag(self, input_ids: torch.LongTensor) -> bool:
         """
         Check if input contains the </think> closing tag.
@@ -1628,18 +1395,10 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
         Returns:
             True if </think> is found in the input (any sequence in batch)
         """
-        # Tokenize </think> to get its token sequence
-        think_end_tokens = self.tokenizer.encode("</think>", add_special_tokens=False)
-        if not think_end_tokens:
-            return False
-        
         # Check each sequence in batch
         for b in range(input_ids.shape[0]):
-            seq = input_ids[b].tolist()
-            # Search for the token sequence in the input
-            for i in range(len(seq) - len(think_end_tokens) + 1):
-                if seq[i:i+len(think_end_tokens)] == think_end_tokens:
-                    return True
+            if self._token_list_contains_think_end_tag(input_ids[b].tolist()):
+                return True
         
         return False
     
@@ -1837,11 +1596,9 @@ class MetadataConstrainedLogitsProcessor(LogitsProcessor):
             
             # Block ALL audio code tokens (critical - these should never appear in caption)
             # Use precomputed mask for O(1) performance instead of O(n) loop
-            if self.audio_code_mask is not None:
-                # Move mask to same device/dtype as scores if needed
-                if self.audio_code_mask.device != scores.device or self.audio_code_mask.dtype != scores.dtype:
-                    self.audio_code_mask = self.audio_code_mask.to(device=scores.device, dtype=scores.dtype)
-                scores = scores + self.audio_code_mask
+            audio_code_mask = self._vocab_tables.mask("audio_code", scores.device, scores.dtype)
+            if audio_code_mask is not None:
+                scores = scores + audio_code_mask
             
             # Enforce 512 token limit for caption
             if self.caption_token_count >= 512:
@@ -0,0 +1,524 @@
+"""Precompiled vocabulary tables for constrained metadata decoding
+
+MetadataConstrainedLogitsProcessor needs a handful of per-tokenizer tables:
+special token ids, the audio code token set and masks, the decoded text of
+every token with a first-character index, and the token sequences of every
+valid bpm/duration/keyscale/language/timesignature value (from which the
+per-field prefix trees are built). Computing them decodes the whole vocabulary
+twice and encodes ~1000 strings, which used to happen for every processor.
+
+ConstrainedVocabTables holds them in compact array form:
+- token texts as one UTF-8 byte buffer, the char -> tokens index and the value
+  token sequences as CSR (offsets + flat data) tensors
+- the audio code set as a boolean vocabulary mask
+Tables are compiled once per tokenizer (keyed by a hash of the tokenizer
+definition and of the metadata value constants), persisted to disk and shared
+by every processor in the process. Prefix trees, fixed-string token lookups and
+the device copies of masks and allowed-token index tensors are derived from
+them lazily and memoized, so decode steps do no host-to-device copies.
+
+Configuration (environment):
+- ACESTEP_CONSTRAINED_VOCAB_CACHE: set to 0/false to disable the disk tier
+- ACESTEP_CONSTRAINED_VOCAB_CACHE_DIR: disk tier directory (default .cache/acestep/constrained_vocab)
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import torch
+from loguru import logger
+
+from acestep.constants import (
+    VALID_LANGUAGES,
+    KEYSCALE_NOTES,
+    VALID_KEYSCALES,
+    BPM_MIN,
+    BPM_MAX,
+    DURATION_MIN,
+    DURATION_MAX,
+    VALID_TIME_SIGNATURES,
+)
+
+# Bump when the compiled layout or the compile logic changes
+_TABLES_VERSION = 1
+
+_AUDIO_CODE_PATTERN = re.compile(r'^<\|audio_code_\d+\|>$')
+
+# field -> (context the FSM generates, context as the tokenizer sees it in the full line)
+_VALUE_CONTEXTS = {
+    "bpm": ("bpm:", "bpm: "),
+    "duration": ("duration:", "duration: "),
+    "timesignature": ("timesignature:", "timesignature: "),
+    "keyscale": ("keyscale:", "keyscale: "),
+    "language": ("language:", "language: "),
+}
+
+# Bound of the memoized device index tensors (token sets seen by the FSM); least
+# recently used ones are evicted
+_MAX_DEVICE_INDICES = 4096
+
+PrefixTree = Dict[Tuple[int, ...], Set[int]]
+
+
+def _field_values() -> Dict[str, List[str]]:
+    return {
+        "bpm": [str(v) for v in range(BPM_MIN, BPM_MAX + 1)],
+        "duration": [str(v) for v in range(DURATION_MIN, DURATION_MAX + 1)],
+        "timesignature": [str(v) for v in VALID_TIME_SIGNATURES],
+        "keyscale": sorted(VALID_KEYSCALES),
+        "language": list(VALID_LANGUAGES),
+    }
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Hash of everything the compiled tables depend on: tokenizer definition and value constants."""
+    h = hashlib.sha1(
+        f"{_TABLES_VERSION}|{type(tokenizer).__name__}|{len(tokenizer)}|{tokenizer.eos_token_id}|"
+        f"{getattr(tokenizer, 'clean_up_tokenization_spaces', None)}".encode("utf-8")
+    )
+    h.update(json.dumps(_field_values(), sort_keys=True).encode("utf-8"))
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        # Fast tokenizers: full definition (vocab, merges, added tokens, normalizers)
+        h.update(backend.to_str().encode("utf-8"))
+    else:
+        h.update(json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _last_token(tokenizer, text: str) -> Optional[int]:
+    # Take the last token in case of a prefix token
+    tokens = tokenizer.encode(text, add_special_tokens=False)
+    return tokens[-1] if tokens else None
+
+
+def _decode_vocab(tokenizer, vocab_size: int) -> List[Optional[str]]:
+    """Decoded text of every token id (None where decoding fails)."""
+    texts: List[Optional[str]] = []
+    for token_id in range(vocab_size):
+        try:
+            texts.append(tokenizer.decode([token_id]))
+        except Exception:
+            texts.append(None)
+    return texts
+
+
+def _pack_texts(texts: List[str]) -> Tuple[torch.Tensor, torch.Tensor]:
+    # One UTF-8 byte buffer + offsets; a list of ~150k str is slow to (un)pickle
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = [0]
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    if not offsets[-1]:
+        return torch.tensor(offsets, dtype=torch.int64), torch.zeros(0, dtype=torch.uint8)
+    return torch.tensor(offsets, dtype=torch.int64), torch.frombuffer(bytearray(b"".join(encoded)), dtype=torch.uint8)
+
+
+def _unpack_texts(offsets: torch.Tensor, buffer: torch.Tensor) -> List[str]:
+    offsets, data = offsets.tolist(), buffer.numpy().tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+def _value_token_ids(tokenizer, field: str, values: List[str]) -> Tuple[List[str], List[List[int]]]:
+    """
+    Token ids of each field value as they occur in the generated "<field>: <value>" line.
+
+    The tokenizer may merge the context's trailing space into the value token, e.g.
+    "keyscale: " -> ['keys', 'cale', ':', ' '] but "keyscale: G major" ->
+    ['keys', 'cale', ':', ' G', ' major']. So each value is encoded together with
+    its context (with space) and the tokens of the context as the FSM generates it
+    (no space) are stripped from the front.
+
+    Returns:
+        (kept values, their token id sequences); values whose tokenization does not
+        start with the context are dropped, as are empty keyscale/language values and
+        keyscales whose first token is not a note
+    """
+    context_for_matching, context_for_tokenization = _VALUE_CONTEXTS[field]
+    context_ids = tokenizer.encode(context_for_matching, add_special_tokens=False)
+    kept_values, sequences = [], []
+    for value in values:
+        full_ids = tokenizer.encode(context_for_tokenization + value, add_special_tokens=False)
+        if full_ids[:len(context_ids)] != context_ids:
+            logger.debug(f"Could not find context prefix in tokenization of {context_for_tokenization + value!r}, skipping")
+            continue
+        value_ids = full_ids[len(context_ids):]
+        if field in ("keyscale", "language") and not value_ids:
+            continue
+        if field == "keyscale":
+            # A whitespace-only first token (space not merged into the note) is kept
+            first_text = tokenizer.decode([value_ids[0]]).lstrip()
+            if first_text and first_text[0].upper() not in KEYSCALE_NOTES:
+                logger.debug(f"Skipping keyscale {value!r}: first token {first_text!r} is not a note")
+                continue
+        kept_values.append(value)
+        sequences.append(value_ids)
+    return kept_values, sequences
+
+
+def _to_csr(rows: List[List[int]]) -> Tuple[torch.Tensor, torch.Tensor]:
+    offsets = [0]
+    for row in rows:
+        offsets.append(offsets[-1] + len(row))
+    flat = [token_id for row in rows for token_id in row]
+    return torch.tensor(offsets, dtype=torch.int64), torch.tensor(flat, dtype=torch.int32)
+
+
+def _csr_rows(offsets: torch.Tensor, flat: torch.Tensor) -> List[List[int]]:
+    offsets, flat = offsets.tolist(), flat.tolist()
+    return [flat[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def compile_vocab_tables(tokenizer) -> Dict[str, Any]:
+    """
+    Compile the constrained decoding tables of a tokenizer.
+
+    Returns:
+        Serializable dict of tensors, strings and ints (see ConstrainedVocabTables)
+    """
+    vocab_size = len(tokenizer)
+
+    special: Dict[str, Any] = {
+        "vocab_size": vocab_size,
+        "eos_token_id": tokenizer.eos_token_id,
+        "digit_tokens": {},
+        "note_tokens": {},
+    }
+    for d in range(10):
+        token_id = _last_token(tokenizer, str(d))
+        if token_id is not None:
+            special["digit_tokens"][d] = token_id
+    for note in KEYSCALE_NOTES:
+        token_id = _last_token(tokenizer, note)
+        if token_id is not None:
+            special["note_tokens"][note] = token_id
+    for name, texts in (
+        ("sharp_tokens", ["#", "♯"]),
+        ("flat_tokens", ["b", "♭"]),
+        ("minor_start_tokens", ["m", "M"]),
+        ("additional_stop_token_ids", ["<|im_end|>", "<|endoftext|>"]),
+    ):
+        special[name] = [t for t in (_last_token(tokenizer, text) for text in texts) if t is not None]
+    # "major" also starts with m
+    special["major_start_tokens"] = list(special["minor_start_tokens"])
+    for name, text in (
+        ("newline_token", "\n"),
+        ("space_token", " "),
+        ("comma_token", ","),
+        ("period_token", "."),
+        ("backtick_token", "`"),
+    ):
+        special[name] = _last_token(tokenizer, text)
+
+    # One pass over the vocabulary for the audio code set and the token texts
+    audio_code_flags = torch.zeros(vocab_size, dtype=torch.bool)
+    token_texts: List[str] = []
+    char_to_tokens: Dict[str, List[int]] = {}
+    for token_id, text in enumerate(_decode_vocab(tokenizer, vocab_size)):
+        if not text:
+            token_texts.append("")
+            continue
+        if _AUDIO_CODE_PATTERN.match(text):
+            audio_code_flags[token_id] = True
+        # Lowercase; keep leading spaces for concatenation (" rock" in "pop rock"),
+        # rstrip trailing whitespace unless the token is pure whitespace
+        text_lower = text.lower()
+        token_texts.append(text_lower.rstrip() if text_lower.strip() else " ")
+        # Index by the first character (including space) and, for tokens with a space
+        # prefix (" pop"), by the first non-space character as well
+        first_chars = [text[0].lower()]
+        stripped_text = text.lstrip()
+        if stripped_text and stripped_text != text:
+            first_chars.append(stripped_text[0].lower())
+        for char in first_chars:
+            char_to_tokens.setdefault(char, []).append(token_id)
+
+    text_offsets, text_bytes = _pack_texts(token_texts)
+    char_keys = sorted(char_to_tokens)
+    char_offsets, char_token_ids = _to_csr([char_to_tokens[c] for c in char_keys])
+
+    fields: Dict[str, Dict[str, Any]] = {}
+    for field, values in _field_values().items():
+        kept_values, sequences = _value_token_ids(tokenizer, field, values)
+        offsets, token_ids = _to_csr(sequences)
+        fields[field] = {"values": kept_values, "offsets": offsets, "token_ids": token_ids}
+
+    return {
+        "version": _TABLES_VERSION,
+        "special": special,
+        "audio_code_flags": audio_code_flags,
+        "text_offsets": text_offsets,
+        "text_bytes": text_bytes,
+        "char_keys": char_keys,
+        "char_offsets": char_offsets,
+        "char_token_ids": char_token_ids,
+        "fields": fields,
+    }
+
+
+class ConstrainedVocabTables:
+    """
+    Compiled constrained decoding tables of one tokenizer, shared by all processors.
+
+    Everything exposed here is read-only for callers; derived structures (prefix trees,
+    fixed-string tokens) are built on first use and memoized.
+    """
+
+    def __init__(self, tokenizer, compiled: Dict[str, Any]):
+        """
+        Args:
+            tokenizer: Tokenizer the tables were compiled for (used to extend them on demand)
+            compiled: Output of compile_vocab_tables()
+        """
+        self.tokenizer = tokenizer
+        self.compiled = compiled
+        self._lock = threading.Lock()
+        self.special: Dict[str, Any] = compiled["special"]
+        self.vocab_size: int = self.special["vocab_size"]
+
+        flags = compiled["audio_code_flags"]
+        self.audio_code_token_ids: Set[int] = set(torch.nonzero(flags).flatten().tolist())
+        self.audio_code_mask: Optional[torch.Tensor] = None
+        self.non_audio_code_mask: Optional[torch.Tensor] = None
+        if self.audio_code_token_ids:
+            # float32 for compatibility with most model dtypes
+            self.audio_code_mask = torch.zeros(1, self.vocab_size, dtype=torch.float32)
+            self.audio_code_mask[0, flags] = float('-inf')
+            # Inverse mask for CODES_GENERATION: only audio codes, EOS and the stop tokens
+            # (aliased to EOS by the processor) stay open
+            self.non_audio_code_mask = torch.full((1, self.vocab_size), float('-inf'), dtype=torch.float32)
+            self.non_audio_code_mask[0, flags] = 0
+            for stop_id in [self.special["eos_token_id"]] + self.special["additional_stop_token_ids"]:
+                if stop_id is not None and stop_id < self.vocab_size:
+                    self.non_audio_code_mask[0, stop_id] = 0
+
+        self.token_to_text: Dict[int, str] = {
+            token_id: text
+            for token_id, text in enumerate(_unpack_texts(compiled["text_offsets"], compiled["text_bytes"]))
+            if text
+        }
+        self.char_to_tokens: Dict[str, Set[int]] = {
+            char: set(token_ids)
+            for char, token_ids in zip(
+                compiled["char_keys"], _csr_rows(compiled["char_offsets"], compiled["char_token_ids"])
+            )
+        }
+
+        self._value_sequences: Dict[str, Dict[str, List[int]]] = {
+            field: dict(zip(data["values"], _csr_rows(data["offsets"], data["token_ids"])))
+            for field, data in compiled["fields"].items()
+        }
+        self._prefix_trees: Dict[Tuple[str, Optional[int]], PrefixTree] = {}
+        self._fixed_string_tokens: Dict[str, Tuple[int, ...]] = {}
+        # Device-resident copies, keyed by device (and dtype / token ids)
+        self._device_masks: Dict[Tuple[str, str, torch.dtype], torch.Tensor] = {}
+        self._device_indices: "OrderedDict[Tuple[str, Tuple[int, ...]], torch.Tensor]" = OrderedDict()
+
+    def mask(self, name: str, device: torch.device, dtype: torch.dtype) -> Optional[torch.Tensor]:
+        """
+        Additive [1, vocab_size] mask on device, copied once per device/dtype and shared.
+
+        Args:
+            name: "audio_code" (blocks audio codes) or "non_audio_code" (allows only audio
+                codes, EOS and the additional stop tokens)
+            device: Device of the scores
+            dtype: Dtype of the scores
+
+        Returns:
+            Mask tensor (do not modify), or None if the vocabulary has no audio codes
+        """
+        key = (name, str(device), dtype)
+        mask = self._device_masks.get(key)
+        if mask is None:
+            mask = getattr(self, f"{name}_mask")
+            if mask is None:
+                return None
+            mask = mask.to(device=device, dtype=dtype)
+            self._device_masks[key] = mask
+        return mask
+
+    def token_index(self, token_ids: Tuple[int, ...], device: torch.device) -> torch.Tensor:
+        """
+        Long index tensor of token_ids on device, created once per device and shared.
+
+        The FSM allows the same few token sets over and over (fixed strings, digits,
+        prefix tree nodes), so this avoids a host-to-device copy per decode step.
+        """
+        key = (str(device), token_ids)
+        with self._lock:
+            index = self._device_indices.get(key)
+            if index is not None:
+                self._device_indices.move_to_end(key)
+                return index
+        index = torch.tensor(token_ids, dtype=torch.long, device=device)
+        with self._lock:
+            self._device_indices[key] = index
+            if len(self._device_indices) > _MAX_DEVICE_INDICES:
+                self._device_indices.popitem(last=False)
+        return index
+
+    def prefix_tree(self, field: str, max_value: Optional[int] = None) -> PrefixTree:
+        """
+        Token prefix -> allowed next tokens for the values of a metadata field.
+
+        Keys are token id tuples (not strings) so they match the generated tokenization
+        exactly; a complete value allows the newline token.
+
+        Args:
+            field: "bpm", "duration", "timesignature", "keyscale" or "language"
+            max_value: Upper bound of numeric values (used for duration)
+
+        Returns:
+            Shared prefix tree (do not modify)
+        """
+        key = (field, max_value)
+        tree = self._prefix_trees.get(key)
+        if tree is not None:
+            return tree
+        with self._lock:
+            tree = self._prefix_trees.get(key)
+            if tree is None:
+                tree = self._build_prefix_tree(field, max_value)
+                self._prefix_trees[key] = tree
+        return tree
+
+    def _build_prefix_tree(self, field: str, max_value: Optional[int]) -> PrefixTree:
+        sequences = self._value_sequences[field]
+        values = list(sequences)
+        if max_value is not None:
+            compiled_max = max((int(v) for v in values), default=max_value)
+            if max_value > compiled_max:
+                # Beyond the compiled range: tokenize the extra values now
+                extra = [str(v) for v in range(compiled_max + 1, max_value + 1)]
+                sequences.update(zip(*_value_token_ids(self.tokenizer, field, extra)))
+            values = [v for v in sequences if int(v) <= max_value]
+
+        newline_token = self.special["newline_token"]
+        tree: PrefixTree = {}
+        for value in values:
+            value_ids = sequences[value]
+            for i in range(len(value_ids) + 1):
+                allowed = tree.setdefault(tuple(value_ids[:i]), set())
+                if i < len(value_ids):
+                    allowed.add(value_ids[i])
+                elif newline_token:
+                    allowed.add(newline_token)
+        return tree
+
+    def fixed_string_tokens(self, remaining: str) -> Tuple[int, ...]:
+        """
+        Tokens that can continue a fixed FSM string ("bpm:", "</think>", ...) at its remaining part.
+
+        Prefers the longest prefix of remaining that encodes to a single token. Otherwise
+        returns every first token whose text matches the start of remaining, longest
+        match first.
+        """
+        tokens = self._fixed_string_tokens.get(remaining)
+        if tokens is None:
+            tokens = self._compute_fixed_string_tokens(remaining)
+            self._fixed_string_tokens[remaining] = tokens
+        return tokens
+
+    def _compute_fixed_string_tokens(self, remaining: str) -> Tuple[int, ...]:
+        tokenizer = self.tokenizer
+        for end in range(len(remaining), 0, -1):
+            tokens = tokenizer.encode(remaining[:end], add_special_tokens=False)
+            if len(tokens) == 1:
+                return (tokens[0],)
+
+        # Limit the search to avoid too many iterations
+        match_lengths: Dict[int, int] = {}
+        for end in range(1, min(len(remaining) + 1, 20)):
+            prefix = remaining[:end]
+            tokens = tokenizer.encode(prefix, add_special_tokens=False)
+            if not tokens:
+                continue
+            first_token = tokens[0]
+            # Only tokens whose text matches the start of the string (allowing space prefixes)
+            normalized_prefix = prefix.lstrip().lower()
+            normalized_decoded = tokenizer.decode([first_token]).lstrip().lower()
+            if normalized_decoded.startswith(normalized_prefix) or normalized_prefix.startswith(normalized_decoded):
+                if end > match_lengths.get(first_token, 0):
+                    match_lengths[first_token] = end
+        return tuple(token for token, _ in sorted(match_lengths.items(), key=lambda x: x[1], reverse=True))
+
+
+def _disk_cache_dir() -> Optional[str]:
+    if os.environ.get("ACESTEP_CONSTRAINED_VOCAB_CACHE", "true").strip().lower() in {"0", "false", "no", "off"}:
+        return None
+    return os.environ.get("ACESTEP_CONSTRAINED_VOCAB_CACHE_DIR") or os.path.join(
+        os.path.dirname(os.path.dirname(__file__)),
+        ".cache",
+        "acestep",
+        "constrained_vocab",
+    )
+
+
+def _read_disk(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    try:
+        compiled = torch.load(path, map_location="cpu", weights_only=True)
+        if compiled.get("version") != _TABLES_VERSION:
+            return None
+        return compiled
+    except Exception as e:
+        logger.warning(f"[ConstrainedVocabTables] Dropping unreadable cache file {path}: {e}")
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+
+def _write_disk(path: str, compiled: Dict[str, Any]) -> None:
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        torch.save(compiled, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"[ConstrainedVocabTables] Failed to write cache file {path}: {e}")
+
+
+# Process-wide tables per tokenizer fingerprint, and fingerprints per tokenizer object
+_tables: Dict[str, ConstrainedVocabTables] = {}
+_fingerprints: "weakref.WeakKeyDictionary[Any, str]" = weakref.WeakKeyDictionary()
+_tables_lock = threading.Lock()
+
+
+def get_constrained_vocab_tables(tokenizer) -> ConstrainedVocabTables:
+    """
+    Get the shared constrained decoding tables of a tokenizer.
+
+    Looked up in memory, then on disk (ACESTEP_CONSTRAINED_VOCAB_CACHE_DIR), and
+    compiled (and persisted) only if neither has them.
+    """
+    with _tables_lock:
+        fingerprint = _fingerprints.get(tokenizer)
+        if fingerprint is None:
+            fingerprint = tokenizer_fingerprint(tokenizer)
+            _fingerprints[tokenizer] = fingerprint
+        tables = _tables.get(fingerprint)
+        if tables is not None:
+            return tables
+
+        cache_dir = _disk_cache_dir()
+        path = os.path.join(cache_dir, f"{fingerprint}.pt") if cache_dir else None
+        compiled = _read_disk(path) if path else None
+        if compiled is not None:
+            logger.info(f"[ConstrainedVocabTables] Loaded vocabulary tables from {path}")
+        else:
+            compiled = compile_vocab_tables(tokenizer)
+            logger.info(f"[ConstrainedVocabTables] Compiled vocabulary tables for {compiled['special']['vocab_size']} tokens")
+            if path:
+                _write_disk(path, compiled)
+        tables = ConstrainedVocabTables(tokenizer, compiled)
+        _tables[fingerprint] = tables
+        return tables
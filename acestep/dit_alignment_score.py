@@ -36,16 +36,39 @@ class SentenceTimestamp:
 
 
 # ================= DTW Algorithm (Numba Optimized) =================
+DTW_BACKENDS = ("auto", "numba", "wavefront")
+
+
+def _resolve_band(band: Optional[int], N: int, M: int) -> int:
+    """
+    Clamp a Sakoe-Chiba band half-width so that a monotonic path always exists.
+
+    Args:
+        band: Requested half-width in frames (time axis), or None/<=0 for no constraint
+        N, M: Cost matrix dimensions
+
+    Returns:
+        Effective half-width, or -1 when the band is disabled
+    """
+    if band is None or band <= 0:
+        return -1
+    # Consecutive rows shift the band centre by M / N frames; the band must be
+    # at least that wide or the diagonal corridor becomes disconnected.
+    min_band = max(1, -(-M // max(N, 1)))
+    return max(int(band), min_band)
+
+
 @numba.jit(nopython=True)
-def dtw_cpu(x: np.ndarray):
+def _dtw_trace_numba(x: np.ndarray, band: int):
     """
-    Dynamic Time Warping algorithm optimized with Numba.
-    
+    Fill the DTW cost/trace matrices with a compiled row-major double loop.
+
     Args:
         x: Cost matrix of shape [N, M]
-        
+        band: Sakoe-Chiba half-width in frames, or -1 for the full matrix
+
     Returns:
-        Tuple of (text_indices, time_indices) arrays
+        Trace matrix of shape (N+1, M+1)
     """
     N, M = x.shape
     # Use float32 for memory efficiency
@@ -53,8 +76,14 @@ def dtw_cpu(x: np.ndarray):
     trace = -np.ones((N + 1, M + 1), dtype=np.float32)
     cost[0, 0] = 0
 
-    for j in range(1, M + 1):
-        for i in range(1, N + 1):
+    for i in range(1, N + 1):
+        j_start = 1
+        j_end = M
+        if band >= 0:
+            center = i * M / N
+            j_start = max(1, int(np.floor(center - band)))
+            j_end = min(M, int(np.ceil(center + band)))
+        for j in range(j_start, j_end + 1):
             c0 = cost[i - 1, j - 1]
             c1 = cost[i - 1, j]
             c2 = cost[i, j - 1]
@@ -69,9 +98,144 @@ def dtw_cpu(x: np.ndarray):
             cost[i, j] = x[i - 1, j - 1] + c
             trace[i, j] = t
 
+    return trace
+
+
+def dtw_cpu(x: np.ndarray, band: Optional[int] = None):
+    """
+    Dynamic Time Warping algorithm optimized with Numba.
+    
+    Args:
+        x: Cost matrix of shape [N, M]
+        band: Optional Sakoe-Chiba half-width in frames (time axis)
+        
+    Returns:
+        Tuple of (text_indices, time_indices) arrays
+    """
+    N, M = x.shape
+    trace = _dtw_trace_numba(np.ascontiguousarray(x), _resolve_band(band, N, M))
     return _backtrace(trace, N, M)
 
 
+def _dtw_trace_wavefront(x: torch.Tensor, band: int) -> torch.Tensor:
+    """
+    Fill DTW trace matrices one anti-diagonal at a time.
+
+    Every cell on the anti-diagonal i + j = d depends only on diagonals d-1
+    and d-2, so a whole diagonal (for every batch item) is updated with a few
+    vectorized tensor ops. This runs on whatever device ``x`` lives on.
+
+    Args:
+        x: Cost tensor of shape [B, N, M]
+        band: Sakoe-Chiba half-width in frames, or -1 for the full matrix
+
+    Returns:
+        Trace tensor of shape [B, N+1, M+1] (int8)
+    """
+    B, N, M = x.shape
+    device = x.device
+    x = x.to(torch.float32)
+    cost = torch.full((B, N + 1, M + 1), float("inf"), dtype=torch.float32, device=device)
+    trace = torch.full((B, N + 1, M + 1), -1, dtype=torch.int8, device=device)
+    cost[:, 0, 0] = 0
+
+    rows_all = torch.arange(1, N + 1, device=device)
+    if band >= 0:
+        centers = rows_all.to(torch.float64) * M / N
+        row_lo = torch.clamp(torch.floor(centers - band), min=1).long()
+        row_hi = torch.clamp(torch.ceil(centers + band), max=M).long()
+
+    t_zero = torch.zeros((), dtype=torch.int8, device=device)
+    t_one = torch.ones((), dtype=torch.int8, device=device)
+    t_two = torch.full((), 2, dtype=torch.int8, device=device)
+
+    for d in range(2, N + M + 1):
+        i_lo = max(1, d - M)
+        i_hi = min(N, d - 1)
+        i = rows_all[i_lo - 1:i_hi]
+        j = d - i
+        if band >= 0:
+            in_band = (j >= row_lo[i_lo - 1:i_hi]) & (j <= row_hi[i_lo - 1:i_hi])
+            i = i[in_band]
+            j = j[in_band]
+            if i.numel() == 0:
+                continue
+
+        c0 = cost[:, i - 1, j - 1]
+        c1 = cost[:, i - 1, j]
+        c2 = cost[:, i, j - 1]
+
+        # Same tie-breaking as the scalar kernel: strict wins for 0 and 1, else 2
+        pick0 = (c0 < c1) & (c0 < c2)
+        pick1 = ~pick0 & (c1 < c0) & (c1 < c2)
+        c = torch.where(pick0, c0, torch.where(pick1, c1, c2))
+        t = torch.where(pick0, t_zero, torch.where(pick1, t_one, t_two))
+
+        cost[:, i, j] = x[:, i - 1, j - 1] + c
+        trace[:, i, j] = t
+
+    return trace
+
+
+def dtw_batch(
+    x: Union[torch.Tensor, np.ndarray],
+    backend: str = "auto",
+    band: Optional[int] = None,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Run DTW over a batch of equally shaped cost matrices.
+
+    Args:
+        x: Cost matrices of shape [B, N, M] (or a single [N, M] matrix)
+        backend: One of DTW_BACKENDS. "auto" picks the wavefront kernel for
+            CUDA tensors and the compiled kernel everywhere else
+        band: Optional Sakoe-Chiba half-width in frames (time axis)
+
+    Returns:
+        List of (text_indices, time_indices) tuples, one per batch item
+    """
+    if backend not in DTW_BACKENDS:
+        raise ValueError(f"Unknown DTW backend '{backend}', expected one of {DTW_BACKENDS}")
+
+    if x.ndim == 2:
+        x = x[None]
+    B, N, M = x.shape
+    is_cuda = isinstance(x, torch.Tensor) and x.is_cuda
+
+    if backend == "auto":
+        backend = "wavefront" if is_cuda else "numba"
+
+    if backend == "numba":
+        if isinstance(x, torch.Tensor):
+            x = x.detach().float().cpu().numpy()
+        return [tuple(dtw_cpu(x[b], band=band)) for b in range(B)]
+
+    if not isinstance(x, torch.Tensor):
+        x = torch.from_numpy(np.ascontiguousarray(x))
+    trace = _dtw_trace_wavefront(x.detach(), _resolve_band(band, N, M))
+    trace = trace.cpu().numpy()
+    return [tuple(_backtrace(trace[b], N, M)) for b in range(B)]
+
+
+def dtw(
+    x: Union[torch.Tensor, np.ndarray],
+    backend: str = "auto",
+    band: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Run DTW on a single [N, M] cost matrix with the selected backend.
+
+    Args:
+        x: Cost matrix of shape [N, M]
+        backend: One of DTW_BACKENDS
+        band: Optional Sakoe-Chiba half-width in frames (time axis)
+
+    Returns:
+        Tuple of (text_indices, time_indices) arrays
+    """
+    return dtw_batch(x, backend=backend, band=band)[0]
+
+
 @numba.jit(nopython=True)
 def _backtrace(trace: np.ndarray, N: int, M: int):
     """
@@ -147,14 +311,18 @@ class MusicStampsAligner:
     Uses bidirectional consensus denoising and DTW for alignment.
     """
     
-    def __init__(self, tokenizer):
+    def __init__(self, tokenizer, dtw_backend: str = "auto", dtw_band: Optional[int] = None):
         """
         Initialize the aligner.
         
         Args:
             tokenizer: Text tokenizer for decoding tokens
+            dtw_backend: DTW kernel to use, one of DTW_BACKENDS
+            dtw_band: Optional Sakoe-Chiba half-width in frames for DTW
         """
         self.tokenizer = tokenizer
+        self.dtw_backend = dtw_backend
+        self.dtw_band = dtw_band
 
     def _apply_bidirectional_consensus(
         self, 
@@ -359,7 +527,9 @@ class MusicStampsAligner:
             List of TokenTimestamp objects
         """
         n_frames = calc_matrix.shape[-1]
-        text_indices, time_indices = dtw_cpu(-calc_matrix.astype(np.float64))
+        text_indices, time_indices = dtw(
+            -calc_matrix.astype(np.float64), backend=self.dtw_backend, band=self.dtw_band
+        )
 
         seconds_per_frame = total_duration_seconds / n_frames
         alignment_results = []
@@ -554,14 +724,18 @@ class MusicLyricScorer:
     using tensor operations for potential differentiability or GPU acceleration.
     """
 
-    def __init__(self, tokenizer: Any):
+    def __init__(self, tokenizer: Any, dtw_backend: str = "auto", dtw_band: Optional[int] = None):
         """
         Initialize the aligner.
 
         Args:
             tokenizer: Tokenizer instance (must implement .decode()).
+            dtw_backend: DTW kernel to use, one of DTW_BACKENDS.
+            dtw_band: Optional Sakoe-Chiba half-width in frames for DTW.
         """
         self.tokenizer = tokenizer
+        self.dtw_backend = dtw_backend
+        self.dtw_band = dtw_band
 
     def _generate_token_type_mask(self, token_ids: List[int]) -> np.ndarray:
         """
@@ -797,7 +971,9 @@ class MusicLyricScorer:
 
         # 2. DTW Pathfinding
         # Using negative calc_matrix because DTW minimizes cost
-        text_indices, time_indices = dtw_cpu(-calc_matrix.astype(np.float32))
+        text_indices, time_indices = dtw(
+            -calc_matrix.astype(np.float32), backend=self.dtw_backend, band=self.dtw_band
+        )
         path_coords = np.stack([text_indices, time_indices], axis=1)
 
         return_dict = {
@@ -0,0 +1,356 @@
+"""Continuous batching of the DiT stage across concurrent generation jobs
+
+The API server runs each job (LM sample/format/CoT/codes, then DiT, then
+saving) on its own thread. Without batching every job makes its own
+service_generate() call, so concurrent small jobs use the GPU one at a time
+even though the DiT supports batch > 1.
+
+DiTBatchScheduler is a drop-in replacement for handler.generate_music(): it
+parks each job's DiT request briefly, merges compatible requests (same DiT
+handler, task type, step count, shift, infer_method, timesteps, guidance
+settings and exact target length) and runs them with a single
+handler.generate_music_batch() call, then hands each job its own result.
+Only requests of the same length are merged: a shorter request padded to a
+longer partner would be generated as the longer song (the DiT latent mask
+covers the padding) and then cut off, so its output would depend on its
+batch partners.
+
+GPU work stays serialized: a job holds the scheduler's execution slot while
+it runs (see session()) and gives it up only while its DiT request waits to
+be batched, which is what lets other jobs reach their DiT stage meanwhile.
+
+Configuration (environment):
+- ACESTEP_DIT_BATCH_MAX: max audio items per merged DiT batch (default 4, 1 disables)
+- ACESTEP_DIT_BATCH_WAIT_MS: how long the oldest request waits for partners (default 200)
+"""
+
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Hashable, List, Optional
+
+from loguru import logger
+
+from acestep.cancellation import JobCancelledError
+
+_AUDIO_CODE_RE = re.compile(r"<\|audio_code_\d+\|>")
+_AUDIO_CODES_PER_SECOND = 5
+_SAMPLE_RATE = 48000
+_BATCHABLE_TASKS = ("text2music", "cover")
+
+
+def request_duration(kwargs: Dict[str, Any]) -> Optional[float]:
+    """Duration in seconds a generate_music() request will produce, or None if random/unknown."""
+    codes = kwargs.get("audio_code_string") or ""
+    if isinstance(codes, str):
+        codes = [codes]
+    code_counts = [len(_AUDIO_CODE_RE.findall(c or "")) for c in codes]
+    if any(code_counts):
+        return max(code_counts) / _AUDIO_CODES_PER_SECOND
+    try:
+        duration = float(kwargs.get("audio_duration") or 0)
+    except (TypeError, ValueError):
+        return None
+    return duration if duration > 0 else None
+
+
+def request_target_length(kwargs: Dict[str, Any]) -> Optional[Hashable]:
+    """
+    Length a generate_music() request generates, in the units that set its DiT latent length.
+
+    Returns:
+        ("codes", number of audio codes) for requests with audio codes, ("frames", silent
+        target frames as created by handler.create_target_wavs) otherwise, or None if random/unknown
+    """
+    codes = kwargs.get("audio_code_string") or ""
+    if isinstance(codes, str):
+        codes = [codes]
+    code_counts = [len(_AUDIO_CODE_RE.findall(c or "")) for c in codes]
+    if any(code_counts):
+        return ("codes", max(code_counts))
+    duration = request_duration(kwargs)
+    if duration is None:
+        return None
+    return ("frames", int(max(0.1, round(duration, 1)) * _SAMPLE_RATE))
+
+
+class _PendingRequest:
+    __slots__ = ("handler", "kwargs", "key", "size", "arrival", "result", "error", "done")
+
+    def __init__(self, handler, kwargs: Dict[str, Any], key: Hashable, size: int):
+        self.handler = handler
+        self.kwargs = kwargs
+        self.key = key
+        self.size = size
+        self.arrival = time.monotonic()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+
+
+class DiTBatchScheduler:
+    """Merges the DiT stage of concurrent generate_music() calls into shared batches."""
+
+    def __init__(self, max_batch_size: int = 4, max_wait_seconds: float = 0.2):
+        """
+        Args:
+            max_batch_size: Max audio items (sum of request batch sizes) per merged batch
+            max_wait_seconds: How long the oldest pending request waits for compatible partners
+        """
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_seconds = max(0.0, float(max_wait_seconds))
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._pending: List[_PendingRequest] = []
+        self._slot_busy = False
+        self._priority_waiters = 0
+        self._leader_active = False
+        # Sessions that have not submitted their DiT request yet (could still join a batch)
+        self._unsubmitted = 0
+        self.batches = 0
+        self.merged_requests = 0
+        self.merged_items = 0
+        self.solo_requests = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch_size > 1
+
+    def batch_key(self, handler, kwargs: Dict[str, Any]) -> Optional[Hashable]:
+        """Compatibility key of a generate_music() request, or None if it must run on its own."""
+        if kwargs.get("src_audio") is not None:
+            return None
+        task_type = kwargs.get("task_type", "text2music")
+        if task_type == "text2music" and handler._has_audio_codes(kwargs.get("audio_code_string", "")):
+            task_type = "cover"
+        if task_type not in _BATCHABLE_TASKS:
+            return None
+        target_length = request_target_length(kwargs)
+        if target_length is None:
+            return None
+        timesteps = kwargs.get("timesteps")
+        return (
+            id(handler),
+            task_type,
+            int(kwargs.get("inference_steps", 8)),
+            float(kwargs.get("shift", 1.0)),
+            kwargs.get("infer_method", "ode"),
+            tuple(timesteps) if timesteps else None,
+            float(kwargs.get("guidance_scale", 7.0)),
+            bool(kwargs.get("use_adg", False)),
+            float(kwargs.get("cfg_interval_start", 0.0)),
+            float(kwargs.get("cfg_interval_end", 1.0)),
+            float(kwargs.get("audio_cover_strength", 1.0)),
+            bool(kwargs.get("use_tiled_decode", True)),
+            target_length,
+        )
+
+    # Execution slot (caller holds self._cond)
+
+    def _acquire_slot(self, priority: bool = False) -> None:
+        # Leaders and jobs returning from a batch go before jobs that are just starting
+        if priority:
+            self._priority_waiters += 1
+        try:
+            while self._slot_busy or (not priority and self._priority_waiters):
+                self._cond.wait()
+        finally:
+            if priority:
+                self._priority_waiters -= 1
+        self._slot_busy = True
+        self._local.holds_slot = True
+
+    def _release_slot(self) -> None:
+        self._slot_busy = False
+        self._local.holds_slot = False
+        self._cond.notify_all()
+
+    @contextmanager
+    def session(self):
+        """
+        Run one job's generation while holding the execution slot.
+
+        Use submit() as the job's DiT generate function inside the session; the slot
+        is released only while the DiT request waits to be batched.
+        """
+        with self._cond:
+            self._unsubmitted += 1
+            self._local.submitted = False
+            self._acquire_slot()
+        try:
+            yield self
+        finally:
+            with self._cond:
+                if not self._local.submitted:
+                    self._unsubmitted -= 1
+                if getattr(self._local, "holds_slot", False):
+                    self._release_slot()
+                self._cond.notify_all()
+
+    def _mark_submitted(self) -> None:
+        if getattr(self._local, "submitted", True):
+            return
+        self._local.submitted = True
+        self._unsubmitted -= 1
+        self._cond.notify_all()
+
+    def submit(self, handler, **kwargs) -> Dict[str, Any]:
+        """
+        Drop-in for handler.generate_music(**kwargs) that may share the DiT pass with other jobs.
+
+        Args:
+            handler: AceStepHandler to run the request on
+            **kwargs: generate_music() keyword arguments
+
+        Returns:
+            generate_music() result dict for this request only
+        """
+        in_session = getattr(self._local, "holds_slot", False)
+        key = self.batch_key(handler, kwargs) if self.enabled and in_session else None
+        if key is None:
+            with self._cond:
+                if in_session:
+                    self._mark_submitted()
+                self.solo_requests += 1
+            return handler.generate_music(**kwargs)
+
+        # Merged batches run without per-request progress; report the DiT stage once
+        progress = kwargs.get("progress")
+        if progress is not None:
+            progress(0.52, desc="Generating music (batched DiT)...")
+        size = max(1, int(kwargs.get("batch_size") or handler.batch_size))
+        request = _PendingRequest(handler, kwargs, key, size)
+        parked_at = time.monotonic()
+        with self._cond:
+            self._pending.append(request)
+            self._mark_submitted()
+            self._release_slot()
+            try:
+                while not request.done:
+                    if self._leader_active or not self._pending:
+                        self._cond.wait()
+                        continue
+                    delay = self._flush_delay()
+                    if delay > 0:
+                        self._cond.wait(timeout=delay)
+                        continue
+                    self._lead()
+            finally:
+                self._acquire_slot(priority=True)
+        if request.error is not None:
+            raise request.error
+        time_costs = (request.result.get("extra_outputs") or {}).get("time_costs")
+        if isinstance(time_costs, dict):
+            # Time from parking until the slot is back: waiting for the batch plus the batch itself
+            time_costs["batch_wait_time_cost"] = time.monotonic() - parked_at
+        return request.result
+
+    def _flush_delay(self) -> float:
+        """Seconds until the oldest pending request should be flushed (<= 0 means now)."""
+        oldest = self._pending[0]
+        if self._unsubmitted == 0:
+            # Every running job is already waiting here; nobody else can join
+            return 0.0
+        if sum(r.size for r in self._pending if r.key == oldest.key) >= self.max_batch_size:
+            return 0.0
+        return oldest.arrival + self.max_wait_seconds - time.monotonic()
+
+    def _take_batch(self) -> List[_PendingRequest]:
+        oldest = self._pending[0]
+        batch: List[_PendingRequest] = []
+        size = 0
+        for request in self._pending:
+            if request.key != oldest.key:
+                continue
+            if batch and size + request.size > self.max_batch_size:
+                continue
+            batch.append(request)
+            size += request.size
+        for request in batch:
+            self._pending.remove(request)
+        return batch
+
+    def _lead(self) -> None:
+        """Run the oldest compatible batch on this thread (caller holds self._cond)."""
+        self._leader_active = True
+        try:
+            self._acquire_slot(priority=True)
+            # Collect the batch only once the slot is ours: jobs that finished their
+            # LM stage while we waited can still join
+            batch = self._take_batch()
+            self._cond.release()
+            try:
+                self._run_batch(batch)
+            finally:
+                self._cond.acquire()
+                for request in batch:
+                    request.done = True
+                self.batches += 1
+                if len(batch) > 1:
+                    self.merged_requests += len(batch)
+                    self.merged_items += sum(r.size for r in batch)
+                else:
+                    self.solo_requests += 1
+                self._release_slot()
+        finally:
+            self._leader_active = False
+            self._cond.notify_all()
+
+    def _run_batch(self, batch: List[_PendingRequest]) -> None:
+        # Jobs cancelled while parked here never reach the GPU
+        batch = [r for r in batch if not self._cancelled(r)]
+        if not batch:
+            return
+        handler = batch[0].handler
+        try:
+            if len(batch) == 1:
+                results = [handler.generate_music(**batch[0].kwargs)]
+            else:
+                logger.info(
+                    f"[DiTBatchScheduler] Merging {len(batch)} requests "
+                    f"({sum(r.size for r in batch)} items) into one DiT batch"
+                )
+                results = handler.generate_music_batch([r.kwargs for r in batch])
+            for request, result in zip(batch, results):
+                request.result = result
+                # A merged batch keeps running while any member is still wanted
+                self._cancelled(request)
+        except JobCancelledError as e:
+            for request in batch:
+                request.error = e
+        except Exception as e:
+            logger.exception("[DiTBatchScheduler] Batch failed")
+            for request in batch:
+                request.error = e
+
+    @staticmethod
+    def _cancelled(request: _PendingRequest) -> bool:
+        """Fail a request whose job was cancelled (sets its error)."""
+        token = request.kwargs.get("cancel_token")
+        if token is None or not token.cancelled:
+            return False
+        request.error = JobCancelledError(token.reason)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "enabled": self.enabled,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": int(self.max_wait_seconds * 1000),
+                "batches": self.batches,
+                "merged_requests": self.merged_requests,
+                "merged_items": self.merged_items,
+                "solo_requests": self.solo_requests,
+                "pending": len(self._pending),
+            }
+
+
+def create_dit_batch_scheduler() -> DiTBatchScheduler:
+    """Create a DiTBatchScheduler configured from ACESTEP_DIT_BATCH_* environment variables."""
+    return DiTBatchScheduler(
+        max_batch_size=int(os.environ.get("ACESTEP_DIT_BATCH_MAX", "4")),
+        max_wait_seconds=float(os.environ.get("ACESTEP_DIT_BATCH_WAIT_MS", "200")) / 1000.0,
+    )
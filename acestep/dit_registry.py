@@ -0,0 +1,288 @@
+"""DiT model registry for the API server
+
+The API server used to load a fixed set of DiT handlers (ACESTEP_CONFIG_PATH,
+..._PATH2, ..._PATH3) at startup and keep all of them on the GPU.
+DiTModelRegistry serves any number of DiT variants (turbo, turbo-shift3,
+sft, base, ...) from a VRAM budget instead:
+- a model's handler is created on the first job that asks for it; all
+  handlers share the primary handler's VAE and text encoder
+- loads and restores run on a dedicated loader thread, so the job queue
+  keeps serving jobs for resident models while a cold one loads
+- when the DiT weights on the GPU would exceed the budget, the least
+  recently used idle DiT is evicted, either to CPU RAM (fast restore) or
+  back to disk (handler dropped, reloaded from its checkpoint)
+
+Jobs hold a model with try_acquire()/release() while they run; held models
+are never evicted. The primary model is loaded at startup and is only ever
+evicted to CPU, since it owns the shared components.
+
+Configuration (environment):
+- ACESTEP_DIT_MODELS: comma-separated DiT configs that may be requested, in addition to
+  ACESTEP_CONFIG_PATH / ACESTEP_CONFIG_PATH2 / ACESTEP_CONFIG_PATH3 (default: every
+  acestep-v15-* checkpoint found on disk)
+- ACESTEP_DIT_VRAM_BUDGET_GB: VRAM for resident DiT weights (default: the residency
+  budget minus the shared VAE / text encoder when DiTs stay on the GPU, else no limit)
+- ACESTEP_DIT_EVICT_TO: "cpu" (keep evicted weights in RAM) or "disk" (default cpu)
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from loguru import logger
+
+_EVICT_TARGETS = ("cpu", "disk")
+
+
+class _ModelEntry:
+    __slots__ = ("name", "config_path", "handler", "state", "in_use", "last_used", "nbytes",
+                 "load_future", "loads", "restores", "evictions")
+
+    def __init__(self, name: str, config_path: str):
+        self.name = name
+        self.config_path = config_path
+        self.handler: Any = None
+        # unloaded -> loading -> ready -> evicting -> cpu / unloaded
+        self.state = "unloaded"
+        self.in_use = 0
+        self.last_used = 0.0
+        self.nbytes = 0
+        self.load_future: Optional[Future] = None
+        self.loads = 0
+        self.restores = 0
+        self.evictions = 0
+
+
+class DiTModelRegistry:
+    """Lazily loaded, LRU-evicted DiT handlers keyed by model name."""
+
+    def __init__(
+        self,
+        load_fn: Callable[[str], Any],
+        primary_config_path: str,
+        config_paths: List[str],
+        budget_bytes: Optional[int] = None,
+        evict_to: str = "cpu",
+    ):
+        """
+        Args:
+            load_fn: Creates and initializes a handler for a config path (raises on failure);
+                called on the loader thread
+            primary_config_path: Config of the default model (registered via add_loaded())
+            config_paths: Other configs that may be requested
+            budget_bytes: Max DiT weight bytes resident on the device (None for no limit)
+            evict_to: "cpu" or "disk"
+        """
+        if evict_to not in _EVICT_TARGETS:
+            raise ValueError(f"evict_to must be one of {_EVICT_TARGETS}, got {evict_to!r}")
+        self.budget_bytes = budget_bytes
+        self.evict_to = evict_to
+        self._load_fn = load_fn
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _ModelEntry] = {}
+        for path in [primary_config_path] + list(config_paths):
+            name = model_name(path)
+            if name and name not in self._entries:
+                self._entries[name] = _ModelEntry(name, path)
+        self.primary = model_name(primary_config_path)
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dit-loader")
+
+    def names(self) -> List[str]:
+        """Model names that may be requested, primary first."""
+        return list(self._entries)
+
+    def resolve(self, name: Optional[str]) -> str:
+        """Registry name for a requested model; unknown or empty names map to the primary."""
+        return model_name(name or "") if model_name(name or "") in self._entries else self.primary
+
+    def is_known(self, name: Optional[str]) -> bool:
+        return model_name(name or "") in self._entries
+
+    def handler(self, name: str) -> Any:
+        """Handler of a model if it has been loaded (on the device or evicted to CPU), else None."""
+        with self._lock:
+            return self._entries[name].handler
+
+    def add_loaded(self, name: str, handler: Any) -> None:
+        """Register a handler initialized elsewhere (the primary model at startup) as ready."""
+        with self._lock:
+            entry = self._entries[self.resolve(name)]
+            entry.handler = handler
+            entry.nbytes = handler.dit_nbytes()
+            entry.state = "ready"
+            entry.last_used = time.monotonic()
+            entry.loads += 1
+
+    def try_acquire(self, name: str) -> Optional[Any]:
+        """
+        Hold a model for a job if it is ready on the device (never blocks).
+
+        Returns:
+            The handler (call release() when done), or None if it must be loaded first
+        """
+        with self._lock:
+            entry = self._entries[name]
+            if entry.state != "ready":
+                return None
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+            return entry.handler
+
+    def release(self, name: str) -> None:
+        with self._lock:
+            entry = self._entries[name]
+            entry.in_use = max(0, entry.in_use - 1)
+            entry.last_used = time.monotonic()
+
+    def load(self, name: str) -> Future:
+        """Start loading (or restoring) a model on the loader thread; the future yields its handler."""
+        with self._lock:
+            entry = self._entries[name]
+            if entry.load_future is None or entry.load_future.done():
+                entry.load_future = self._loader.submit(self._load, entry)
+            return entry.load_future
+
+    def _load(self, entry: _ModelEntry) -> Any:
+        with self._lock:
+            if entry.state == "ready":
+                return entry.handler
+            handler = entry.handler
+            entry.state = "loading"
+        restore = handler is not None
+        start = time.time()
+        try:
+            # Size is unknown before the first load; assume the largest DiT seen so far
+            self._make_room(entry.nbytes or max((e.nbytes for e in self._entries.values()), default=0), entry)
+            if restore:
+                handler.move_dit(handler.device)
+            else:
+                handler = self._load_fn(entry.config_path)
+            nbytes = handler.dit_nbytes()
+        except Exception:
+            with self._lock:
+                entry.state = "cpu" if restore else "unloaded"
+            raise
+        with self._lock:
+            entry.handler = handler
+            entry.nbytes = nbytes
+            entry.state = "ready"
+            entry.last_used = time.monotonic()
+            if restore:
+                entry.restores += 1
+            else:
+                entry.loads += 1
+        logger.info(
+            f"[DiTModelRegistry] {'Restored' if restore else 'Loaded'} {entry.name} "
+            f"({nbytes / 1024**3:.2f} GB) in {time.time() - start:.1f}s"
+        )
+        self._make_room(0, entry)
+        return handler
+
+    def _on_device(self, handler: Any) -> bool:
+        return handler is not None and str(getattr(handler, "device", "cpu")) != "cpu"
+
+    def _make_room(self, nbytes: int, loading: _ModelEntry) -> None:
+        """Evict idle DiTs, least recently used first, until nbytes more fit the budget (loader thread)."""
+        if self.budget_bytes is None:
+            return
+        while True:
+            with self._lock:
+                resident = [
+                    e for e in self._entries.values()
+                    if e is not loading and e.state == "ready" and self._on_device(e.handler)
+                ]
+                used = sum(e.nbytes for e in resident) + (loading.nbytes if loading.state == "ready" else nbytes)
+                if used <= self.budget_bytes:
+                    return
+                idle = [e for e in resident if e.in_use == 0]
+                if not idle:
+                    # Everything else is running a job; go over budget rather than wait
+                    logger.warning("[DiTModelRegistry] VRAM budget exceeded: all other resident DiTs are in use")
+                    return
+                victim = min(idle, key=lambda e: e.last_used)
+                victim.state = "evicting"
+            self._evict(victim)
+
+    def _evict(self, entry: _ModelEntry) -> None:
+        to_disk = self.evict_to == "disk" and entry.name != self.primary
+        logger.info(f"[DiTModelRegistry] Evicting {entry.name} to {'disk' if to_disk else 'CPU'}")
+        handler = entry.handler
+        try:
+            if to_disk:
+                handler.unload_dit()
+            else:
+                handler.move_dit("cpu")
+        finally:
+            with self._lock:
+                entry.evictions += 1
+                if to_disk:
+                    entry.handler = None
+                    entry.state = "unloaded"
+                else:
+                    entry.state = "cpu"
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = list(self._entries.values())
+            return {
+                "budget_gb": round(self.budget_bytes / 1024**3, 3) if self.budget_bytes is not None else None,
+                "resident_gb": round(
+                    sum(e.nbytes for e in entries if e.state == "ready" and self._on_device(e.handler)) / 1024**3, 3
+                ),
+                "evict_to": self.evict_to,
+                "models": {
+                    e.name: {
+                        "state": e.state,
+                        "in_use": e.in_use,
+                        "size_gb": round(e.nbytes / 1024**3, 3),
+                        "loads": e.loads,
+                        "restores": e.restores,
+                        "evictions": e.evictions,
+                    }
+                    for e in entries
+                },
+            }
+
+    def shutdown(self) -> None:
+        self._loader.shutdown(wait=False, cancel_futures=True)
+
+
+def model_name(config_path: str) -> str:
+    """Model name of a config path ("/ckpt/acestep-v15-turbo/" -> "acestep-v15-turbo")."""
+    return os.path.basename(config_path.strip().rstrip("/\\"))
+
+
+def create_dit_model_registry(
+    load_fn: Callable[[str], Any],
+    primary_config_path: str,
+    checkpoint_dir: str,
+    default_budget_bytes: Optional[int] = None,
+) -> DiTModelRegistry:
+    """
+    Create a DiTModelRegistry configured from environment variables.
+
+    Args:
+        load_fn: Creates and initializes a handler for a config path
+        primary_config_path: Default model config (ACESTEP_CONFIG_PATH)
+        checkpoint_dir: Directory scanned for acestep-v15-* checkpoints when ACESTEP_DIT_MODELS is unset
+        default_budget_bytes: Budget used when ACESTEP_DIT_VRAM_BUDGET_GB is unset (None for no limit)
+    """
+    config_paths = [os.environ.get("ACESTEP_CONFIG_PATH2", ""), os.environ.get("ACESTEP_CONFIG_PATH3", "")]
+    models_env = os.environ.get("ACESTEP_DIT_MODELS")
+    if models_env is not None:
+        config_paths += models_env.split(",")
+    elif os.path.isdir(checkpoint_dir):
+        config_paths += sorted(
+            d for d in os.listdir(checkpoint_dir)
+            if d.startswith("acestep-v15-") and os.path.isdir(os.path.join(checkpoint_dir, d))
+        )
+    budget_gb = os.environ.get("ACESTEP_DIT_VRAM_BUDGET_GB")
+    return DiTModelRegistry(
+        load_fn,
+        primary_config_path,
+        [p.strip() for p in config_paths if p.strip()],
+        budget_bytes=int(float(budget_gb) * 1024**3) if budget_gb else default_budget_bytes,
+        evict_to=os.environ.get("ACESTEP_DIT_EVICT_TO", "cpu").strip().lower(),
+    )
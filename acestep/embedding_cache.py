@@ -0,0 +1,188 @@
+"""Text-encoder embedding cache
+
+Batched generation repeats the same caption for every seed, the Gradio
+"generate next batch" loop re-encodes the same prompt each round, and cover
+CFG encodes an extra non-cover prompt. This cache memoizes text encoder
+outputs per token sequence so each distinct prompt is encoded once.
+
+Entries are keyed on (token ids, encoder identity, dtype) and kept in two
+LRU tiers:
+- device: hidden states stay on the GPU, ready to use
+- cpu: entries evicted from the device tier, promoted back on hit
+
+Configuration (environment):
+- ACESTEP_TEXT_EMBEDDING_CACHE: set to 0/false to disable
+- ACESTEP_TEXT_EMBEDDING_CACHE_GPU_MB: device tier cap (default 256)
+- ACESTEP_TEXT_EMBEDDING_CACHE_CPU_MB: CPU tier cap (default 1024)
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+
+def _nbytes(tensor: torch.Tensor) -> int:
+    return tensor.numel() * tensor.element_size()
+
+
+class TextEmbeddingCache:
+    """Two-tier (device + CPU) LRU cache of text encoder hidden states."""
+
+    def __init__(self, max_device_bytes: int = 256 * 1024**2, max_cpu_bytes: int = 1024 * 1024**2):
+        self.max_device_bytes = max_device_bytes
+        self.max_cpu_bytes = max_cpu_bytes
+        self._lock = threading.Lock()
+        self._device: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self._cpu: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self._device_bytes = 0
+        self._cpu_bytes = 0
+        self.device_hits = 0
+        self.cpu_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(token_ids: torch.Tensor, encoder_identity: str, dtype: torch.dtype) -> str:
+        """Key for one token sequence (1D tensor of ids, padding included)."""
+        h = hashlib.sha1(f"{encoder_identity}|{dtype}|{token_ids.numel()}".encode("utf-8"))
+        h.update(token_ids.to("cpu", torch.int64).contiguous().numpy().tobytes())
+        return h.hexdigest()
+
+    def _store_device(self, key: str, value: torch.Tensor) -> None:
+        old = self._device.pop(key, None)
+        if old is not None:
+            self._device_bytes -= _nbytes(old)
+        self._device[key] = value
+        self._device_bytes += _nbytes(value)
+        while self._device_bytes > self.max_device_bytes and self._device:
+            evicted_key, evicted = self._device.popitem(last=False)
+            self._device_bytes -= _nbytes(evicted)
+            # Demote to the CPU tier instead of dropping
+            self._store_cpu(evicted_key, evicted.to("cpu"))
+
+    def _store_cpu(self, key: str, value: torch.Tensor) -> None:
+        if _nbytes(value) > self.max_cpu_bytes:
+            return
+        old = self._cpu.pop(key, None)
+        if old is not None:
+            self._cpu_bytes -= _nbytes(old)
+        self._cpu[key] = value
+        self._cpu_bytes += _nbytes(value)
+        while self._cpu_bytes > self.max_cpu_bytes and self._cpu:
+            _, evicted = self._cpu.popitem(last=False)
+            self._cpu_bytes -= _nbytes(evicted)
+
+    def get(self, key: str, device: torch.device) -> Optional[torch.Tensor]:
+        """Return the cached hidden states on device, or None on miss."""
+        with self._lock:
+            value = self._device.get(key)
+            if value is not None:
+                self._device.move_to_end(key)
+                self.device_hits += 1
+                return value
+            value = self._cpu.pop(key, None)
+            if value is not None:
+                self._cpu_bytes -= _nbytes(value)
+                self.cpu_hits += 1
+                value = value.to(device)
+                self._store_device(key, value)
+                return value
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: torch.Tensor) -> None:
+        with self._lock:
+            if _nbytes(value) > self.max_device_bytes:
+                self._store_cpu(key, value.detach().to("cpu"))
+            else:
+                self._store_device(key, value.detach())
+
+    def encode_rows(
+        self,
+        token_ids: torch.Tensor,
+        encode_fn: Callable[[torch.Tensor], torch.Tensor],
+        encoder_identity: str,
+        dtype: torch.dtype,
+    ) -> torch.Tensor:
+        """
+        Encode a padded batch of token ids, running the encoder only on distinct uncached rows.
+
+        Args:
+            token_ids: [batch, length] token ids
+            encode_fn: Maps [n, length] ids to [n, length, hidden] states
+            encoder_identity: Identifies the encoder weights (e.g. checkpoint path)
+            dtype: Dtype of the returned hidden states (part of the key)
+
+        Returns:
+            [batch, length, hidden] hidden states
+        """
+        ids_cpu = token_ids.detach().to("cpu")
+        identity = f"{encoder_identity}|{token_ids.device}"
+        keys = [self.make_key(row, identity, dtype) for row in ids_cpu]
+        rows: Dict[str, torch.Tensor] = {}
+        missing: List[int] = []
+        pending = set()
+        for i, key in enumerate(keys):
+            # Repeated prompts within the batch are looked up / encoded once
+            if key in rows or key in pending:
+                continue
+            cached = self.get(key, token_ids.device)
+            if cached is not None:
+                rows[key] = cached
+            else:
+                missing.append(i)
+                pending.add(key)
+
+        if missing:
+            encoded = encode_fn(token_ids[missing])
+            for n, i in enumerate(missing):
+                value = encoded[n]
+                rows[keys[i]] = value
+                # Clone so the cache entry does not pin the whole encoded batch
+                self.put(keys[i], value.clone())
+
+        return torch.stack([rows[key] for key in keys], dim=0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._device.clear()
+            self._cpu.clear()
+            self._device_bytes = 0
+            self._cpu_bytes = 0
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.device_hits + self.cpu_hits + self.misses
+            return {
+                "device_hits": self.device_hits,
+                "cpu_hits": self.cpu_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.device_hits + self.cpu_hits) / lookups, 4) if lookups else 0.0,
+                "device_entries": len(self._device),
+                "device_bytes": self._device_bytes,
+                "cpu_entries": len(self._cpu),
+                "cpu_bytes": self._cpu_bytes,
+            }
+
+
+# Lazily initialized global instance
+_text_embedding_cache: Optional[TextEmbeddingCache] = None
+_text_embedding_cache_lock = threading.Lock()
+
+
+def get_text_embedding_cache() -> Optional[TextEmbeddingCache]:
+    """Get the process-wide text embedding cache, or None if disabled via ACESTEP_TEXT_EMBEDDING_CACHE."""
+    global _text_embedding_cache
+    if os.environ.get("ACESTEP_TEXT_EMBEDDING_CACHE", "true").strip().lower() in {"0", "false", "no", "off"}:
+        return None
+    if _text_embedding_cache is None:
+        with _text_embedding_cache_lock:
+            if _text_embedding_cache is None:
+                _text_embedding_cache = TextEmbeddingCache(
+                    max_device_bytes=int(float(os.environ.get("ACESTEP_TEXT_EMBEDDING_CACHE_GPU_MB", "256")) * 1024**2),
+                    max_cpu_bytes=int(float(os.environ.get("ACESTEP_TEXT_EMBEDDING_CACHE_CPU_MB", "1024")) * 1024**2),
+                )
+    return _text_embedding_cache
@@ -939,9 +939,8 @@ def setup_training_event_handlers(demo, dit_handler, llm_handler, training_secti
     
     # Scan directory for audio files
     training_section["scan_btn"].click(
-        fn=lambda dir, name, tag, pos, instr, state: train_h.scan_directory(
-            dir, name, tag, pos, instr, state
-        ),
+        # Passed directly (not wrapped in a lambda) so Gradio streams the generator's updates
+        fn=train_h.scan_directory,
         inputs=[
             training_section["audio_directory"],
             training_section["dataset_name"],
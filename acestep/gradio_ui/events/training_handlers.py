@@ -11,6 +11,7 @@ from loguru import logger
 import gradio as gr
 
 from acestep.training.dataset_builder import DatasetBuilder, AudioSample
+from acestep.training.tensor_shards import TensorShardReader, is_sharded_tensor_dir
 
 
 def create_dataset_builder() -> DatasetBuilder:
@@ -25,14 +26,17 @@ def scan_directory(
     tag_position: str,
     all_instrumental: bool,
     builder_state: Optional[DatasetBuilder],
-) -> Tuple[Any, str, Any, DatasetBuilder]:
+):
     """Scan a directory for audio files.
     
-    Returns:
-        Tuple of (table_data, status, slider_update, builder_state)
+    This is a generator function: the table fills in while audio headers are read.
+    
+    Yields:
+        Tuples of (table_data, status, slider_update, builder_state)
     """
     if not audio_dir or not audio_dir.strip():
-        return [], "❌ Please enter a directory path", gr.Slider(maximum=0, value=0), builder_state
+        yield [], "❌ Please enter a directory path", gr.Slider(maximum=0, value=0), builder_state
+        return
     
     # Create or use existing builder
     builder = builder_state if builder_state else DatasetBuilder()
@@ -43,11 +47,15 @@ def scan_directory(
     builder.metadata.tag_position = tag_position
     builder.metadata.all_instrumental = all_instrumental
     
-    # Scan directory
-    samples, status = builder.scan_directory(audio_dir.strip())
+    # Scan directory, showing partial results
+    samples, status = [], ""
+    for samples, status in builder.iter_scan_directory(audio_dir.strip()):
+        table_data = builder.get_samples_dataframe_data() if samples else []
+        yield table_data, status, gr.Slider(maximum=0, value=0), builder
     
     if not samples:
-        return [], status, gr.Slider(maximum=0, value=0), builder
+        yield [], status, gr.Slider(maximum=0, value=0), builder
+        return
     
     # Set instrumental and tag for all samples
     builder.set_all_instrumental(all_instrumental)
@@ -60,7 +68,7 @@ def scan_directory(
     # Calculate slider max and return as Slider update
     slider_max = max(0, len(samples) - 1)
     
-    return table_data, status, gr.Slider(maximum=slider_max, value=0), builder
+    yield table_data, status, gr.Slider(maximum=slider_max, value=0), builder
 
 
 def auto_label_all(
@@ -423,6 +431,17 @@ def load_training_dataset(
     if not os.path.isdir(tensor_dir):
         return f"❌ Not a directory: {tensor_dir}"
     
+    # Packed tensor shards take precedence over the per-file layout
+    if is_sharded_tensor_dir(tensor_dir):
+        try:
+            reader = TensorShardReader(tensor_dir)
+            info = f"✅ Loaded sharded dataset: {reader.metadata.get('name', 'Unknown')}\n"
+            info += f"📊 Samples: {len(reader)} in {len(reader.shards)} memory-mapped shard(s)\n"
+            info += f"🏷️ Custom Tag: {reader.metadata.get('custom_tag', '') or '(none)'}"
+            return info
+        except Exception as e:
+            logger.warning(f"Failed to read shard index: {e}")
+    
     # Check for manifest
     manifest_path = os.path.join(tensor_dir, "manifest.json")
     if os.path.exists(manifest_path):
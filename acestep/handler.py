@@ -9,6 +9,7 @@ import gc
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 import math
+import threading
 from copy import deepcopy
 import tempfile
 import traceback
@@ -19,7 +20,7 @@ import uuid
 import hashlib
 import json
 from contextlib import contextmanager
-from typing import Optional, Dict, Any, Tuple, List, Union
+from typing import Optional, Dict, Any, Tuple, List, Union, Callable
 
 import torch
 import torchaudio
@@ -45,7 +46,12 @@ from acestep.constants import (
     DEFAULT_DIT_INSTRUCTION,
 )
 from acestep.dit_alignment_score import MusicStampsAligner, MusicLyricScorer
-from acestep.gpu_config import get_gpu_memory_gb
+from acestep.gpu_config import get_gpu_memory_gb, get_global_gpu_config
+from acestep.model_residency import get_residency_manager, module_nbytes, residency_budget_bytes
+from acestep.audio_cache import cache_key, get_audio_cache
+from acestep.embedding_cache import get_text_embedding_cache
+from acestep.audio_utils import get_audio_file_hash, get_audio_tensor_hash
+from acestep.cancellation import CancellationToken, JobCancelledError, all_cancelled
 
 
 warnings.filterwarnings("ignore")
@@ -84,6 +90,14 @@ class AceStepHandler:
         self.offload_to_cpu = False
         self.offload_dit_to_cpu = False
         self.current_offload_cost = 0.0
+        # Shared GPU residency manager (set up in initialize_service when offload_to_cpu is enabled)
+        self._residency = None
+        # Handler whose VAE / text encoder this one shares (see initialize_service(shared_components=...))
+        self._shared_owner = None
+        # Identities of the loaded VAE / DiT, part of the audio feature cache keys
+        self._vae_identity = ""
+        self._dit_identity = ""
+        self._text_encoder_identity = ""
         
         # LoRA state
         self.lora_loaded = False
@@ -334,6 +348,7 @@ class AceStepHandler:
         offload_to_cpu: bool = False,
         offload_dit_to_cpu: bool = False,
         quantization: Optional[str] = None,
+        shared_components: Optional["AceStepHandler"] = None,
     ) -> Tuple[str, bool]:
         """
         Initialize DiT model service
@@ -346,6 +361,8 @@ class AceStepHandler:
             compile_model: Whether to use torch.compile to optimize the model
             offload_to_cpu: Whether to offload models to CPU when not in use
             offload_dit_to_cpu: Whether to offload DiT model to CPU when not in use (only effective if offload_to_cpu is True)
+            shared_components: Initialized handler whose VAE and text encoder are reused instead of
+                loading new copies (only if it runs on the same device with the same offload setting)
         
         Returns:
             (status_message, enable_generate_button)
@@ -362,6 +379,15 @@ class AceStepHandler:
                     device = "cpu"
 
             status_msg = ""
+
+            if shared_components is not None and (
+                shared_components.vae is None
+                or shared_components.device != device
+                or shared_components.offload_to_cpu != offload_to_cpu
+            ):
+                logger.warning("[initialize_service] Not sharing VAE/text encoder: handler is uninitialized or set up differently")
+                shared_components = None
+            self._shared_owner = shared_components
             
             self.device = device
             self.offload_to_cpu = offload_to_cpu
@@ -490,7 +516,9 @@ class AceStepHandler:
             
             # 2. Load VAE
             vae_checkpoint_path = os.path.join(checkpoint_dir, "vae")
-            if os.path.exists(vae_checkpoint_path):
+            if shared_components is not None:
+                self.vae = shared_components.vae
+            elif os.path.exists(vae_checkpoint_path):
                 self.vae = AutoencoderOobleck.from_pretrained(vae_checkpoint_path)
                 # Use bfloat16 for VAE on GPU, otherwise use self.dtype (float32 on CPU)
                 vae_dtype = self._get_vae_dtype(device)
@@ -502,7 +530,7 @@ class AceStepHandler:
             else:
                 raise FileNotFoundError(f"VAE checkpoint not found at {vae_checkpoint_path}")
 
-            if compile_model:
+            if compile_model and shared_components is None:
                 # Add __len__ method to VAE to support torch.compile if needed
                 # Note: This modifies the VAE class, affecting all instances
                 if not hasattr(self.vae.__class__, '__len__'):
@@ -515,7 +543,10 @@ class AceStepHandler:
             
             # 3. Load text encoder and tokenizer
             text_encoder_path = os.path.join(checkpoint_dir, "Qwen3-Embedding-0.6B")
-            if os.path.exists(text_encoder_path):
+            if shared_components is not None:
+                self.text_tokenizer = shared_components.text_tokenizer
+                self.text_encoder = shared_components.text_encoder
+            elif os.path.exists(text_encoder_path):
                 self.text_tokenizer = AutoTokenizer.from_pretrained(text_encoder_path)
                 self.text_encoder = AutoModel.from_pretrained(text_encoder_path)
                 if not self.offload_to_cpu:
@@ -526,6 +557,13 @@ class AceStepHandler:
             else:
                 raise FileNotFoundError(f"Text encoder not found at {text_encoder_path}")
 
+            self._vae_identity = f"{vae_checkpoint_path}|{self._get_vae_dtype(device)}"
+            self._dit_identity = acestep_v15_checkpoint_path
+            self._text_encoder_identity = text_encoder_path
+
+            if self.offload_to_cpu:
+                self._setup_residency()
+
             # Determine actual attention implementation used
             actual_attn = getattr(self.config, "_attn_implementation", "eager")
             
@@ -653,13 +691,147 @@ class AceStepHandler:
             if still_wrong:
                 logger.error(f"[_recursive_to_device] CRITICAL: {len(still_wrong)} parameters still on wrong device: {still_wrong[:10]}")
     
+    def _residency_key(self, model_name: str) -> str:
+        # Shared components are registered once, under the handler that loaded them
+        owner = self._shared_owner if self._shared_owner is not None and model_name != "model" else self
+        return f"{id(owner)}:{model_name}"
+
+    def _setup_residency(self):
+        """Register text_encoder, DiT and VAE with the shared residency manager for self.device."""
+        self._residency = get_residency_manager(
+            self.device,
+            residency_budget_bytes(get_global_gpu_config()),
+            release_memory_fn=self._release_memory,
+        )
+        for model_name in ("text_encoder", "model", "vae"):
+            if self._shared_owner is not None and model_name != "model":
+                continue
+            self._register_residency(model_name)
+
+    def _register_residency(self, model_name: str, resident: bool = False):
+        key = self._residency_key(model_name)
+        self._residency.unregister(key)
+        if getattr(self, model_name, None) is None:
+            return
+        self._residency.register(
+            key,
+            stage=model_name,
+            load_fn=lambda name=model_name: self._residency_load(name),
+            offload_fn=lambda name=model_name: self._residency_offload(name),
+            size_fn=lambda name=model_name: module_nbytes(getattr(self, name, None)),
+            resident=resident,
+            # A DiT kept on GPU (offload_dit_to_cpu=False) still counts against the budget
+            pinned=(model_name == "model" and not self.offload_dit_to_cpu),
+        )
+
+    def dit_nbytes(self) -> int:
+        """Size of the DiT weights in bytes."""
+        return module_nbytes(self.model)
+
+    def move_dit(self, device: str):
+        """
+        Move the DiT weights to device or back to CPU (DiT model registry eviction / restore).
+
+        The residency manager is told where the weights are, so it neither counts an
+        evicted DiT against its budget nor assumes a restored one still needs loading.
+        """
+        if self.model is None:
+            return
+        logger.info(f"[move_dit] Moving DiT ({self._dit_identity}) to {device}")
+        self._recursive_to_device(self.model, device, self.dtype)
+        if device == "cpu":
+            self._release_memory()
+        if self._residency is None:
+            return
+        if device == "cpu" and not self.offload_dit_to_cpu:
+            # A pinned DiT would still count against the budget; it is re-registered on restore
+            self._residency.unregister(self._residency_key("model"))
+        else:
+            self._register_residency("model", resident=(device != "cpu"))
+
+    def unload_dit(self):
+        """Drop the DiT weights; initialize_service() loads them again."""
+        if self._residency is not None:
+            self._residency.unregister(self._residency_key("model"))
+        self.model = None
+        self._release_memory()
+
+    def _release_memory(self):
+        gc.collect()
+        self._safe_empty_cache()
+
+    def _residency_load(self, model_name: str):
+        """Move a component to self.device (called by the residency manager)."""
+        model = getattr(self, model_name)
+        logger.info(f"[_load_model_context] Loading {model_name} to {self.device}")
+        start_time = time.time()
+        if model_name == "vae":
+            self._recursive_to_device(model, self.device, self._get_vae_dtype())
+        else:
+            self._recursive_to_device(model, self.device, self.dtype)
+
+        if model_name == "model" and hasattr(self, "silence_latent"):
+            self.silence_latent = self.silence_latent.to(self.device).to(self.dtype)
+
+        load_time = time.time() - start_time
+        self.current_offload_cost += load_time
+        logger.info(f"[_load_model_context] Loaded {model_name} to {self.device} in {load_time:.4f}s")
+
+    def _residency_offload(self, model_name: str):
+        """Move a component back to CPU (called by the residency manager on eviction)."""
+        model = getattr(self, model_name)
+        logger.info(f"[_load_model_context] Offloading {model_name} to CPU")
+        start_time = time.time()
+        self._recursive_to_device(model, "cpu")
+
+        # NOTE: Do NOT offload silence_latent to CPU here!
+        # silence_latent is used in many places outside of model context,
+        # so it should stay on GPU to avoid device mismatch errors.
+
+        offload_time = time.time() - start_time
+        self.current_offload_cost += offload_time
+        logger.info(f"[_load_model_context] Offloaded {model_name} to CPU in {offload_time:.4f}s")
+
+    def get_residency_stats(self) -> Optional[Dict[str, Any]]:
+        """Per-stage residency hit/miss counters, or None when offload_to_cpu is disabled."""
+        if self._residency is None:
+            return None
+        return self._residency.get_stats()
+
     @contextmanager
-    def _load_model_context(self, model_name: str):
+    def _cancellation_hook(self, module: Optional[torch.nn.Module], cancel_token: Optional[CancellationToken]):
         """
-        Context manager to load a model to GPU and offload it back to CPU after use.
+        Check cancel_token before every forward of module on this thread.
+
+        Hooked on the DiT decoder this is a check per diffusion step, on the VAE
+        decoder one per decoded tile. Other threads sharing the module are unaffected.
+        """
+        if module is None or cancel_token is None:
+            yield
+            return
+        thread_id = threading.get_ident()
+
+        def _check(*_):
+            if threading.get_ident() == thread_id:
+                cancel_token.check()
+
+        handle = module.register_forward_pre_hook(_check)
+        try:
+            yield
+        finally:
+            handle.remove()
+
+    @contextmanager
+    def _load_model_context(self, model_name: str, prefetch_next: Optional[str] = None):
+        """
+        Context manager to make a model resident on GPU for the duration of the block.
+
+        With offload_to_cpu, components are kept on GPU after use under the
+        residency manager's VRAM budget and evicted LRU-first when room is needed.
         
         Args:
             model_name: Name of the model to load ("text_encoder", "vae", "model")
+            prefetch_next: Model to start loading on a side stream while this block runs
         """
         if not self.offload_to_cpu:
             yield
@@ -689,52 +861,13 @@ class AceStepHandler:
             yield
             return
 
-        # Load to GPU
-        logger.info(f"[_load_model_context] Loading {model_name} to {self.device}")
-
-        # Explicitly release memory before loading to GPU
-        # Clear memory before loading to maximize available VRAM
-        gc.collect()
-        self._safe_empty_cache()
-
-        start_time = time.time()
-        if model_name == "vae":
-            vae_dtype = self._get_vae_dtype()
-            self._recursive_to_device(model, self.device, vae_dtype)
-        else:
-            self._recursive_to_device(model, self.device, self.dtype)
-        
-        if model_name == "model" and hasattr(self, "silence_latent"):
-             self.silence_latent = self.silence_latent.to(self.device).to(self.dtype)
-        
-        load_time = time.time() - start_time
-        self.current_offload_cost += load_time
-        logger.info(f"[_load_model_context] Loaded {model_name} to {self.device} in {load_time:.4f}s")
+        if self._residency is None:
+            self._setup_residency()
 
-        try:
+        with self._residency.acquire(self._residency_key(model_name)):
+            if prefetch_next is not None and getattr(self, prefetch_next, None) is not None:
+                self._residency.prefetch(self._residency_key(prefetch_next))
             yield
-        finally:
-            # Offload to CPU
-            logger.info(f"[_load_model_context] Offloading {model_name} to CPU")
-
-            # Explicitly release memory before offloading to CPU
-            gc.collect()
-            self._safe_empty_cache()
-
-            start_time = time.time()
-            self._recursive_to_device(model, "cpu")
-            
-            # NOTE: Do NOT offload silence_latent to CPU here!
-            # silence_latent is used in many places outside of model context,
-            # so it should stay on GPU to avoid device mismatch errors.
-            
-            # Explicitly release memory after offloading to CPU
-            gc.collect()
-            self._safe_empty_cache()
-
-            offload_time = time.time() - start_time
-            self.current_offload_cost += offload_time
-            logger.info(f"[_load_model_context] Offloaded {model_name} to CPU in {offload_time:.4f}s")
 
     def process_target_audio(self, audio_file) -> Optional[torch.Tensor]:
         """Process target audio"""
@@ -944,16 +1077,24 @@ class AceStepHandler:
             text_attention_mask = text_inputs.attention_mask.to(self.device).bool()
             
             # Encode
-            with torch.no_grad():
-                text_outputs = self.text_encoder(text_input_ids)
-                if hasattr(text_outputs, 'last_hidden_state'):
-                    text_hidden_states = text_outputs.last_hidden_state
-                elif isinstance(text_outputs, tuple):
-                    text_hidden_states = text_outputs[0]
-                else:
-                    text_hidden_states = text_outputs
-            
-            text_hidden_states = text_hidden_states.to(self.dtype)
+            def _encode(input_ids):
+                with torch.no_grad():
+                    text_outputs = self.text_encoder(input_ids)
+                    if hasattr(text_outputs, 'last_hidden_state'):
+                        text_hidden_states = text_outputs.last_hidden_state
+                    elif isinstance(text_outputs, tuple):
+                        text_hidden_states = text_outputs[0]
+                    else:
+                        text_hidden_states = text_outputs
+                return text_hidden_states.to(self.dtype)
+
+            cache = get_text_embedding_cache()
+            if cache is not None:
+                text_hidden_states = cache.encode_rows(
+                    text_input_ids, _encode, f"{self._text_encoder_identity}|hidden", self.dtype
+                )
+            else:
+                text_hidden_states = _encode(text_input_ids)
             
             return text_hidden_states, text_attention_mask
     
@@ -1173,10 +1314,8 @@ class AceStepHandler:
         if input_was_2d:
             audio = audio.unsqueeze(0)
         
-        # Use tiled_encode for memory-efficient encoding
-        # tiled_encode handles device transfer and dtype conversion internally
-        with torch.no_grad():
-            latents = self.tiled_encode(audio, offload_latent_to_cpu=True)
+        # Use tiled_encode for memory-efficient encoding (cached by waveform content)
+        latents = self._tiled_encode_cached(audio)
         
         # Move back to device and cast to model dtype
         latents = latents.to(self.device).to(self.dtype)
@@ -1190,6 +1329,59 @@ class AceStepHandler:
         
         return latents
     
+    def _tiled_encode_cached(self, audio: torch.Tensor) -> torch.Tensor:
+        """
+        tiled_encode with the content-addressed latent cache in front.
+        
+        Args:
+            audio: Audio tensor [batch, channels, samples] (or [channels, samples])
+            
+        Returns:
+            Latents as returned by tiled_encode ([batch, d, T], CPU on cache hit)
+        """
+        cache = get_audio_cache()
+        key = None
+        if cache is not None:
+            key = cache_key("latents", get_audio_tensor_hash(audio), self._vae_identity)
+            cached = cache.get("latents", key)
+            if cached is not None:
+                logger.info("[_tiled_encode_cached] VAE latents cache hit, skipping encode")
+                return cached.clone()
+
+        with torch.no_grad():
+            latents = self.tiled_encode(audio, offload_latent_to_cpu=True)
+
+        if cache is not None:
+            cache.put("latents", key, latents)
+        return latents
+
+    def _load_normalized_audio(self, audio_file) -> Tuple[torch.Tensor, str]:
+        """
+        Load an audio file as stereo 48kHz, using the waveform cache for files on disk.
+        
+        Args:
+            audio_file: Path to audio file (or anything torchaudio.load accepts)
+            
+        Returns:
+            (audio [2, samples], file content hash or "" when the input is not a file path)
+        """
+        file_hash = ""
+        cache = get_audio_cache()
+        if isinstance(audio_file, str) and os.path.isfile(audio_file):
+            file_hash = get_audio_file_hash(audio_file)
+        if cache is not None and file_hash:
+            cached = cache.get("waveform", cache_key("waveform", file_hash))
+            if cached is not None:
+                return cached.clone(), file_hash
+
+        audio, sr = torchaudio.load(audio_file)
+        logger.debug(f"[_load_normalized_audio] Loaded audio shape: {audio.shape}, sample rate: {sr}")
+        audio = self._normalize_audio_to_stereo_48k(audio, sr)
+
+        if cache is not None and file_hash:
+            cache.put("waveform", cache_key("waveform", file_hash), audio)
+        return audio, file_hash
+
     def _build_metadata_dict(self, bpm: Optional[Union[int, str]], key_scale: str, time_signature: str, duration: Optional[float] = None) -> Dict[str, Any]:
         """
         Build metadata dictionary with default values.
@@ -1267,16 +1459,12 @@ class AceStepHandler:
             return None
             
         try:
-            # Load audio file
-            audio, sr = torchaudio.load(audio_file)
+            # Load audio file and normalize to stereo 48kHz
+            audio, _ = self._load_normalized_audio(audio_file)
             
             logger.debug(f"[process_reference_audio] Reference audio shape: {audio.shape}")
-            logger.debug(f"[process_reference_audio] Reference audio sample rate: {sr}")
             logger.debug(f"[process_reference_audio] Reference audio duration: {audio.shape[-1] / 48000.0} seconds")
             
-            # Normalize to stereo 48kHz
-            audio = self._normalize_audio_to_stereo_48k(audio, sr)
-            
             is_silence = self.is_silence(audio)
             if is_silence:
                 return None
@@ -1322,11 +1510,8 @@ class AceStepHandler:
             return None
             
         try:
-            # Load audio file
-            audio, sr = torchaudio.load(audio_file)
-            
-            # Normalize to stereo 48kHz
-            audio = self._normalize_audio_to_stereo_48k(audio, sr)
+            # Load audio file and normalize to stereo 48kHz
+            audio, _ = self._load_normalized_audio(audio_file)
             
             return audio
             
@@ -1351,6 +1536,15 @@ class AceStepHandler:
             return "❌ Model not initialized. Please initialize the service first."
         
         try:
+            cache = get_audio_cache()
+            codes_key = None
+            if cache is not None and isinstance(audio_file, str) and os.path.isfile(audio_file):
+                codes_key = cache_key("codes", get_audio_file_hash(audio_file), self._dit_identity, self._vae_identity)
+                cached_codes = cache.get("codes", codes_key)
+                if cached_codes is not None:
+                    logger.info("[convert_src_audio_to_codes] Audio codes cache hit")
+                    return cached_codes
+
             # Process audio file
             processed_audio = self.process_src_audio(audio_file)
             if processed_audio is None:
@@ -1366,31 +1560,133 @@ class AceStepHandler:
                     # Encode to latents using helper method
                     latents = self._encode_audio_to_latents(processed_audio)  # [T, d]
                 
-                # Create attention mask for latents
-                attention_mask = torch.ones(latents.shape[0], dtype=torch.bool, device=self.device)
-                
                 # Tokenize latents to get code indices
                 with self._load_model_context("model"):
-                    # Prepare latents for tokenize: [T, d] -> [1, T, d]
-                    hidden_states = latents.unsqueeze(0)  # [1, T, d]
-                    
-                    # Call tokenize method
-                    # tokenize returns: (quantized, indices, attention_mask)
-                    _, indices, _ = self.model.tokenize(hidden_states, self.silence_latent, attention_mask.unsqueeze(0))
-                    
-                    # Format indices as code string
-                    # indices shape: [1, T_5Hz] or [1, T_5Hz, num_quantizers]
-                    # Flatten and convert to list
-                    indices_flat = indices.flatten().cpu().tolist()
-                    codes_string = "".join([f"<|audio_code_{idx}|>" for idx in indices_flat])
-                    
-                    logger.info(f"[convert_src_audio_to_codes] Generated {len(indices_flat)} audio codes")
+                    codes_string = self._latents_to_codes_string(latents)
+                    if codes_key is not None:
+                        cache.put("codes", codes_key, codes_string)
                     return codes_string
                     
         except Exception as e:
             error_msg = f"❌ Error converting audio to codes: {str(e)}\n{traceback.format_exc()}"
             logger.exception("[convert_src_audio_to_codes] Error converting audio to codes")
             return error_msg
+    
+    def _latents_to_codes_string(self, latents: torch.Tensor) -> str:
+        """
+        Tokenize VAE latents into an audio codes string (model must be loaded).
+        
+        Args:
+            latents: Latents tensor [T, d]
+            
+        Returns:
+            Codes string like '<|audio_code_123|><|audio_code_456|>...'
+        """
+        # Create attention mask for latents
+        attention_mask = torch.ones(latents.shape[0], dtype=torch.bool, device=self.device)
+        
+        # Prepare latents for tokenize: [T, d] -> [1, T, d]
+        hidden_states = latents.to(self.device).to(self.dtype).unsqueeze(0)  # [1, T, d]
+        
+        # Call tokenize method
+        # tokenize returns: (quantized, indices, attention_mask)
+        _, indices, _ = self.model.tokenize(hidden_states, self.silence_latent, attention_mask.unsqueeze(0))
+        
+        # Format indices as code string
+        # indices shape: [1, T_5Hz] or [1, T_5Hz, num_quantizers]
+        # Flatten and convert to list
+        indices_flat = indices.flatten().cpu().tolist()
+        logger.info(f"[convert_src_audio_to_codes] Generated {len(indices_flat)} audio codes")
+        return "".join([f"<|audio_code_{idx}|>" for idx in indices_flat])
+    
+    def convert_src_audio_to_codes_batch(
+        self,
+        audio_files: List[str],
+        batch_size: int = 4,
+        progress_callback: Optional[Callable[[str], None]] = None,
+    ) -> List[str]:
+        """
+        Convert several audio files to audio codes strings, VAE-encoding them in batches.
+        
+        Each batch of files is zero-padded to its longest member and encoded with one
+        tiled_encode call; the latents of every file are then cut to its own length and
+        tokenized. Pass files of similar length next to each other to keep padding small.
+        Codes found in the audio cache are reused as in convert_src_audio_to_codes.
+        
+        Args:
+            audio_files: Paths of audio files
+            batch_size: Files per VAE batch
+            progress_callback: Optional callback for progress updates
+            
+        Returns:
+            One codes string (or error message starting with "❌") per file, in order
+        """
+        if self.model is None or self.vae is None:
+            return ["❌ Model not initialized. Please initialize the service first."] * len(audio_files)
+        
+        cache = get_audio_cache()
+        results: List[Optional[str]] = [None] * len(audio_files)
+        codes_keys: Dict[int, str] = {}
+        pending = []
+        for i, audio_file in enumerate(audio_files):
+            if cache is not None and os.path.isfile(audio_file):
+                codes_keys[i] = cache_key("codes", get_audio_file_hash(audio_file), self._dit_identity, self._vae_identity)
+                cached_codes = cache.get("codes", codes_keys[i])
+                if cached_codes is not None:
+                    results[i] = cached_codes
+                    continue
+            pending.append(i)
+        
+        batch_size = max(1, int(batch_size))
+        for start in range(0, len(pending), batch_size):
+            group = pending[start:start + batch_size]
+            if progress_callback:
+                progress_callback(f"Encoding audio {start + 1}-{start + len(group)}/{len(pending)}")
+            try:
+                group_codes = self._convert_audio_group_to_codes([audio_files[i] for i in group])
+            except Exception:
+                logger.exception(
+                    f"[convert_src_audio_to_codes_batch] Batch of {len(group)} files failed, retrying one file at a time"
+                )
+                # convert_src_audio_to_codes reports its own errors as "❌ ..." strings and fills the cache
+                for i in group:
+                    results[i] = self.convert_src_audio_to_codes(audio_files[i])
+                continue
+            for i, codes in zip(group, group_codes):
+                results[i] = codes
+                if i in codes_keys and not codes.startswith("❌"):
+                    cache.put("codes", codes_keys[i], codes)
+        return results
+    
+    def _convert_audio_group_to_codes(self, audio_files: List[str]) -> List[str]:
+        """VAE-encode a group of audio files as one batch and tokenize each file's latents."""
+        codes: List[Optional[str]] = [None] * len(audio_files)
+        waveforms = []
+        for i, audio_file in enumerate(audio_files):
+            audio, _ = self._load_normalized_audio(audio_file)
+            if self.is_silence(audio.unsqueeze(0)):
+                codes[i] = "❌ Audio file appears to be silent"
+            else:
+                waveforms.append((i, audio))
+        if not waveforms:
+            return codes
+        
+        lengths = [audio.shape[-1] for _, audio in waveforms]
+        max_len = max(lengths)
+        batch = torch.zeros(len(waveforms), 2, max_len, dtype=waveforms[0][1].dtype)
+        for row, (_, audio) in enumerate(waveforms):
+            batch[row, :, :audio.shape[-1]] = audio
+        
+        with torch.no_grad():
+            with self._load_model_context("vae"):
+                latents = self.tiled_encode(batch, offload_latent_to_cpu=True)  # [B, d, T]
+            latents = latents.transpose(1, 2)  # [B, T, d]
+            with self._load_model_context("model"):
+                for row, (i, _) in enumerate(waveforms):
+                    # Drop the latent frames that only cover padding
+                    latent_length = max(1, lengths[row] * latents.shape[1] // max_len)
+                    codes[i] = self._latents_to_codes_string(latents[row, :latent_length])
+        return codes
         
     def prepare_batch_data(
         self,
@@ -2050,9 +2346,8 @@ class AceStepHandler:
             else:
                 for refer_audio in refer_audios:
                     refer_audio = _normalize_audio_2d(refer_audio)
-                    # Use tiled_encode for memory-efficient encoding of long audio
-                    with torch.no_grad():
-                        refer_audio_latent = self.tiled_encode(refer_audio, offload_latent_to_cpu=True)
+                    # Use tiled_encode for memory-efficient encoding of long audio (cached by content)
+                    refer_audio_latent = self._tiled_encode_cached(refer_audio)
                     # Move to device and cast to model dtype
                     refer_audio_latent = refer_audio_latent.to(self.device).to(self.dtype)
                     # Ensure 3D before transpose: [C, T] -> [1, C, T] -> [1, T, C]
@@ -2066,9 +2361,17 @@ class AceStepHandler:
         return refer_audio_latents, refer_audio_order_mask
 
     def infer_text_embeddings(self, text_token_idss):
-        with torch.no_grad():
-            text_embeddings = self.text_encoder(input_ids=text_token_idss, lyric_attention_mask=None).last_hidden_state
-        return text_embeddings
+        def _encode(input_ids):
+            with torch.no_grad():
+                return self.text_encoder(input_ids=input_ids, lyric_attention_mask=None).last_hidden_state
+
+        # Each distinct prompt row is encoded once (repeated seeds, next-batch loops, non-cover CFG)
+        cache = get_text_embedding_cache()
+        if cache is None:
+            return _encode(text_token_idss)
+        return cache.encode_rows(
+            text_token_idss, _encode, f"{self._text_encoder_identity}|last_hidden_state", self.text_encoder.dtype
+        )
 
     def infer_lyric_embeddings(self, lyric_token_ids):
         with torch.no_grad():
@@ -2109,7 +2412,8 @@ class AceStepHandler:
         text_inputs = batch["text_inputs"]
 
         logger.info("[preprocess_batch] Inferring prompt embeddings...")
-        with self._load_model_context("text_encoder"):
+        # DiT runs next: start moving it to GPU while the text encoder computes
+        with self._load_model_context("text_encoder", prefetch_next="model"):
             text_hidden_states = self.infer_text_embeddings(text_token_idss)
             logger.info("[preprocess_batch] Inferring lyric embeddings...")
             lyric_hidden_states = self.infer_lyric_embeddings(lyric_token_idss)
@@ -2175,6 +2479,7 @@ class AceStepHandler:
         audio_code_hints: Optional[Union[str, List[str]]] = None,
         infer_method: str = "ode",
         timesteps: Optional[List[float]] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Dict[str, Any]:
 
         """
@@ -2199,6 +2504,7 @@ class AceStepHandler:
             use_adg: Whether to use ADG (Adaptive Diffusion Guidance) (default: False)
             cfg_interval_start: Start of CFG interval (0.0-1.0, default: 0.0)
             cfg_interval_end: End of CFG interval (0.0-1.0, default: 1.0)
+            cancel_token: Checked before every diffusion step; raises JobCancelledError once it trips
             
         Returns:
             Dictionary containing:
@@ -2345,7 +2651,8 @@ class AceStepHandler:
         if timesteps is not None:
             generate_kwargs["timesteps"] = torch.tensor(timesteps, dtype=torch.float32)
         logger.info("[service_generate] Generating audio...")
-        with self._load_model_context("model"):
+        # VAE decode follows diffusion: prefetch it while the DiT runs
+        with self._load_model_context("model", prefetch_next="vae"):
             # Prepare condition tensors first (for LRC timestamp generation)
             encoder_hidden_states, encoder_attention_mask, context_latents = self.model.prepare_condition(
                 text_hidden_states=text_hidden_states,
@@ -2363,7 +2670,8 @@ class AceStepHandler:
                 precomputed_lm_hints_25Hz=precomputed_lm_hints_25Hz,
             )
             
-            outputs = self.model.generate_audio(**generate_kwargs)
+            with self._cancellation_hook(getattr(self.model, "decoder", None), cancel_token):
+                outputs = self.model.generate_audio(**generate_kwargs)
         
         # Add intermediate information to outputs for extra_outputs
         outputs["src_latents"] = src_latents
@@ -2417,7 +2725,19 @@ class AceStepHandler:
     
     def _tiled_decode_gpu(self, latents, B, T, stride, overlap, num_steps):
         """Standard tiled decode keeping all data on GPU."""
-        decoded_audio_list = []
+        decoded_audio_list = list(self._iter_tiled_decode_cores(latents, T, stride, overlap, num_steps))
+
+        # Concatenate
+        final_audio = torch.cat(decoded_audio_list, dim=-1)
+        return final_audio
+
+    def _iter_tiled_decode_cores(self, latents, T, stride, overlap, num_steps):
+        """
+        Decode latents window by window and yield each trimmed core segment.
+
+        With overlap-discard, a window's core is final as soon as the window is
+        decoded, so segments can be consumed (saved, streamed) immediately.
+        """
         upsample_factor = None
         
         for i in tqdm(range(num_steps), desc="Decoding audio chunks"):
@@ -2455,12 +2775,40 @@ class AceStepHandler:
             audio_len = audio_chunk.shape[-1]
             end_idx = audio_len - trim_end if trim_end > 0 else audio_len
             
-            audio_core = audio_chunk[:, :, trim_start:end_idx]
-            decoded_audio_list.append(audio_core)
+            yield audio_chunk[:, :, trim_start:end_idx]
+
+    def iter_tiled_decode(self, latents, chunk_size=512, overlap=64):
+        """
+        Streaming variant of tiled_decode.
+
+        Yields finished audio segments in order as soon as each tile is decoded,
+        so the first audio is available after one tile instead of the whole track.
+        Concatenating the yielded segments gives the same result as tiled_decode.
+        
+        Args:
+            latents: [Batch, Channels, Length]
+            chunk_size: Size of latent chunk to process at once
+            overlap: Overlap size in latent frames
             
-        # Concatenate
-        final_audio = torch.cat(decoded_audio_list, dim=-1)
-        return final_audio
+        Yields:
+            Audio segments [Batch, AudioChannels, Samples], CPU, float32
+        """
+        B, C, T = latents.shape
+
+        if T <= chunk_size:
+            decoder_output = self.vae.decode(latents)
+            yield decoder_output.sample.float().cpu()
+            del decoder_output
+            return
+
+        stride = chunk_size - 2 * overlap
+        if stride <= 0:
+            raise ValueError(f"chunk_size {chunk_size} must be > 2 * overlap {overlap}")
+
+        num_steps = math.ceil(T / stride)
+        for audio_core in self._iter_tiled_decode_cores(latents, T, stride, overlap, num_steps):
+            yield audio_core.float().cpu()
+            del audio_core
     
     def _tiled_decode_offload_cpu(self, latents, B, T, stride, overlap, num_steps):
         """Optimized tiled decode that offloads to CPU immediately to save VRAM."""
@@ -2720,6 +3068,297 @@ class AceStepHandler:
         
         return final_latents
 
+    @staticmethod
+    def _has_audio_codes(v: Union[str, List[str]]) -> bool:
+        if isinstance(v, list):
+            return any((x or "").strip() for x in v)
+        return bool(v and str(v).strip())
+
+    # generate_music() arguments that may differ between requests merged by generate_music_batch()
+    PER_REQUEST_GENERATE_ARGS = (
+        "captions", "lyrics", "bpm", "key_scale", "time_signature", "vocal_language",
+        "use_random_seed", "seed", "reference_audio", "audio_duration", "batch_size",
+        "src_audio", "audio_code_string", "repainting_start", "repainting_end",
+        "instruction", "task_type",
+    )
+
+    def _prepare_generation_inputs(
+        self,
+        captions: str,
+        lyrics: str,
+        bpm: Optional[int] = None,
+        key_scale: str = "",
+        time_signature: str = "",
+        vocal_language: str = "en",
+        use_random_seed: bool = True,
+        seed: Optional[Union[str, float, int]] = -1,
+        reference_audio=None,
+        audio_duration: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        src_audio=None,
+        audio_code_string: Union[str, List[str]] = "",
+        repainting_start: float = 0.0,
+        repainting_end: Optional[float] = None,
+        instruction: str = DEFAULT_DIT_INSTRUCTION,
+        task_type: str = "text2music",
+    ) -> Dict[str, Any]:
+        """
+        Expand one generate_music() request into per-item service_generate() inputs.
+
+        Returns:
+            Dictionary with the effective task_type, batch_size, seeds, seed_value and
+            per-item captions, lyrics, metas, vocal_languages, instructions, refer_audios,
+            target_wavs, repainting_start, repainting_end and audio_code_hints
+        """
+        # Auto-detect task type based on audio_code_string
+        # If audio_code_string is provided and not empty, use cover task
+        # Otherwise, use text2music task (or keep current task_type if not text2music)
+        if task_type == "text2music":
+            if self._has_audio_codes(audio_code_string):
+                # User has provided audio codes, switch to cover task
+                task_type = "cover"
+                # Update instruction for cover task
+                instruction = TASK_INSTRUCTIONS["cover"]
+
+        # Caption and lyrics are optional - can be empty
+        # Use provided batch_size or default
+        actual_batch_size = batch_size if batch_size is not None else self.batch_size
+        actual_batch_size = max(1, actual_batch_size)  # Ensure at least 1
+
+        actual_seed_list, seed_value_for_ui = self.prepare_seeds(actual_batch_size, seed, use_random_seed)
+
+        # Convert special values to None
+        if audio_duration is not None and float(audio_duration) <= 0:
+            audio_duration = None
+        if repainting_end is not None and float(repainting_end) < 0:
+            repainting_end = None
+
+        # 1. Process reference audio
+        refer_audios = None
+        if reference_audio is not None:
+            logger.info("[generate_music] Processing reference audio...")
+            processed_ref_audio = self.process_reference_audio(reference_audio)
+            if processed_ref_audio is not None:
+                # Convert to the format expected by the service: List[List[torch.Tensor]]
+                # Each batch item has a list of reference audios
+                refer_audios = [[processed_ref_audio] for _ in range(actual_batch_size)]
+        else:
+            refer_audios = [[torch.zeros(2, 30*self.sample_rate)] for _ in range(actual_batch_size)]
+
+        # 2. Process source audio
+        # If audio_code_string is provided, ignore src_audio and use codes instead
+        processed_src_audio = None
+        if src_audio is not None:
+            # Check if audio codes are provided - if so, ignore src_audio
+            if self._has_audio_codes(audio_code_string):
+                logger.info("[generate_music] Audio codes provided, ignoring src_audio and using codes instead")
+            else:
+                logger.info("[generate_music] Processing source audio...")
+                processed_src_audio = self.process_src_audio(src_audio)
+
+        # 3. Prepare batch data
+        captions_batch, instructions_batch, lyrics_batch, vocal_languages_batch, metas_batch = self.prepare_batch_data(
+            actual_batch_size,
+            processed_src_audio,
+            audio_duration,
+            captions,
+            lyrics,
+            vocal_language,
+            instruction,
+            bpm,
+            key_scale,
+            time_signature
+        )
+
+        is_repaint_task, is_lego_task, is_cover_task, can_use_repainting = self.determine_task_type(task_type, audio_code_string)
+
+        repainting_start_batch, repainting_end_batch, target_wavs_tensor = self.prepare_padding_info(
+            actual_batch_size,
+            processed_src_audio,
+            audio_duration,
+            repainting_start,
+            repainting_end,
+            is_repaint_task,
+            is_lego_task,
+            is_cover_task,
+            can_use_repainting
+        )
+
+        # Prepare audio_code_hints - use if audio_code_string is provided
+        # This works for both text2music (auto-switched to cover) and cover tasks
+        audio_code_hints_batch = None
+        if self._has_audio_codes(audio_code_string):
+            if isinstance(audio_code_string, list):
+                audio_code_hints_batch = audio_code_string
+            else:
+                audio_code_hints_batch = [audio_code_string] * actual_batch_size
+
+        return {
+            "task_type": task_type,
+            "batch_size": actual_batch_size,
+            "seeds": actual_seed_list,
+            "seed_value": seed_value_for_ui,
+            "captions": captions_batch,
+            "lyrics": lyrics_batch,
+            "metas": metas_batch,
+            "vocal_languages": vocal_languages_batch,
+            "instructions": instructions_batch,
+            "refer_audios": refer_audios,
+            "target_wavs": target_wavs_tensor,  # Shape: [batch_size, 2, frames]
+            "repainting_start": repainting_start_batch,
+            "repainting_end": repainting_end_batch,
+            "audio_code_hints": audio_code_hints_batch,
+        }
+
+    def _decode_pred_latents(
+        self,
+        pred_latents: torch.Tensor,
+        use_tiled_decode: bool = True,
+        audio_chunk_callback: Optional[Callable[[torch.Tensor, int], None]] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Decode DiT output latents to waveforms with the VAE.
+
+        Args:
+            pred_latents: [batch, latent_length, latent_dim] latents
+            use_tiled_decode: Decode in overlapping tiles to reduce VRAM usage
+            audio_chunk_callback: Optional callable(segment, sample_rate) for streaming output
+            cancel_token: Checked before every decoded tile
+
+        Returns:
+            Tuple of (pred_wavs [batch, channels, samples] float32, pred_latents on CPU)
+        """
+        with torch.no_grad():
+            with self._load_model_context("vae"), self._cancellation_hook(getattr(self.vae, "decoder", None), cancel_token):
+                # Move pred_latents to CPU early to save VRAM (will be used in extra_outputs later)
+                pred_latents_cpu = pred_latents.detach().cpu()
+
+                # Transpose for VAE decode: [batch, latent_length, latent_dim] -> [batch, latent_dim, latent_length]
+                pred_latents_for_decode = pred_latents.transpose(1, 2).contiguous()
+                # Ensure input is in VAE's dtype
+                pred_latents_for_decode = pred_latents_for_decode.to(self.vae.dtype)
+
+                # Release original pred_latents to free VRAM before VAE decode
+                del pred_latents
+                self._safe_empty_cache()
+
+                logger.debug(f"[generate_music] Before VAE decode: allocated={torch.cuda.memory_allocated()/1024**3:.2f}GB, max={torch.cuda.max_memory_allocated()/1024**3:.2f}GB")
+
+                if use_tiled_decode and audio_chunk_callback is not None:
+                    logger.info("[generate_music] Using streaming tiled VAE decode...")
+                    decoded_segments = []
+                    for segment in self.iter_tiled_decode(pred_latents_for_decode):
+                        audio_chunk_callback(segment, self.sample_rate)
+                        decoded_segments.append(segment)
+                    pred_wavs = torch.cat(decoded_segments, dim=-1)  # [batch, channels, samples]
+                    del decoded_segments
+                elif use_tiled_decode:
+                    logger.info("[generate_music] Using tiled VAE decode to reduce VRAM usage...")
+                    pred_wavs = self.tiled_decode(pred_latents_for_decode)  # [batch, channels, samples]
+                else:
+                    decoder_output = self.vae.decode(pred_latents_for_decode)
+                    pred_wavs = decoder_output.sample
+                    del decoder_output
+                    if audio_chunk_callback is not None:
+                        audio_chunk_callback(pred_wavs.float().cpu(), self.sample_rate)
+
+                logger.debug(f"[generate_music] After VAE decode: allocated={torch.cuda.memory_allocated()/1024**3:.2f}GB, max={torch.cuda.max_memory_allocated()/1024**3:.2f}GB")
+
+                # Release pred_latents_for_decode after decode
+                del pred_latents_for_decode
+
+                # Cast output to float32 for audio processing/saving (in-place if possible)
+                if pred_wavs.dtype != torch.float32:
+                    pred_wavs = pred_wavs.float()
+
+                self._safe_empty_cache()
+        return pred_wavs, pred_latents_cpu
+
+    def _package_generation_outputs(
+        self,
+        outputs: Dict[str, Any],
+        pred_wavs: torch.Tensor,
+        pred_latents_cpu: torch.Tensor,
+        time_costs: Dict[str, float],
+        seed_value: str,
+        rows: slice = slice(None),
+        latent_length: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Build the generate_music() result dict for a range of batch rows.
+
+        Args:
+            outputs: service_generate() outputs
+            pred_wavs: Decoded audio [batch, channels, samples]
+            pred_latents_cpu: DiT output latents on CPU [batch, T, D]
+            time_costs: Timing information
+            seed_value: Comma-separated seeds of the rows
+            rows: Batch rows belonging to this request
+            latent_length: Trim audio and latents to this many latent frames (None keeps all)
+        """
+        def _rows(t: Optional[torch.Tensor], has_time_dim: bool = True) -> Optional[torch.Tensor]:
+            # Move to CPU to save VRAM (detach to release computation graph)
+            if t is None:
+                return None
+            t = t[rows]
+            if has_time_dim and latent_length is not None:
+                t = t[:, :latent_length]
+            return t.detach().cpu()
+
+        # Prepare audio tensors (no file I/O here, no UUID generation)
+        # pred_wavs is already [batch, channels, samples] format
+        # Move to CPU and convert to float32 for return
+        pred_wavs = pred_wavs[rows]
+        if latent_length is not None:
+            pred_wavs = pred_wavs[..., :latent_length * 1920]
+        audio_tensors = []
+        for i in range(pred_wavs.shape[0]):
+            # Extract audio tensor: [channels, samples] format, CPU, float32
+            audio_tensor = pred_wavs[i].cpu().float()
+            audio_tensors.append(audio_tensor)
+
+        status_message = f"✅ Generation completed successfully!"
+        logger.info(f"[generate_music] Done! Generated {len(audio_tensors)} audio tensors.")
+
+        spans = outputs.get("spans", [])[rows]  # List of tuples
+        if latent_length is not None:
+            spans = [(kind, min(start, latent_length), min(end, latent_length)) for kind, start, end in spans]
+
+        # Extract intermediate information and condition tensors (for LRC timestamp generation) from outputs
+        extra_outputs = {
+            "pred_latents": _rows(pred_latents_cpu),  # Already moved to CPU earlier to save VRAM during VAE decode
+            "target_latents": _rows(outputs.get("target_latents_input")),
+            "src_latents": _rows(outputs.get("src_latents")),
+            "chunk_masks": _rows(outputs.get("chunk_masks")),
+            "latent_masks": _rows(outputs.get("latent_masks")),
+            "spans": spans,
+            "time_costs": time_costs,
+            "seed_value": seed_value,
+            # Condition tensors for LRC timestamp generation
+            "encoder_hidden_states": _rows(outputs.get("encoder_hidden_states"), has_time_dim=False),
+            "encoder_attention_mask": _rows(outputs.get("encoder_attention_mask"), has_time_dim=False),
+            "context_latents": _rows(outputs.get("context_latents")),
+            "lyric_token_idss": _rows(outputs.get("lyric_token_idss"), has_time_dim=False),
+        }
+
+        # Build audios list with tensor data (no file paths, no UUIDs, handled outside)
+        audios = []
+        for idx, audio_tensor in enumerate(audio_tensors):
+            audio_dict = {
+                "tensor": audio_tensor,  # torch.Tensor [channels, samples], CPU, float32
+                "sample_rate": self.sample_rate,
+            }
+            audios.append(audio_dict)
+
+        return {
+            "audios": audios,
+            "status_message": status_message,
+            "extra_outputs": extra_outputs,
+            "success": True,
+            "error": None,
+        }
+
     def generate_music(
         self,
         captions: str,
@@ -2749,10 +3388,19 @@ class AceStepHandler:
         infer_method: str = "ode",
         use_tiled_decode: bool = True,
         timesteps: Optional[List[float]] = None,
-        progress=None
+        progress=None,
+        audio_chunk_callback: Optional[Callable[[torch.Tensor, int], None]] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Dict[str, Any]:
         """
         Main interface for music generation
+
+        Args:
+            audio_chunk_callback: Optional callable(segment, sample_rate) invoked with each
+                decoded audio segment [batch, channels, samples] (CPU, float32) in order,
+                as soon as its VAE tile is decoded. Used for streaming output.
+            cancel_token: Checked before every diffusion step and VAE tile; once it trips,
+                GPU memory of the run is released and JobCancelledError is raised
         
         Returns:
             Dictionary containing:
@@ -2776,21 +3424,6 @@ class AceStepHandler:
                 "error": "Model not fully initialized",
             }
 
-        def _has_audio_codes(v: Union[str, List[str]]) -> bool:
-            if isinstance(v, list):
-                return any((x or "").strip() for x in v)
-            return bool(v and str(v).strip())
-
-        # Auto-detect task type based on audio_code_string
-        # If audio_code_string is provided and not empty, use cover task
-        # Otherwise, use text2music task (or keep current task_type if not text2music)
-        if task_type == "text2music":
-            if _has_audio_codes(audio_code_string):
-                # User has provided audio codes, switch to cover task
-                task_type = "cover"
-                # Update instruction for cover task
-                instruction = TASK_INSTRUCTIONS["cover"]
-
         logger.info("[generate_music] Starting generation...")
         if progress:
             progress(0.51, desc="Preparing inputs...")
@@ -2799,107 +3432,53 @@ class AceStepHandler:
         # Reset offload cost
         self.current_offload_cost = 0.0
 
-        # Caption and lyrics are optional - can be empty
-        # Use provided batch_size or default
-        actual_batch_size = batch_size if batch_size is not None else self.batch_size
-        actual_batch_size = max(1, actual_batch_size)  # Ensure at least 1
-
-        actual_seed_list, seed_value_for_ui = self.prepare_seeds(actual_batch_size, seed, use_random_seed)
-        
-        # Convert special values to None
-        if audio_duration is not None and float(audio_duration) <= 0:
-            audio_duration = None
-        # if seed is not None and seed < 0:
-        #     seed = None
-        if repainting_end is not None and float(repainting_end) < 0:
-            repainting_end = None
-            
         try:
-            # 1. Process reference audio
-            refer_audios = None
-            if reference_audio is not None:
-                logger.info("[generate_music] Processing reference audio...")
-                processed_ref_audio = self.process_reference_audio(reference_audio)
-                if processed_ref_audio is not None:
-                    # Convert to the format expected by the service: List[List[torch.Tensor]]
-                    # Each batch item has a list of reference audios
-                    refer_audios = [[processed_ref_audio] for _ in range(actual_batch_size)]
-            else:
-                refer_audios = [[torch.zeros(2, 30*self.sample_rate)] for _ in range(actual_batch_size)]
-            
-            # 2. Process source audio
-            # If audio_code_string is provided, ignore src_audio and use codes instead
-            processed_src_audio = None
-            if src_audio is not None:
-                # Check if audio codes are provided - if so, ignore src_audio
-                if _has_audio_codes(audio_code_string):
-                    logger.info("[generate_music] Audio codes provided, ignoring src_audio and using codes instead")
-                else:
-                    logger.info("[generate_music] Processing source audio...")
-                    processed_src_audio = self.process_src_audio(src_audio)
-                
-            # 3. Prepare batch data
-            captions_batch, instructions_batch, lyrics_batch, vocal_languages_batch, metas_batch = self.prepare_batch_data(
-                actual_batch_size,
-                processed_src_audio,
-                audio_duration,
-                captions,
-                lyrics,
-                vocal_language,
-                instruction,
-                bpm,
-                key_scale,
-                time_signature
+            inputs = self._prepare_generation_inputs(
+                captions=captions,
+                lyrics=lyrics,
+                bpm=bpm,
+                key_scale=key_scale,
+                time_signature=time_signature,
+                vocal_language=vocal_language,
+                use_random_seed=use_random_seed,
+                seed=seed,
+                reference_audio=reference_audio,
+                audio_duration=audio_duration,
+                batch_size=batch_size,
+                src_audio=src_audio,
+                audio_code_string=audio_code_string,
+                repainting_start=repainting_start,
+                repainting_end=repainting_end,
+                instruction=instruction,
+                task_type=task_type,
             )
             
-            is_repaint_task, is_lego_task, is_cover_task, can_use_repainting = self.determine_task_type(task_type, audio_code_string)
-            
-            repainting_start_batch, repainting_end_batch, target_wavs_tensor = self.prepare_padding_info(
-                actual_batch_size,
-                processed_src_audio,
-                audio_duration,
-                repainting_start,
-                repainting_end,
-                is_repaint_task,
-                is_lego_task,
-                is_cover_task,
-                can_use_repainting
-            )
-            
-            progress(0.52, desc=f"Generating music (batch size: {actual_batch_size})...")
-            
-            # Prepare audio_code_hints - use if audio_code_string is provided
-            # This works for both text2music (auto-switched to cover) and cover tasks
-            audio_code_hints_batch = None
-            if _has_audio_codes(audio_code_string):
-                if isinstance(audio_code_string, list):
-                    audio_code_hints_batch = audio_code_string
-                else:
-                    audio_code_hints_batch = [audio_code_string] * actual_batch_size
+            progress(0.52, desc=f"Generating music (batch size: {inputs['batch_size']})...")
 
-            should_return_intermediate = (task_type == "text2music")
+            should_return_intermediate = (inputs["task_type"] == "text2music")
             outputs = self.service_generate(
-                captions=captions_batch,
-                lyrics=lyrics_batch,
-                metas=metas_batch,  # Pass as dict, service will convert to string
-                vocal_languages=vocal_languages_batch,
-                refer_audios=refer_audios,  # Already in List[List[torch.Tensor]] format
-                target_wavs=target_wavs_tensor,  # Shape: [batch_size, 2, frames]
+                captions=inputs["captions"],
+                lyrics=inputs["lyrics"],
+                metas=inputs["metas"],  # Pass as dict, service will convert to string
+                vocal_languages=inputs["vocal_languages"],
+                refer_audios=inputs["refer_audios"],  # Already in List[List[torch.Tensor]] format
+                target_wavs=inputs["target_wavs"],  # Shape: [batch_size, 2, frames]
                 infer_steps=inference_steps,
                 guidance_scale=guidance_scale,
-                seed=actual_seed_list,  # Pass list of seeds, one per batch item
-                repainting_start=repainting_start_batch,
-                repainting_end=repainting_end_batch,
-                instructions=instructions_batch,  # Pass instructions to service
+                seed=inputs["seeds"],  # Pass list of seeds, one per batch item
+                repainting_start=inputs["repainting_start"],
+                repainting_end=inputs["repainting_end"],
+                instructions=inputs["instructions"],  # Pass instructions to service
                 audio_cover_strength=audio_cover_strength,  # Pass audio cover strength
                 use_adg=use_adg,  # Pass use_adg parameter
                 cfg_interval_start=cfg_interval_start,  # Pass CFG interval start
                 cfg_interval_end=cfg_interval_end,  # Pass CFG interval end
                 shift=shift,  # Pass shift parameter
                 infer_method=infer_method,  # Pass infer method (ode or sde)
-                audio_code_hints=audio_code_hints_batch,  # Pass audio code hints as list
+                audio_code_hints=inputs["audio_code_hints"],  # Pass audio code hints as list
                 return_intermediate=should_return_intermediate,
                 timesteps=timesteps,  # Pass custom timesteps if provided
+                cancel_token=cancel_token,
             )
             
             logger.info("[generate_music] Model generation completed. Decoding latents...")
@@ -2914,40 +3493,10 @@ class AceStepHandler:
             
             # Decode latents to audio
             start_time = time.time()
-            with torch.no_grad():
-                with self._load_model_context("vae"):
-                    # Move pred_latents to CPU early to save VRAM (will be used in extra_outputs later)
-                    pred_latents_cpu = pred_latents.detach().cpu()
-                    
-                    # Transpose for VAE decode: [batch, latent_length, latent_dim] -> [batch, latent_dim, latent_length]
-                    pred_latents_for_decode = pred_latents.transpose(1, 2).contiguous()
-                    # Ensure input is in VAE's dtype
-                    pred_latents_for_decode = pred_latents_for_decode.to(self.vae.dtype)
-                    
-                    # Release original pred_latents to free VRAM before VAE decode
-                    del pred_latents
-                    self._safe_empty_cache()
-                    
-                    logger.debug(f"[generate_music] Before VAE decode: allocated={torch.cuda.memory_allocated()/1024**3:.2f}GB, max={torch.cuda.max_memory_allocated()/1024**3:.2f}GB")
-                    
-                    if use_tiled_decode:
-                        logger.info("[generate_music] Using tiled VAE decode to reduce VRAM usage...")
-                        pred_wavs = self.tiled_decode(pred_latents_for_decode)  # [batch, channels, samples]
-                    else:
-                        decoder_output = self.vae.decode(pred_latents_for_decode)
-                        pred_wavs = decoder_output.sample
-                        del decoder_output
-                    
-                    logger.debug(f"[generate_music] After VAE decode: allocated={torch.cuda.memory_allocated()/1024**3:.2f}GB, max={torch.cuda.max_memory_allocated()/1024**3:.2f}GB")
-                    
-                    # Release pred_latents_for_decode after decode
-                    del pred_latents_for_decode
-                    
-                    # Cast output to float32 for audio processing/saving (in-place if possible)
-                    if pred_wavs.dtype != torch.float32:
-                        pred_wavs = pred_wavs.float()
-                    
-                    self._safe_empty_cache()
+            pred_wavs, pred_latents_cpu = self._decode_pred_latents(
+                pred_latents, use_tiled_decode, audio_chunk_callback, cancel_token
+            )
+            del pred_latents
             end_time = time.time()
             time_costs["vae_decode_time_cost"] = end_time - start_time
             time_costs["total_time_cost"] = time_costs["total_time_cost"] + time_costs["vae_decode_time_cost"]
@@ -2958,67 +3507,11 @@ class AceStepHandler:
             logger.info("[generate_music] VAE decode completed. Preparing audio tensors...")
             if progress:
                 progress(0.99, desc="Preparing audio data...")
-            
-            # Prepare audio tensors (no file I/O here, no UUID generation)
-            # pred_wavs is already [batch, channels, samples] format
-            # Move to CPU and convert to float32 for return
-            audio_tensors = []
-            
-            for i in range(actual_batch_size):
-                # Extract audio tensor: [channels, samples] format, CPU, float32
-                audio_tensor = pred_wavs[i].cpu().float()
-                audio_tensors.append(audio_tensor)
-            
-            status_message = f"✅ Generation completed successfully!"
-            logger.info(f"[generate_music] Done! Generated {len(audio_tensors)} audio tensors.")
-            
-            # Extract intermediate information from outputs
-            src_latents = outputs.get("src_latents")  # [batch, T, D]
-            target_latents_input = outputs.get("target_latents_input")  # [batch, T, D]
-            chunk_masks = outputs.get("chunk_masks")  # [batch, T]
-            spans = outputs.get("spans", [])  # List of tuples
-            latent_masks = outputs.get("latent_masks")  # [batch, T]
-            
-            # Extract condition tensors for LRC timestamp generation
-            encoder_hidden_states = outputs.get("encoder_hidden_states")
-            encoder_attention_mask = outputs.get("encoder_attention_mask")
-            context_latents = outputs.get("context_latents")
-            lyric_token_idss = outputs.get("lyric_token_idss")
-            
-            # Move all tensors to CPU to save VRAM (detach to release computation graph)
-            extra_outputs = {
-                "pred_latents": pred_latents_cpu,  # Already moved to CPU earlier to save VRAM during VAE decode
-                "target_latents": target_latents_input.detach().cpu() if target_latents_input is not None else None,
-                "src_latents": src_latents.detach().cpu() if src_latents is not None else None,
-                "chunk_masks": chunk_masks.detach().cpu() if chunk_masks is not None else None,
-                "latent_masks": latent_masks.detach().cpu() if latent_masks is not None else None,
-                "spans": spans,
-                "time_costs": time_costs,
-                "seed_value": seed_value_for_ui,
-                # Condition tensors for LRC timestamp generation
-                "encoder_hidden_states": encoder_hidden_states.detach().cpu() if encoder_hidden_states is not None else None,
-                "encoder_attention_mask": encoder_attention_mask.detach().cpu() if encoder_attention_mask is not None else None,
-                "context_latents": context_latents.detach().cpu() if context_latents is not None else None,
-                "lyric_token_idss": lyric_token_idss.detach().cpu() if lyric_token_idss is not None else None,
-            }
-            
-            # Build audios list with tensor data (no file paths, no UUIDs, handled outside)
-            audios = []
-            for idx, audio_tensor in enumerate(audio_tensors):
-                audio_dict = {
-                    "tensor": audio_tensor,  # torch.Tensor [channels, samples], CPU, float32
-                    "sample_rate": self.sample_rate,
-                }
-                audios.append(audio_dict)
-            
-            return {
-                "audios": audios,
-                "status_message": status_message,
-                "extra_outputs": extra_outputs,
-                "success": True,
-                "error": None,
-            }
 
+            return self._package_generation_outputs(outputs, pred_wavs, pred_latents_cpu, time_costs, inputs["seed_value"])
+
+        except JobCancelledError as e:
+            reason = str(e)
         except Exception as e:
             error_msg = f"❌ Error: {str(e)}\n{traceback.format_exc()}"
             logger.exception("[generate_music] Generation failed")
@@ -3029,6 +3522,190 @@ class AceStepHandler:
                 "success": False,
                 "error": str(e),
             }
+        # Cancelled: the traceback (and the activations its frames hold) is gone, free them now
+        outputs = pred_latents = pred_wavs = None
+        self._release_memory()
+        logger.info(f"[generate_music] Generation cancelled: {reason}")
+        raise JobCancelledError(reason)
+
+    def generate_music_batch(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Run several generate_music() requests through a single service_generate() call.
+
+        Captions, lyrics, metadata, seeds, reference audio and audio codes may differ per
+        request (see PER_REQUEST_GENERATE_ARGS); sampling settings (inference_steps,
+        guidance_scale, shift, infer_method, timesteps, use_adg, cfg interval,
+        audio_cover_strength, use_tiled_decode) are taken from the first request.
+        Requests without audio codes must target the same length: padding a silent
+        target would make the DiT generate the longer song (see
+        dit_batching.request_target_length). src_audio and repaint/lego requests are
+        not supported. The merged run is
+        cancelled (JobCancelledError) only once every request's cancel_token has tripped.
+
+        Args:
+            requests: generate_music() keyword arguments, one dict per request
+
+        Returns:
+            One generate_music()-style result dict per request, in the same order
+        """
+        if self.model is None or self.vae is None or self.text_tokenizer is None or self.text_encoder is None:
+            return [{
+                "audios": [],
+                "status_message": "❌ Model not fully initialized. Please initialize all components first.",
+                "extra_outputs": {},
+                "success": False,
+                "error": "Model not fully initialized",
+            } for _ in requests]
+
+        shared = requests[0]
+        logger.info(f"[generate_music_batch] Starting generation of {len(requests)} merged requests...")
+        self.current_offload_cost = 0.0
+        cancel_token = all_cancelled(request.get("cancel_token") for request in requests)
+
+        try:
+            prepared = []
+            for request in requests:
+                if request.get("src_audio") is not None or request.get("task_type", "text2music") in ("repaint", "lego"):
+                    raise ValueError("generate_music_batch does not support src_audio or repaint/lego requests")
+                prepared.append(self._prepare_generation_inputs(
+                    **{k: v for k, v in request.items() if k in self.PER_REQUEST_GENERATE_ARGS}
+                ))
+
+            row_ranges = []
+            start = 0
+            for inputs in prepared:
+                row_ranges.append((start, start + inputs["batch_size"]))
+                start += inputs["batch_size"]
+
+            # Silent targets set the latent mask, so they cannot be padded without changing the song
+            silent_lengths = {
+                inputs["target_wavs"].shape[-1] for inputs in prepared if not any(inputs["audio_code_hints"] or [])
+            }
+            if len(silent_lengths) > 1:
+                raise ValueError("generate_music_batch requests without audio codes must have the same duration")
+
+            # Pad target wavs of requests with audio codes (their codes set the latent length)
+            max_frames = max(inputs["target_wavs"].shape[-1] for inputs in prepared)
+            target_wavs = torch.cat([
+                torch.nn.functional.pad(inputs["target_wavs"], (0, max_frames - inputs["target_wavs"].shape[-1]))
+                for inputs in prepared
+            ], dim=0)
+
+            def _concat(field: str) -> List[Any]:
+                merged = []
+                for inputs in prepared:
+                    merged.extend(inputs[field])
+                return merged
+
+            audio_code_hints = None
+            if any(inputs["audio_code_hints"] for inputs in prepared):
+                audio_code_hints = []
+                for inputs in prepared:
+                    audio_code_hints.extend(inputs["audio_code_hints"] or [None] * inputs["batch_size"])
+
+            outputs = self.service_generate(
+                captions=_concat("captions"),
+                lyrics=_concat("lyrics"),
+                metas=_concat("metas"),
+                vocal_languages=_concat("vocal_languages"),
+                refer_audios=_concat("refer_audios"),
+                target_wavs=target_wavs,
+                infer_steps=shared.get("inference_steps", 8),
+                guidance_scale=shared.get("guidance_scale", 7.0),
+                seed=_concat("seeds"),
+                repainting_start=None,
+                repainting_end=None,
+                instructions=_concat("instructions"),
+                audio_cover_strength=shared.get("audio_cover_strength", 1.0),
+                use_adg=shared.get("use_adg", False),
+                cfg_interval_start=shared.get("cfg_interval_start", 0.0),
+                cfg_interval_end=shared.get("cfg_interval_end", 1.0),
+                shift=shared.get("shift", 1.0),
+                infer_method=shared.get("infer_method", "ode"),
+                audio_code_hints=audio_code_hints,
+                return_intermediate=(prepared[0]["task_type"] == "text2music"),
+                timesteps=shared.get("timesteps"),
+                cancel_token=cancel_token,
+            )
+
+            pred_latents = outputs["target_latents"]  # [batch, latent_length, latent_dim]
+            time_costs = outputs["time_costs"]
+
+            # Latent length each request would have had on its own: code hints set the
+            # length of their rows, silent targets are frames // 1920 (minimum 128, as in _prepare_batch)
+            merged_length = pred_latents.shape[1]
+            row_lengths = outputs["latent_masks"].sum(dim=1).tolist()
+            latent_lengths = []
+            for inputs, (row_start, row_end) in zip(prepared, row_ranges):
+                own_frames = inputs["target_wavs"].shape[-1]
+                lengths = []
+                for row in range(row_start, row_end):
+                    if audio_code_hints is not None and audio_code_hints[row]:
+                        lengths.append(int(row_lengths[row]))
+                    else:
+                        lengths.append(own_frames // 1920)
+                latent_lengths.append(min(merged_length, max(128, max(lengths))))
+
+            # Route streamed segments to each request's callback, trimmed to its own length
+            callbacks = [request.get("audio_chunk_callback") for request in requests]
+            chunk_callback = None
+            if any(callbacks):
+                emitted = [0] * len(requests)
+
+                def chunk_callback(segment: torch.Tensor, sample_rate: int) -> None:
+                    for i, callback in enumerate(callbacks):
+                        remaining = latent_lengths[i] * 1920 - emitted[i]
+                        if callback is None or remaining <= 0:
+                            continue
+                        row_start, row_end = row_ranges[i]
+                        part = segment[row_start:row_end, :, :remaining]
+                        emitted[i] += part.shape[-1]
+                        callback(part, sample_rate)
+
+            logger.info("[generate_music_batch] Decoding latents with VAE...")
+            start_time = time.time()
+            pred_wavs, pred_latents_cpu = self._decode_pred_latents(
+                pred_latents, shared.get("use_tiled_decode", True), chunk_callback, cancel_token
+            )
+            del pred_latents
+            time_costs["vae_decode_time_cost"] = time.time() - start_time
+            time_costs["total_time_cost"] = time_costs["total_time_cost"] + time_costs["vae_decode_time_cost"]
+            time_costs["offload_time_cost"] = self.current_offload_cost
+
+            results = []
+            total_rows = row_ranges[-1][1]
+            for inputs, (row_start, row_end), latent_length in zip(prepared, row_ranges, latent_lengths):
+                # All rows share one target length, so each request's share of the
+                # merged pass is its share of the rows
+                member_time_costs = dict(time_costs)
+                member_time_costs["batch_share"] = (row_end - row_start) / total_rows
+                results.append(self._package_generation_outputs(
+                    outputs,
+                    pred_wavs,
+                    pred_latents_cpu,
+                    member_time_costs,
+                    inputs["seed_value"],
+                    rows=slice(row_start, row_end),
+                    latent_length=latent_length,
+                ))
+            return results
+
+        except JobCancelledError as e:
+            reason = str(e)
+        except Exception as e:
+            error_msg = f"❌ Error: {str(e)}\n{traceback.format_exc()}"
+            logger.exception("[generate_music_batch] Generation failed")
+            return [{
+                "audios": [],
+                "status_message": error_msg,
+                "extra_outputs": {},
+                "success": False,
+                "error": str(e),
+            } for _ in requests]
+        outputs = pred_latents = pred_wavs = None
+        self._release_memory()
+        logger.info(f"[generate_music_batch] Generation cancelled: {reason}")
+        raise JobCancelledError(reason)
 
     @torch.no_grad()
     def get_lyric_timestamp(
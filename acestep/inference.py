@@ -14,6 +14,7 @@ from dataclasses import dataclass, field, asdict
 from loguru import logger
 
 from acestep.audio_utils import AudioSaver, generate_uuid_from_params
+from acestep.cancellation import JobCancelledError, check_cancelled
 
 # HuggingFace Space environment detection
 IS_HUGGINGFACE_SPACE = os.environ.get("SPACE_ID") is not None
@@ -297,6 +298,9 @@ def generate_music(
     config: GenerationConfig,
     save_dir: Optional[str] = None,
     progress=None,
+    audio_chunk_callback=None,
+    dit_generate_fn=None,
+    cancel_token=None,
 ) -> GenerationResult:
     """Generate music using ACE-Step model with optional LM reasoning.
     
@@ -305,6 +309,12 @@ def generate_music(
         llm_handler: Initialized LLM handler (LLMHandler instance)
         params: Generation parameters (GenerationParams instance)
         config: Generation configuration (GenerationConfig instance)
+        audio_chunk_callback: Optional callable(segment, sample_rate) receiving decoded audio
+            segments [batch, channels, samples] while the VAE decode is still running
+        dit_generate_fn: Optional replacement for dit_handler.generate_music (same signature),
+            e.g. a DiTBatchScheduler that merges the DiT stage of concurrent jobs
+        cancel_token: Optional CancellationToken checked throughout the LM and DiT stages;
+            JobCancelledError is raised (not returned as a failed result) once it trips
         
     Returns:
         GenerationResult with generated audio files and metadata
@@ -467,6 +477,7 @@ def generate_music(
                     batch_size=chunk_size,
                     seeds=chunk_seeds,
                     progress=progress,
+                    cancel_token=cancel_token,
                 )
 
                 # Check if LM generation failed
@@ -554,7 +565,10 @@ def generate_music(
 
         # Phase 2: DiT music generation
         # Use seed_for_generation (from config.seed or params.seed) instead of params.seed for actual generation
-        result = dit_handler.generate_music(
+        check_cancelled(cancel_token)
+        if dit_generate_fn is None:
+            dit_generate_fn = dit_handler.generate_music
+        result = dit_generate_fn(
             captions=dit_input_caption,
             lyrics=dit_input_lyrics,
             bpm=bpm,
@@ -582,6 +596,8 @@ def generate_music(
             infer_method=params.infer_method,
             timesteps=params.timesteps,
             progress=progress,
+            audio_chunk_callback=audio_chunk_callback,
+            cancel_token=cancel_token,
         )
 
         # Check if generation failed
@@ -705,6 +721,8 @@ def generate_music(
             error=None,
         )
 
+    except JobCancelledError:
+        raise
     except Exception as e:
         logger.exception("Music generation failed")
         return GenerationResult(
@@ -0,0 +1,284 @@
+"""Per-stage job cost model for API queue ETAs and admission control
+
+The API server used to estimate waits as queue position x a rolling average
+job time, so a 10 second instrumental and a 4 minute thinking-mode job with
+batch 8 got the same ETA. JobCostModel predicts each job's cost from its
+shape instead, as a sum of stages, each priced per unit of work:
+- lm_cot: CoT metadata/caption pass (phase 1), per job
+- lm_codes: audio code generation (phase 2, thinking=True), per audio second x batch
+- dit: diffusion, per audio second x batch x step
+- vae: VAE decode, per audio second x batch
+- other: sample/format LM calls, offload, saving/encoding, per call
+
+Each stage is fitted online as fixed + rate x units (exponentially weighted
+least squares) from the time_costs dict generate_music() returns for every
+job, starting from rough prior rates; DiT/VAE fits are kept per DiT model.
+Jobs without a known duration use the moving average of generated durations.
+
+Jobs whose DiT pass was merged with others (DiT batching) report the whole
+batch's DiT time and their share of its rows; the DiT/VAE fits learn from
+that share and the time spent parked waiting for the batch is not counted as
+"other", so predictions stay per-job costs of serialized GPU work.
+
+The model also tracks the predicted cost of every queued/running job, so the
+server can estimate the wait ahead of a position (running jobs count with
+their predicted remaining time, and the work is spread over the number of
+jobs that execute concurrently) and reject new work it cannot finish within
+an SLA.
+
+Configuration (environment):
+- ACESTEP_QUEUE_SLA_SECONDS: reject submissions (429 + Retry-After) whose predicted
+  completion exceeds this many seconds (default 0, disabled)
+- ACESTEP_COST_MODEL_EMA: weight of each new observation in the fits (default 0.2)
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# Seconds per unit before any job was observed (roughly a turbo model on a recent GPU)
+_PRIOR_RATES = {
+    "lm_cot": 3.0,
+    "lm_codes": 0.03,
+    "dit": 0.0015,
+    "vae": 0.01,
+    "other": 1.0,
+}
+_PRIOR_DURATION_SECONDS = 60.0
+# Stages whose rate depends on the DiT model; LM stages share one rate
+_PER_MODEL_STAGES = ("dit", "vae")
+
+
+class _StageFit:
+    """seconds ~= fixed + rate * units, fitted by exponentially weighted least squares."""
+
+    __slots__ = ("w", "u", "uu", "y", "uy")
+
+    def __init__(self):
+        self.w = self.u = self.uu = self.y = self.uy = 0.0
+
+    def add(self, units: float, seconds: float, ema: float) -> None:
+        keep = 1.0 - ema
+        self.w = keep * self.w + ema
+        self.u = keep * self.u + ema * units
+        self.uu = keep * self.uu + ema * units * units
+        self.y = keep * self.y + ema * seconds
+        self.uy = keep * self.uy + ema * units * seconds
+
+    def coefficients(self) -> Tuple[float, float]:
+        """(fixed, rate), both non-negative."""
+        var = self.w * self.uu - self.u * self.u
+        if var > 1e-9 * max(1.0, self.w * self.uu):
+            rate = (self.w * self.uy - self.u * self.y) / var
+            fixed = (self.y - rate * self.u) / self.w
+            if rate >= 0 and fixed >= 0:
+                return fixed, rate
+            if rate < 0:
+                return self.y / self.w, 0.0
+        # All observations had the same size (or the fit went negative): proportional only
+        return 0.0, self.uy / self.uu if self.uu > 0 else 0.0
+
+    def predict(self, units: float) -> float:
+        fixed, rate = self.coefficients()
+        return fixed + rate * units
+
+
+@dataclass
+class JobFeatures:
+    """Shape of a generation job, as far as its cost is concerned."""
+
+    model: str
+    duration: Optional[float]  # audio seconds, None if the LM/DiT picks it
+    batch_size: int
+    steps: int
+    lm_cot: bool = False  # CoT phase 1 runs
+    lm_codes: bool = False  # LM generates audio codes (thinking)
+    lm_calls: int = 0  # sample_mode / use_format LM calls before generation
+
+    def units(self, duration: float) -> Dict[str, float]:
+        item_seconds = max(0.0, duration) * max(1, self.batch_size)
+        return {
+            "lm_cot": 1.0 if self.lm_cot else 0.0,
+            "lm_codes": item_seconds if self.lm_codes else 0.0,
+            "dit": item_seconds * max(1, self.steps),
+            "vae": item_seconds,
+            "other": 1.0 + self.lm_calls,
+        }
+
+
+class JobCostModel:
+    """Learns per-stage costs from finished jobs and prices queued ones."""
+
+    def __init__(self, ema: float = 0.2, sla_seconds: float = 0.0, concurrency: int = 1):
+        """
+        Args:
+            ema: Weight of a new observation in the stage fits and average duration (0-1]
+            sla_seconds: Max predicted completion time accepted by admit() (0 disables)
+            concurrency: Number of jobs that execute at the same time
+        """
+        self.ema = min(1.0, max(0.01, float(ema)))
+        self.sla_seconds = max(0.0, float(sla_seconds))
+        self.concurrency = max(1, int(concurrency))
+        self._lock = threading.Lock()
+        self._fits: Dict[Tuple[str, str], _StageFit] = {}
+        self._duration = _PRIOR_DURATION_SECONDS
+        # job_id -> (predicted seconds, start time or None while queued)
+        self._jobs: Dict[str, Tuple[float, Optional[float]]] = {}
+        self.observed = 0
+        self.rejected = 0
+        self._abs_error = 0.0
+
+    def _key(self, stage: str, model: str) -> Tuple[str, str]:
+        return (stage, model if stage in _PER_MODEL_STAGES else "")
+
+    def _stage_seconds(self, stage: str, model: str, units: float) -> float:
+        fit = self._fits.get(self._key(stage, model))
+        if fit is None and stage in _PER_MODEL_STAGES:
+            # Unseen model: borrow any model's fit before the prior
+            fit = next((f for (s, _), f in self._fits.items() if s == stage), None)
+        return _PRIOR_RATES[stage] * units if fit is None else fit.predict(units)
+
+    def predict_stages(self, features: JobFeatures) -> Dict[str, float]:
+        """Predicted seconds per stage."""
+        with self._lock:
+            duration = features.duration if features.duration and features.duration > 0 else self._duration
+            return {
+                stage: self._stage_seconds(stage, features.model, units)
+                for stage, units in features.units(duration).items()
+                if units > 0
+            }
+
+    def predict(self, features: JobFeatures) -> float:
+        """Predicted wall time of a job in seconds."""
+        return sum(self.predict_stages(features).values())
+
+    def observe(self, features: JobFeatures, time_costs: Dict[str, Any], wall_seconds: float,
+                duration: Optional[float] = None) -> None:
+        """
+        Learn from a finished job.
+
+        Args:
+            features: Features the job was priced with
+            time_costs: generate_music() extra_outputs["time_costs"] (lm_*/dit_* keys)
+            wall_seconds: Wall time of the job from the start of its execution
+            duration: Generated audio duration, if known
+        """
+        predicted = self.predict(features)
+
+        def _cost(key: str) -> float:
+            try:
+                return max(0.0, float(time_costs.get(key) or 0.0))
+            except (TypeError, ValueError):
+                return 0.0
+
+        lm_total = _cost("lm_phase1_time") + _cost("lm_phase2_time")
+        dit_total = _cost("dit_total_time_cost")
+        vae = _cost("dit_vae_decode_time_cost")
+        # A merged DiT batch ran this job's rows alongside other jobs' rows: learn from this
+        # job's share, and leave the time parked waiting for the batch out of "other"
+        share = min(1.0, _cost("dit_batch_share") or 1.0)
+        dit_wall = max(dit_total, _cost("dit_batch_wait_time_cost"))
+        observed = {
+            "lm_cot": _cost("lm_phase1_time"),
+            "lm_codes": _cost("lm_phase2_time"),
+            "dit": max(0.0, dit_total - vae) * share,
+            "vae": vae * share,
+            "other": max(0.0, wall_seconds - lm_total - dit_wall),
+        }
+        job_seconds = wall_seconds - dit_wall + dit_total * share
+        with self._lock:
+            if duration is not None and duration > 0:
+                self._duration = (1.0 - self.ema) * self._duration + self.ema * duration
+            else:
+                duration = features.duration if features.duration and features.duration > 0 else self._duration
+            units = features.units(duration)
+            for stage, seconds in observed.items():
+                # Only learn from stages that ran (and whose work is known)
+                if units[stage] > 0 and (seconds > 0 or stage == "other"):
+                    self._fits.setdefault(self._key(stage, features.model), _StageFit()).add(
+                        units[stage], seconds, self.ema
+                    )
+            self.observed += 1
+            self._abs_error += abs(job_seconds - predicted)
+
+    # Queue accounting
+
+    def enqueue(self, job_id: str, predicted_seconds: float) -> None:
+        with self._lock:
+            self._jobs[job_id] = (predicted_seconds, None)
+
+    def start(self, job_id: str) -> None:
+        with self._lock:
+            predicted, _ = self._jobs.get(job_id, (0.0, None))
+            self._jobs[job_id] = (predicted, time.time())
+
+    def finish(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def running_seconds(self) -> float:
+        """Predicted remaining time of the running jobs."""
+        now = time.time()
+        with self._lock:
+            return sum(max(0.0, p - (now - t)) for p, t in self._jobs.values() if t is not None)
+
+    def queued_seconds(self, job_ids: Iterable[str]) -> float:
+        """Predicted cost of the given queued jobs."""
+        with self._lock:
+            return sum(self._jobs[j][0] for j in job_ids if j in self._jobs)
+
+    def wait_seconds(self, job_ids: Iterable[str]) -> float:
+        """Predicted seconds until the running jobs and the given queued jobs are done."""
+        return (self.running_seconds() + self.queued_seconds(job_ids)) / self.concurrency
+
+    def admit(self, wait_seconds: float, job_seconds: float) -> Optional[float]:
+        """
+        Admission check for a new job.
+
+        Args:
+            wait_seconds: Predicted wait before the job starts
+            job_seconds: Predicted cost of the job itself
+
+        Returns:
+            None if admitted, else the suggested Retry-After in seconds
+        """
+        if self.sla_seconds <= 0 or wait_seconds + job_seconds <= self.sla_seconds:
+            return None
+        with self._lock:
+            self.rejected += 1
+        # Once the work ahead has drained enough to fit the SLA
+        return max(1.0, wait_seconds + job_seconds - self.sla_seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sla_seconds": self.sla_seconds,
+                "concurrency": self.concurrency,
+                "observed_jobs": self.observed,
+                "rejected": self.rejected,
+                "mean_abs_error_seconds": round(self._abs_error / self.observed, 3) if self.observed else None,
+                "avg_duration_seconds": round(self._duration, 2),
+                "tracked_jobs": len(self._jobs),
+                "stages": {
+                    f"{stage}@{model}" if model else stage: dict(
+                        zip(("fixed_seconds", "seconds_per_unit"), (round(c, 6) for c in fit.coefficients()))
+                    )
+                    for (stage, model), fit in sorted(self._fits.items())
+                },
+            }
+
+
+def create_job_cost_model(concurrency: int = 1) -> JobCostModel:
+    """
+    Create a JobCostModel configured from environment variables.
+
+    Args:
+        concurrency: Number of jobs the server executes at the same time
+    """
+    return JobCostModel(
+        ema=float(os.environ.get("ACESTEP_COST_MODEL_EMA", "0.2")),
+        sla_seconds=float(os.environ.get("ACESTEP_QUEUE_SLA_SECONDS", "0")),
+        concurrency=concurrency,
+    )
@@ -0,0 +1,128 @@
+"""Server-push job status events for the API server
+
+Clients used to learn about job progress by polling /query_result, which
+re-reads and re-serializes every job result on each poll. JobEventBus is an
+in-process pub/sub bus the job pipeline publishes to instead:
+- queued: on submission and whenever the job moves up the queue
+  (queue_position, eta_seconds)
+- running: when a worker picks the job up
+- progress: LM / DiT milestones reported by generate_music() (progress, stage)
+- succeeded / failed: terminal event carrying the result or error
+
+The /v1/events (SSE) and /v1/events/ws (WebSocket) endpoints subscribe to
+the bus for a set of task IDs and push these events as they happen.
+
+All bus state lives on the server's event loop; generation threads publish
+through publish_threadsafe().
+
+Configuration (environment):
+- ACESTEP_EVENTS_KEEPALIVE_SECONDS: idle interval after which a keepalive is sent (default 15)
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, Iterable, Optional, Set
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+class JobSubscription:
+    """Events of a set of jobs, in publish order; use as a context manager to unsubscribe."""
+
+    def __init__(self, bus: "JobEventBus", job_ids: Iterable[str]):
+        self._bus = bus
+        self.job_ids = list(dict.fromkeys(job_ids))
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+
+    def __enter__(self) -> "JobSubscription":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._bus._unsubscribe(self)
+
+    def put(self, event: Dict[str, Any]) -> None:
+        self._queue.put_nowait(event)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Next event, or None if none arrived within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class JobEventBus:
+    """In-process pub/sub of job status events keyed by job ID."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, keepalive_seconds: float = 15.0):
+        """
+        Args:
+            loop: Event loop the bus and its subscribers live on
+            keepalive_seconds: Idle interval after which streaming endpoints send a keepalive
+        """
+        self.keepalive_seconds = max(1.0, float(keepalive_seconds))
+        self._loop = loop
+        self._subscribers: Dict[str, Set[JobSubscription]] = {}
+        # Last event of each unfinished job, for clients subscribing mid-run
+        self._latest: Dict[str, Dict[str, Any]] = {}
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, job_ids: Iterable[str]) -> JobSubscription:
+        """Subscribe to the events of job_ids published from now on."""
+        subscription = JobSubscription(self, job_ids)
+        for job_id in subscription.job_ids:
+            self._subscribers.setdefault(job_id, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: JobSubscription) -> None:
+        for job_id in subscription.job_ids:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def has_subscribers(self, job_id: str) -> bool:
+        return job_id in self._subscribers
+
+    def latest(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Last event published for a job that has not finished yet."""
+        return self._latest.get(job_id)
+
+    def publish(self, job_id: str, status: str, **fields: Any) -> None:
+        """
+        Publish an event (event loop thread only).
+
+        Args:
+            job_id: Job the event belongs to
+            status: queued, running, progress, succeeded or failed
+            **fields: Extra event fields (queue_position, eta_seconds, progress, stage, result, error)
+        """
+        event = {"task_id": job_id, "status": status, **fields}
+        self.published += 1
+        if status in TERMINAL_STATUSES:
+            self._latest.pop(job_id, None)
+        else:
+            self._latest[job_id] = event
+        for subscription in self._subscribers.get(job_id, ()):
+            subscription.put(event)
+            self.delivered += 1
+
+    def publish_threadsafe(self, job_id: str, status: str, **fields: Any) -> None:
+        """publish() from a worker thread."""
+        self._loop.call_soon_threadsafe(lambda: self.publish(job_id, status, **fields))
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "subscribed_jobs": len(self._subscribers),
+            "subscriptions": len({s for subs in self._subscribers.values() for s in subs}),
+            "published": self.published,
+            "delivered": self.delivered,
+        }
+
+
+def create_job_event_bus(loop: asyncio.AbstractEventLoop) -> JobEventBus:
+    """Create a JobEventBus configured from ACESTEP_EVENTS_* environment variables."""
+    return JobEventBus(loop, keepalive_seconds=float(os.environ.get("ACESTEP_EVENTS_KEEPALIVE_SECONDS", "15")))
@@ -0,0 +1,380 @@
+"""Job store backends for the API server.
+
+Two interchangeable backends are provided:
+- InMemoryJobStore: process-local dict (jobs are lost on restart)
+- SQLiteJobStore: SQLite (WAL) file, survives restarts and recovers queued jobs
+
+Both expose the same methods, so api_server only depends on this interface.
+Select a backend with create_job_store() (ACESTEP_JOB_STORE=memory|sqlite).
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Literal, Optional, Tuple
+from uuid import uuid4
+
+JobStatus = Literal["queued", "running", "succeeded", "failed"]
+
+JOB_STORE_MAX_AGE_SECONDS = 86400  # 24 hours - completed jobs older than this will be cleaned
+
+# SQLite limits the number of host parameters per statement (999 on old builds)
+_SQLITE_MAX_PARAMS = 900
+
+
+@dataclass
+class JobRecord:
+    job_id: str
+    status: JobStatus
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    env: str = "development"
+
+
+class InMemoryJobStore:
+    """Process-local job store guarded by a lock."""
+
+    def __init__(self, max_age_seconds: int = JOB_STORE_MAX_AGE_SECONDS) -> None:
+        self._lock = Lock()
+        self._jobs: Dict[str, JobRecord] = {}
+        self._max_age = max_age_seconds
+
+    def create(self, request: Optional[Dict[str, Any]] = None) -> JobRecord:
+        return self.create_with_id(str(uuid4()), request=request)
+
+    def create_with_id(
+        self,
+        job_id: str,
+        env: str = "development",
+        request: Optional[Dict[str, Any]] = None,
+    ) -> JobRecord:
+        """Create job record with specified ID"""
+        rec = JobRecord(
+            job_id=job_id,
+            status="queued",
+            created_at=time.time(),
+            env=env
+        )
+        with self._lock:
+            self._jobs[job_id] = rec
+        return rec
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get_many(self, job_ids: Iterable[str]) -> Dict[str, JobRecord]:
+        """Look up several jobs at once; missing IDs are omitted."""
+        with self._lock:
+            return {job_id: self._jobs[job_id] for job_id in job_ids if job_id in self._jobs}
+
+    def mark_running(self, job_id: str) -> None:
+        with self._lock:
+            rec = self._jobs[job_id]
+            rec.status = "running"
+            rec.started_at = time.time()
+
+    def mark_succeeded(self, job_id: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            rec = self._jobs[job_id]
+            rec.status = "succeeded"
+            rec.finished_at = time.time()
+            rec.result = result
+            rec.error = None
+
+    def mark_failed(self, job_id: str, error: str) -> None:
+        with self._lock:
+            rec = self._jobs[job_id]
+            rec.status = "failed"
+            rec.finished_at = time.time()
+            rec.result = None
+            rec.error = error
+
+    def recover_pending(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Return (job_id, request) pairs to re-enqueue after a restart (none in memory)."""
+        return []
+
+    def cleanup_old_jobs(self, max_age_seconds: Optional[int] = None) -> int:
+        """
+        Clean up completed jobs older than max_age_seconds.
+
+        Only removes jobs with status 'succeeded' or 'failed'.
+        Jobs that are 'queued' or 'running' are never removed.
+
+        Returns the number of jobs removed.
+        """
+        max_age = max_age_seconds if max_age_seconds is not None else self._max_age
+        now = time.time()
+        removed = 0
+
+        with self._lock:
+            to_remove = []
+            for job_id, rec in self._jobs.items():
+                if rec.status in ("succeeded", "failed"):
+                    finish_time = rec.finished_at or rec.created_at
+                    age = now - finish_time
+                    if age > max_age:
+                        to_remove.append(job_id)
+
+            for job_id in to_remove:
+                del self._jobs[job_id]
+                removed += 1
+
+        return removed
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get statistics about jobs in the store."""
+        with self._lock:
+            stats = {
+                "total": len(self._jobs),
+                "queued": 0,
+                "running": 0,
+                "succeeded": 0,
+                "failed": 0,
+            }
+            for rec in self._jobs.values():
+                if rec.status in stats:
+                    stats[rec.status] += 1
+            return stats
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteJobStore:
+    """
+    Persistent job store backed by a SQLite database in WAL mode.
+
+    Each thread gets its own connection so status polls never wait on a
+    Python lock; WAL lets readers proceed while a writer commits. The table is
+    indexed by status and finish time, which keeps cleanup and stats queries
+    off a full scan, and the original request payload is stored so queued
+    jobs can be re-enqueued after a restart.
+    """
+
+    _COLUMNS = "job_id, status, created_at, started_at, finished_at, result, error, env"
+
+    def __init__(self, db_path: str, max_age_seconds: int = JOB_STORE_MAX_AGE_SECONDS) -> None:
+        self._db_path = db_path
+        self._max_age = max_age_seconds
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = Lock()
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                result TEXT,
+                error TEXT,
+                env TEXT NOT NULL DEFAULT 'development',
+                request TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status_finished ON jobs (status, finished_at);
+            CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self._db_path,
+                timeout=30.0,
+                isolation_level=None,  # autocommit; each statement is its own transaction
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    def _row_to_record(row: Tuple) -> JobRecord:
+        job_id, status, created_at, started_at, finished_at, result, error, env = row
+        return JobRecord(
+            job_id=job_id,
+            status=status,
+            created_at=created_at,
+            started_at=started_at,
+            finished_at=finished_at,
+            result=json.loads(result) if result else None,
+            error=error,
+            env=env,
+        )
+
+    def create(self, request: Optional[Dict[str, Any]] = None) -> JobRecord:
+        return self.create_with_id(str(uuid4()), request=request)
+
+    def create_with_id(
+        self,
+        job_id: str,
+        env: str = "development",
+        request: Optional[Dict[str, Any]] = None,
+    ) -> JobRecord:
+        """Create job record with specified ID"""
+        rec = JobRecord(job_id=job_id, status="queued", created_at=time.time(), env=env)
+        request_json = json.dumps(request, ensure_ascii=False) if request is not None else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO jobs (job_id, status, created_at, env, request) VALUES (?, ?, ?, ?, ?)",
+            (rec.job_id, rec.status, rec.created_at, rec.env, request_json),
+        )
+        return rec
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        row = self._conn().execute(
+            f"SELECT {self._COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def get_many(self, job_ids: Iterable[str]) -> Dict[str, JobRecord]:
+        """Look up several jobs with one indexed query per chunk of IDs; missing IDs are omitted."""
+        ids = list(dict.fromkeys(job_ids))
+        records: Dict[str, JobRecord] = {}
+        conn = self._conn()
+        for start in range(0, len(ids), _SQLITE_MAX_PARAMS):
+            chunk = ids[start:start + _SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE job_id IN ({placeholders})", chunk
+            ).fetchall()
+            for row in rows:
+                rec = self._row_to_record(row)
+                records[rec.job_id] = rec
+        return records
+
+    def _require_update(self, cursor: sqlite3.Cursor, job_id: str) -> None:
+        # Mirror the in-memory store, which raises KeyError for unknown jobs
+        if cursor.rowcount == 0:
+            raise KeyError(job_id)
+
+    def mark_running(self, job_id: str) -> None:
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = 'running', started_at = ? WHERE job_id = ?",
+            (time.time(), job_id),
+        )
+        self._require_update(cursor, job_id)
+
+    def mark_succeeded(self, job_id: str, result: Dict[str, Any]) -> None:
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = 'succeeded', finished_at = ?, result = ?, error = NULL, request = NULL "
+            "WHERE job_id = ?",
+            (time.time(), json.dumps(result, ensure_ascii=False), job_id),
+        )
+        self._require_update(cursor, job_id)
+
+    def mark_failed(self, job_id: str, error: str) -> None:
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, result = NULL, error = ?, request = NULL "
+            "WHERE job_id = ?",
+            (time.time(), error, job_id),
+        )
+        self._require_update(cursor, job_id)
+
+    def recover_pending(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Return (job_id, request) pairs for jobs that were queued or running when the
+        previous process stopped, oldest first. Interrupted running jobs are reset to
+        queued; jobs without a stored request cannot be replayed and are marked failed.
+        """
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT job_id, request FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        ).fetchall()
+        recovered = []
+        for job_id, request_json in rows:
+            if not request_json:
+                self.mark_failed(job_id, "Job interrupted by server restart and cannot be recovered")
+                continue
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE job_id = ?", (job_id,)
+            )
+            recovered.append((job_id, json.loads(request_json)))
+        return recovered
+
+    def cleanup_old_jobs(self, max_age_seconds: Optional[int] = None) -> int:
+        """
+        Clean up completed jobs older than max_age_seconds.
+
+        Only removes jobs with status 'succeeded' or 'failed'.
+        Jobs that are 'queued' or 'running' are never removed.
+
+        Returns the number of jobs removed.
+        """
+        max_age = max_age_seconds if max_age_seconds is not None else self._max_age
+        cutoff = time.time() - max_age
+        cursor = self._conn().execute(
+            "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?",
+            (cutoff,),
+        )
+        return max(cursor.rowcount, 0)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get statistics about jobs in the store."""
+        stats = {"total": 0, "queued": 0, "running": 0, "succeeded": 0, "failed": 0}
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        for status, count in rows:
+            if status in stats:
+                stats[status] += count
+            stats["total"] += count
+        return stats
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def create_job_store(
+    backend: Optional[str] = None,
+    db_path: Optional[str] = None,
+    max_age_seconds: int = JOB_STORE_MAX_AGE_SECONDS,
+):
+    """
+    Build the configured job store.
+
+    Args:
+        backend: "memory" or "sqlite" (default from ACESTEP_JOB_STORE, else "memory")
+        db_path: SQLite file path (default from ACESTEP_JOB_STORE_PATH, else
+            <project>/.cache/acestep/jobs.sqlite3)
+        max_age_seconds: Retention for completed jobs
+
+    Returns:
+        InMemoryJobStore or SQLiteJobStore
+    """
+    backend = (backend or os.getenv("ACESTEP_JOB_STORE", "memory")).strip().lower()
+    if backend == "sqlite":
+        if not db_path:
+            db_path = os.getenv("ACESTEP_JOB_STORE_PATH", "").strip() or os.path.join(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                ".cache",
+                "acestep",
+                "jobs.sqlite3",
+            )
+        return SQLiteJobStore(db_path, max_age_seconds=max_age_seconds)
+    if backend != "memory":
+        raise ValueError(f"Unknown job store backend '{backend}', expected 'memory' or 'sqlite'")
+    return InMemoryJobStore(max_age_seconds=max_age_seconds)
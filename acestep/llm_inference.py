@@ -19,11 +19,25 @@ from transformers.generation.logits_process import (
     LogitsProcessorList,
     RepetitionPenaltyLogitsProcessor,
 )
+from transformers.generation.stopping_criteria import StoppingCriteria, StoppingCriteriaList
+from acestep.cancellation import CancellationToken, JobCancelledError, check_cancelled
 from acestep.constrained_logits_processor import MetadataConstrainedLogitsProcessor
+from acestep.pt_decode import PtDecodeState, compile_decode_step, compile_step_enabled
 from acestep.constants import DEFAULT_LM_INSTRUCTION, DEFAULT_LM_UNDERSTAND_INSTRUCTION, DEFAULT_LM_INSPIRED_INSTRUCTION, DEFAULT_LM_REWRITE_INSTRUCTION
 from acestep.gpu_config import get_lm_gpu_memory_ratio, get_gpu_memory_gb, get_lm_model_size, get_global_gpu_config
 
 
+class _CancellationCriteria(StoppingCriteria):
+    """Aborts transformers generate() between decode steps once the job's token trips."""
+
+    def __init__(self, cancel_token: CancellationToken):
+        self.cancel_token = cancel_token
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.cancel_token.check()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+
 class LLMHandler:
     """5Hz LM Handler for audio code generation"""
 
@@ -55,6 +69,12 @@ class LLMHandler:
         # Shared HuggingFace model for perplexity calculation
         self._hf_model_for_scoring = None
 
+        # torch.compile'd decode step of the PT backend (ACESTEP_LM_PT_COMPILE)
+        self._pt_decode_step_fn = None
+
+        # Prompt / prefix-cache-hit token counts of the last vllm generate call
+        self.last_prefix_cache_usage: Dict[str, int] = {}
+
     def _safe_empty_cache(self):
         """Safely clear CUDA cache, handling potential RuntimeError due to active CUDA graph capture."""
         if torch.cuda.is_available():
@@ -188,8 +208,10 @@ class LLMHandler:
         
         self.constrained_processor.set_target_duration(target_duration)
         
-        # Batch mode uses default/disabled settings for these options
-        if is_batch:
+        # Batch mode uses default/disabled settings for these options. Understanding
+        # batches hold unrelated songs, so every sequence generates its full metadata
+        # (each with its own FSM state, see process_batch).
+        if is_batch and generation_phase != "understand":
             self.constrained_processor.set_user_metadata(None)
             self.constrained_processor.set_stop_at_reasoning(False)
             self.constrained_processor.set_skip_genres(True)
@@ -239,6 +261,7 @@ class LLMHandler:
             else:
                 self.llm = self.llm.to("cpu").to(self.dtype)
             self.llm.eval()
+            self._pt_decode_step_fn = None
             self.llm_backend = "pt"
             self.llm_initialized = True
             logger.info(f"5Hz LM initialized successfully using PyTorch backend on {device}")
@@ -297,29 +320,20 @@ class LLMHandler:
             for b in range(tokens.shape[0]):
                 constrained_processor.update_state(tokens[b].item())
     
-    def _forward_pass(
+    def _create_pt_decode_state(
         self,
-        model: Any,
-        generated_ids: torch.Tensor,
-        model_kwargs: Dict[str, Any],
-        past_key_values: Optional[Any],
-        use_cache: bool,
-    ) -> Any:
-        """Perform forward pass with KV cache support"""
-        if past_key_values is None:
-            outputs = model(
-                input_ids=generated_ids,
-                **model_kwargs,
-                use_cache=use_cache,
-            )
-        else:
-            outputs = model(
-                input_ids=generated_ids[:, -1:],
-                past_key_values=past_key_values,
-                **model_kwargs,
-                use_cache=use_cache,
-            )
-        return outputs
+        input_ids: torch.Tensor,
+        attention_mask: Optional[torch.Tensor],
+        max_new_tokens: int,
+        pad_token_id: int,
+    ) -> PtDecodeState:
+        """Preallocated buffers + static KV cache for a PT generation loop (see acestep.pt_decode)"""
+        step_fn = None
+        if compile_step_enabled():
+            if self._pt_decode_step_fn is None:
+                self._pt_decode_step_fn = compile_decode_step(self.llm)
+            step_fn = self._pt_decode_step_fn
+        return PtDecodeState(self.llm, input_ids, attention_mask, max_new_tokens, pad_token_id, step_fn=step_fn)
     
     def _normalize_batch_input(self, formatted_prompts: Union[str, List[str]]) -> Tuple[List[str], bool]:
         """Normalize batch input: convert single string to list and return (list, is_batch)"""
@@ -512,11 +526,18 @@ class LLMHandler:
         lyrics: str = "",
         cot_text: str = "",
         seeds: Optional[List[int]] = None,
+        retain_prefix_cache: bool = False,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Union[str, List[str]]:
         """
         Unified vllm generation function supporting both single and batch modes.
         Accepts either a single formatted prompt (str) or a list of formatted prompts (List[str]).
         Returns a single string for single mode, or a list of strings for batch mode.
+
+        With retain_prefix_cache=True the prompt KV blocks stay in the prefix cache for the
+        next call (release with _release_prefix_cache()). Prompt and prefix-cache-hit token
+        counts are recorded in self.last_prefix_cache_usage. A tripped cancel_token raises
+        JobCancelledError between engine steps, after the request's KV blocks are freed.
         """
         from nanovllm import SamplingParams
 
@@ -569,6 +590,7 @@ class LLMHandler:
             logits_processor_update_state=constrained_processor.update_state if constrained_processor else None,
         )
 
+        abort_check = cancel_token.check if cancel_token is not None else None
         if cfg_scale > 1.0:
             # Build unconditional prompt based on generation phase
             formatted_unconditional_prompt = self._build_unconditional_prompt(
@@ -585,9 +607,21 @@ class LLMHandler:
                 formatted_prompt_list,
                 sampling_params,
                 unconditional_prompts=unconditional_prompts,
+                retain_prefix_cache=retain_prefix_cache,
+                abort_check=abort_check,
             )
         else:
-            outputs = self.llm.generate(formatted_prompt_list, sampling_params)
+            outputs = self.llm.generate(
+                formatted_prompt_list,
+                sampling_params,
+                retain_prefix_cache=retain_prefix_cache,
+                abort_check=abort_check,
+            )
+
+        self.last_prefix_cache_usage = {
+            "num_prompt_tokens": sum(o.get("num_prompt_tokens", 0) for o in outputs if isinstance(o, dict)),
+            "num_cached_tokens": sum(o.get("num_cached_tokens", 0) for o in outputs if isinstance(o, dict)),
+        }
 
         # Extract text from outputs
         output_texts = []
@@ -604,6 +638,23 @@ class LLMHandler:
         # Return single string for single mode, list for batch mode
         return output_texts[0] if not is_batch else output_texts
 
+    def _release_prefix_cache(self) -> None:
+        """Drop prompt blocks kept in the nano-vllm prefix cache by retain_prefix_cache=True."""
+        if self.llm_backend == "vllm" and hasattr(self.llm, "release_prefix_cache"):
+            self.llm.release_prefix_cache()
+
+    def get_prefix_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """nano-vllm prefix-cache hit rate and KV block pool stats, or None for the PyTorch backend."""
+        if self.llm_backend != "vllm" or not hasattr(self.llm, "get_prefix_cache_stats"):
+            return None
+        return self.llm.get_prefix_cache_stats()
+
+    def _log_prefix_cache_usage(self, usage: Dict[str, int]) -> None:
+        prompt_tokens = usage.get("num_prompt_tokens", 0)
+        if prompt_tokens:
+            cached_tokens = usage.get("num_cached_tokens", 0)
+            logger.info(f"Phase 2 prefix cache: reused {cached_tokens}/{prompt_tokens} prompt tokens ({cached_tokens / prompt_tokens:.0%})")
+
     def _run_pt_single(
         self,
         formatted_prompt: str,
@@ -625,6 +676,7 @@ class LLMHandler:
         caption: str,
         lyrics: str,
         cot_text: str,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> str:
         """Internal helper function for single-item PyTorch generation."""
         inputs = self.llm_tokenizer(
@@ -709,6 +761,7 @@ class LLMHandler:
                     pad_token_id=self.llm_tokenizer.pad_token_id or self.llm_tokenizer.eos_token_id,
                     streamer=None,
                     constrained_processor=constrained_processor,
+                    cancel_token=cancel_token,
                 )
                 
                 # Extract only the conditional output (first in batch)
@@ -726,6 +779,7 @@ class LLMHandler:
                     pad_token_id=self.llm_tokenizer.pad_token_id or self.llm_tokenizer.eos_token_id,
                     streamer=None,
                     constrained_processor=constrained_processor,
+                    cancel_token=cancel_token,
                 )
             else:
                 # Generate without CFG using native generate() parameters
@@ -738,6 +792,9 @@ class LLMHandler:
                         top_k=top_k if top_k is not None and top_k > 0 else None,
                         top_p=top_p if top_p is not None and 0.0 < top_p < 1.0 else None,
                         logits_processor=logits_processor if len(logits_processor) > 0 else None,
+                        stopping_criteria=(
+                            StoppingCriteriaList([_CancellationCriteria(cancel_token)]) if cancel_token is not None else None
+                        ),
                         pad_token_id=self.llm_tokenizer.pad_token_id or self.llm_tokenizer.eos_token_id,
                         streamer=None,
                     )
@@ -792,6 +849,7 @@ class LLMHandler:
         lyrics: str = "",
         cot_text: str = "",
         seeds: Optional[List[int]] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Union[str, List[str]]:
         """
         Unified PyTorch generation function supporting both single and batch modes.
@@ -833,6 +891,7 @@ class LLMHandler:
                     caption=caption,
                     lyrics=lyrics,
                     cot_text=cot_text,
+                    cancel_token=cancel_token,
                 )
                 
                 output_texts.append(output_text)
@@ -862,6 +921,7 @@ class LLMHandler:
             caption=caption,
             lyrics=lyrics,
             cot_text=cot_text,
+            cancel_token=cancel_token,
         )
 
     def has_all_metas(self, user_metadata: Optional[Dict[str, Optional[str]]]) -> bool:
@@ -922,6 +982,7 @@ class LLMHandler:
         batch_size: Optional[int] = None,
         seeds: Optional[List[int]] = None,
         progress=None,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Dict[str, Any]:
         """Two-phase LM generation: CoT generation followed by audio codes generation.
 
@@ -939,6 +1000,8 @@ class LLMHandler:
                        If > 1, returns batch results (lists).
             seeds: Optional list of seeds for batch generation (for reproducibility).
                   Only used when batch_size > 1. TODO: not used yet
+            cancel_token: Checked between decode steps of both phases; once it trips the KV
+                cache of the request is released and JobCancelledError is raised
         
         Returns:
             Dictionary containing:
@@ -973,6 +1036,11 @@ class LLMHandler:
         has_all_metas = self.has_all_metas(user_metadata)
         phase1_time = 0.0
         phase2_time = 0.0
+
+        # Phase 2 prompts start with the same system/caption/lyrics turns as Phase 1, so keep
+        # Phase 1's prompt KV in the nano-vllm prefix cache until Phase 2 has been prefilled
+        retain_prompt_cache = infer_type == "llm_dit" and self.llm_backend == "vllm"
+        prefix_cache_usage: Dict[str, Dict[str, int]] = {}
         
         # Handle seeds for batch mode
         if is_batch:
@@ -1013,6 +1081,7 @@ class LLMHandler:
                     "skip_language": not use_cot_language,
                     "skip_genres": True,  # Generate genres
                     "generation_phase": "cot",
+                    "retain_prefix_cache": retain_prompt_cache,
                     # Pass context for building unconditional prompt in CoT phase
                     "caption": caption,
                     "lyrics": lyrics,
@@ -1020,11 +1089,16 @@ class LLMHandler:
                 use_constrained_decoding=use_constrained_decoding,
                 constrained_decoding_debug=constrained_decoding_debug,
                 stop_at_reasoning=True,  # Always stop at </think> in Phase 1
+                cancel_token=cancel_token,
             )
             
             phase1_time = time.time() - phase1_start
+            if self.llm_backend == "vllm":
+                prefix_cache_usage["phase1"] = dict(self.last_prefix_cache_usage)
             
             if not cot_output_text:
+                if retain_prompt_cache:
+                    self._release_prefix_cache()
                 return {
                     "metadata": [] if is_batch else {},
                     "audio_codes": [] if is_batch else "",
@@ -1060,7 +1134,8 @@ class LLMHandler:
                         "time_costs": {
                             "phase1_time": phase1_time,
                             "total_time": phase1_time,
-                        }
+                        },
+                        "prefix_cache": prefix_cache_usage,
                     },
                 }
             else:
@@ -1073,7 +1148,8 @@ class LLMHandler:
                         "time_costs": {
                             "phase1_time": phase1_time,
                             "total_time": phase1_time,
-                        }
+                        },
+                        "prefix_cache": prefix_cache_usage,
                     },
                 }
         
@@ -1115,6 +1191,8 @@ class LLMHandler:
                         lyrics=lyrics,
                         cot_text=cot_text,
                         seeds=seeds,
+                        retain_prefix_cache=False,
+                        cancel_token=cancel_token,
                     )
                 else:  # pt backend
                     codes_outputs = self._run_pt(
@@ -1133,10 +1211,17 @@ class LLMHandler:
                         lyrics=lyrics,
                         cot_text=cot_text,
                         seeds=seeds,
+                        cancel_token=cancel_token,
                     )
+            except JobCancelledError:
+                if retain_prompt_cache:
+                    self._release_prefix_cache()
+                raise
             except Exception as e:
                 error_msg = f"Error in batch codes generation: {str(e)}"
                 logger.error(error_msg)
+                if retain_prompt_cache:
+                    self._release_prefix_cache()
                 return {
                     "metadata": [],
                     "audio_codes": [],
@@ -1151,6 +1236,11 @@ class LLMHandler:
                     },
                 }
             
+            if retain_prompt_cache:
+                self._release_prefix_cache()
+                prefix_cache_usage["phase2"] = dict(self.last_prefix_cache_usage)
+                self._log_prefix_cache_usage(prefix_cache_usage["phase2"])
+
             # Parse audio codes from each output
             audio_codes_list = []
             metadata_list = []
@@ -1179,33 +1269,42 @@ class LLMHandler:
                     },
                     "codes_counts": codes_counts,
                     "total_codes": sum(codes_counts),
+                    "prefix_cache": prefix_cache_usage,
                 },
             }
         else:
             # Single mode: generate codes for one item
-            codes_output_text, status = self.generate_from_formatted_prompt(
-                formatted_prompt=formatted_prompt_with_cot,
-                cfg={
-                    "temperature": temperature,
-                    "cfg_scale": cfg_scale,
-                    "negative_prompt": negative_prompt,
-                    "top_k": top_k,
-                    "top_p": top_p,
-                    "repetition_penalty": repetition_penalty,
-                    "target_duration": target_duration,
-                    "user_metadata": None,  # No user metadata injection in Phase 2
-                    "skip_caption": True,  # Skip caption since CoT is already included
-                    "skip_language": True,  # Skip language since CoT is already included
-                    "generation_phase": "codes",
-                    # Pass context for building unconditional prompt in codes phase
-                    "caption": caption,
-                    "lyrics": lyrics,
-                    "cot_text": cot_text,
-                },
-                use_constrained_decoding=use_constrained_decoding,
-                constrained_decoding_debug=constrained_decoding_debug,
-                stop_at_reasoning=False,  # Generate codes until EOS
-            )
+            try:
+                codes_output_text, status = self.generate_from_formatted_prompt(
+                    formatted_prompt=formatted_prompt_with_cot,
+                    cfg={
+                        "temperature": temperature,
+                        "cfg_scale": cfg_scale,
+                        "negative_prompt": negative_prompt,
+                        "top_k": top_k,
+                        "top_p": top_p,
+                        "repetition_penalty": repetition_penalty,
+                        "target_duration": target_duration,
+                        "user_metadata": None,  # No user metadata injection in Phase 2
+                        "skip_caption": True,  # Skip caption since CoT is already included
+                        "skip_language": True,  # Skip language since CoT is already included
+                        "generation_phase": "codes",
+                        # Pass context for building unconditional prompt in codes phase
+                        "caption": caption,
+                        "lyrics": lyrics,
+                        "cot_text": cot_text,
+                    },
+                    use_constrained_decoding=use_constrained_decoding,
+                    constrained_decoding_debug=constrained_decoding_debug,
+                    stop_at_reasoning=False,  # Generate codes until EOS
+                    cancel_token=cancel_token,
+                )
+            finally:
+                if retain_prompt_cache:
+                    self._release_prefix_cache()
+            if retain_prompt_cache:
+                prefix_cache_usage["phase2"] = dict(self.last_prefix_cache_usage)
+                self._log_prefix_cache_usage(prefix_cache_usage["phase2"])
             
             if not codes_output_text:
                 total_time = phase1_time + phase2_time
@@ -1244,9 +1343,22 @@ class LLMHandler:
                         "total_time": total_time,
                     },
                     "codes_count": codes_count,
+                    "prefix_cache": prefix_cache_usage,
                 },
             }
     
+    def _build_caption_lyrics_messages(self, caption: str, lyrics: str) -> List[Dict[str, str]]:
+        """
+        System + user turns shared by the CoT and codes phase prompts.
+
+        Both phases must render these identically (token for token): the codes phase
+        then reuses the CoT phase's prompt KV blocks from the nano-vllm prefix cache.
+        """
+        return [
+            {"role": "system", "content": f"# Instruction\n{DEFAULT_LM_INSTRUCTION}\n\n"},
+            {"role": "user", "content": f"# Caption\n{caption}\n\n# Lyric\n{lyrics}\n"},
+        ]
+
     def build_formatted_prompt(self, caption: str, lyrics: str = "", is_negative_prompt: bool = False, generation_phase: str = "cot", negative_prompt: str = "NO USER INPUT") -> str:
         """
         Build the chat-formatted prompt for 5Hz LM from caption/lyrics.
@@ -1274,7 +1386,11 @@ class LLMHandler:
                 # CoT phase unconditional prompt
                 if has_negative_prompt:
                     # If negative prompt provided, use it as caption
-                    prompt = f"# Caption\n{negative_prompt}\n\n# Lyric\n{lyrics}\n"
+                    return self.llm_tokenizer.apply_chat_template(
+                        self._build_caption_lyrics_messages(negative_prompt, lyrics),
+                        tokenize=False,
+                        add_generation_prompt=True,
+                    )
                 else:
                     # No negative prompt: remove caption, keep only lyrics
                     prompt = f"# Lyric\n{lyrics}\n"
@@ -1284,7 +1400,11 @@ class LLMHandler:
                 prompt = caption
         else:
             # Conditional prompt: include both caption and lyrics
-            prompt = f"# Caption\n{caption}\n\n# Lyric\n{lyrics}\n"
+            return self.llm_tokenizer.apply_chat_template(
+                self._build_caption_lyrics_messages(caption, lyrics),
+                tokenize=False,
+                add_generation_prompt=True,
+            )
         
         return self.llm_tokenizer.apply_chat_template(
             [
@@ -1335,18 +1455,11 @@ class LLMHandler:
             cot_for_prompt = cot_text
             caption_for_prompt = caption
         
-        # Build user prompt with caption and lyrics ONLY (no COT)
-        # COT should be in the assistant's message, not user's
-        user_prompt = f"# Caption\n{caption_for_prompt}\n\n# Lyric\n{lyrics}\n"
-        
-        # Build the chat with assistant message containing the COT
-        # The model will continue generation after the COT
+        # User prompt carries caption and lyrics ONLY (no COT), in the same layout as the CoT
+        # phase prompt; COT goes in the assistant's message, and the model continues after it
         formatted = self.llm_tokenizer.apply_chat_template(
-            [
-                {"role": "system", "content": f"# Instruction\n{DEFAULT_LM_INSTRUCTION}\n\n"},
-                {"role": "user", "content": user_prompt},
-                {"role": "assistant", "content": cot_for_prompt},
-            ],
+            self._build_caption_lyrics_messages(caption_for_prompt, lyrics)
+            + [{"role": "assistant", "content": cot_for_prompt}],
             tokenize=False,
             add_generation_prompt=False,  # Don't add generation prompt, COT is already in assistant
         )
@@ -1466,21 +1579,7 @@ class LLMHandler:
         # Note: cfg_scale and negative_prompt are not used in understand mode
         output_text, status = self.generate_from_formatted_prompt(
             formatted_prompt=formatted_prompt,
-            cfg={
-                "temperature": temperature,
-                "top_k": top_k,
-                "top_p": top_p,
-                "repetition_penalty": repetition_penalty,
-                "target_duration": None,  # No duration constraint for understanding
-                "user_metadata": None,  # No user metadata injection
-                "skip_caption": False,  # Generate caption
-                "skip_language": False,  # Generate language
-                "skip_genres": False,  # Generate genres
-                "generation_phase": "understand",  # Understanding phase: generate CoT metadata, then free-form lyrics
-                # Context for building unconditional prompt
-                "caption": "",
-                "lyrics": "",
-            },
+            cfg=self._understanding_cfg(temperature, top_k, top_p, repetition_penalty),
             use_constrained_decoding=use_constrained_decoding,
             constrained_decoding_debug=constrained_decoding_debug,
             stop_at_reasoning=False,  # Continue after </think> to generate lyrics
@@ -1489,6 +1588,102 @@ class LLMHandler:
         if not output_text:
             return {}, status
         
+        return self._parse_understanding_output(output_text, constrained_decoding_debug)
+    
+    def understand_audio_from_codes_batch(
+        self,
+        audio_codes_list: List[str],
+        temperature: float = 0.3,
+        top_k: Optional[int] = None,
+        top_p: Optional[float] = None,
+        repetition_penalty: float = 1.0,
+        use_constrained_decoding: bool = True,
+        constrained_decoding_debug: bool = False,
+    ) -> List[Tuple[Dict[str, Any], str]]:
+        """
+        understand_audio_from_codes() for several songs in one LM run.
+
+        With the vllm backend all prompts go to the engine as one multi-sequence
+        generate call; constrained decoding keeps a separate FSM state per sequence.
+        The PyTorch backend understands the songs one after another.
+
+        Args:
+            audio_codes_list: Audio code strings, one per song
+            temperature, top_k, top_p, repetition_penalty, use_constrained_decoding,
+            constrained_decoding_debug: As in understand_audio_from_codes
+
+        Returns:
+            One (metadata_dict, status_message) tuple per input, in order
+        """
+        kwargs = dict(
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            use_constrained_decoding=use_constrained_decoding,
+            constrained_decoding_debug=constrained_decoding_debug,
+        )
+        if not getattr(self, "llm_initialized", False):
+            return [({}, "❌ 5Hz LM not initialized. Please initialize it first.")] * len(audio_codes_list)
+        if self.llm_backend != "vllm" or len(audio_codes_list) <= 1:
+            return [self.understand_audio_from_codes(codes, **kwargs) for codes in audio_codes_list]
+
+        results: List[Tuple[Dict[str, Any], str]] = [
+            ({}, "❌ No audio codes provided. Please paste audio codes first.")
+        ] * len(audio_codes_list)
+        indices = [i for i, codes in enumerate(audio_codes_list) if codes and codes.strip()]
+        if not indices:
+            return results
+
+        logger.info(f"Understanding {len(indices)} audio code sequences in one batch")
+        formatted_prompts = [self.build_formatted_prompt_for_understanding(audio_codes_list[i]) for i in indices]
+        output_texts, status = self.generate_from_formatted_prompt(
+            formatted_prompt=formatted_prompts,
+            cfg=self._understanding_cfg(temperature, top_k, top_p, repetition_penalty),
+            use_constrained_decoding=use_constrained_decoding,
+            constrained_decoding_debug=constrained_decoding_debug,
+            stop_at_reasoning=False,
+        )
+        if not output_texts:
+            for i in indices:
+                results[i] = ({}, status)
+            return results
+
+        for i, output_text in zip(indices, output_texts):
+            if output_text:
+                results[i] = self._parse_understanding_output(output_text, constrained_decoding_debug)
+            else:
+                results[i] = ({}, "❌ LM returned no output")
+        return results
+    
+    def _understanding_cfg(
+        self,
+        temperature: float,
+        top_k: Optional[int],
+        top_p: Optional[float],
+        repetition_penalty: float,
+    ) -> Dict[str, Any]:
+        """generate_from_formatted_prompt() cfg for the understand phase."""
+        return {
+            "temperature": temperature,
+            "top_k": top_k,
+            "top_p": top_p,
+            "repetition_penalty": repetition_penalty,
+            "target_duration": None,  # No duration constraint for understanding
+            "user_metadata": None,  # No user metadata injection
+            "skip_caption": False,  # Generate caption
+            "skip_language": False,  # Generate language
+            "skip_genres": False,  # Generate genres
+            "generation_phase": "understand",  # Understanding phase: generate CoT metadata, then free-form lyrics
+            # Context for building unconditional prompt
+            "caption": "",
+            "lyrics": "",
+        }
+    
+    def _parse_understanding_output(
+        self, output_text: str, constrained_decoding_debug: bool = False
+    ) -> Tuple[Dict[str, Any], str]:
+        """Metadata dict (with "lyrics") and status message from understand-phase LM output."""
         # Parse metadata and extract lyrics
         metadata, _ = self.parse_lm_output(output_text)
         
@@ -1919,17 +2114,19 @@ class LLMHandler:
     
     def generate_from_formatted_prompt(
         self,
-        formatted_prompt: str,
+        formatted_prompt: Union[str, List[str]],
         cfg: Optional[Dict[str, Any]] = None,
         use_constrained_decoding: bool = True,
         constrained_decoding_debug: bool = False,
         stop_at_reasoning: bool = False,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Tuple[str, str]:
         """
         Generate raw LM text output from a pre-built formatted prompt.
 
         Args:
-            formatted_prompt: Prompt that is already formatted by `build_formatted_prompt`.
+            formatted_prompt: Prompt that is already formatted by `build_formatted_prompt`, or a
+                list of such prompts generated together (output_text is then a list of texts).
             cfg: Optional dict supporting keys:
                 - temperature (float)
                 - cfg_scale (float)
@@ -1937,9 +2134,11 @@ class LLMHandler:
                 - top_k (int), top_p (float), repetition_penalty (float)
                 - target_duration (float): Target duration in seconds for codes generation
                 - generation_phase (str): "cot" or "codes" for phase-aware CFG
+                - retain_prefix_cache (bool): keep the prompt KV cached for a follow-up call (vllm)
             use_constrained_decoding: Whether to use FSM-based constrained decoding
             constrained_decoding_debug: Whether to enable debug logging for constrained decoding
             stop_at_reasoning: If True, stop generation immediately after </think> tag (no audio codes)
+            cancel_token: Checked between decode steps; raises JobCancelledError once it trips
 
         Returns:
             (output_text, status_message)
@@ -1966,6 +2165,7 @@ class LLMHandler:
         skip_language = cfg.get("skip_language", False)  # Skip language generation in CoT
         skip_genres = cfg.get("skip_genres", False)  # Skip genres generation in CoT
         generation_phase = cfg.get("generation_phase", "cot")  # "cot" or "codes"
+        retain_prefix_cache = cfg.get("retain_prefix_cache", False)  # Keep prompt KV for a follow-up phase (vllm)
         # Additional context for codes phase unconditional prompt building
         caption = cfg.get("caption", "")
         lyrics = cfg.get("lyrics", "")
@@ -1993,7 +2193,11 @@ class LLMHandler:
                     caption=caption,
                     lyrics=lyrics,
                     cot_text=cot_text,
+                    retain_prefix_cache=retain_prefix_cache,
+                    cancel_token=cancel_token,
                 )
+                if isinstance(output_text, list):
+                    return output_text, f"✅ Generated successfully (vllm) | sequences={len(output_text)}"
                 return output_text, f"✅ Generated successfully (vllm) | length={len(output_text)}"
 
             # PyTorch backend
@@ -2017,7 +2221,10 @@ class LLMHandler:
                 caption=caption,
                 lyrics=lyrics,
                 cot_text=cot_text,
+                cancel_token=cancel_token,
             )
+            if isinstance(output_text, list):
+                return output_text, f"✅ Generated successfully (pt) | sequences={len(output_text)}"
             return output_text, f"✅ Generated successfully (pt) | length={len(output_text)}"
 
         except BaseException as e:
@@ -2041,6 +2248,10 @@ class LLMHandler:
                 self._safe_empty_cache()
                 torch.cuda.synchronize()
 
+            if isinstance(e, JobCancelledError):
+                if retain_prefix_cache:
+                    self._release_prefix_cache()
+                raise
             if isinstance(e, Exception):
                 return "", f"❌ Error generating from formatted prompt: {e}"
             else:
@@ -2060,27 +2271,14 @@ class LLMHandler:
         pad_token_id: int,
         streamer: Optional[BaseStreamer],
         constrained_processor: Optional[MetadataConstrainedLogitsProcessor] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> torch.Tensor:
         """
         Custom generation loop with constrained decoding support (non-CFG).
         This allows us to call update_state() after each token generation.
         """
-        model = self.llm
-        device = self.device
-        
-        # Initialize generated sequences
-        generated_ids = input_ids.clone()
-        if attention_mask is not None:
-            attn_mask = attention_mask.clone()
-        else:
-            attn_mask = torch.ones_like(input_ids)
-        
-        # Prepare model inputs
-        model_kwargs = {'attention_mask': attn_mask}
-        
-        # Past key values for KV cache
-        past_key_values = None
-        use_cache = hasattr(model, 'generation_config') and getattr(model.generation_config, 'use_cache', True)
+        # Token / mask buffers and KV cache preallocated to the final length, written in place
+        decode_state = self._create_pt_decode_state(input_ids, attention_mask, max_new_tokens, pad_token_id)
         
         # Get EOS token ID
         eos_token_id = self.llm_tokenizer.eos_token_id
@@ -2092,11 +2290,10 @@ class LLMHandler:
         
         with torch.no_grad():
             for step in range(max_new_tokens):
-                # Forward pass
-                outputs = self._forward_pass(model, generated_ids, model_kwargs, past_key_values, use_cache)
-                
-                # Get logits for the last position
-                next_token_logits = outputs.logits[:, -1, :]  # [batch_size, vocab_size]
+                check_cancelled(cancel_token)
+                # Forward pass: the prompt first, then only the last sampled token
+                next_token_logits = decode_state.prefill() if step == 0 else decode_state.step()  # [batch_size, vocab_size]
+                generated_ids = decode_state.generated_ids
                 
                 # Apply constrained processor FIRST (modifies logits based on FSM state)
                 if constrained_processor is not None:
@@ -2120,14 +2317,8 @@ class LLMHandler:
                 should_stop = self._check_eos_token(next_tokens, eos_token_id, pad_token_id)
                 
                 # Append token to sequence
+                decode_state.append(next_tokens)
                 next_tokens_unsqueezed = next_tokens.unsqueeze(1)
-                generated_ids = torch.cat([generated_ids, next_tokens_unsqueezed], dim=1)
-                attn_mask = torch.cat([attn_mask, torch.ones((input_ids.shape[0], 1), device=device, dtype=attn_mask.dtype)], dim=1)
-                model_kwargs['attention_mask'] = attn_mask
-                
-                # Update KV cache
-                if use_cache and hasattr(outputs, 'past_key_values'):
-                    past_key_values = outputs.past_key_values
                 
                 # Update streamer
                 if streamer is not None:
@@ -2139,7 +2330,7 @@ class LLMHandler:
         if streamer is not None:
             streamer.end()
         
-        return generated_ids
+        return decode_state.generated_ids
     
     def _generate_with_cfg_custom(
         self,
@@ -2154,6 +2345,7 @@ class LLMHandler:
         pad_token_id: int,
         streamer: Optional[BaseStreamer],
         constrained_processor: Optional[MetadataConstrainedLogitsProcessor] = None,
+        cancel_token: Optional[CancellationToken] = None,
     ) -> torch.Tensor:
         """
         Custom CFG generation loop that:
@@ -2165,27 +2357,12 @@ class LLMHandler:
         
         Batch format: [cond_input, uncond_input]
         """
-        model = self.llm
-        device = self.device
         batch_size = batch_input_ids.shape[0] // 2  # Half are conditional, half are unconditional
         cond_start_idx = 0
         uncond_start_idx = batch_size
         
-        # Initialize generated sequences
-        generated_ids = batch_input_ids.clone()
-        if batch_attention_mask is not None:
-            attention_mask = batch_attention_mask.clone()
-        else:
-            attention_mask = torch.ones_like(batch_input_ids)
-        
-        # Prepare model inputs
-        model_kwargs = {}
-        if batch_attention_mask is not None:
-            model_kwargs['attention_mask'] = attention_mask
-        
-        # Past key values for KV cache (if model supports it)
-        past_key_values = None
-        use_cache = hasattr(model, 'generation_config') and getattr(model.generation_config, 'use_cache', True)
+        # Token / mask buffers and KV cache preallocated to the final length, written in place
+        decode_state = self._create_pt_decode_state(batch_input_ids, batch_attention_mask, max_new_tokens, pad_token_id)
         
         # Get EOS token ID for stopping condition
         eos_token_id = self.llm_tokenizer.eos_token_id
@@ -2197,11 +2374,11 @@ class LLMHandler:
         
         with torch.no_grad():
             for step in range(max_new_tokens):
-                # Forward pass for the entire batch (conditional + unconditional)
-                outputs = self._forward_pass(model, generated_ids, model_kwargs, past_key_values, use_cache)
-                
-                # Get logits for the last position
-                next_token_logits = outputs.logits[:, -1, :]  # [batch_size*2, vocab_size]
+                check_cancelled(cancel_token)
+                # Forward pass for the entire batch (conditional + unconditional):
+                # the prompt first, then only the last sampled token
+                next_token_logits = decode_state.prefill() if step == 0 else decode_state.step()  # [batch_size*2, vocab_size]
+                generated_ids = decode_state.generated_ids
                 
                 # Split conditional and unconditional logits
                 cond_logits = next_token_logits[cond_start_idx:cond_start_idx+batch_size]
@@ -2237,14 +2414,8 @@ class LLMHandler:
                 should_stop = self._check_eos_token(next_tokens, eos_token_id, pad_token_id)
                 
                 # Apply the same sampled tokens to both conditional and unconditional sequences
+                decode_state.append(next_tokens.repeat(2))
                 next_tokens_unsqueezed = next_tokens.unsqueeze(1)
-                generated_ids = torch.cat([generated_ids, next_tokens_unsqueezed.repeat(2, 1)], dim=1)
-                attention_mask = torch.cat([attention_mask, torch.ones((batch_size*2, 1), device=device, dtype=attention_mask.dtype)], dim=1)
-                model_kwargs['attention_mask'] = attention_mask
-                
-                # Update past_key_values for next iteration
-                if use_cache and hasattr(outputs, 'past_key_values'):
-                    past_key_values = outputs.past_key_values
                 
                 # Update streamer
                 if streamer is not None:
@@ -2259,7 +2430,7 @@ class LLMHandler:
         
         # Return the full batch (both conditional and unconditional)
         # The caller will extract only the conditional output
-        return generated_ids
+        return decode_state.generated_ids
     
     def parse_lm_output(self, output_text: str) -> Tuple[Dict[str, Any], str]:
         """
@@ -2435,11 +2606,40 @@ class LLMHandler:
             offload_time = time.time() - start_time
             logger.info(f"Offloaded LLM to CPU in {offload_time:.4f}s")
     
+    def score_prompt_targets(self, pairs: List[Tuple[str, str]], top_k: int = 0) -> List[Dict[str, Any]]:
+        """
+        Score target texts given prompts with the nano-vllm engine in one prefill-only call.
+
+        Args:
+            pairs: (formatted_prompt, target_text) pairs. Pairs sharing a prompt prefix
+                share its KV blocks instead of each running a full forward pass.
+            top_k: Also return the top-k predicted token ids at each target position
+
+        Returns:
+            One dict per pair with "target_ids", "token_logprobs" and "topk_token_ids"
+        """
+        if self.llm_backend != "vllm":
+            raise ValueError("score_prompt_targets requires the vllm backend")
+        token_ids, target_starts = [], []
+        for formatted_prompt, target_text in pairs:
+            # Tokenize prompt + target together so subword merging at the boundary matches
+            # teacher forcing on the full text; the prompt alone only gives the offset
+            prompt_len = len(self.llm_tokenizer(formatted_prompt, add_special_tokens=True)["input_ids"])
+            full_ids = self.llm_tokenizer(formatted_prompt + target_text, truncation=True, add_special_tokens=True)["input_ids"]
+            token_ids.append(full_ids)
+            target_starts.append(min(prompt_len, len(full_ids)))
+
+        outputs = self.llm.score(token_ids, target_starts, top_k=top_k)
+        for output, full_ids, start in zip(outputs, token_ids, target_starts):
+            output["target_ids"] = full_ids[start:]
+        return outputs
+
     def get_hf_model_for_scoring(self):
         """
         Get HuggingFace model for perplexity scoring.
         
-        For vllm backend, loads HuggingFace model from disk (weights are cached by transformers).
+        For vllm backend, loads HuggingFace model from disk (weights are cached by transformers);
+        prefer score_prompt_targets(), which scores with the loaded engine instead.
         For pt backend, returns the existing model.
         
         Returns:
@@ -0,0 +1,385 @@
+"""
+GPU Model Residency Manager
+Keeps recently used model components on the GPU under a VRAM budget
+
+With offload_to_cpu enabled, every pipeline stage (text encoder, DiT, VAE) used
+to be moved to the GPU on entry and back to CPU on exit. The residency manager
+replaces that round trip with an LRU cache of GPU-resident components:
+
+- a component stays on the GPU after use while it fits in the VRAM budget
+- least recently used components are offloaded only when the budget or the
+  device's free memory requires it
+- gc.collect()/empty_cache() only run when something was actually evicted
+- the next stage can be prefetched on a side CUDA stream while the current
+  stage computes
+- per-stage hit/miss/eviction counters are exposed via get_stats()
+
+One manager is shared per device so several handlers on the same GPU compete
+for the same budget (see get_residency_manager()).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+import torch
+from loguru import logger
+
+from acestep.gpu_config import GPUConfig
+
+# VRAM kept free for activations (DiT attention, VAE decode chunks, LM KV cache growth)
+DEFAULT_RESIDENCY_RESERVE_GB = 4.0
+
+
+@dataclass
+class _Component:
+    stage: str
+    load_fn: Callable[[], None]
+    offload_fn: Callable[[], None]
+    size_fn: Callable[[], int]
+    pinned: bool = False
+    in_use: int = 0
+    nbytes: int = 0
+    prefetch_future: Optional[Future] = None
+    prefetch_event: Any = None
+
+
+@dataclass
+class _StageStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    prefetches: int = 0
+    prefetch_hits: int = 0
+    load_seconds: float = 0.0
+    offload_seconds: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "prefetches": self.prefetches,
+            "prefetch_hits": self.prefetch_hits,
+            "load_seconds": round(self.load_seconds, 4),
+            "offload_seconds": round(self.offload_seconds, 4),
+        }
+
+
+def residency_budget_bytes(gpu_config: GPUConfig, reserve_gb: Optional[float] = None) -> int:
+    """
+    Compute the VRAM budget for resident model weights.
+
+    The budget is the detected GPU memory minus an activation reserve and the
+    largest 5Hz LM allocation the tier allows. ACESTEP_RESIDENCY_BUDGET_GB
+    overrides the computed value, ACESTEP_RESIDENCY_RESERVE_GB the reserve.
+
+    Args:
+        gpu_config: GPU configuration for the current device
+        reserve_gb: VRAM kept free for activations (GB)
+
+    Returns:
+        Budget in bytes (0 disables residency; every stage is offloaded after use)
+    """
+    override = os.environ.get("ACESTEP_RESIDENCY_BUDGET_GB")
+    if override is not None:
+        try:
+            return max(0, int(float(override) * 1024**3))
+        except ValueError:
+            logger.warning(f"Invalid ACESTEP_RESIDENCY_BUDGET_GB value: {override}, ignoring")
+
+    if reserve_gb is None:
+        try:
+            reserve_gb = float(os.environ.get("ACESTEP_RESIDENCY_RESERVE_GB", DEFAULT_RESIDENCY_RESERVE_GB))
+        except ValueError:
+            reserve_gb = DEFAULT_RESIDENCY_RESERVE_GB
+
+    lm_gb = max(gpu_config.lm_memory_gb.values(), default=0)
+    budget_gb = gpu_config.gpu_memory_gb - reserve_gb - lm_gb
+    return max(0, int(budget_gb * 1024**3))
+
+
+def module_nbytes(module: Optional[torch.nn.Module]) -> int:
+    """Total size of a module's parameters and buffers in bytes."""
+    if module is None:
+        return 0
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModelResidencyManager:
+    """
+    LRU residency cache for model components on a single device.
+
+    Components are registered with callbacks that move them to the device,
+    move them back to CPU, and report their size. Use acquire() around any code
+    that needs a component on the device, and prefetch() to start loading the
+    next stage ahead of time.
+    """
+
+    def __init__(self, device: str, budget_bytes: int, release_memory_fn: Optional[Callable[[], None]] = None):
+        self.device = device
+        self.budget_bytes = budget_bytes
+        self._release_memory_fn = release_memory_fn
+        self._lock = threading.RLock()
+        self._components: Dict[str, _Component] = {}
+        # key -> None, ordered from least to most recently used
+        self._resident: "OrderedDict[str, None]" = OrderedDict()
+        self._stats: Dict[str, _StageStats] = {}
+        self._use_cuda_stream = str(device).startswith("cuda") and torch.cuda.is_available()
+        self._prefetch_stream = None
+        self._prefetch_executor: Optional[ThreadPoolExecutor] = None
+
+    def register(
+        self,
+        key: str,
+        stage: str,
+        load_fn: Callable[[], None],
+        offload_fn: Callable[[], None],
+        size_fn: Callable[[], int],
+        resident: bool = False,
+        pinned: bool = False,
+    ) -> None:
+        """
+        Register a component.
+
+        Args:
+            key: Unique component key (one per handler and stage)
+            stage: Stage name used for stats ("text_encoder", "model", "vae")
+            load_fn: Moves the component to the device
+            offload_fn: Moves the component to CPU
+            size_fn: Returns the component size in bytes
+            resident: Whether the component is already on the device
+            pinned: Pinned components are never evicted but count against the budget
+        """
+        with self._lock:
+            self._wait_prefetch(key)
+            self._resident.pop(key, None)
+            comp = _Component(stage=stage, load_fn=load_fn, offload_fn=offload_fn, size_fn=size_fn, pinned=pinned)
+            self._components[key] = comp
+            self._stats.setdefault(stage, _StageStats())
+            if resident or pinned:
+                comp.nbytes = size_fn()
+                self._resident[key] = None
+
+    def unregister(self, key: str) -> None:
+        """Forget a component without moving it (e.g. before re-initializing a handler)."""
+        with self._lock:
+            self._wait_prefetch(key)
+            self._resident.pop(key, None)
+            self._components.pop(key, None)
+
+    def is_resident(self, key: str) -> bool:
+        with self._lock:
+            return key in self._resident
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(self._components[k].nbytes for k in self._resident)
+
+    @contextmanager
+    def acquire(self, key: str):
+        """
+        Context manager that keeps a component on the device while in use.
+
+        On exit the component stays resident while it fits the budget; it is
+        offloaded later only if another component needs the room.
+        """
+        with self._lock:
+            comp = self._components[key]
+            stats = self._stats[comp.stage]
+            prefetched = comp.prefetch_future is not None
+            self._wait_prefetch(key)
+
+            if key in self._resident:
+                stats.hits += 1
+                if prefetched:
+                    stats.prefetch_hits += 1
+                self._resident.move_to_end(key)
+            else:
+                stats.misses += 1
+                size = comp.size_fn()
+                self._make_room(size, exclude=key)
+                start = time.time()
+                comp.load_fn()
+                stats.load_seconds += time.time() - start
+                comp.nbytes = size
+                self._resident[key] = None
+            comp.in_use += 1
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                comp.in_use -= 1
+                # Enforce the budget once nothing needs the component (a budget of 0
+                # reproduces the old offload-after-every-use behavior)
+                if comp.in_use == 0:
+                    self._make_room(0, exclude="")
+
+    def prefetch(self, key: str) -> bool:
+        """
+        Start moving a component to the device on a side CUDA stream.
+
+        Only runs on CUDA, only evicts components that are not in use, and is
+        skipped when the component is already resident or does not fit.
+
+        Returns:
+            True if a prefetch was started
+        """
+        if not self._use_cuda_stream:
+            return False
+        with self._lock:
+            comp = self._components.get(key)
+            if comp is None or comp.prefetch_future is not None or key in self._resident:
+                return False
+            size = comp.size_fn()
+            if not self._make_room(size, exclude=key, require_fit=True):
+                return False
+
+            if self._prefetch_stream is None:
+                self._prefetch_stream = torch.cuda.Stream(device=self.device)
+                self._prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="residency-prefetch")
+
+            stats = self._stats[comp.stage]
+            stats.prefetches += 1
+            comp.nbytes = size
+            comp.prefetch_event = torch.cuda.Event()
+            self._resident[key] = None
+            comp.prefetch_future = self._prefetch_executor.submit(self._run_prefetch, comp)
+            return True
+
+    def _run_prefetch(self, comp: _Component) -> float:
+        start = time.time()
+        with torch.cuda.stream(self._prefetch_stream):
+            comp.load_fn()
+            comp.prefetch_event.record(self._prefetch_stream)
+        return time.time() - start
+
+    def _wait_prefetch(self, key: str) -> None:
+        """Block until an in-flight prefetch of key finishes and order the current stream after it."""
+        comp = self._components.get(key)
+        if comp is None or comp.prefetch_future is None:
+            return
+        future, comp.prefetch_future = comp.prefetch_future, None
+        try:
+            self._stats[comp.stage].load_seconds += future.result()
+            torch.cuda.current_stream(self.device).wait_event(comp.prefetch_event)
+        except Exception as e:
+            logger.warning(f"[ModelResidencyManager] Prefetch of {key} failed: {e}")
+            self._resident.pop(key, None)
+        finally:
+            comp.prefetch_event = None
+
+    def _device_free_bytes(self) -> Optional[int]:
+        if not self._use_cuda_stream:
+            return None
+        try:
+            free, _ = torch.cuda.mem_get_info(self.device)
+            # Memory cached by the allocator is reusable without empty_cache()
+            free += torch.cuda.memory_reserved(self.device) - torch.cuda.memory_allocated(self.device)
+            return free
+        except Exception:
+            return None
+
+    def _make_room(self, size: int, exclude: str, require_fit: bool = False) -> bool:
+        """
+        Evict least recently used components until size fits the budget and the device.
+
+        Args:
+            size: Bytes needed
+            exclude: Key being loaded (never evicted)
+            require_fit: If True, evict nothing and return False when room cannot be made
+
+        Returns:
+            True if the component fits after eviction
+        """
+        def over_budget(resident_total: int, freed: int) -> bool:
+            if resident_total + size > self.budget_bytes:
+                return True
+            free = self._device_free_bytes()
+            return free is not None and free + freed < size
+
+        candidates = [
+            k for k in self._resident
+            if k != exclude
+            and not self._components[k].pinned
+            and self._components[k].in_use == 0
+            and self._components[k].prefetch_future is None
+        ]
+
+        resident_total = self.resident_bytes()
+        if require_fit:
+            evictable = sum(self._components[k].nbytes for k in candidates)
+            if resident_total - evictable + size > self.budget_bytes:
+                return False
+
+        victims = []
+        freed = 0
+        for k in candidates:
+            if not over_budget(resident_total - freed, freed):
+                break
+            victims.append(k)
+            freed += self._components[k].nbytes
+
+        if require_fit and over_budget(resident_total - freed, freed):
+            return False
+
+        for k in victims:
+            comp = self._components[k]
+            stats = self._stats[comp.stage]
+            start = time.time()
+            comp.offload_fn()
+            stats.offload_seconds += time.time() - start
+            stats.evictions += 1
+            self._resident.pop(k, None)
+            logger.info(f"[ModelResidencyManager] Evicted {k} ({comp.nbytes / 1024**3:.2f} GB)")
+
+        if victims and self._release_memory_fn is not None:
+            self._release_memory_fn()
+        return not over_budget(resident_total - freed, 0)
+
+    def evict_all(self) -> None:
+        """Offload every resident, unpinned component that is not in use."""
+        with self._lock:
+            for key in list(self._resident):
+                self._wait_prefetch(key)
+            self._make_room(self.budget_bytes + 1, exclude="")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-stage counters plus current residency."""
+        with self._lock:
+            return {
+                "device": str(self.device),
+                "budget_gb": round(self.budget_bytes / 1024**3, 3),
+                "resident_gb": round(self.resident_bytes() / 1024**3, 3),
+                "resident": list(self._resident),
+                "stages": {stage: s.as_dict() for stage, s in self._stats.items()},
+            }
+
+
+_managers: Dict[str, ModelResidencyManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_residency_manager(
+    device: str,
+    budget_bytes: int,
+    release_memory_fn: Optional[Callable[[], None]] = None,
+) -> ModelResidencyManager:
+    """Get the shared residency manager for a device, creating it on first use."""
+    key = str(torch.device(device))
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = ModelResidencyManager(device, budget_bytes, release_memory_fn)
+            _managers[key] = manager
+            logger.info(f"[ModelResidencyManager] VRAM budget for {key}: {budget_bytes / 1024**3:.2f} GB")
+        return manager
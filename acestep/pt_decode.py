@@ -0,0 +1,183 @@
+"""Preallocated decode state for the PyTorch LM backend
+
+The custom PT generation loops (CFG and constrained decoding) used to grow
+the token ids and attention mask with torch.cat and carry HF dynamic
+past_key_values every step, i.e. O(n^2) copies over a 1000+ step codes
+generation. PtDecodeState allocates everything once, at prompt length +
+max_new_tokens:
+- token ids / attention mask buffers, written in place (loops see views)
+- a KV cache written in place, in one of two layouts:
+  - eager (default): InPlaceKVCache, which attends over the filled prefix only.
+    Cheapest without compilation, notably on CPU.
+  - compiled: a transformers StaticCache. Every decode step has fixed shapes,
+    so the single-token step runs under torch.compile (CUDA graphs via
+    "reduce-overhead" on GPU).
+
+Configuration (environment):
+- ACESTEP_LM_PT_COMPILE: set to 1/true to torch.compile the decode step (default off;
+  compilation takes a while and is recompiled per batch size / cache length)
+"""
+
+import os
+from typing import Any, Callable, Optional
+
+import torch
+from loguru import logger
+
+from transformers import DynamicCache, StaticCache
+
+
+def compile_step_enabled() -> bool:
+    return os.environ.get("ACESTEP_LM_PT_COMPILE", "false").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def compile_decode_step(model: Any) -> Callable[..., Any]:
+    """torch.compile a model's forward for the fixed-shape single-token decode step."""
+    mode = "reduce-overhead" if next(model.parameters()).is_cuda else "default"
+    logger.info(f"[PtDecodeState] Compiling LM decode step (mode={mode})")
+    return torch.compile(model.forward, mode=mode, dynamic=False)
+
+
+class InPlaceKVCache(DynamicCache):
+    """
+    DynamicCache whose per-layer keys/values live in buffers preallocated to max_length.
+
+    update() copies the new states into the buffers and exposes the filled prefix as a
+    view, so attention covers only the positions seen so far (like the dynamic cache)
+    without its per-step torch.cat of the whole cache.
+    """
+
+    def __init__(self, max_length: int):
+        super().__init__()
+        self.max_length = max_length
+        self._buffers = []
+        self._lengths = []
+
+    def update(self, key_states, value_states, layer_idx, cache_kwargs=None):
+        if layer_idx == len(self._buffers):
+            batch_size, num_heads, _, _ = key_states.shape
+            self._buffers.append((
+                key_states.new_empty(batch_size, num_heads, self.max_length, key_states.shape[-1]),
+                value_states.new_empty(batch_size, num_heads, self.max_length, value_states.shape[-1]),
+            ))
+            self._lengths.append(0)
+        key_buffer, value_buffer = self._buffers[layer_idx]
+        start = self._lengths[layer_idx]
+        end = start + key_states.shape[-2]
+        key_buffer[:, :, start:end] = key_states
+        value_buffer[:, :, start:end] = value_states
+        self._lengths[layer_idx] = end
+        keys, values = key_buffer[:, :, :end], value_buffer[:, :, :end]
+
+        # Publish the views where the rest of transformers reads the cache from
+        if hasattr(self, "layers"):
+            # transformers >= 4.56: per-layer cache objects
+            while len(self.layers) <= layer_idx:
+                self.layers.append(self.layer_class_to_replicate())
+            layer = self.layers[layer_idx]
+            if not layer.is_initialized:
+                layer.lazy_initialization(key_states)
+            layer.keys, layer.values = keys, values
+        else:
+            if layer_idx == 0 and hasattr(self, "_seen_tokens"):
+                self._seen_tokens += key_states.shape[-2]
+            if len(self.key_cache) <= layer_idx:
+                self.key_cache.append(keys)
+                self.value_cache.append(values)
+            else:
+                self.key_cache[layer_idx] = keys
+                self.value_cache[layer_idx] = values
+        return keys, values
+
+
+class PtDecodeState:
+    """Token / mask buffers and KV cache of one PT generation, preallocated to the final length."""
+
+    def __init__(
+        self,
+        model: Any,
+        input_ids: torch.Tensor,
+        attention_mask: Optional[torch.Tensor],
+        max_new_tokens: int,
+        pad_token_id: int,
+        step_fn: Optional[Callable[..., Any]] = None,
+    ):
+        """
+        Args:
+            model: HF causal LM
+            input_ids: [batch, prompt_len] prompt token ids
+            attention_mask: [batch, prompt_len] prompt mask, or None for all ones
+            max_new_tokens: Max tokens appended after the prompt
+            pad_token_id: Fill value of the unwritten token positions
+            step_fn: Compiled replacement for model.forward in decode steps (see
+                compile_decode_step()); switches the KV cache to the fixed-shape StaticCache
+        """
+        self.model = model
+        batch_size, self.prompt_length = input_ids.shape
+        self.max_length = self.prompt_length + max_new_tokens
+        self.length = self.prompt_length
+        device = input_ids.device
+
+        self.token_ids = torch.full((batch_size, self.max_length), pad_token_id, dtype=input_ids.dtype, device=device)
+        self.token_ids[:, :self.prompt_length] = input_ids
+        # Positions not yet generated are 1 here; causal masking hides them until written
+        self.attention_mask = torch.ones((batch_size, self.max_length), dtype=torch.long, device=device)
+        if attention_mask is not None:
+            self.attention_mask[:, :self.prompt_length] = attention_mask
+
+        self.compiled = step_fn is not None
+        self.step_fn = step_fn if self.compiled else model.forward
+        if self.compiled:
+            # Keyword arguments cover both the old (max_batch_size/device/dtype) and the
+            # newer lazily-initialized StaticCache signatures
+            self.past_key_values = StaticCache(
+                config=model.config,
+                max_batch_size=batch_size,
+                max_cache_len=self.max_length,
+                device=device,
+                dtype=next(model.parameters()).dtype,
+            )
+        else:
+            self.past_key_values = InPlaceKVCache(self.max_length)
+        self._cache_position = torch.zeros(1, dtype=torch.long, device=device)
+
+    @property
+    def generated_ids(self) -> torch.Tensor:
+        """[batch, current_length] view of prompt + generated tokens."""
+        return self.token_ids[:, :self.length]
+
+    def _mask(self) -> torch.Tensor:
+        # The static cache covers max_length positions; the in-place one only what was seen
+        return self.attention_mask if self.compiled else self.attention_mask[:, :self.length]
+
+    def prefill(self) -> torch.Tensor:
+        """Run the prompt through the model; returns next-token logits [batch, vocab]."""
+        outputs = self.model(
+            input_ids=self.generated_ids,
+            attention_mask=self._mask(),
+            past_key_values=self.past_key_values,
+            cache_position=torch.arange(self.length, device=self.token_ids.device),
+            use_cache=True,
+            logits_to_keep=1,
+        )
+        return outputs.logits[:, -1, :]
+
+    def append(self, tokens: torch.Tensor) -> None:
+        """Write one token per row ([batch]) in place."""
+        self.token_ids[:, self.length] = tokens
+        self.length += 1
+
+    def step(self) -> torch.Tensor:
+        """Run the last appended token through the model; returns next-token logits [batch, vocab]."""
+        self._cache_position.fill_(self.length - 1)
+        outputs = self.step_fn(
+            input_ids=self.token_ids[:, self.length - 1:self.length],
+            attention_mask=self._mask(),
+            past_key_values=self.past_key_values,
+            cache_position=self._cache_position,
+            use_cache=True,
+        )
+        if self.compiled:
+            # CUDA-graph outputs are overwritten by the next replay; callers edit logits in place
+            return outputs.logits[:, -1, :].clone()
+        return outputs.logits[:, -1, :]
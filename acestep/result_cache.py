@@ -0,0 +1,225 @@
+"""Request coalescing and result cache for deterministic generation requests
+
+Bots, UIs and client retries often submit the exact same generation request
+while it is still running, or again shortly after it finished. When every
+audio item has a pinned seed the output is fully determined by the request,
+so running it again only burns GPU time. GenerationResultCache keys such
+requests on a hash of their parameters (audio_utils.generate_uuid_from_params)
+and lets the API server:
+- attach an identical request to the job already queued/running for that key
+- answer with the finished job of a cached result (while its audio files
+  still exist) instead of queueing a new one
+
+Requests with use_random_seed, a negative seed or more than one audio item
+(only the first item uses the given seed, the rest are random) are never
+coalesced: each of them is meant to produce new audio. Neither are requests
+that sample from the 5Hz LM at a temperature above 0 (thinking, sample mode,
+sample_query, format, or CoT metadata completion when metas are missing): the
+seed only pins the DiT noise, the LM calls of a single-item job are unseeded.
+
+Configuration (environment):
+- ACESTEP_RESULT_CACHE: set to 0/false to disable coalescing and caching
+- ACESTEP_RESULT_CACHE_MAX_ENTRIES: max cached results, least recently used are evicted (default 256)
+- ACESTEP_RESULT_CACHE_TTL_SECONDS: how long a finished result is served (default 3600)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from acestep.audio_utils import generate_uuid_from_params
+
+# Request fields naming server-side input files; their size/mtime is part of the key
+_FILE_FIELDS = ("reference_audio_path", "src_audio_path")
+# Metadata fields; CoT completion (LM phase 1) only runs when one of them is missing
+_META_FIELDS = ("bpm", "key_scale", "time_signature", "audio_duration")
+
+
+def _samples_lm(params: Dict[str, Any]) -> bool:
+    """True if the request draws unseeded samples from the 5Hz LM."""
+    try:
+        if float(params.get("lm_temperature", 0.85)) <= 0:
+            return False  # Greedy decoding is deterministic
+    except (TypeError, ValueError):
+        return True
+    if params.get("thinking") or params.get("sample_mode") or params.get("use_format"):
+        return True
+    if str(params.get("sample_query") or "").strip():
+        return True
+    if params.get("use_cot_caption", True) or params.get("use_cot_language", True):
+        return not all(params.get(field) for field in _META_FIELDS)
+    return False
+
+
+class _CachedResult:
+    __slots__ = ("job_id", "result", "files", "expires_at")
+
+    def __init__(self, job_id: str, result: Dict[str, Any], files: List[str], expires_at: float):
+        self.job_id = job_id
+        self.result = result
+        self.files = files
+        self.expires_at = expires_at
+
+
+class GenerationResultCache:
+    """Coalesces identical deterministic generation requests and caches their finished jobs."""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600.0, enabled: bool = True):
+        """
+        Args:
+            max_entries: Max cached results (0 keeps coalescing of in-flight requests only)
+            ttl_seconds: How long a finished result is served after completion
+            enabled: False disables both coalescing and caching
+        """
+        self.max_entries = max(0, int(max_entries))
+        self.ttl_seconds = max(0.0, float(ttl_seconds))
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._results: "OrderedDict[str, _CachedResult]" = OrderedDict()
+        self._inflight: Dict[str, str] = {}  # key -> job_id
+        self._job_keys: Dict[str, str] = {}  # job_id -> key
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def request_key(self, params: Dict[str, Any], batch_size: int) -> Optional[str]:
+        """
+        Coalescing key of a generation request, or None if its output is not deterministic.
+
+        Args:
+            params: Request parameters (JSON-serializable)
+            batch_size: Number of audio items the request generates
+
+        Returns:
+            Parameter hash, or None if the request must always run on its own
+        """
+        if not self.enabled or batch_size != 1:
+            return None
+        if params.get("use_random_seed", True):
+            return None
+        try:
+            if int(params.get("seed", -1)) < 0:
+                return None
+        except (TypeError, ValueError):
+            return None
+        if _samples_lm(params):
+            return None
+
+        keyed = dict(params)
+        for field in _FILE_FIELDS:
+            path = params.get(field)
+            if not path:
+                continue
+            # Same path, different content must not share a result
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            keyed[f"{field}_stat"] = [st.st_size, st.st_mtime_ns]
+        try:
+            return generate_uuid_from_params(keyed)
+        except (TypeError, ValueError):
+            return None
+
+    def attach(self, key: str) -> Optional[str]:
+        """Job ID of the queued/running job for key, if any (the caller joins that job)."""
+        with self._lock:
+            job_id = self._inflight.get(key)
+            if job_id is not None:
+                self.coalesced += 1
+            return job_id
+
+    def get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Finished job for key, if its result is cached, unexpired and its audio files still exist.
+
+        Returns:
+            (job_id, result) of the job that produced the result, or None
+        """
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                del self._results[key]
+                self.expirations += 1
+                entry = None
+            if entry is not None and not all(os.path.exists(p) for p in entry.files):
+                del self._results[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return entry.job_id, entry.result
+
+    def discard(self, key: str) -> None:
+        """Forget the cached result for key (e.g. its job record is gone)."""
+        with self._lock:
+            self._results.pop(key, None)
+
+    def register(self, key: str, job_id: str) -> None:
+        """Record job_id as the in-flight job for key."""
+        with self._lock:
+            self._inflight[key] = job_id
+            self._job_keys[job_id] = key
+
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, files: Iterable[str] = ()) -> None:
+        """
+        Mark a job done; a successful result is cached for its key.
+
+        Args:
+            job_id: Job passed to register() (other jobs are ignored)
+            result: Job result, or None if the job failed
+            files: Local audio files the result refers to; the entry is dropped once one is gone
+        """
+        with self._lock:
+            key = self._job_keys.pop(job_id, None)
+            if key is None:
+                return
+            if self._inflight.get(key) == job_id:
+                del self._inflight[key]
+            if result is None or self.max_entries == 0 or self.ttl_seconds == 0:
+                return
+            now = time.time()
+            self._results.pop(key, None)
+            self._results[key] = _CachedResult(job_id, result, list(files), now + self.ttl_seconds)
+            for stale in [k for k, e in self._results.items() if e.expires_at <= now]:
+                del self._results[stale]
+                self.expirations += 1
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+                self.evictions += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "entries": len(self._results),
+                "inflight": len(self._inflight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+def create_generation_result_cache() -> GenerationResultCache:
+    """Create a GenerationResultCache configured from ACESTEP_RESULT_CACHE* environment variables."""
+    return GenerationResultCache(
+        max_entries=int(os.environ.get("ACESTEP_RESULT_CACHE_MAX_ENTRIES", "256")),
+        ttl_seconds=float(os.environ.get("ACESTEP_RESULT_CACHE_TTL_SECONDS", "3600")),
+        enabled=os.environ.get("ACESTEP_RESULT_CACHE", "true").strip().lower() not in {"0", "false", "no", "off"},
+    )
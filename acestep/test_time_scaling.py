@@ -112,38 +112,60 @@ def _get_logits_and_target_for_scoring(llm_handler, formatted_prompt: str,
     return target_logits, target_ids
 
 
+def _score_targets(llm_handler,
+                   pairs: List[Tuple[str, str]],
+                   topk: int = 0) -> List[Dict[str, Any]]:
+    """
+    Score (formatted_prompt, target_text) pairs.
+
+    With the vllm backend all pairs go to the nano-vllm engine in one prefill-only call
+    (shared prompt prefixes reuse KV); with the pt backend each pair runs its own forward.
+
+    Returns:
+        One dict per pair with "target_ids", "token_logprobs" and "topk_token_ids"
+    """
+    if llm_handler.llm_backend == "vllm":
+        return llm_handler.score_prompt_targets(pairs, top_k=topk)
+
+    results = []
+    for formatted_prompt, target_text in pairs:
+        pred_logits, target_ids = _get_logits_and_target_for_scoring(llm_handler, formatted_prompt, target_text)
+        if target_ids.shape[0] == 0:
+            results.append({"target_ids": [], "token_logprobs": [], "topk_token_ids": []})
+            continue
+        # FIX: Do not divide by temperature.
+        # Log-probability for PMI/Perplexity should be exact.
+        log_probs = F.log_softmax(pred_logits.float(), dim=-1)  # [target_len, vocab_size]
+        target_log_probs = log_probs[torch.arange(target_ids.shape[0]), target_ids]
+        topk_indices = torch.topk(pred_logits, k=min(topk, pred_logits.shape[-1]), dim=-1).indices if topk > 0 else None
+        results.append({
+            "target_ids": target_ids.tolist(),
+            "token_logprobs": target_log_probs.tolist(),
+            "topk_token_ids": topk_indices.tolist() if topk_indices is not None else [],
+        })
+    return results
+
+
 # ==============================================================================
 # Scoring Logic
 # ==============================================================================
 
 
-def _calculate_topk_recall(llm_handler,
-                           formatted_prompt: str,
-                           target_text: str,
-                           topk: int = 10) -> Tuple[float, Dict[int, float]]:
+def _topk_recall(score: Dict[str, Any], topk: int = 10) -> Tuple[float, Dict[int, float]]:
     """
-    Calculate top-k recall for target text given prompt.
+    Calculate top-k recall of a scored target.
     Checks if the ground truth token is within the top-k probabilities at each step.
     """
-    # Use the fixed helper to get aligned logits/labels
-    pred_logits, target_ids = _get_logits_and_target_for_scoring(llm_handler, formatted_prompt, target_text)
+    target_ids_list = score["target_ids"]
+    topk_indices_list = score["topk_token_ids"]
+    target_len = len(target_ids_list)
 
-    if target_ids.shape[0] == 0:
+    if target_len == 0:
         return 0.0, {}
 
-    target_len = target_ids.shape[0]
-
-    # Get top-k indices for all positions at once
-    # topk_indices: [target_len, topk]
-    _, topk_indices = torch.topk(pred_logits, k=min(topk, pred_logits.shape[-1]), dim=-1)
-
     recall_per_k = {}
     position_scores = []
 
-    # Convert to list for faster CPU iteration
-    target_ids_list = target_ids.tolist()
-    topk_indices_list = topk_indices.tolist()
-
     for k in range(1, topk + 1):
         hits = 0
         for pos in range(target_len):
@@ -171,61 +193,20 @@ def _calculate_topk_recall(llm_handler,
     return average_recall, recall_per_k
 
 
-def _calculate_metadata_recall(llm_handler,
-                               formatted_prompt: str,
-                               fields_dict: Dict[str, Any],
-                               topk: int = 10) -> Dict[str, float]:
+def _mean_log_prob(score: Dict[str, Any]) -> float:
     """
-    Args:
-        fields_dict: Dictionary of {field_name: field_value}
+    Average log probability of a scored target.
     """
-    if not fields_dict:
-        return {}
-
-    field_scores = {}
-
-    for field_name in sorted(fields_dict.keys()):
-        # Construct target text for this specific field
-        # e.g. <think>\nbpm: 120\n</think>\n
-        field_yaml = yaml.dump({field_name: fields_dict[field_name]}, allow_unicode=True, sort_keys=True).strip()
-        field_target_text = f"<think>\n{field_yaml}\n</think>\n"
-
-        # Calculate recall using the robust logic
-        avg_score, _ = _calculate_topk_recall(llm_handler, formatted_prompt, field_target_text, topk=topk)
-
-        field_scores[field_name] = avg_score
-        logger.debug(f"Recall for {field_name}: {avg_score:.4f}")
-
-    return field_scores
-
-
-def _calculate_log_prob(
-        llm_handler,
-        formatted_prompt: str,
-        target_text: str,
-        temperature: float = 1.0  # Kept for API compatibility, but ignored for scoring
-) -> float:
-    """
-    Calculate average log probability of target text given prompt.
-    """
-    pred_logits, target_ids = _get_logits_and_target_for_scoring(llm_handler, formatted_prompt, target_text)
-
-    if target_ids.shape[0] == 0:
+    token_logprobs = score["token_logprobs"]
+    if not token_logprobs:
         return float('-inf')
+    return sum(token_logprobs) / len(token_logprobs)
 
-    # FIX: Do not divide by temperature.
-    # Log-probability for PMI/Perplexity should be exact.
-
-    # Calculate log probabilities (log_softmax)
-    log_probs = F.log_softmax(pred_logits, dim=-1)  # [target_len, vocab_size]
-
-    # Gather log probabilities of the ground truth tokens
-    target_log_probs = log_probs[torch.arange(target_ids.shape[0]), target_ids]
-
-    # Return average log probability
-    mean_log_prob = target_log_probs.mean().item()
 
-    return mean_log_prob
+def _cot_target_text(key: str, value: Any) -> str:
+    # e.g. <think>\nbpm: 120\n</think>\n
+    field_yaml = yaml.dump({key: value}, allow_unicode=True, sort_keys=True).strip()
+    return f"<think>\n{field_yaml}\n</think>\n"
 
 
 def calculate_reward_score(
@@ -350,41 +331,43 @@ def calculate_pmi_score_per_condition(
 
     formatted_prompt = llm_handler.build_formatted_prompt_for_understanding(audio_codes=audio_codes, is_negative_prompt=False)
     prompt_uncond = llm_handler.build_formatted_prompt_for_understanding(audio_codes="NO USER INPUT", is_negative_prompt=False)
+    # Define which fields use which metric
+    metadata_recall_keys = ['bpm', 'duration', 'genres', 'keyscale', 'language', 'timesignature']
+    metadata_pmi_keys = ['caption']
     try:
-        # 1. Calculate Recall for Metadata Fields
+        # Collect every scoring request for this candidate, then score them in one call:
+        # - recall: (prompt, target) for each metadata field
+        # - pmi: conditional and unconditional (prompt, target) for caption and lyrics
+        recall_targets = {}
+        pmi_targets = {}
         if metadata and isinstance(metadata, dict):
-            scores = {}
-            # Define which fields use which metric
-            metadata_recall_keys = ['bpm', 'duration', 'genres', 'keyscale', 'language', 'timesignature']
-            metadata_pmi_keys = ['caption']
             for key in metadata_recall_keys:
                 if key in metadata and metadata[key] is not None:
-                    recall_metadata = {key: metadata[key]}
-                    field_scores = _calculate_metadata_recall(llm_handler, formatted_prompt, recall_metadata, topk=topk)
-                    scores.update(field_scores)
-
-            # 2. Calculate PMI for Caption
+                    recall_targets[key] = _cot_target_text(key, metadata[key])
             for key in metadata_pmi_keys:
                 if key in metadata and metadata[key] is not None:
-                    cot_yaml = yaml.dump({key: metadata[key]}, allow_unicode=True, sort_keys=True).strip()
-                    target_text = f"<think>\n{cot_yaml}\n</think>\n"
-
-                    log_prob_cond = _calculate_log_prob(llm_handler, formatted_prompt, target_text)
-                    log_prob_uncond = _calculate_log_prob(llm_handler, prompt_uncond, target_text)
-
-                    pmi_normalized = pmi_to_normalized_score(log_prob_cond - log_prob_uncond, scale=score_scale)
-                    scores[key] = pmi_normalized
-
-        # 3. Calculate PMI for Lyrics
+                    pmi_targets[key] = _cot_target_text(key, metadata[key])
         if lyrics:
-            target_text = f"<think>\n</think>\n# Lyric\n{lyrics}\n"
-
-            log_prob_cond = _calculate_log_prob(llm_handler, formatted_prompt, target_text)
-
-            prompt_uncond = llm_handler.build_formatted_prompt_for_understanding(audio_codes="NO USER INPUT", is_negative_prompt=False)
-            log_prob_uncond = _calculate_log_prob(llm_handler, prompt_uncond, target_text)
-
-            scores['lyrics'] = pmi_to_normalized_score(log_prob_cond - log_prob_uncond, scale=score_scale)
+            pmi_targets['lyrics'] = f"<think>\n</think>\n# Lyric\n{lyrics}\n"
+
+        pairs = [(formatted_prompt, target) for target in recall_targets.values()]
+        for target in pmi_targets.values():
+            pairs.append((formatted_prompt, target))
+            pairs.append((prompt_uncond, target))
+        results = iter(_score_targets(llm_handler, pairs, topk=topk if recall_targets else 0))
+
+        # 1. Recall for Metadata Fields
+        scores = {}
+        for key in recall_targets:
+            avg_score, _ = _topk_recall(next(results), topk=topk)
+            scores[key] = avg_score
+            logger.debug(f"Recall for {key}: {avg_score:.4f}")
+
+        # 2. PMI for Caption and Lyrics
+        for key in pmi_targets:
+            log_prob_cond = _mean_log_prob(next(results))
+            log_prob_uncond = _mean_log_prob(next(results))
+            scores[key] = pmi_to_normalized_score(log_prob_cond - log_prob_uncond, scale=score_scale)
 
         if not scores:
             return {}, 0.0, "❌ No conditions to evaluate"
@@ -1,7 +1,11 @@
+import argparse
 import os
 import time
 from random import randint, seed
+from types import SimpleNamespace
 from nanovllm import LLM, SamplingParams
+from nanovllm.engine.scheduler import Scheduler
+from nanovllm.engine.sequence import Sequence
 # from vllm import LLM, SamplingParams
 
 
@@ -28,5 +32,40 @@ def main():
     print(f"Total: {total_tokens}tok, Time: {t:.2f}s, Throughput: {throughput:.2f}tok/s")
 
 
+def scheduler_main(num_pairs: int = 64, num_blocks: int = 4096, max_ouput_len: int = 1024):
+    """CPU-only benchmark of scheduling + block management for CFG pairs (no model, no GPU)."""
+    seed(0)
+    config = SimpleNamespace(max_num_seqs=512, max_num_batched_tokens=65536, eos=-1,
+                             num_kvcache_blocks=num_blocks, kvcache_block_size=256)
+    scheduler = Scheduler(config)
+    # Shared caption/lyrics-like prefix so the prefix cache is exercised too
+    prefix = [randint(0, 10000) for _ in range(512)]
+    for _ in range(num_pairs):
+        sp = SamplingParams(temperature=0.6, cfg_scale=2.0, ignore_eos=True, max_tokens=randint(100, max_ouput_len))
+        prompt = prefix + [randint(0, 10000) for _ in range(randint(100, 512))]
+        cond = Sequence(prompt, sp)
+        uncond = Sequence(prompt, sp, is_unconditional=True, conditional_seq=cond)
+        cond.paired_seq = uncond
+        scheduler.add(cond)
+        scheduler.add(uncond)
+
+    steps = 0
+    t = time.perf_counter()
+    while not scheduler.is_finished():
+        seqs, is_prefill = scheduler.schedule()
+        num_cond = sum(not s.is_unconditional for s in seqs)
+        scheduler.postprocess(seqs, [randint(0, 10000) for _ in range(num_cond)])
+        steps += 1
+    t = time.perf_counter() - t
+    print(f"Scheduler: {num_pairs} CFG pairs, {num_blocks} blocks, {steps} steps, "
+          f"Time: {t:.2f}s, {t / steps * 1e6:.1f}us/step")
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scheduler", action="store_true", help="CPU-only scheduler/block manager microbenchmark")
+    args = parser.parse_args()
+    if args.scheduler:
+        scheduler_main()
+    else:
+        main()
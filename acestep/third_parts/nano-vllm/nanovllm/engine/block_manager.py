@@ -1,4 +1,4 @@
-from collections import deque
+from collections import OrderedDict
 import xxhash
 import numpy as np
 
@@ -29,91 +29,202 @@ class BlockManager:
         self.block_size = block_size
         self.blocks: list[Block] = [Block(i) for i in range(num_blocks)]
         self.hash_to_block_id: dict[int, int] = dict()
-        self.free_block_ids: deque[int] = deque(range(num_blocks))
+        # Ordered sets of unreferenced block ids (O(1) removal of any id, O(1) take-oldest):
+        # - free: blank blocks
+        # - evictable: freed blocks that still hold a full, hashed block of KV. They keep their
+        #   hash_to_block_id entry so later requests with the same prefix reuse them, and are
+        #   reclaimed least recently freed first, only once the free list runs dry
+        self.free_block_ids: OrderedDict[int, None] = OrderedDict.fromkeys(range(num_blocks))
+        self.evictable_block_ids: OrderedDict[int, None] = OrderedDict()
         self.used_block_ids: set[int] = set()
+        # Blocks hashed since the last commit_hashes(). Their hash is published at allocation
+        # (so sequences prefilled in the same batch share them), but their KV is only written
+        # by the next model run; if that run fails they must not stay reachable by hash
+        self.uncommitted_block_ids: set[int] = set()
+        # Prefix-cache counters (prompt allocations, preemption re-allocations included)
+        self.num_lookup_tokens = 0
+        self.num_hit_tokens = 0
+        self.num_evicted_blocks = 0
+
+    @property
+    def num_free_blocks(self) -> int:
+        """Blocks available for allocation (blank + evictable)."""
+        return len(self.free_block_ids) + len(self.evictable_block_ids)
 
     @classmethod
     def compute_hash(cls, token_ids: list[int], prefix: int = -1):
         h = xxhash.xxh64()
         if prefix != -1:
             h.update(prefix.to_bytes(8, "little"))
-        h.update(np.array(token_ids).tobytes())
+        h.update(np.array(token_ids, dtype=np.int64).tobytes())
         return h.intdigest()
 
+    def block_hash(self, seq: Sequence, i: int) -> int:
+        """Rolling hash of full block i of seq, computed once and kept on the sequence."""
+        hashes = seq.block_hashes
+        while len(hashes) <= i:
+            j = len(hashes)
+            hashes.append(self.compute_hash(seq.block(j), hashes[-1] if hashes else -1))
+        return hashes[i]
+
     def _allocate_block(self, block_id: int) -> Block:
         block = self.blocks[block_id]
         assert block.ref_count == 0
         block.reset()
-        self.free_block_ids.remove(block_id)
+        if block_id in self.free_block_ids:
+            del self.free_block_ids[block_id]
+        else:
+            del self.evictable_block_ids[block_id]
         self.used_block_ids.add(block_id)
-        return self.blocks[block_id]
+        return block
+
+    def _allocate_free_block(self) -> Block:
+        if self.free_block_ids:
+            return self._allocate_block(next(iter(self.free_block_ids)))
+        # Free list ran dry: reclaim the least recently freed cached block
+        block_id = next(iter(self.evictable_block_ids))
+        block = self.blocks[block_id]
+        if self.hash_to_block_id.get(block.hash) == block_id:
+            del self.hash_to_block_id[block.hash]
+        self.num_evicted_blocks += 1
+        return self._allocate_block(block_id)
 
     def _deallocate_block(self, block_id: int) -> Block:
-        assert self.blocks[block_id].ref_count == 0
+        block = self.blocks[block_id]
+        assert block.ref_count == 0
         self.used_block_ids.remove(block_id)
-        self.free_block_ids.append(block_id)
+        if block_id in self.uncommitted_block_ids:
+            # Freed before its KV was computed (e.g. preempted while scheduling): unpublish
+            self.uncommitted_block_ids.discard(block_id)
+            if self.hash_to_block_id.get(block.hash) == block_id:
+                del self.hash_to_block_id[block.hash]
+        if block.hash != -1 and self.hash_to_block_id.get(block.hash) == block_id:
+            self.evictable_block_ids[block_id] = None
+        else:
+            # Not reachable through the prefix cache: nothing worth keeping
+            block.hash = -1
+            block.token_ids = []
+            self.free_block_ids[block_id] = None
+
+    def _touch_cached_block(self, block_id: int) -> Block:
+        """Take a reference on a prefix-cache hit (in use, or back from the evictable pool)."""
+        block = self.blocks[block_id]
+        if block_id in self.used_block_ids:
+            block.ref_count += 1
+        else:
+            del self.evictable_block_ids[block_id]
+            block.ref_count = 1
+            self.used_block_ids.add(block_id)
+        return block
 
     def can_allocate(self, seq: Sequence) -> bool:
-        return len(self.free_block_ids) >= seq.num_blocks
+        return self.num_free_blocks >= seq.num_blocks
 
-    def allocate(self, seq: Sequence):
+    def allocate(self, seq: Sequence, max_cached_tokens: int | None = None):
+        """Allocate blocks for seq, reusing prefix-cache blocks for at most max_cached_tokens tokens."""
         assert not seq.block_table
-        h = -1
+        num_full_blocks = len(seq) // self.block_size
+        num_cacheable_blocks = num_full_blocks if max_cached_tokens is None else min(num_full_blocks, max_cached_tokens // self.block_size)
         cache_miss = False
         for i in range(seq.num_blocks):
             token_ids = seq.block(i)
-            h = self.compute_hash(token_ids, h) if len(token_ids) == self.block_size else -1
-            block_id = self.hash_to_block_id.get(h, -1)
+            h = self.block_hash(seq, i) if i < num_full_blocks else -1
+            block_id = -1 if cache_miss or i >= num_cacheable_blocks else self.hash_to_block_id.get(h, -1)
             if block_id == -1 or self.blocks[block_id].token_ids != token_ids:
                 cache_miss = True
+            elif i == seq.num_blocks - 1:
+                # Fully cached prompt: recompute the last block so prefill still has a token to run
+                cache_miss = True
             if cache_miss:
-                block_id = self.free_block_ids[0]
-                block = self._allocate_block(block_id)
+                block = self._allocate_free_block()
+                block_id = block.block_id
             else:
                 seq.num_cached_tokens += self.block_size
-                if block_id in self.used_block_ids:
-                    block = self.blocks[block_id]
-                    block.ref_count += 1
-                else:
-                    block = self._allocate_block(block_id)
+                block = self._touch_cached_block(block_id)
             if h != -1:
                 block.update(h, token_ids)
                 self.hash_to_block_id[h] = block_id
+                if cache_miss:
+                    self.uncommitted_block_ids.add(block_id)
             seq.block_table.append(block_id)
+        self.num_lookup_tokens += len(seq)
+        self.num_hit_tokens += seq.num_cached_tokens
+
+    def commit_hashes(self):
+        """Mark the blocks hashed since the last call as holding computed KV (after a model run)."""
+        self.uncommitted_block_ids.clear()
+
+    def drop_uncommitted_hashes(self):
+        """Unpublish blocks hashed since the last commit_hashes(): the run that fills them failed."""
+        for block_id in self.uncommitted_block_ids:
+            block = self.blocks[block_id]
+            if block.hash != -1 and self.hash_to_block_id.get(block.hash) == block_id:
+                del self.hash_to_block_id[block.hash]
+            block.hash = -1
+            block.token_ids = []
+            if block_id in self.evictable_block_ids:
+                del self.evictable_block_ids[block_id]
+                self.free_block_ids[block_id] = None
+        self.uncommitted_block_ids.clear()
+
+    def _release_block(self, block_id: int):
+        block = self.blocks[block_id]
+        block.ref_count -= 1
+        if block.ref_count == 0:
+            # Hashed blocks keep their hash_to_block_id entry while in the evictable pool; the
+            # entry is dropped when the block is reclaimed (never left pointing at reused KV)
+            self._deallocate_block(block_id)
 
     def deallocate(self, seq: Sequence):
         for block_id in reversed(seq.block_table):
-            block = self.blocks[block_id]
-            block.ref_count -= 1
-            if block.ref_count == 0:
-                # Fix: Clean up hash_to_block_id mapping to prevent stale references
-                # This prevents CUDA illegal memory access when prefix cache tries to
-                # reuse a block_id that has already been freed
-                if block.hash != -1:
-                    cached_id = self.hash_to_block_id.get(block.hash)
-                    if cached_id == block_id:
-                        del self.hash_to_block_id[block.hash]
-                self._deallocate_block(block_id)
+            self._release_block(block_id)
         seq.num_cached_tokens = 0
         seq.block_table.clear()
 
+    def retain(self, seq: Sequence) -> list[int]:
+        """Take an extra reference on the full, hashed prompt blocks of a prefilled sequence.
+
+        Retained blocks (and their prefix-cache entries) outlive the sequence until
+        release() is called, so a follow-up request with the same prompt prefix reuses them.
+        """
+        block_ids = []
+        for i in range(seq.num_prompt_tokens // self.block_size):
+            block = self.blocks[seq.block_table[i]]
+            if block.hash == -1:
+                break
+            block.ref_count += 1
+            block_ids.append(block.block_id)
+        return block_ids
+
+    def release(self, block_ids: list[int]):
+        for block_id in reversed(block_ids):
+            self._release_block(block_id)
+
+    def get_prefix_cache_stats(self) -> dict:
+        return {
+            "lookup_tokens": self.num_lookup_tokens,
+            "hit_tokens": self.num_hit_tokens,
+            "hit_rate": round(self.num_hit_tokens / self.num_lookup_tokens, 4) if self.num_lookup_tokens else 0.0,
+            "used_blocks": len(self.used_block_ids),
+            "cached_blocks": len(self.evictable_block_ids),
+            "free_blocks": len(self.free_block_ids),
+            "evicted_blocks": self.num_evicted_blocks,
+        }
+
     def can_append(self, seq: Sequence) -> bool:
-        return len(self.free_block_ids) >= (len(seq) % self.block_size == 1)
+        return self.num_free_blocks >= (len(seq) % self.block_size == 1)
 
     def may_append(self, seq: Sequence):
         block_table = seq.block_table
         last_block = self.blocks[block_table[-1]]
         if len(seq) % self.block_size == 1:
             assert last_block.hash != -1
-            block_id = self.free_block_ids[0]
-            self._allocate_block(block_id)
-            block_table.append(block_id)
+            block_table.append(self._allocate_free_block().block_id)
         elif len(seq) % self.block_size == 0:
             assert last_block.hash == -1
-            token_ids = seq.block(seq.num_blocks-1)
-            prefix = self.blocks[block_table[-2]].hash if len(block_table) > 1 else -1
-            h = self.compute_hash(token_ids, prefix)
-            last_block.update(h, token_ids)
+            h = self.block_hash(seq, seq.num_blocks - 1)
+            last_block.update(h, seq.block(seq.num_blocks - 1))
             self.hash_to_block_id[h] = last_block.block_id
+            self.uncommitted_block_ids.add(last_block.block_id)
         else:
             assert last_block.hash == -1
@@ -2,6 +2,7 @@ import atexit
 import re
 from dataclasses import fields
 from time import perf_counter
+from typing import Callable
 from tqdm.auto import tqdm
 from transformers import AutoTokenizer
 import torch.multiprocessing as mp
@@ -36,6 +37,9 @@ class LLMEngine:
             self.tokenizer = AutoTokenizer.from_pretrained(config.model, use_fast=True)
         config.eos = self.tokenizer.eos_token_id
         self.scheduler = Scheduler(config)
+        # Prompt blocks kept alive across generate() calls (see retain_prefix_cache)
+        self.retained_block_ids: list[int] = []
+        self._retain_prefix_cache = False
         atexit.register(self.exit)
 
     def exit(self):
@@ -82,13 +86,34 @@ class LLMEngine:
             seq = Sequence(prompt, sampling_params)
             self.scheduler.add(seq)
 
+    @staticmethod
+    def _prefix_cache_usage(seq: Sequence) -> dict:
+        """Prompt / prefix-cache-hit token counts of a request (conditional + CFG unconditional)."""
+        seqs = [seq] if seq.paired_seq is None else [seq, seq.paired_seq]
+        return {
+            "num_prompt_tokens": sum(s.num_prompt_tokens for s in seqs),
+            "num_cached_tokens": sum(max(0, s.num_prefix_hit_tokens) for s in seqs),
+        }
+
     def step(self):
         seqs, is_prefill = self.scheduler.schedule()
         token_ids = self.model_runner.call("run", seqs, is_prefill)
+        # KV of the blocks hashed while scheduling this step is computed now
+        self.scheduler.block_manager.commit_hashes()
+        if is_prefill:
+            for seq in seqs:
+                if seq.num_prefix_hit_tokens < 0:
+                    seq.num_prefix_hit_tokens = seq.num_cached_tokens
+                    if self._retain_prefix_cache:
+                        # KV of the prompt blocks is computed now; keep them for the next request
+                        self.retained_block_ids.extend(self.scheduler.block_manager.retain(seq))
         self.scheduler.postprocess(seqs, token_ids)
+        for seq in seqs:
+            if seq.is_finished and hasattr(seq.logits_processor, "release_sequence"):
+                seq.logits_processor.release_sequence(seq.seq_id)
         # Only output conditional sequences (unconditional sequences are just for CFG computation)
         output_seqs = [seq for seq in seqs if seq.is_finished and (seq.cfg_scale <= 1.0 or not seq.is_unconditional)]
-        outputs = [(seq.seq_id, seq.completion_token_ids) for seq in output_seqs]
+        outputs = [(seq.seq_id, seq.completion_token_ids, self._prefix_cache_usage(seq)) for seq in output_seqs]
         num_tokens = sum(len(seq) for seq in seqs) if is_prefill else -len([s for s in seqs if not s.is_unconditional])
         return outputs, num_tokens
 
@@ -100,7 +125,10 @@ class LLMEngine:
         Reset the scheduler state and release all allocated blocks.
         This should be called when an exception occurs during generation to prevent
         KV cache block leaks that can cause 'deque index out of range' errors.
+        Blocks hashed for a step that never ran are dropped from the prefix cache first,
+        so no later request gets a cache hit on KV that was never computed.
         """
+        self.scheduler.block_manager.drop_uncommitted_hashes()
         # Deallocate all running sequences
         while self.scheduler.running:
             seq = self.scheduler.running.popleft()
@@ -119,11 +147,28 @@ class LLMEngine:
         sampling_params: SamplingParams | list[SamplingParams],
         use_tqdm: bool = True,
         unconditional_prompts: list[str] | list[list[int]] | None = None,
+        retain_prefix_cache: bool = False,
+        abort_check: Callable[[], None] | None = None,
     ) -> list[str]:
+        """
+        Generate completions for a list of prompts.
+
+        abort_check is called before every engine step; an exception raised from it
+        aborts the generation and frees the KV blocks of all its sequences at once.
+
+        With retain_prefix_cache=True the full prompt blocks of every request stay in the
+        prefix cache after this call, so a follow-up call sharing the prompt prefix (e.g.
+        the codes phase after the CoT phase) skips most of its prefill. Call
+        release_prefix_cache() once the follow-up is done.
+
+        Each output dict has "text", "token_ids", and the prompt / prefix-cache-hit token
+        counts "num_prompt_tokens" and "num_cached_tokens" (CFG unconditional prompt included).
+        """
         # Clean up any residual state from previous interrupted generations
         # This prevents 'deque index out of range' errors from accumulated block leaks
         if not self.is_finished():
             self.reset()
+        self._retain_prefix_cache = retain_prefix_cache
         
         if use_tqdm:
             pbar = tqdm(total=len(prompts), desc="Generating", dynamic_ncols=True)
@@ -137,6 +182,8 @@ class LLMEngine:
         prefill_throughput = decode_throughput = 0.
         try:
             while not self.is_finished():
+                if abort_check is not None:
+                    abort_check()
                 t = perf_counter()
                 output, num_tokens = self.step()
                 if use_tqdm:
@@ -148,8 +195,8 @@ class LLMEngine:
                         "Prefill": f"{int(prefill_throughput)}tok/s",
                         "Decode": f"{int(decode_throughput)}tok/s",
                     })
-                for seq_id, token_ids in output:
-                    outputs[seq_id] = token_ids
+                for seq_id, token_ids, usage in output:
+                    outputs[seq_id] = (token_ids, usage)
                     if use_tqdm:
                         pbar.update(1)
         except Exception:
@@ -157,9 +204,72 @@ class LLMEngine:
             self.reset()
             raise
         finally:
+            self._retain_prefix_cache = False
             if use_tqdm:
                 pbar.close()
         
         outputs = [outputs[seq_id] for seq_id in sorted(outputs.keys())]
-        outputs = [{"text": self.tokenizer.decode(token_ids), "token_ids": token_ids} for token_ids in outputs]
+        outputs = [{"text": self.tokenizer.decode(token_ids), "token_ids": token_ids, **usage} for token_ids, usage in outputs]
+        return outputs
+
+    def score(self, prompts: list[list[int]], target_starts: list[int], top_k: int = 0) -> list[dict]:
+        """
+        Prefill-only scoring of prompt tails (prompt log-probs).
+
+        prompts[i][target_starts[i]:] is scored token by token given everything before it.
+        Prompts sharing a prefix (e.g. one context scored against several targets, or the
+        same target under several contexts) share prefix KV blocks, within a batch and
+        across batches through the prefix cache.
+
+        Each output dict has "token_logprobs" (one float per target token), "topk_token_ids"
+        (the top_k predicted ids at each target position, empty if top_k == 0) and
+        "num_cached_tokens" (prompt tokens served from the prefix cache).
+        """
+        if not self.is_finished():
+            self.reset()
+        block_manager = self.scheduler.block_manager
+        seqs = [Sequence(list(prompt)) for prompt in prompts]
+        outputs = [None] * len(seqs)
+        i = 0
+        while i < len(seqs):
+            batch = []
+            num_batched_tokens = 0
+            try:
+                while i < len(seqs) and len(batch) < self.scheduler.max_num_seqs:
+                    seq, start = seqs[i], target_starts[i]
+                    assert 1 <= start <= len(seq), "target must start after the first token"
+                    fits = (num_batched_tokens + len(seq) <= self.scheduler.max_num_batched_tokens
+                            and block_manager.can_allocate(seq))
+                    if not fits:
+                        if batch:
+                            break
+                        raise RuntimeError(f"Scoring prompt of {len(seq)} tokens does not fit in the KV cache")
+                    # The positions predicting the target must be recomputed to get their logits
+                    block_manager.allocate(seq, max_cached_tokens=start - 1)
+                    num_batched_tokens += len(seq) - seq.num_cached_tokens
+                    batch.append(i)
+                    i += 1
+                num_cached_tokens = [seqs[j].num_cached_tokens for j in batch]
+                batch_outputs = self.model_runner.call(
+                    "score", [seqs[j] for j in batch], [target_starts[j] for j in batch], top_k
+                )
+                block_manager.commit_hashes()
+            finally:
+                # No-op after a successful run; otherwise the batch's new blocks hold no KV
+                block_manager.drop_uncommitted_hashes()
+                for j in batch:
+                    block_manager.deallocate(seqs[j])
+            for j, cached, output in zip(batch, num_cached_tokens, batch_outputs):
+                outputs[j] = {**output, "num_cached_tokens": cached}
         return outputs
+
+    def get_prefix_cache_stats(self) -> dict:
+        """Prefix-cache hit rate and KV block pool occupancy (used / cached-evictable / free)."""
+        stats = self.scheduler.block_manager.get_prefix_cache_stats()
+        stats["retained_blocks"] = len(self.retained_block_ids)
+        return stats
+
+    def release_prefix_cache(self):
+        """Drop the prompt blocks kept by generate(..., retain_prefix_cache=True)."""
+        self.scheduler.block_manager.release(self.retained_block_ids)
+        self.retained_block_ids = []
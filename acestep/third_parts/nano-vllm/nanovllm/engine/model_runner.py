@@ -330,6 +330,54 @@ class ModelRunner:
         
         return temperatures, cfg_scales, top_ks, top_ps, repetition_penalties
 
+    def apply_logits_processors(self, seqs: list[Sequence], logits: torch.Tensor) -> torch.Tensor:
+        """Apply per-sequence logits processors to a [B, V] logits tensor.
+
+        Processors exposing ``process_batch(seq_ids, token_ids, scores)`` keep one state
+        per sequence and are called once for all rows they own. Other processors are
+        called row by row with the sequence history as a [1, L] tensor.
+        """
+        groups = {}
+        for i, seq in enumerate(seqs):
+            processor = seq.logits_processor
+            if processor is None:
+                continue
+            if hasattr(processor, "process_batch"):
+                groups.setdefault(id(processor), (processor, []))[1].append(i)
+            else:
+                seq_input_ids = torch.tensor([seq.token_ids], device=logits.device)
+                logits[i:i+1] = processor(seq_input_ids, logits[i:i+1].clone())
+
+        for processor, rows in groups.values():
+            seq_ids = [seqs[i].seq_id for i in rows]
+            token_ids = [seqs[i].token_ids for i in rows]
+            if len(rows) == len(seqs):
+                logits = processor.process_batch(seq_ids, token_ids, logits)
+            else:
+                row_index = torch.tensor(rows, dtype=torch.long, device=logits.device)
+                logits[row_index] = processor.process_batch(seq_ids, token_ids, logits[row_index])
+        return logits
+
+    def update_logits_processors(self, seqs: list[Sequence], token_ids: list[int]):
+        """Advance logits processor state for every sequence after sampling."""
+        groups = {}
+        legacy_updates = {}
+        for seq, token_id in zip(seqs, token_ids):
+            processor = seq.logits_processor
+            if processor is not None and hasattr(processor, "update_state_batch"):
+                group = groups.setdefault(id(processor), (processor, [], []))
+                group[1].append(seq.seq_id)
+                group[2].append(token_id)
+            elif seq.logits_processor_update_state is not None:
+                # Stateful processors without per-sequence state are shared across the
+                # batch; update them once so counters don't advance N times per step
+                legacy_updates.setdefault(id(seq.logits_processor_update_state), (seq.logits_processor_update_state, token_id))
+
+        for processor, seq_ids, sampled in groups.values():
+            processor.update_state_batch(seq_ids, sampled)
+        for update_state, token_id in legacy_updates.values():
+            update_state(token_id)
+
     @torch.inference_mode()
     def run_model(self, input_ids: torch.Tensor, positions: torch.Tensor, is_prefill: bool):
         if is_prefill or self.enforce_eager or input_ids.size(0) > 512:
@@ -427,12 +475,7 @@ class ModelRunner:
                 logits_cfg = logits_uncond + cfg_scales_tensor * (logits_cond - logits_uncond)
                 
                 # Apply logits processor for constrained decoding (if any sequence has one)
-                for i, seq in enumerate(cond_seqs):
-                    if seq.logits_processor is not None:
-                        # Create input_ids tensor for this sequence
-                        seq_input_ids = torch.tensor([seq.token_ids], device=logits_cfg.device)
-                        # Apply processor to this sequence's logits
-                        logits_cfg[i:i+1] = seq.logits_processor(seq_input_ids, logits_cfg[i:i+1])
+                logits_cfg = self.apply_logits_processors(cond_seqs, logits_cfg)
                 
                 # Prepare input_ids for sampler (for repetition penalty, though we already applied it)
                 # cond_input_ids = torch.tensor([seq.token_ids for seq in cond_seqs], device=logits_cfg.device)
@@ -448,10 +491,7 @@ class ModelRunner:
                 ).tolist()
                 
                 # Update logits processor state after sampling
-                # NOTE: Only update for the first sequence since all sequences share the same processor
-                # Updating multiple times would cause duplicate state updates (e.g., codes_count += N instead of += 1)
-                if cond_seqs and cond_seqs[0].logits_processor_update_state is not None:
-                    cond_seqs[0].logits_processor_update_state(token_ids_cfg[0])
+                self.update_logits_processors(cond_seqs, token_ids_cfg)
                 
                 # Return token_ids (will be applied to both conditional and unconditional sequences)
                 return token_ids_cfg
@@ -494,14 +534,7 @@ class ModelRunner:
                 
                 # Apply logits processor for constrained decoding (if any sequence has one)
                 # Clone logits to avoid in-place update issues in inference mode
-                logits = logits.clone()
-                for i, seq in enumerate(seqs):
-                    if seq.logits_processor is not None:
-                        # Create input_ids tensor for this sequence
-                        seq_input_ids = torch.tensor([seq.token_ids], device=logits.device)
-                        # Apply processor to this sequence's logits (clone to avoid inference mode issues)
-                        processed = seq.logits_processor(seq_input_ids, logits[i:i+1].clone())
-                        logits[i] = processed[0]
+                logits = self.apply_logits_processors(seqs, logits.clone())
                 
                 # Prepare input_ids for sampler
                 # seq_input_ids = torch.tensor([seq.token_ids for seq in seqs], device=logits.device)
@@ -516,16 +549,64 @@ class ModelRunner:
                 ).tolist()
                 
                 # Update logits processor state after sampling
-                # NOTE: Only update for the first sequence since all sequences may share the same processor
-                # (when using a single SamplingParams for batch generation)
-                # Updating multiple times would cause duplicate state updates (e.g., codes_count += N instead of += 1)
-                if seqs and seqs[0].logits_processor_update_state is not None:
-                    seqs[0].logits_processor_update_state(token_ids[0])
+                self.update_logits_processors(seqs, token_ids)
                 
                 return token_ids
             else:
                 return None
 
+    @torch.inference_mode()
+    def score(self, seqs: list[Sequence], target_starts: list[int], top_k: int = 0) -> list[dict] | None:
+        """Prefill-only forward returning prompt log-probs of each sequence's target span.
+
+        For sequence i, scores every token at positions target_starts[i]..len-1 given the
+        tokens before it (teacher forcing). Tokens before target_starts[i] - 1 may come from
+        the prefix cache; the target span's predecessors must be computed in this prefill.
+        """
+        input_ids, positions = self.prepare_prefill(seqs)
+        hidden_states = self.model(input_ids, positions)
+        # Outside prefill context the LM head projects every row, not just the last per sequence
+        reset_context()
+
+        device = hidden_states.device
+        rows, target_ids, spans = [], [], []
+        offset = 0
+        for seq, start in zip(seqs, target_starts):
+            assert seq.num_cached_tokens <= start - 1
+            first = offset + start - 1 - seq.num_cached_tokens
+            rows.append(torch.arange(first, first + len(seq) - start, device=device))
+            target_ids.extend(seq.token_ids[start:])
+            spans.append(len(seq) - start)
+            offset += len(seq) - seq.num_cached_tokens
+        rows = torch.cat(rows)
+        target_ids = torch.tensor(target_ids, dtype=torch.int64, device=device)
+
+        # Project to the vocabulary in chunks: full-vocab logits for a long target are large
+        chunk_size = 256
+        token_logprobs, topk_token_ids = [], []
+        for i in range(0, rows.numel(), chunk_size):
+            logits = self.model.compute_logits(hidden_states[rows[i:i + chunk_size]])
+            if self.rank != 0:
+                continue
+            logprobs = torch.log_softmax(logits.float(), dim=-1)
+            token_logprobs.append(logprobs.gather(1, target_ids[i:i + chunk_size, None]).squeeze(1))
+            if top_k > 0:
+                topk_token_ids.append(logits.topk(min(top_k, logits.size(-1)), dim=-1).indices)
+        if self.rank != 0:
+            return None
+
+        token_logprobs = torch.cat(token_logprobs).tolist() if token_logprobs else []
+        topk_token_ids = torch.cat(topk_token_ids).tolist() if topk_token_ids else []
+        outputs = []
+        offset = 0
+        for span in spans:
+            outputs.append({
+                "token_logprobs": token_logprobs[offset:offset + span],
+                "topk_token_ids": topk_token_ids[offset:offset + span],
+            })
+            offset += span
+        return outputs
+
     @torch.inference_mode()
     def capture_cudagraph(self):
         config = self.config
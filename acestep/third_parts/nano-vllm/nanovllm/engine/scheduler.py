@@ -21,12 +21,31 @@ class Scheduler:
     def add(self, seq: Sequence):
         self.waiting.append(seq)
 
+    @staticmethod
+    def _order_cfg(scheduled_seqs: list[Sequence]) -> list[Sequence]:
+        # Reorder: non-CFG, then CFG conditional, then CFG unconditional
+        non_cfg_seqs, cfg_cond_seqs, cfg_uncond_seqs = [], [], []
+        for s in scheduled_seqs:
+            if s.is_unconditional:
+                cfg_uncond_seqs.append(s)
+            elif s.cfg_scale > 1.0:
+                cfg_cond_seqs.append(s)
+            else:
+                non_cfg_seqs.append(s)
+        return non_cfg_seqs + cfg_cond_seqs + cfg_uncond_seqs
+
+    def _pop_waiting(self, seq: Sequence):
+        # The sequence is almost always at the front (CFG pairs are added back to back)
+        if self.waiting and self.waiting[0] is seq:
+            self.waiting.popleft()
+        else:
+            self.waiting.remove(seq)
+
     def schedule(self) -> tuple[list[Sequence], bool]:
         # prefill
         scheduled_seqs = []
         num_seqs = 0
         num_batched_tokens = 0
-        processed_seqs = set()  # Track processed sequences to handle CFG pairs
         
         while self.waiting and num_seqs < self.max_num_seqs:
             seq = self.waiting[0]
@@ -46,7 +65,7 @@ class Scheduler:
                 # The old check was wrong: it checked each sequence independently,
                 # but didn't account for the total blocks needed by both
                 total_blocks_needed = seq.num_blocks + paired_seq.num_blocks
-                can_allocate_both = len(self.block_manager.free_block_ids) >= total_blocks_needed
+                can_allocate_both = self.block_manager.num_free_blocks >= total_blocks_needed
                 
                 if num_batched_tokens + total_tokens > self.max_num_batched_tokens or not can_allocate_both:
                     break
@@ -57,17 +76,10 @@ class Scheduler:
                     self.block_manager.allocate(s)
                     num_batched_tokens += len(s) - s.num_cached_tokens
                     s.status = SequenceStatus.RUNNING
-                    self.waiting.remove(s)
+                    self._pop_waiting(s)
                     self.running.append(s)
                     scheduled_seqs.append(s)
-                    processed_seqs.add(s.seq_id)
             else:
-                # Normal sequence or unconditional sequence (already processed with its conditional)
-                if seq.seq_id in processed_seqs:
-                    # Skip if already processed as part of a CFG pair
-                    self.waiting.popleft()
-                    continue
-                    
                 if num_batched_tokens + len(seq) > self.max_num_batched_tokens or not self.block_manager.can_allocate(seq):
                     break
                 num_seqs += 1
@@ -80,102 +92,88 @@ class Scheduler:
                 
         if scheduled_seqs:
             # For CFG batches, ensure conditional sequences come before their unconditional pairs
-            cfg_cond_seqs = [s for s in scheduled_seqs if s.cfg_scale > 1.0 and not s.is_unconditional]
-            cfg_uncond_seqs = [s for s in scheduled_seqs if s.is_unconditional]
-            non_cfg_seqs = [s for s in scheduled_seqs if s.cfg_scale <= 1.0]
-            
-            # Reorder: non-CFG, then CFG conditional, then CFG unconditional
-            scheduled_seqs = non_cfg_seqs + cfg_cond_seqs + cfg_uncond_seqs
-            return scheduled_seqs, True
+            return self._order_cfg(scheduled_seqs), True
 
         # decode
-        processed_seqs = set()
-        temp_running = list(self.running)  # Work with a copy
+        # Sequences leave the candidate queue lazily: `taken` holds the ids already scheduled
+        # or preempted this step, so pair lookups and removals are O(1) instead of list scans
+        temp_running = deque(self.running)
+        candidate_ids = {s.seq_id for s in temp_running}
+        taken: set[int] = set()
+        block_size = self.block_manager.block_size
+
+        def available(s: Sequence) -> bool:
+            return s.seq_id in candidate_ids and s.seq_id not in taken
+
+        def preempt_victim(keep: Sequence) -> bool:
+            # Preempt the lowest-priority (last) candidate, together with its CFG partner
+            while temp_running:
+                victim = temp_running.pop()
+                if not available(victim) or victim is keep or victim is keep.paired_seq:
+                    continue
+                victims = [victim]
+                if victim.paired_seq is not None and available(victim.paired_seq):
+                    victims.append(victim.paired_seq)
+                # Unconditional first, so the conditional ends up in front of it in waiting
+                for s in sorted(victims, key=lambda s: not s.is_unconditional):
+                    taken.add(s.seq_id)
+                    self.preempt(s)
+                return True
+            return False
         
         while temp_running and num_seqs < self.max_num_seqs:
-            seq = temp_running.pop(0)
+            seq = temp_running.popleft()
+            if not available(seq):
+                continue
             
             # For CFG sequences, ensure conditional and unconditional are scheduled together
             if seq.cfg_scale > 1.0 and seq.paired_seq is not None and not seq.is_unconditional:
                 paired_seq = seq.paired_seq
-                if paired_seq not in temp_running:
+                if not available(paired_seq):
                     # Paired sequence not available, skip for now
                     continue
                 
-                # Remove paired_seq from temp_running
-                temp_running.remove(paired_seq)
-                
                 # FIX: Check if we have enough blocks for BOTH sequences to append
                 # Each sequence needs 1 block when at block boundary (len % block_size == 1)
-                block_size = self.block_manager.block_size
-                blocks_needed_seq = 1 if len(seq) % block_size == 1 else 0
-                blocks_needed_paired = 1 if len(paired_seq) % block_size == 1 else 0
-                total_blocks_needed = blocks_needed_seq + blocks_needed_paired
-                can_append_both = len(self.block_manager.free_block_ids) >= total_blocks_needed
+                total_blocks_needed = (len(seq) % block_size == 1) + (len(paired_seq) % block_size == 1)
+                while self.block_manager.num_free_blocks < total_blocks_needed:
+                    if not preempt_victim(seq):
+                        break
                 
-                if not can_append_both:
-                    # Try preempting other sequences
-                    preempted = False
-                    while not can_append_both and temp_running:
-                        other_seq = temp_running.pop(0)
-                        if other_seq != seq and other_seq != paired_seq:
-                            self.preempt(other_seq)
-                            # Recalculate with the same correct logic
-                            can_append_both = len(self.block_manager.free_block_ids) >= total_blocks_needed
-                            preempted = True
-                        else:
-                            temp_running.append(other_seq)
-                            break
-                    
-                    if not can_append_both:
-                        # Can't schedule this pair right now
-                        temp_running.append(seq)
-                        temp_running.append(paired_seq)
-                        continue
+                if self.block_manager.num_free_blocks < total_blocks_needed:
+                    # Nothing left to preempt: give up this pair's blocks for now
+                    for s in (paired_seq, seq):
+                        taken.add(s.seq_id)
+                        self.preempt(s)
+                    continue
                 
                 # Schedule both sequences
                 for s in [seq, paired_seq]:
                     num_seqs += 1
                     self.block_manager.may_append(s)
                     scheduled_seqs.append(s)
-                    processed_seqs.add(s.seq_id)
-                    # Remove from actual running list if scheduled
-                    if s in self.running:
-                        self.running.remove(s)
+                    taken.add(s.seq_id)
             else:
-                # Normal sequence or unconditional (already processed)
-                if seq.seq_id in processed_seqs:
-                    continue
-                    
                 while not self.block_manager.can_append(seq):
-                    if temp_running:
-                        other_seq = temp_running.pop(0)
-                        if other_seq != seq:
-                            self.preempt(other_seq)
-                        else:
-                            temp_running.append(other_seq)
-                            break
-                    else:
+                    if not preempt_victim(seq):
+                        taken.add(seq.seq_id)
                         self.preempt(seq)
-                        if seq in self.running:
-                            self.running.remove(seq)
                         break
                 else:
                     num_seqs += 1
                     self.block_manager.may_append(seq)
                     scheduled_seqs.append(seq)
-                    if seq in self.running:
-                        self.running.remove(seq)
+                    taken.add(seq.seq_id)
                     
         assert scheduled_seqs
         
         # For CFG batches in decode, ensure conditional sequences come before unconditional
-        cfg_cond_seqs = [s for s in scheduled_seqs if s.cfg_scale > 1.0 and not s.is_unconditional]
-        cfg_uncond_seqs = [s for s in scheduled_seqs if s.is_unconditional]
-        non_cfg_seqs = [s for s in scheduled_seqs if s.cfg_scale <= 1.0]
-        scheduled_seqs = non_cfg_seqs + cfg_cond_seqs + cfg_uncond_seqs
+        scheduled_seqs = self._order_cfg(scheduled_seqs)
         
-        self.running.extendleft(reversed(scheduled_seqs))
+        # Scheduled sequences go first; preempted ones have moved to waiting
+        running = deque(scheduled_seqs)
+        running.extend(s for s in self.running if s.seq_id not in taken)
+        self.running = running
         return scheduled_seqs, False
 
     def preempt(self, seq: Sequence):
@@ -186,6 +184,7 @@ class Scheduler:
     def postprocess(self, seqs: list[Sequence], token_ids: list[int]) -> list[bool]:
         # Check if this is a CFG batch
         is_cfg_batch = False
+        any_finished = False
         if len(seqs) > 0 and seqs[0].cfg_scale > 1.0 and seqs[0].paired_seq is not None:
             num_cond = len(seqs) // 2
             is_cfg_batch = (num_cond > 0 and 
@@ -216,10 +215,7 @@ class Scheduler:
                     uncond_seq.status = SequenceStatus.FINISHED
                     self.block_manager.deallocate(cond_seq)
                     self.block_manager.deallocate(uncond_seq)
-                    if cond_seq in self.running:
-                        self.running.remove(cond_seq)
-                    if uncond_seq in self.running:
-                        self.running.remove(uncond_seq)
+                    any_finished = True
         else:
             # Normal batch
             for seq, token_id in zip(seqs, token_ids):
@@ -227,4 +223,8 @@ class Scheduler:
                 if (not seq.ignore_eos and token_id == self.eos) or seq.num_completion_tokens == seq.max_tokens:
                     seq.status = SequenceStatus.FINISHED
                     self.block_manager.deallocate(seq)
-                    self.running.remove(seq)
+                    any_finished = True
+        
+        if any_finished:
+            # One pass over running instead of a deque.remove() per finished sequence
+            self.running = deque(s for s in self.running if not s.is_finished)
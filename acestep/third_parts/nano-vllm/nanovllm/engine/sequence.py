@@ -24,7 +24,11 @@ class Sequence:
         self.num_tokens = len(self.token_ids)
         self.num_prompt_tokens = len(token_ids)
         self.num_cached_tokens = 0
+        # Prompt tokens served from the prefix cache at the first prefill (-1 until scheduled)
+        self.num_prefix_hit_tokens = -1
         self.block_table = []
+        # Rolling prefix hashes of the full blocks, filled in lazily by BlockManager.block_hash()
+        self.block_hashes: list[int] = []
         self.temperature = sampling_params.temperature
         self.max_tokens = sampling_params.max_tokens
         self.ignore_eos = sampling_params.ignore_eos
@@ -0,0 +1,57 @@
+"""Prefix-cache consistency of LLMEngine when a model run fails (no GPU needed)."""
+from types import SimpleNamespace
+
+import pytest
+
+from nanovllm.engine.llm_engine import LLMEngine
+from nanovllm.engine.scheduler import Scheduler
+from nanovllm.sampling_params import SamplingParams
+
+
+class FakeRunner:
+    """Stands in for ModelRunner: raises on the first `fail_runs` calls, then samples token 1."""
+
+    def __init__(self, fail_runs: int = 0):
+        self.fail_runs = fail_runs
+
+    def call(self, method, seqs, *args):
+        if self.fail_runs:
+            self.fail_runs -= 1
+            raise RuntimeError("CUDA out of memory")
+        return [1] * len(seqs)
+
+
+def make_engine(runner: FakeRunner) -> LLMEngine:
+    engine = LLMEngine.__new__(LLMEngine)
+    engine.model_runner = runner
+    engine.tokenizer = SimpleNamespace(decode=lambda token_ids: "")
+    engine.scheduler = Scheduler(SimpleNamespace(
+        max_num_seqs=16, max_num_batched_tokens=16384, eos=-1, num_kvcache_blocks=32, kvcache_block_size=256,
+    ))
+    engine.retained_block_ids = []
+    engine._retain_prefix_cache = False
+    return engine
+
+
+PROMPT = list(range(2, 2 + 600))  # two full blocks + a partial one
+
+
+def generate(engine: LLMEngine) -> dict:
+    return engine.generate([PROMPT], SamplingParams(temperature=1.0, max_tokens=1), use_tqdm=False)[0]
+
+
+def test_failed_prefill_leaves_no_cache_hit():
+    engine = make_engine(FakeRunner(fail_runs=1))
+    with pytest.raises(RuntimeError):
+        generate(engine)
+
+    # Blocks allocated for the failed prefill hold no KV: the same prompt must recompute them
+    assert generate(engine)["num_cached_tokens"] == 0
+    block_manager = engine.scheduler.block_manager
+    assert block_manager.num_free_blocks == len(block_manager.blocks)
+
+
+def test_completed_prefill_is_reused():
+    engine = make_engine(FakeRunner())
+    assert generate(engine)["num_cached_tokens"] == 0
+    assert generate(engine)["num_cached_tokens"] == 512
@@ -18,6 +18,7 @@ from acestep.training.data_module import (
     # Preprocessed (recommended)
     PreprocessedTensorDataset,
     PreprocessedDataModule,
+    LengthBucketBatchSampler,
     collate_preprocessed_batch,
     # Legacy (raw audio)
     AceStepTrainingDataset,
@@ -25,6 +26,11 @@ from acestep.training.data_module import (
     collate_training_batch,
     load_dataset_from_json,
 )
+from acestep.training.tensor_shards import (
+    TensorShardReader,
+    TensorShardWriter,
+    convert_tensor_dir_to_shards,
+)
 from acestep.training.trainer import LoRATrainer, PreprocessedLoRAModule, LIGHTNING_AVAILABLE
 
 def check_lightning_available():
@@ -47,12 +53,17 @@ __all__ = [
     # Data Module (Preprocessed - Recommended)
     "PreprocessedTensorDataset",
     "PreprocessedDataModule",
+    "LengthBucketBatchSampler",
     "collate_preprocessed_batch",
     # Data Module (Legacy)
     "AceStepTrainingDataset",
     "AceStepDataModule",
     "collate_training_batch",
     "load_dataset_from_json",
+    # Tensor shards
+    "TensorShardReader",
+    "TensorShardWriter",
+    "convert_tensor_dir_to_shards",
     # Trainer
     "LoRATrainer",
     "PreprocessedLoRAModule",
@@ -0,0 +1,118 @@
+"""
+Persistent audio metadata cache for dataset directory scans
+
+DatasetBuilder.scan_directory() needs the duration of every audio file,
+which means opening and parsing each file's header. On network-mounted
+libraries with thousands of tracks that takes minutes, on every rescan.
+AudioMetadataCache remembers (path, size, mtime) -> duration, sample rate
+and channels in a SQLite file, so a rescan only probes new or modified
+files; the scanner probes those concurrently.
+
+Configuration (environment):
+- ACESTEP_AUDIO_META_CACHE: SQLite cache file (default .cache/acestep/audio_meta.sqlite3);
+  set to an empty string to disable the cache
+- ACESTEP_SCAN_WORKERS: concurrent header probes / lyrics reads during a scan (default 16)
+"""
+
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+# SQLite limits the number of host parameters per statement (999 on old builds)
+_SQLITE_MAX_PARAMS = 900
+
+
+@dataclass
+class AudioMetadata:
+    """Header information of an audio file."""
+
+    duration: float
+    sample_rate: int
+    channels: int
+
+
+class AudioMetadataCache:
+    """SQLite-backed (path, size, mtime) -> AudioMetadata map."""
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: SQLite file (created with its directory if missing)
+        """
+        self.db_path = db_path
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Scans may be driven from different threads (e.g. Gradio generator steps)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS audio_meta ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+                "duration REAL NOT NULL, sample_rate INTEGER NOT NULL, channels INTEGER NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get_many(self, files: Iterable[Tuple[str, int, int]]) -> Dict[str, AudioMetadata]:
+        """
+        Cached metadata of files that are unchanged since they were cached.
+
+        Args:
+            files: (absolute path, size, mtime_ns) tuples
+
+        Returns:
+            path -> AudioMetadata for cache hits
+        """
+        wanted = {path: (size, mtime_ns) for path, size, mtime_ns in files}
+        paths = list(wanted)
+        hits: Dict[str, AudioMetadata] = {}
+        with self._lock:
+            for start in range(0, len(paths), _SQLITE_MAX_PARAMS):
+                chunk = paths[start:start + _SQLITE_MAX_PARAMS]
+                rows = self._conn.execute(
+                    "SELECT path, size, mtime_ns, duration, sample_rate, channels FROM audio_meta "
+                    f"WHERE path IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for path, size, mtime_ns, duration, sample_rate, channels in rows:
+                    if wanted.get(path) == (size, mtime_ns):
+                        hits[path] = AudioMetadata(duration, sample_rate, channels)
+        return hits
+
+    def put_many(self, entries: List[Tuple[str, int, int, AudioMetadata]]) -> None:
+        """Store (absolute path, size, mtime_ns, metadata) entries."""
+        if not entries:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO audio_meta (path, size, mtime_ns, duration, sample_rate, channels) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(p, s, m, meta.duration, meta.sample_rate, meta.channels) for p, s, m, meta in entries],
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def scan_workers() -> int:
+    """Concurrent probes per scan (ACESTEP_SCAN_WORKERS)."""
+    return max(1, int(os.environ.get("ACESTEP_SCAN_WORKERS", "16")))
+
+
+def create_audio_metadata_cache() -> Optional[AudioMetadataCache]:
+    """Open the cache configured by ACESTEP_AUDIO_META_CACHE, or None if disabled or unavailable."""
+    db_path = os.environ.get("ACESTEP_AUDIO_META_CACHE", os.path.join(".cache", "acestep", "audio_meta.sqlite3"))
+    if not db_path.strip():
+        return None
+    try:
+        return AudioMetadataCache(db_path)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Audio metadata cache unavailable ({db_path}): {e}")
+        return None
@@ -81,6 +81,8 @@ class TrainingConfig:
     # Data loading
     num_workers: int = 4
     pin_memory: bool = True
+    bucket_by_length: bool = True  # Batch samples of similar duration together
+    max_latent_frames: Optional[int] = None  # Padded latent frames per batch (25 per second) instead of batch_size
     
     # Logging
     log_every_n_steps: int = 10
@@ -103,5 +105,7 @@ class TrainingConfig:
             "output_dir": self.output_dir,
             "num_workers": self.num_workers,
             "pin_memory": self.pin_memory,
+            "bucket_by_length": self.bucket_by_length,
+            "max_latent_frames": self.max_latent_frames,
             "log_every_n_steps": self.log_every_n_steps,
         }
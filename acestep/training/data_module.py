@@ -13,7 +13,9 @@ from loguru import logger
 
 import torch
 import torchaudio
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, Sampler, Subset
+
+from acestep.training.tensor_shards import TensorShardReader, is_sharded_tensor_dir
 
 try:
     from lightning.pytorch import LightningDataModule
@@ -41,16 +43,32 @@ class PreprocessedTensorDataset(Dataset):
     - attention_mask: Audio latent mask [T]
     
     No VAE/text encoder needed during training - just load tensors directly!
+    
+    Directories converted with acestep.training.tensor_shards (shards.json) are
+    read from memory-mapped shards instead of one torch.load() per sample.
     """
     
     def __init__(self, tensor_dir: str):
-        """Initialize from a directory of preprocessed .pt files.
+        """Initialize from a directory of preprocessed .pt files or tensor shards.
         
         Args:
-            tensor_dir: Directory containing preprocessed .pt files and manifest.json
+            tensor_dir: Directory containing preprocessed .pt files and manifest.json,
+                or shards.json and its shard files
         """
         self.tensor_dir = tensor_dir
         self.sample_paths = []
+        self.valid_paths = []
+        self.shard_reader: Optional[TensorShardReader] = None
+        self._manifest_lengths: Dict[str, int] = {}
+        self._latent_lengths: Optional[List[int]] = None
+        
+        if is_sharded_tensor_dir(tensor_dir):
+            self.shard_reader = TensorShardReader(tensor_dir)
+            logger.info(
+                f"PreprocessedTensorDataset: {len(self.shard_reader)} samples from "
+                f"{len(self.shard_reader.shards)} shard(s) in {tensor_dir}"
+            )
+            return
         
         # Load manifest if exists
         manifest_path = os.path.join(tensor_dir, "manifest.json")
@@ -58,6 +76,10 @@ class PreprocessedTensorDataset(Dataset):
             with open(manifest_path, 'r') as f:
                 manifest = json.load(f)
             self.sample_paths = manifest.get("samples", [])
+            # Recorded by preprocess_to_tensors; older manifests have no lengths
+            lengths = manifest.get("latent_lengths") or []
+            if len(lengths) == len(self.sample_paths):
+                self._manifest_lengths = dict(zip(self.sample_paths, lengths))
         else:
             # Fallback: scan directory for .pt files
             for f in os.listdir(tensor_dir):
@@ -73,16 +95,48 @@ class PreprocessedTensorDataset(Dataset):
         logger.info(f"PreprocessedTensorDataset: {len(self.valid_paths)} samples from {tensor_dir}")
     
     def __len__(self) -> int:
+        if self.shard_reader is not None:
+            return len(self.shard_reader)
         return len(self.valid_paths)
     
+    @property
+    def latent_lengths(self) -> List[int]:
+        """Latent length (frames) of every sample, for length-bucketed batching.
+        
+        Taken from the shard index or manifest; otherwise read once from the
+        tensor files (memory-mapped, only the shape is needed).
+        """
+        if self._latent_lengths is None:
+            if self.shard_reader is not None:
+                self._latent_lengths = self.shard_reader.latent_lengths
+            else:
+                self._latent_lengths = [
+                    self._manifest_lengths[p] if p in self._manifest_lengths else self._read_latent_length(p)
+                    for p in self.valid_paths
+                ]
+        return self._latent_lengths
+    
+    @staticmethod
+    def _read_latent_length(tensor_path: str) -> int:
+        try:
+            data = torch.load(tensor_path, map_location='cpu', mmap=True)
+        except RuntimeError:
+            # Legacy (non-zipfile) serialization cannot be memory-mapped
+            data = torch.load(tensor_path, map_location='cpu')
+        return int(data["target_latents"].shape[0])
+    
     def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
         """Load a preprocessed tensor file.
         
         Returns:
             Dictionary containing all pre-computed tensors for training
         """
-        tensor_path = self.valid_paths[idx]
-        data = torch.load(tensor_path, map_location='cpu')
+        if self.shard_reader is not None:
+            # Zero-copy views into the mapped shard
+            data = self.shard_reader[idx]
+        else:
+            tensor_path = self.valid_paths[idx]
+            data = torch.load(tensor_path, map_location='cpu')
         
         return {
             "target_latents": data["target_latents"],  # [T, 64]
@@ -94,10 +148,30 @@ class PreprocessedTensorDataset(Dataset):
         }
 
 
+def _pad_stack(tensors: List[torch.Tensor], max_len: int) -> torch.Tensor:
+    """Stack tensors of shape [len_i, ...] into one preallocated, zero-padded [B, max_len, ...] tensor.
+    
+    The dtype matches concatenating with default-dtype zero padding: a batch that
+    needs padding is promoted (bf16 tensors come out float32), an unpadded one keeps
+    the stored dtype.
+    """
+    first = tensors[0]
+    dtype = first.dtype
+    for t in tensors[1:]:
+        dtype = torch.promote_types(dtype, t.dtype)
+    if any(t.shape[0] < max_len for t in tensors):
+        dtype = torch.promote_types(dtype, torch.get_default_dtype())
+    out = first.new_zeros((len(tensors), max_len) + tuple(first.shape[1:]), dtype=dtype)
+    for i, t in enumerate(tensors):
+        out[i, :t.shape[0]].copy_(t)
+    return out
+
+
 def collate_preprocessed_batch(batch: List[Dict]) -> Dict[str, torch.Tensor]:
     """Collate function for preprocessed tensor batches.
     
     Handles variable-length tensors by padding to the longest in the batch.
+    Each output tensor is allocated once and the samples are copied into it.
     
     Args:
         batch: List of sample dictionaries with pre-computed tensors
@@ -109,59 +183,110 @@ def collate_preprocessed_batch(batch: List[Dict]) -> Dict[str, torch.Tensor]:
     max_latent_len = max(s["target_latents"].shape[0] for s in batch)
     max_encoder_len = max(s["encoder_hidden_states"].shape[0] for s in batch)
     
-    # Pad and stack tensors
-    target_latents = []
-    attention_masks = []
-    encoder_hidden_states = []
-    encoder_attention_masks = []
-    context_latents = []
-    
-    for sample in batch:
-        # Pad target_latents [T, 64] -> [max_T, 64]
-        tl = sample["target_latents"]
-        if tl.shape[0] < max_latent_len:
-            pad = torch.zeros(max_latent_len - tl.shape[0], tl.shape[1])
-            tl = torch.cat([tl, pad], dim=0)
-        target_latents.append(tl)
-        
-        # Pad attention_mask [T] -> [max_T]
-        am = sample["attention_mask"]
-        if am.shape[0] < max_latent_len:
-            pad = torch.zeros(max_latent_len - am.shape[0])
-            am = torch.cat([am, pad], dim=0)
-        attention_masks.append(am)
-        
-        # Pad context_latents [T, 65] -> [max_T, 65]
-        cl = sample["context_latents"]
-        if cl.shape[0] < max_latent_len:
-            pad = torch.zeros(max_latent_len - cl.shape[0], cl.shape[1])
-            cl = torch.cat([cl, pad], dim=0)
-        context_latents.append(cl)
-        
-        # Pad encoder_hidden_states [L, D] -> [max_L, D]
-        ehs = sample["encoder_hidden_states"]
-        if ehs.shape[0] < max_encoder_len:
-            pad = torch.zeros(max_encoder_len - ehs.shape[0], ehs.shape[1])
-            ehs = torch.cat([ehs, pad], dim=0)
-        encoder_hidden_states.append(ehs)
-        
-        # Pad encoder_attention_mask [L] -> [max_L]
-        eam = sample["encoder_attention_mask"]
-        if eam.shape[0] < max_encoder_len:
-            pad = torch.zeros(max_encoder_len - eam.shape[0])
-            eam = torch.cat([eam, pad], dim=0)
-        encoder_attention_masks.append(eam)
+    def _field(key: str, max_len: int) -> torch.Tensor:
+        return _pad_stack([s[key] for s in batch], max_len)
     
     return {
-        "target_latents": torch.stack(target_latents),  # [B, T, 64]
-        "attention_mask": torch.stack(attention_masks),  # [B, T]
-        "encoder_hidden_states": torch.stack(encoder_hidden_states),  # [B, L, D]
-        "encoder_attention_mask": torch.stack(encoder_attention_masks),  # [B, L]
-        "context_latents": torch.stack(context_latents),  # [B, T, 65]
+        "target_latents": _field("target_latents", max_latent_len),  # [B, T, 64]
+        "attention_mask": _field("attention_mask", max_latent_len),  # [B, T]
+        "encoder_hidden_states": _field("encoder_hidden_states", max_encoder_len),  # [B, L, D]
+        "encoder_attention_mask": _field("encoder_attention_mask", max_encoder_len),  # [B, L]
+        "context_latents": _field("context_latents", max_latent_len),  # [B, T, 65]
         "metadata": [s["metadata"] for s in batch],
     }
 
 
+class LengthBucketBatchSampler(Sampler[List[int]]):
+    """Batch sampler that groups samples of similar latent length.
+    
+    Random batching pairs short clips with long ones, so most of a batch is
+    padding. Each epoch, samples are shuffled, ordered by length bucket
+    (random order within a bucket) and cut into consecutive batches, and the
+    batches are shuffled. Batches hold either a fixed number of samples or as
+    many as fit a padded latent frame budget (batch size x longest sample).
+    
+    Like DistributedSampler, the epoch only changes through set_epoch(), which
+    must be called before each epoch to get a new order (Lightning does this).
+    """
+    
+    def __init__(
+        self,
+        lengths: List[int],
+        batch_size: int = 1,
+        max_latent_frames: Optional[int] = None,
+        bucket_frames: int = 250,
+        shuffle: bool = True,
+        drop_last: bool = False,
+        seed: int = 42,
+    ):
+        """Initialize the sampler.
+        
+        Args:
+            lengths: Latent length (frames) of every sample in the dataset
+            batch_size: Samples per batch (max samples per batch with max_latent_frames)
+            max_latent_frames: Padded latent frames per batch; when set, batches are filled
+                up to this budget instead of batch_size (a longer single sample gets its own batch)
+            bucket_frames: Width of a length bucket in latent frames (250 = 10s of audio)
+            shuffle: Shuffle samples within buckets and the batch order every epoch
+            drop_last: Drop the last incomplete batch (fixed batch size only)
+            seed: Base seed; epoch e uses seed + e
+        """
+        self.lengths = [int(length) for length in lengths]
+        self.batch_size = max(1, int(batch_size))
+        self.max_latent_frames = max_latent_frames if max_latent_frames and max_latent_frames > 0 else None
+        self.bucket_frames = max(1, int(bucket_frames))
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self._cached: Optional[Tuple[int, List[List[int]]]] = None
+    
+    def set_epoch(self, epoch: int) -> None:
+        """Select the epoch whose batches __iter__ and __len__ describe."""
+        self.epoch = epoch
+    
+    def _batches(self, epoch: int) -> List[List[int]]:
+        if self._cached is not None and self._cached[0] == epoch:
+            return self._cached[1]
+        
+        gen = torch.Generator().manual_seed(self.seed + epoch)
+        order = torch.randperm(len(self.lengths), generator=gen).tolist() if self.shuffle else list(range(len(self.lengths)))
+        # Stable sort keeps the random order within a bucket
+        order.sort(key=lambda i: self.lengths[i] // self.bucket_frames)
+        
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_max = 0
+        for idx in order:
+            length = self.lengths[idx]
+            if current:
+                if self.max_latent_frames is not None:
+                    full = (
+                        len(current) >= self.batch_size
+                        or (len(current) + 1) * max(current_max, length) > self.max_latent_frames
+                    )
+                else:
+                    full = len(current) >= self.batch_size
+                if full:
+                    batches.append(current)
+                    current, current_max = [], 0
+            current.append(idx)
+            current_max = max(current_max, length)
+        if current and not (self.drop_last and self.max_latent_frames is None and len(current) < self.batch_size):
+            batches.append(current)
+        
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=gen).tolist()]
+        self._cached = (epoch, batches)
+        return batches
+    
+    def __iter__(self):
+        return iter(self._batches(self.epoch))
+    
+    def __len__(self) -> int:
+        return len(self._batches(self.epoch))
+
+
 class PreprocessedDataModule(LightningDataModule if LIGHTNING_AVAILABLE else object):
     """DataModule for preprocessed tensor files.
     
@@ -176,15 +301,22 @@ class PreprocessedDataModule(LightningDataModule if LIGHTNING_AVAILABLE else obj
         num_workers: int = 4,
         pin_memory: bool = True,
         val_split: float = 0.0,
+        bucket_by_length: bool = True,
+        max_latent_frames: Optional[int] = None,
+        seed: int = 42,
     ):
         """Initialize the data module.
         
         Args:
-            tensor_dir: Directory containing preprocessed .pt files
-            batch_size: Training batch size
+            tensor_dir: Directory containing preprocessed .pt files (or tensor shards)
+            batch_size: Training batch size (max samples per batch with max_latent_frames)
             num_workers: Number of data loading workers
             pin_memory: Whether to pin memory for faster GPU transfer
             val_split: Fraction of data for validation (0 = no validation)
+            bucket_by_length: Batch training samples of similar length (LengthBucketBatchSampler)
+            max_latent_frames: Padded latent frames per training batch instead of a fixed
+                batch size (requires bucket_by_length; None = fixed batch_size)
+            seed: Seed of the length-bucketed batch order
         """
         if LIGHTNING_AVAILABLE:
             super().__init__()
@@ -194,7 +326,11 @@ class PreprocessedDataModule(LightningDataModule if LIGHTNING_AVAILABLE else obj
         self.num_workers = num_workers
         self.pin_memory = pin_memory
         self.val_split = val_split
+        self.bucket_by_length = bucket_by_length
+        self.max_latent_frames = max_latent_frames
+        self.seed = seed
         
+        self.full_dataset = None
         self.train_dataset = None
         self.val_dataset = None
     
@@ -203,6 +339,7 @@ class PreprocessedDataModule(LightningDataModule if LIGHTNING_AVAILABLE else obj
         if stage == 'fit' or stage is None:
             # Create full dataset
             full_dataset = PreprocessedTensorDataset(self.tensor_dir)
+            self.full_dataset = full_dataset
             
             # Split if validation requested
             if self.val_split > 0 and len(full_dataset) > 1:
@@ -216,8 +353,31 @@ class PreprocessedDataModule(LightningDataModule if LIGHTNING_AVAILABLE else obj
                 self.train_dataset = full_dataset
                 self.val_dataset = None
     
+    def _train_lengths(self) -> List[int]:
+        lengths = self.full_dataset.latent_lengths
+        if isinstance(self.train_dataset, Subset):
+            return [lengths[i] for i in self.train_dataset.indices]
+        return lengths
+    
     def train_dataloader(self) -> DataLoader:
         """Create training dataloader."""
+        if self.bucket_by_length:
+            batch_sampler = LengthBucketBatchSampler(
+                self._train_lengths(),
+                batch_size=self.batch_size,
+                max_latent_frames=self.max_latent_frames,
+                shuffle=True,
+                drop_last=True,
+                seed=self.seed,
+            )
+            return DataLoader(
+                self.train_dataset,
+                batch_sampler=batch_sampler,
+                num_workers=self.num_workers,
+                pin_memory=self.pin_memory,
+                collate_fn=collate_preprocessed_batch,
+            )
+        
         return DataLoader(
             self.train_dataset,
             batch_size=self.batch_size,
@@ -13,7 +13,8 @@ import json
 import uuid
 from datetime import datetime
 from dataclasses import dataclass, field, asdict
-from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from pathlib import Path
 
 import torch
@@ -21,6 +22,14 @@ import torchaudio
 from loguru import logger
 
 from acestep.constants import SFT_GEN_PROMPT, DEFAULT_DIT_INSTRUCTION
+from acestep.training.audio_metadata_cache import (
+    AudioMetadata,
+    AudioMetadataCache,
+    create_audio_metadata_cache,
+    scan_workers,
+)
+from acestep.training.preprocess_pipeline import PreprocessItem, TensorPreprocessor
+from acestep.training.tensor_shards import convert_tensor_dir_to_shards, is_sharded_tensor_dir
 
 
 # Supported audio formats
@@ -222,11 +231,34 @@ class DatasetBuilder:
         Returns:
             Tuple of (list of AudioSample objects, status message)
         """
+        samples, status = [], ""
+        for samples, status in self.iter_scan_directory(directory):
+            pass
+        return samples, status
+
+    def iter_scan_directory(
+        self, directory: str, update_interval: float = 0.5
+    ) -> Iterator[Tuple[List[AudioSample], str]]:
+        """Scan a directory for audio files, yielding partial results as files are probed.
+
+        Same result as scan_directory(). Audio headers and lyrics files are read
+        concurrently (ACESTEP_SCAN_WORKERS), and durations of files unchanged since
+        an earlier scan come from the audio metadata cache (ACESTEP_AUDIO_META_CACHE).
+
+        Args:
+            directory: Path to directory containing audio files
+            update_interval: Seconds between partial results
+
+        Yields:
+            Tuples of (samples found so far sorted by path, status message); the last one is final
+        """
         if not os.path.exists(directory):
-            return [], f"❌ Directory not found: {directory}"
+            yield [], f"❌ Directory not found: {directory}"
+            return
 
         if not os.path.isdir(directory):
-            return [], f"❌ Not a directory: {directory}"
+            yield [], f"❌ Not a directory: {directory}"
+            return
 
         self._current_dir = directory
         self.samples = []
@@ -240,10 +272,12 @@ class DatasetBuilder:
                     audio_files.append(os.path.join(root, file))
 
         if not audio_files:
-            return [], f"❌ No audio files found in {directory}\nSupported formats: {', '.join(SUPPORTED_AUDIO_FORMATS)}"
+            yield [], f"❌ No audio files found in {directory}\nSupported formats: {', '.join(SUPPORTED_AUDIO_FORMATS)}"
+            return
 
         # Sort files by name
         audio_files.sort()
+        yield [], f"🔍 Found {len(audio_files)} audio files in {directory}, reading metadata..."
 
         # Load CSV metadata if available
         csv_metadata = self._load_csv_metadata(directory)
@@ -251,48 +285,76 @@ class DatasetBuilder:
 
         # Count how many samples have lyrics files
         lyrics_count = 0
+        cached_count = 0
 
-        # Create AudioSample objects
-        for audio_path in audio_files:
-            try:
-                # Get duration
-                duration = self._get_audio_duration(audio_path)
-
-                # Check for accompanying lyrics .txt file with same name
-                lyrics_content, has_lyrics_file = self._load_lyrics_file(audio_path)
-
-                # Determine if instrumental based on lyrics file presence
-                is_instrumental = self.metadata.all_instrumental
-                if has_lyrics_file:
-                    is_instrumental = False
-                    lyrics_count += 1
-
-                sample = AudioSample(
-                    audio_path=audio_path,
-                    filename=os.path.basename(audio_path),
-                    duration=duration,
-                    is_instrumental=is_instrumental,
-                    custom_tag=self.metadata.custom_tag,
-                    lyrics=lyrics_content if has_lyrics_file else "[Instrumental]",
-                    raw_lyrics=lyrics_content if has_lyrics_file else "",  # Store original lyrics
-                )
+        cache = create_audio_metadata_cache()
+        new_entries = []
+        found: Dict[str, AudioSample] = {}
 
-                # Apply CSV metadata if available
-                if csv_metadata and sample.filename in csv_metadata:
-                    meta = csv_metadata[sample.filename]
-                    if meta.get('bpm'):
-                        sample.bpm = meta['bpm']
-                    if meta.get('key'):
-                        sample.keyscale = meta['key']
-                    if meta.get('caption'):
-                        sample.caption = meta['caption']
-                        sample.labeled = True  # Mark as labeled if caption exists
-                    csv_count += 1
+        def _partial() -> List[AudioSample]:
+            return [found[p] for p in audio_files if p in found]
 
-                self.samples.append(sample)
-            except Exception as e:
-                logger.warning(f"Failed to process {audio_path}: {e}")
+        pool = ThreadPoolExecutor(max_workers=scan_workers(), thread_name_prefix="dataset-scan")
+        try:
+            pending = {pool.submit(self._scan_audio_file, path, cache): path for path in audio_files}
+            while pending:
+                done, _ = wait(pending, timeout=update_interval, return_when=FIRST_COMPLETED)
+                # Collect everything that finished, then report once per interval
+                done |= {f for f in pending if f.done()}
+                for future in done:
+                    audio_path = pending.pop(future)
+                    try:
+                        duration, lyrics_content, has_lyrics_file, cache_entry = future.result()
+                    except Exception as e:
+                        logger.warning(f"Failed to process {audio_path}: {e}")
+                        continue
+                    if cache_entry is None:
+                        cached_count += 1
+                    elif cache_entry is not False:
+                        new_entries.append(cache_entry)
+
+                    # Determine if instrumental based on lyrics file presence
+                    is_instrumental = self.metadata.all_instrumental
+                    if has_lyrics_file:
+                        is_instrumental = False
+                        lyrics_count += 1
+
+                    sample = AudioSample(
+                        audio_path=audio_path,
+                        filename=os.path.basename(audio_path),
+                        duration=duration,
+                        is_instrumental=is_instrumental,
+                        custom_tag=self.metadata.custom_tag,
+                        lyrics=lyrics_content if has_lyrics_file else "[Instrumental]",
+                        raw_lyrics=lyrics_content if has_lyrics_file else "",  # Store original lyrics
+                    )
 
+                    # Apply CSV metadata if available
+                    if csv_metadata and sample.filename in csv_metadata:
+                        meta = csv_metadata[sample.filename]
+                        if meta.get('bpm'):
+                            sample.bpm = meta['bpm']
+                        if meta.get('key'):
+                            sample.keyscale = meta['key']
+                        if meta.get('caption'):
+                            sample.caption = meta['caption']
+                            sample.labeled = True  # Mark as labeled if caption exists
+                        csv_count += 1
+
+                    found[audio_path] = sample
+
+                if cache is not None:
+                    cache.put_many(new_entries)
+                    new_entries = []
+                if pending:
+                    self.samples = _partial()
+                    yield self.samples, f"🔍 Scanning {directory}: {len(found)}/{len(audio_files)} files"
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            if cache is not None:
+                cache.close()
+
+        self.samples = _partial()
         self.metadata.num_samples = len(self.samples)
 
         # Build status message
@@ -301,8 +363,30 @@ class DatasetBuilder:
             status += f"\n   📝 {lyrics_count} files have accompanying lyrics (.txt)"
         if csv_count > 0:
             status += f"\n   📊 {csv_count} files have metadata from CSV"
+        if cached_count > 0:
+            status += f"\n   ⚡ {cached_count} durations from the metadata cache"
+
+        yield self.samples, status
 
-        return self.samples, status
+    def _scan_audio_file(
+        self, audio_path: str, cache: Optional[AudioMetadataCache]
+    ) -> Tuple[int, str, bool, Any]:
+        """Duration and lyrics of one audio file (runs on the scan thread pool).
+
+        Returns:
+            Tuple of (duration, lyrics_content, has_lyrics_file, cache_entry); cache_entry is
+            None on a cache hit, False if the file could not be probed, else the entry to store
+        """
+        st = os.stat(audio_path)
+        key = (os.path.abspath(audio_path), st.st_size, st.st_mtime_ns)
+        meta = cache.get_many([key]).get(key[0]) if cache is not None else None
+        cache_entry: Any = None
+        if meta is None:
+            meta = self._probe_audio(audio_path)
+            cache_entry = key + (meta,) if meta is not None else False
+        lyrics_content, has_lyrics_file = self._load_lyrics_file(audio_path)
+        duration = int(meta.duration) if meta is not None else 0
+        return duration, lyrics_content, has_lyrics_file, cache_entry
 
     def _load_csv_metadata(self, directory: str) -> Dict[str, Dict[str, Any]]:
         """Load metadata from CSV files in the directory.
@@ -437,12 +521,21 @@ class DatasetBuilder:
         Returns:
             Duration in seconds (integer)
         """
+        meta = self._probe_audio(audio_path)
+        return int(meta.duration) if meta is not None else 0
+    
+    def _probe_audio(self, audio_path: str) -> Optional[AudioMetadata]:
+        """Read duration, sample rate and channels from an audio file's header (None on failure)."""
         try:
             info = torchaudio.info(audio_path)
-            return int(info.num_frames / info.sample_rate)
+            return AudioMetadata(
+                duration=info.num_frames / info.sample_rate,
+                sample_rate=int(info.sample_rate),
+                channels=int(info.num_channels),
+            )
         except Exception as e:
             logger.warning(f"Failed to get duration for {audio_path}: {e}")
-            return 0
+            return None
     
     def label_sample(
         self,
@@ -535,44 +628,9 @@ class DatasetBuilder:
                 if not metadata:
                     return sample, f"❌ LLM labeling failed: {status}"
 
-                # Update sample with generated caption and genre (always)
-                sample.caption = metadata.get('caption', '')
-                sample.genre = metadata.get('genres', '')  # Extract genre from LLM output
-
-                # Update metas only if not skipped and not from CSV
-                if not skip_metas:
-                    if not has_csv_bpm:
-                        sample.bpm = self._parse_int(metadata.get('bpm'))
-                    if not has_csv_key:
-                        sample.keyscale = metadata.get('keyscale', '')
-                    sample.timesignature = metadata.get('timesignature', '')
-
-                sample.language = metadata.get('vocal_language', 'unknown')
-
-                # LLM-generated/transcribed lyrics
-                llm_lyrics = metadata.get('lyrics', '')
-
-                # Handle lyrics based on mode
-                if sample.is_instrumental:
-                    sample.lyrics = "[Instrumental]"
-                    sample.language = "unknown"
-                    sample.formatted_lyrics = ""
-                    status_suffix = "(instrumental)"
-                elif transcribe_lyrics:
-                    # Transcribe mode: Use LLM-generated lyrics, ignore user's .txt file
-                    sample.formatted_lyrics = llm_lyrics
-                    sample.lyrics = llm_lyrics
-                    status_suffix = "(lyrics transcribed by LM)"
-                elif has_preloaded_lyrics:
-                    # Keep raw lyrics from .txt file
-                    sample.lyrics = sample.raw_lyrics
-                    sample.formatted_lyrics = ""
-                    status_suffix = "(using raw lyrics)"
-                else:
-                    # No pre-loaded lyrics and not transcribing, use LLM lyrics
-                    sample.lyrics = llm_lyrics
-                    sample.formatted_lyrics = llm_lyrics
-                    status_suffix = ""
+                status_suffix = self._apply_understanding(
+                    sample, metadata, transcribe_lyrics, skip_metas, has_csv_bpm, has_csv_key
+                )
 
             # NOTE: Duration is NOT overwritten from LM metadata.
             # We keep the real audio duration obtained from torchaudio during scan.
@@ -580,18 +638,75 @@ class DatasetBuilder:
             sample.labeled = True
             self.samples[sample_idx] = sample
 
-            status_msg = f"✅ Labeled: {sample.filename}"
-            if skip_metas:
-                status_msg += " (skip metas)"
-            if status_suffix:
-                status_msg += f" {status_suffix}"
-
-            return sample, status_msg
+            return sample, self._labeled_status(sample, skip_metas, status_suffix)
 
         except Exception as e:
             logger.exception(f"Error labeling sample {sample.filename}")
             return sample, f"❌ Error: {str(e)}"
 
+    def _apply_understanding(
+        self,
+        sample: AudioSample,
+        metadata: Dict[str, Any],
+        transcribe_lyrics: bool,
+        skip_metas: bool,
+        has_csv_bpm: bool,
+        has_csv_key: bool,
+    ) -> str:
+        """Update a sample from understand_audio_from_codes() metadata.
+
+        Returns:
+            Status suffix describing how lyrics were handled
+        """
+        # Check if sample has pre-loaded lyrics from .txt file
+        has_preloaded_lyrics = sample.has_raw_lyrics() and not sample.is_instrumental
+
+        # Update sample with generated caption and genre (always)
+        sample.caption = metadata.get('caption', '')
+        sample.genre = metadata.get('genres', '')  # Extract genre from LLM output
+
+        # Update metas only if not skipped and not from CSV
+        if not skip_metas:
+            if not has_csv_bpm:
+                sample.bpm = self._parse_int(metadata.get('bpm'))
+            if not has_csv_key:
+                sample.keyscale = metadata.get('keyscale', '')
+            sample.timesignature = metadata.get('timesignature', '')
+
+        sample.language = metadata.get('vocal_language', 'unknown')
+
+        # LLM-generated/transcribed lyrics
+        llm_lyrics = metadata.get('lyrics', '')
+
+        # Handle lyrics based on mode
+        if sample.is_instrumental:
+            sample.lyrics = "[Instrumental]"
+            sample.language = "unknown"
+            sample.formatted_lyrics = ""
+            return "(instrumental)"
+        if transcribe_lyrics:
+            # Transcribe mode: Use LLM-generated lyrics, ignore user's .txt file
+            sample.formatted_lyrics = llm_lyrics
+            sample.lyrics = llm_lyrics
+            return "(lyrics transcribed by LM)"
+        if has_preloaded_lyrics:
+            # Keep raw lyrics from .txt file
+            sample.lyrics = sample.raw_lyrics
+            sample.formatted_lyrics = ""
+            return "(using raw lyrics)"
+        # No pre-loaded lyrics and not transcribing, use LLM lyrics
+        sample.lyrics = llm_lyrics
+        sample.formatted_lyrics = llm_lyrics
+        return ""
+
+    def _labeled_status(self, sample: AudioSample, skip_metas: bool, status_suffix: str) -> str:
+        status_msg = f"✅ Labeled: {sample.filename}"
+        if skip_metas:
+            status_msg += " (skip metas)"
+        if status_suffix:
+            status_msg += f" {status_suffix}"
+        return status_msg
+
     def label_all_samples(
         self,
         dit_handler,
@@ -601,9 +716,17 @@ class DatasetBuilder:
         skip_metas: bool = False,
         only_unlabeled: bool = False,
         progress_callback=None,
+        batch_size: int = 16,
+        vae_batch_size: int = 4,
+        checkpoint_path: Optional[str] = None,
     ) -> Tuple[List[AudioSample], str]:
         """Label all samples in the dataset.
 
+        Samples are labeled in batches: the audio of a batch is converted to codes in
+        VAE batches, then all of its understanding prompts go to the LM as one
+        multi-sequence generation. Samples whose lyrics are formatted by the LM
+        (format_lyrics) are labeled one at a time.
+
         Args:
             dit_handler: DiT handler for audio encoding
             llm_handler: LLM handler for caption generation
@@ -612,6 +735,10 @@ class DatasetBuilder:
             skip_metas: If True, skip generating BPM/Key/TimeSig but still generate caption/genre
             only_unlabeled: If True, only label samples without caption
             progress_callback: Optional callback for progress updates
+            batch_size: Samples per LM batch
+            vae_batch_size: Audio files per VAE batch
+            checkpoint_path: If set, the dataset JSON is saved here after every batch, so
+                labeling can resume (only_unlabeled=True) after an interruption
 
         Returns:
             Tuple of (list of updated samples, status message)
@@ -634,10 +761,40 @@ class DatasetBuilder:
         success_count = 0
         fail_count = 0
         total = len(samples_to_label)
-
-        for idx, (i, sample) in enumerate(samples_to_label):
+        batch_size = max(1, int(batch_size))
+
+        # Format mode runs format_sample per sample; everything else is understood in batches
+        can_batch = hasattr(dit_handler, 'convert_src_audio_to_codes_batch') and hasattr(
+            llm_handler, 'understand_audio_from_codes_batch'
+        )
+        batched, sequential = [], []
+        for i, sample in samples_to_label:
+            needs_format = format_lyrics and sample.has_raw_lyrics() and not sample.is_instrumental
+            (batched if can_batch and not needs_format else sequential).append(i)
+        # Similar lengths together keep VAE padding and LM batch stragglers small
+        batched.sort(key=lambda i: self.samples[i].duration)
+
+        done = 0
+        for start in range(0, len(batched), batch_size):
+            group = batched[start:start + batch_size]
+            if progress_callback:
+                progress_callback(f"Labeling {done + 1}-{done + len(group)}/{total}: encoding audio")
+            try:
+                ok = self._label_batch(
+                    group, dit_handler, llm_handler, transcribe_lyrics, skip_metas, vae_batch_size, progress_callback
+                )
+            except Exception:
+                logger.exception(f"Error labeling batch of {len(group)} samples")
+                ok = 0
+            success_count += ok
+            fail_count += len(group) - ok
+            done += len(group)
+            if checkpoint_path:
+                self.save_dataset(checkpoint_path)
+
+        for n, i in enumerate(sequential):
             if progress_callback:
-                progress_callback(f"Labeling {idx+1}/{total}: {sample.filename}")
+                progress_callback(f"Labeling {done + 1}/{total}: {self.samples[i].filename}")
 
             _, status = self.label_sample(
                 i, dit_handler, llm_handler, format_lyrics, transcribe_lyrics, skip_metas, progress_callback
@@ -647,6 +804,9 @@ class DatasetBuilder:
                 success_count += 1
             else:
                 fail_count += 1
+            done += 1
+            if checkpoint_path and ((n + 1) % batch_size == 0 or n + 1 == len(sequential)):
+                self.save_dataset(checkpoint_path)
 
         status_msg = f"✅ Labeled {success_count}/{total} samples"
         if fail_count > 0:
@@ -655,7 +815,59 @@ class DatasetBuilder:
             status_msg += f" (unlabeled only, {len(self.samples)} total)"
 
         return self.samples, status_msg
-    
+
+    def _label_batch(
+        self,
+        sample_indices: List[int],
+        dit_handler,
+        llm_handler,
+        transcribe_lyrics: bool,
+        skip_metas: bool,
+        vae_batch_size: int,
+        progress_callback=None,
+    ) -> int:
+        """Label samples with batched audio-to-codes conversion and one batched LM understanding run.
+
+        Returns:
+            Number of samples labeled successfully
+        """
+        samples = [self.samples[i] for i in sample_indices]
+        codes_list = dit_handler.convert_src_audio_to_codes_batch(
+            [s.audio_path for s in samples], batch_size=vae_batch_size, progress_callback=progress_callback
+        )
+
+        encoded = []
+        for sample, codes in zip(samples, codes_list):
+            if codes and not codes.startswith("❌"):
+                encoded.append((sample, codes))
+            else:
+                logger.warning(f"Failed to convert audio to codes for {sample.filename}: {codes}")
+        if not encoded:
+            return 0
+
+        if progress_callback:
+            progress_callback(f"Generating metadata for {len(encoded)} samples")
+        results = llm_handler.understand_audio_from_codes_batch(
+            [codes for _, codes in encoded],
+            temperature=0.7,
+            use_constrained_decoding=True,
+        )
+
+        labeled = 0
+        for (sample, _), (metadata, status) in zip(encoded, results):
+            if not metadata:
+                logger.warning(f"LLM labeling failed for {sample.filename}: {status}")
+                continue
+            # Pre-existing metadata from CSV is kept (sample.bpm / keyscale set before labeling)
+            status_suffix = self._apply_understanding(
+                sample, metadata, transcribe_lyrics, skip_metas,
+                has_csv_bpm=sample.bpm is not None, has_csv_key=bool(sample.keyscale),
+            )
+            sample.labeled = True
+            labeled += 1
+            logger.info(self._labeled_status(sample, skip_metas, status_suffix))
+        return labeled
+
     def _get_audio_codes(self, audio_path: str, dit_handler) -> Optional[str]:
         """Encode audio to get semantic codes for LLM understanding.
         
@@ -900,6 +1112,9 @@ class DatasetBuilder:
         output_dir: str,
         max_duration: float = 240.0,
         progress_callback=None,
+        num_workers: Optional[int] = None,
+        batch_size: int = 4,
+        force: bool = False,
     ) -> Tuple[List[str], str]:
         """Preprocess all labeled samples to tensor files for efficient training.
         
@@ -908,11 +1123,18 @@ class DatasetBuilder:
         - encoder_hidden_states: Condition encoder output
         - context_latents: Source context (silence_latent + zeros for text2music)
         
+        Samples are decoded in a process pool and encoded in length-sorted batches
+        (see acestep.training.preprocess_pipeline). Samples whose audio, prompt,
+        lyrics and model are unchanged since the last run into output_dir are skipped.
+        
         Args:
             dit_handler: Initialized DiT handler with model, VAE, and text encoder
             output_dir: Directory to save preprocessed .pt files
             max_duration: Maximum audio duration in seconds (default 240s = 4 min)
             progress_callback: Optional callback for progress updates
+            num_workers: Audio decode processes (0 = decode in this process, default min(4, CPUs))
+            batch_size: Max samples per VAE / encoder batch
+            force: Reprocess every sample, even if unchanged
             
         Returns:
             Tuple of (list of output paths, status message)
@@ -931,21 +1153,6 @@ class DatasetBuilder:
         # Create output directory
         os.makedirs(output_dir, exist_ok=True)
         
-        output_paths = []
-        success_count = 0
-        fail_count = 0
-        
-        # Get model and components
-        model = dit_handler.model
-        vae = dit_handler.vae
-        text_encoder = dit_handler.text_encoder
-        text_tokenizer = dit_handler.text_tokenizer
-        silence_latent = dit_handler.silence_latent
-        device = dit_handler.device
-        dtype = dit_handler.dtype
-
-        target_sample_rate = 48000
-
         # Determine which samples use genre based on ratio (for samples without override)
         # genre_ratio: 0 = all caption, 100 = all genre
         genre_ratio = self.metadata.genre_ratio
@@ -958,186 +1165,128 @@ class DatasetBuilder:
         random.shuffle(all_indices)
         genre_indices = set(all_indices[:num_genre_samples])
 
+        items = []
         for i, sample in enumerate(labeled_samples):
-            try:
-                if progress_callback:
-                    progress_callback(f"Preprocessing {i+1}/{len(labeled_samples)}: {sample.filename}")
-
-                # Determine if this sample uses genre (per-sample override > global ratio)
-                use_genre = i in genre_indices
-
-                # Step 1: Load and preprocess audio to stereo @ 48kHz
-                audio, sr = torchaudio.load(sample.audio_path)
-                
-                # Resample if needed
-                if sr != target_sample_rate:
-                    resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-                    audio = resampler(audio)
-                
-                # Convert to stereo
-                if audio.shape[0] == 1:
-                    audio = audio.repeat(2, 1)
-                elif audio.shape[0] > 2:
-                    audio = audio[:2, :]
-                
-                # Truncate to max duration
-                max_samples = int(max_duration * target_sample_rate)
-                if audio.shape[1] > max_samples:
-                    audio = audio[:, :max_samples]
-                
-                # Add batch dimension: [2, T] -> [1, 2, T]
-                audio = audio.unsqueeze(0).to(device).to(vae.dtype)
-                
-                # Step 2: VAE encode audio to get target_latents
-                with torch.no_grad():
-                    latent = vae.encode(audio).latent_dist.sample()
-                    # [1, 64, T_latent] -> [1, T_latent, 64]
-                    target_latents = latent.transpose(1, 2).to(dtype)
-                
-                latent_length = target_latents.shape[1]
-                
-                # Step 3: Create attention mask (all ones for valid audio)
-                attention_mask = torch.ones(1, latent_length, device=device, dtype=dtype)
-
-                # Step 4: Encode caption/genre text (per-sample override > global ratio)
-                # Use SFT_GEN_PROMPT format to match inference (handler.py)
-                caption = sample.get_training_prompt(self.metadata.tag_position, use_genre=use_genre)
-
-                # Construct metas string (matches handler.py _dict_to_meta_string format)
-                metas_str = (
-                    f"- bpm: {sample.bpm if sample.bpm else 'N/A'}\n"
-                    f"- timesignature: {sample.timesignature if sample.timesignature else 'N/A'}\n"
-                    f"- keyscale: {sample.keyscale if sample.keyscale else 'N/A'}\n"
-                    f"- duration: {sample.duration} seconds\n"
-                )
-
-                # Use SFT_GEN_PROMPT format (same as inference)
-                text_prompt = SFT_GEN_PROMPT.format(DEFAULT_DIT_INSTRUCTION, caption, metas_str)
-
-                # Debug: Print first sample's text_prompt for verification
-                if i == 0:
-                    logger.info(f"\n{'='*70}")
-                    logger.info("🔍 [DEBUG] DiT TEXT ENCODER INPUT (Training Preprocess)")
-                    logger.info(f"{'='*70}")
-                    logger.info(f"text_prompt:\n{text_prompt}")
-                    logger.info(f"{'='*70}\n")
-
-                text_inputs = text_tokenizer(
-                    text_prompt,
-                    padding="max_length",
-                    max_length=256,
-                    truncation=True,
-                    return_tensors="pt",
-                )
-                text_input_ids = text_inputs.input_ids.to(device)
-                text_attention_mask = text_inputs.attention_mask.to(device).to(dtype)
-
-                with torch.no_grad():
-                    text_outputs = text_encoder(text_input_ids)
-                    text_hidden_states = text_outputs.last_hidden_state.to(dtype)
-                
-                # Step 5: Encode lyrics
-                lyrics = sample.lyrics if sample.lyrics else "[Instrumental]"
-                lyric_inputs = text_tokenizer(
-                    lyrics,
-                    padding="max_length",
-                    max_length=512,
-                    truncation=True,
-                    return_tensors="pt",
-                )
-                lyric_input_ids = lyric_inputs.input_ids.to(device)
-                lyric_attention_mask = lyric_inputs.attention_mask.to(device).to(dtype)
-                
-                with torch.no_grad():
-                    lyric_hidden_states = text_encoder.embed_tokens(lyric_input_ids).to(dtype)
-                
-                # Step 6: Prepare refer_audio (empty for text2music)
-                # Create minimal refer_audio placeholder
-                refer_audio_hidden = torch.zeros(1, 1, 64, device=device, dtype=dtype)
-                refer_audio_order_mask = torch.zeros(1, device=device, dtype=torch.long)
-                
-                # Step 7: Run model.encoder to get encoder_hidden_states
-                with torch.no_grad():
-                    encoder_hidden_states, encoder_attention_mask = model.encoder(
-                        text_hidden_states=text_hidden_states,
-                        text_attention_mask=text_attention_mask,
-                        lyric_hidden_states=lyric_hidden_states,
-                        lyric_attention_mask=lyric_attention_mask,
-                        refer_audio_acoustic_hidden_states_packed=refer_audio_hidden,
-                        refer_audio_order_mask=refer_audio_order_mask,
-                    )
-                
-                # Step 8: Build context_latents for text2music
-                # For text2music: src_latents = silence_latent, is_covers = 0
-                # chunk_masks: 1 = generate, 0 = keep original
-                # IMPORTANT: chunk_masks must have same shape as src_latents [B, T, 64]
-                # For text2music, we want to generate the entire audio, so chunk_masks = all 1s
-                src_latents = silence_latent[:, :latent_length, :].to(dtype)
-                if src_latents.shape[0] < 1:
-                    src_latents = src_latents.expand(1, -1, -1)
-                
-                # Pad or truncate silence_latent to match latent_length
-                if src_latents.shape[1] < latent_length:
-                    pad_len = latent_length - src_latents.shape[1]
-                    src_latents = torch.cat([
-                        src_latents,
-                        silence_latent[:, :pad_len, :].expand(1, -1, -1).to(dtype)
-                    ], dim=1)
-                elif src_latents.shape[1] > latent_length:
-                    src_latents = src_latents[:, :latent_length, :]
-                
-                # chunk_masks = 1 means "generate this region", 0 = keep original
-                # Shape must match src_latents: [B, T, 64] (NOT [B, T, 1])
-                # For text2music, generate everything -> all 1s with shape [1, T, 64]
-                chunk_masks = torch.ones(1, latent_length, 64, device=device, dtype=dtype)
-                # context_latents = [src_latents, chunk_masks] -> [B, T, 128]
-                context_latents = torch.cat([src_latents, chunk_masks], dim=-1)
-                
-                # Step 9: Save all tensors to .pt file (squeeze batch dimension for storage)
-                output_data = {
-                    "target_latents": target_latents.squeeze(0).cpu(),  # [T, 64]
-                    "attention_mask": attention_mask.squeeze(0).cpu(),  # [T]
-                    "encoder_hidden_states": encoder_hidden_states.squeeze(0).cpu(),  # [L, D]
-                    "encoder_attention_mask": encoder_attention_mask.squeeze(0).cpu(),  # [L]
-                    "context_latents": context_latents.squeeze(0).cpu(),  # [T, 65]
-                    "metadata": {
-                        "audio_path": sample.audio_path,
-                        "filename": sample.filename,
-                        "caption": caption,
-                        "lyrics": lyrics,
-                        "duration": sample.duration,
-                        "bpm": sample.bpm,
-                        "keyscale": sample.keyscale,
-                        "timesignature": sample.timesignature,
-                        "language": sample.language,
-                        "is_instrumental": sample.is_instrumental,
-                    }
-                }
-                
+            # Determine if this sample uses genre (per-sample override > global ratio)
+            use_genre = i in genre_indices
+            # Use SFT_GEN_PROMPT format to match inference (handler.py)
+            caption = sample.get_training_prompt(self.metadata.tag_position, use_genre=use_genre)
+            # Construct metas string (matches handler.py _dict_to_meta_string format)
+            metas_str = (
+                f"- bpm: {sample.bpm if sample.bpm else 'N/A'}\n"
+                f"- timesignature: {sample.timesignature if sample.timesignature else 'N/A'}\n"
+                f"- keyscale: {sample.keyscale if sample.keyscale else 'N/A'}\n"
+                f"- duration: {sample.duration} seconds\n"
+            )
+            text_prompt = SFT_GEN_PROMPT.format(DEFAULT_DIT_INSTRUCTION, caption, metas_str)
+            lyrics = sample.lyrics if sample.lyrics else "[Instrumental]"
+            items.append(PreprocessItem(
+                sample=sample,
+                caption=caption,
+                lyrics=lyrics,
+                text_prompt=text_prompt,
                 # Save with sample ID as filename
-                output_path = os.path.join(output_dir, f"{sample.id}.pt")
-                torch.save(output_data, output_path)
-                output_paths.append(output_path)
-                success_count += 1
-                
-            except Exception as e:
-                logger.exception(f"Error preprocessing {sample.filename}")
-                fail_count += 1
-                if progress_callback:
-                    progress_callback(f"❌ Failed: {sample.filename}: {str(e)}")
+                output_path=os.path.join(output_dir, f"{sample.id}.pt"),
+                metadata={
+                    "audio_path": sample.audio_path,
+                    "filename": sample.filename,
+                    "caption": caption,
+                    "lyrics": lyrics,
+                    "duration": sample.duration,
+                    "bpm": sample.bpm,
+                    "keyscale": sample.keyscale,
+                    "timesignature": sample.timesignature,
+                    "language": sample.language,
+                    "is_instrumental": sample.is_instrumental,
+                },
+            ))
+
+        # Debug: Print first sample's text_prompt for verification
+        logger.info(f"\n{'='*70}")
+        logger.info("🔍 [DEBUG] DiT TEXT ENCODER INPUT (Training Preprocess)")
+        logger.info(f"{'='*70}")
+        logger.info(f"text_prompt:\n{items[0].text_prompt}")
+        logger.info(f"{'='*70}\n")
+
+        preprocessor = TensorPreprocessor(
+            dit_handler, max_duration=max_duration, num_workers=num_workers, batch_size=batch_size
+        )
+
+        # Incremental: reuse tensors whose content hash matches the previous manifest
+        if progress_callback:
+            progress_callback(f"Hashing {len(items)} samples...")
+        preprocessor.hash_items(items)
+        manifest_path = os.path.join(output_dir, "manifest.json")
+        previous_samples = self._read_manifest_samples(manifest_path)
+        previous = self._read_preprocess_manifest(manifest_path) if not force else {}
+        todo = []
+        skipped = 0
+        for item in items:
+            prev = previous.get(item.output_path)
+            if prev is not None and prev[0] == item.content_hash and os.path.exists(item.output_path):
+                item.latent_length = prev[1]
+                skipped += 1
+            else:
+                todo.append(item)
+        if skipped and progress_callback:
+            progress_callback(f"Skipping {skipped} unchanged samples")
+
+        done, failed = preprocessor.run(todo, progress_callback=progress_callback) if todo else ([], [])
+        for item, error in failed:
+            if progress_callback:
+                progress_callback(f"❌ Failed: {item.sample.filename}: {error}")
+        failed_ids = {id(item) for item, _ in failed}
+        kept = [item for item in items if id(item) not in failed_ids]
+        output_paths = [item.output_path for item in kept]
         
         # Save manifest file listing all preprocessed samples
         manifest = {
             "metadata": self.metadata.to_dict(),
             "samples": output_paths,
+            # Used by the length-bucketed training sampler
+            "latent_lengths": [item.latent_length for item in kept],
+            # Content hashes for incremental re-runs
+            "content_hashes": [item.content_hash for item in kept],
             "num_samples": len(output_paths),
         }
-        manifest_path = os.path.join(output_dir, "manifest.json")
         with open(manifest_path, 'w', encoding='utf-8') as f:
             json.dump(manifest, f, indent=2)
         
-        status = f"✅ Preprocessed {success_count}/{len(labeled_samples)} samples to {output_dir}"
-        if fail_count > 0:
-            status += f" ({fail_count} failed)"
+        # Packed shards are stale once a tensor was re-encoded or the sample list changed
+        # (samples removed from the dataset or failed this time): re-pack them
+        if (done or output_paths != previous_samples) and is_sharded_tensor_dir(output_dir):
+            convert_tensor_dir_to_shards(output_dir, progress_callback=progress_callback)
+        
+        status = f"✅ Preprocessed {len(done)}/{len(labeled_samples)} samples to {output_dir}"
+        if skipped:
+            status += f" ({skipped} unchanged, skipped)"
+        if failed:
+            status += f" ({len(failed)} failed)"
         
         return output_paths, status
+
+    @staticmethod
+    def _read_manifest_samples(manifest_path: str) -> List[str]:
+        """Tensor paths listed by a previous preprocessing run (empty if there is none)."""
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return list(json.load(f).get("samples", []))
+        except (OSError, ValueError, AttributeError):
+            return []
+
+    @staticmethod
+    def _read_preprocess_manifest(manifest_path: str) -> Dict[str, Tuple[str, int]]:
+        """Tensor path -> (content hash, latent length) from a previous preprocessing run."""
+        if not os.path.exists(manifest_path):
+            return {}
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        paths = manifest.get("samples", [])
+        hashes = manifest.get("content_hashes", [])
+        lengths = manifest.get("latent_lengths", [])
+        if len(hashes) != len(paths) or len(lengths) != len(paths):
+            return {}
+        return {p: (h, n) for p, h, n in zip(paths, hashes, lengths)}
@@ -0,0 +1,327 @@
+"""
+Parallel, batched and incremental preprocessing of training samples
+
+DatasetBuilder.preprocess_to_tensors() used to handle one sample at a time:
+decode, build a new Resample transform, single-item VAE encode, text and
+condition encode, torch.save - and redo all of it for every sample on each
+run. TensorPreprocessor runs the same computation as a staged pipeline:
+- hash: a content hash per sample (audio bytes + prompt/lyrics + model
+  version) on a thread pool; samples whose hash and tensor file are unchanged
+  since the last run are skipped
+- decode: load, resample (one cached Resample per rate), stereo and truncate
+  in a process pool, prefetching the next groups while the GPU works
+- VAE: length-sorted groups encoded in one batch, bounded by total audio
+  seconds so peak memory stays that of the longest allowed single sample
+- conditioning: text encoder, lyric embeddings and condition encoder run
+  once per group
+- write: torch.save on a background thread
+
+A group that fails as a batch (e.g. out of memory) is retried one sample at
+a time.
+"""
+
+import hashlib
+import math
+import os
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torchaudio
+from loguru import logger
+
+TARGET_SAMPLE_RATE = 48000
+# Audio samples per latent frame (25 latent frames per second)
+LATENT_HOP = TARGET_SAMPLE_RATE // 25
+# Bump when the tensors written for a sample change, to invalidate all content hashes
+PREPROCESS_VERSION = 1
+
+_HASH_CHUNK_BYTES = 1024 * 1024
+
+
+@dataclass
+class PreprocessItem:
+    """One labeled sample on its way to a tensor file."""
+
+    sample: Any  # AudioSample
+    caption: str
+    lyrics: str
+    text_prompt: str
+    output_path: str
+    content_hash: str = ""
+    latent_length: int = 0
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+def content_hash(audio_path: str, *parts: Any) -> str:
+    """sha256 of an audio file's bytes plus everything else that determines its tensors."""
+    h = hashlib.sha256()
+    with open(audio_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_BYTES), b""):
+            h.update(chunk)
+    for part in parts:
+        h.update(b"\0")
+        h.update(str(part).encode("utf-8"))
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=8)
+def _resampler(orig_freq: int, new_freq: int) -> torchaudio.transforms.Resample:
+    return torchaudio.transforms.Resample(orig_freq, new_freq)
+
+
+def load_audio_stereo(audio_path: str, max_duration: float) -> np.ndarray:
+    """Decode audio to stereo @ 48kHz, truncated to max_duration and to whole latent frames.
+
+    Runs in decode worker processes.
+
+    Returns:
+        float32 array [2, samples]
+    """
+    audio, sr = torchaudio.load(audio_path)
+    if sr != TARGET_SAMPLE_RATE:
+        audio = _resampler(sr, TARGET_SAMPLE_RATE)(audio)
+    if audio.shape[0] == 1:
+        audio = audio.repeat(2, 1)
+    elif audio.shape[0] > 2:
+        audio = audio[:2, :]
+    max_samples = int(max_duration * TARGET_SAMPLE_RATE)
+    # Whole latent frames only, so every sample of a padded VAE batch maps to an exact latent length
+    length = min(audio.shape[1], max_samples)
+    if length >= LATENT_HOP:
+        length -= length % LATENT_HOP
+    return audio[:, :length].float().numpy()
+
+
+def plan_groups(items: List[PreprocessItem], max_items: int, max_seconds: float) -> List[List[PreprocessItem]]:
+    """Split items, sorted by duration, into batches of at most max_items and max_seconds of audio."""
+    ordered = sorted(items, key=lambda item: item.sample.duration or 0)
+    groups: List[List[PreprocessItem]] = []
+    current: List[PreprocessItem] = []
+    for item in ordered:
+        duration = min(float(item.sample.duration or max_seconds), max_seconds)
+        # Padded batch: every item costs as much as the longest one (the current item, by sort order)
+        if current and (len(current) >= max_items or (len(current) + 1) * duration > max_seconds):
+            groups.append(current)
+            current = []
+        current.append(item)
+    if current:
+        groups.append(current)
+    return groups
+
+
+class TensorPreprocessor:
+    """Computes training tensors for groups of samples with a DiT handler's VAE, text encoder and condition encoder."""
+
+    def __init__(
+        self,
+        dit_handler,
+        max_duration: float = 240.0,
+        num_workers: Optional[int] = None,
+        batch_size: int = 4,
+        batch_seconds: Optional[float] = None,
+        prefetch_groups: int = 2,
+    ):
+        """
+        Args:
+            dit_handler: Initialized DiT handler with model, VAE, and text encoder
+            max_duration: Audio is truncated to this many seconds
+            num_workers: Decode processes (0 decodes in this process; default min(4, CPUs))
+            batch_size: Max samples per VAE / encoder batch
+            batch_seconds: Max total audio seconds per VAE batch (default max_duration)
+            prefetch_groups: Groups decoded ahead of the one on the GPU
+        """
+        self.dit_handler = dit_handler
+        self.max_duration = max_duration
+        self.num_workers = min(4, os.cpu_count() or 1) if num_workers is None else max(0, num_workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_seconds = batch_seconds or max_duration
+        self.prefetch_groups = max(1, prefetch_groups)
+
+    @property
+    def model_version(self) -> str:
+        """Identifies the model whose encoders produce the tensors (part of every content hash)."""
+        model = self.dit_handler.model
+        config = getattr(model, "config", None)
+        return f"{type(model).__name__}:{getattr(config, '_name_or_path', '')}:{self.dit_handler.dtype}"
+
+    def hash_items(self, items: List[PreprocessItem]) -> None:
+        """Fill in the content hash of every item (reads all audio files, in parallel)."""
+        version = (PREPROCESS_VERSION, self.model_version, self.max_duration)
+
+        def _hash(item: PreprocessItem) -> str:
+            return content_hash(item.sample.audio_path, item.text_prompt, item.lyrics, item.metadata, *version)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.num_workers) * 2) as pool:
+            for item, digest in zip(items, pool.map(_hash, items)):
+                item.content_hash = digest
+
+    def run(
+        self,
+        items: List[PreprocessItem],
+        progress_callback: Optional[Callable[[str], None]] = None,
+    ) -> Tuple[List[PreprocessItem], List[Tuple[PreprocessItem, str]]]:
+        """Preprocess items and write their tensor files.
+
+        Returns:
+            Tuple of (items written, [(failed item, error)])
+        """
+        groups = plan_groups(items, self.batch_size, self.batch_seconds)
+        done: List[PreprocessItem] = []
+        failed: List[Tuple[PreprocessItem, str]] = []
+        writes: List[Tuple[PreprocessItem, Future]] = []
+
+        decoder: Optional[Executor] = ProcessPoolExecutor(max_workers=self.num_workers) if self.num_workers > 0 else None
+        writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tensor-writer")
+        pending: Deque[List[Tuple[PreprocessItem, Any]]] = deque()
+
+        def _submit(group: List[PreprocessItem]) -> List[Tuple[PreprocessItem, Any]]:
+            if decoder is None:
+                return [(item, None) for item in group]
+            return [(item, decoder.submit(load_audio_stereo, item.sample.audio_path, self.max_duration)) for item in group]
+
+        try:
+            next_group = 0
+            processed = 0
+            for _ in range(len(groups)):
+                while next_group < len(groups) and len(pending) < self.prefetch_groups:
+                    pending.append(_submit(groups[next_group]))
+                    next_group += 1
+                group = pending.popleft()
+                processed += len(group)
+                decoded: List[Tuple[PreprocessItem, np.ndarray]] = []
+                for item, future in group:
+                    try:
+                        audio = future.result() if future is not None else load_audio_stereo(
+                            item.sample.audio_path, self.max_duration
+                        )
+                        decoded.append((item, audio))
+                    except Exception as e:
+                        logger.exception(f"Error decoding {item.sample.filename}")
+                        failed.append((item, str(e)))
+                if not decoded:
+                    continue
+
+                if progress_callback:
+                    progress_callback(
+                        f"Preprocessing {processed}/{len(items)}: "
+                        f"{', '.join(item.sample.filename for item, _ in decoded)}"
+                    )
+                try:
+                    outputs = self._encode_group(decoded)
+                except Exception as e:
+                    if len(decoded) == 1:
+                        logger.exception(f"Error preprocessing {decoded[0][0].sample.filename}")
+                        failed.append((decoded[0][0], str(e)))
+                        continue
+                    logger.exception(f"Batch of {len(decoded)} samples failed, retrying one sample at a time")
+                    outputs = []
+                    for pair in decoded:
+                        try:
+                            outputs.extend(self._encode_group([pair]))
+                        except Exception as e:
+                            logger.exception(f"Error preprocessing {pair[0].sample.filename}")
+                            failed.append((pair[0], str(e)))
+                for item, output_data in outputs:
+                    writes.append((item, writer.submit(torch.save, output_data, item.output_path)))
+
+            for item, future in writes:
+                try:
+                    future.result()
+                    done.append(item)
+                except Exception as e:
+                    logger.exception(f"Error writing {item.output_path}")
+                    failed.append((item, str(e)))
+        finally:
+            writer.shutdown(wait=True)
+            if decoder is not None:
+                decoder.shutdown(wait=False, cancel_futures=True)
+        return done, failed
+
+    @torch.no_grad()
+    def _encode_group(self, decoded: List[Tuple[PreprocessItem, np.ndarray]]) -> List[Tuple[PreprocessItem, Dict[str, Any]]]:
+        """VAE-encode and condition-encode a group of decoded samples as one batch."""
+        h = self.dit_handler
+        model, vae = h.model, h.vae
+        device, dtype = h.device, h.dtype
+        batch = len(decoded)
+
+        # VAE: zero-pad to the longest sample and encode together
+        lengths = [audio.shape[1] for _, audio in decoded]
+        max_len = max(lengths)
+        audio = torch.zeros(batch, 2, max_len)
+        for i, (_, wav) in enumerate(decoded):
+            audio[i, :, :wav.shape[1]] = torch.from_numpy(wav)
+        latent = vae.encode(audio.to(device).to(vae.dtype)).latent_dist.sample()
+        # [B, 64, T_latent] -> [B, T_latent, 64]
+        target_latents = latent.transpose(1, 2).to(dtype)
+        latent_lengths = [max(1, n * target_latents.shape[1] // max_len) for n in lengths]
+
+        # Caption/metas text and lyrics (fixed-length padding, as at inference)
+        text_prompts = [item.text_prompt for item, _ in decoded]
+        text_inputs = h.text_tokenizer(
+            text_prompts,
+            padding="max_length",
+            max_length=256,
+            truncation=True,
+            return_tensors="pt",
+        )
+        text_attention_mask = text_inputs.attention_mask.to(device).to(dtype)
+        text_hidden_states = h.text_encoder(text_inputs.input_ids.to(device)).last_hidden_state.to(dtype)
+
+        lyric_inputs = h.text_tokenizer(
+            [item.lyrics for item, _ in decoded],
+            padding="max_length",
+            max_length=512,
+            truncation=True,
+            return_tensors="pt",
+        )
+        lyric_attention_mask = lyric_inputs.attention_mask.to(device).to(dtype)
+        lyric_hidden_states = h.text_encoder.embed_tokens(lyric_inputs.input_ids.to(device)).to(dtype)
+
+        # Empty refer_audio placeholder per sample (text2music)
+        refer_audio_hidden = torch.zeros(batch, 1, 64, device=device, dtype=dtype)
+        refer_audio_order_mask = torch.arange(batch, device=device, dtype=torch.long)
+
+        encoder_hidden_states, encoder_attention_mask = model.encoder(
+            text_hidden_states=text_hidden_states,
+            text_attention_mask=text_attention_mask,
+            lyric_hidden_states=lyric_hidden_states,
+            lyric_attention_mask=lyric_attention_mask,
+            refer_audio_acoustic_hidden_states_packed=refer_audio_hidden,
+            refer_audio_order_mask=refer_audio_order_mask,
+        )
+
+        silence_latent = h.silence_latent
+        outputs = []
+        for i, (item, _) in enumerate(decoded):
+            latent_length = latent_lengths[i]
+            sample_latents = target_latents[i, :latent_length]
+
+            # Batch padding of the condition: keep up to the last valid position
+            mask = encoder_attention_mask[i]
+            valid = torch.nonzero(mask).flatten()
+            enc_len = int(valid[-1]) + 1 if valid.numel() else mask.shape[0]
+
+            # context_latents for text2music: [silence_latent, chunk_masks (all 1 = generate)] -> [T, 128]
+            src_latents = silence_latent[0, :latent_length, :].to(dtype)
+            if src_latents.shape[0] < latent_length:
+                reps = math.ceil(latent_length / max(1, silence_latent.shape[1]))
+                src_latents = silence_latent[0].repeat(reps, 1)[:latent_length].to(dtype)
+            chunk_masks = torch.ones(latent_length, 64, device=src_latents.device, dtype=dtype)
+            context_latents = torch.cat([src_latents, chunk_masks], dim=-1)
+
+            item.latent_length = latent_length
+            outputs.append((item, {
+                "target_latents": sample_latents.cpu(),  # [T, 64]
+                "attention_mask": torch.ones(latent_length, dtype=dtype),  # [T]
+                "encoder_hidden_states": encoder_hidden_states[i, :enc_len].cpu(),  # [L, D]
+                "encoder_attention_mask": encoder_attention_mask[i, :enc_len].cpu(),  # [L]
+                "context_latents": context_latents.cpu(),  # [T, 128]
+                "metadata": item.metadata,
+            }))
+        return outputs
@@ -0,0 +1,308 @@
+"""
+Sharded, memory-mapped storage for preprocessed training tensors
+
+preprocess_to_tensors() writes one .pt pickle per sample, and reading them
+back means a full torch.load() (unpickling every latent and encoder state)
+per sample per epoch. With thousands of clips that dominates data loading
+and churns the page cache.
+
+A sharded tensor directory packs all samples into a few large files of raw
+tensor bytes plus one JSON index:
+- shards.json: per sample its metadata, latent length and, per tensor, the
+  shard, byte offset, dtype and shape
+- shard-00000.bin, shard-00001.bin, ...: tensor bytes, each tensor aligned
+  to 64 bytes; a sample never spans two shards
+
+TensorShardReader memory-maps the shards and returns tensors that are
+zero-copy views into the mapped files, so a sample costs a few slices
+instead of a file open + unpickle. PreprocessedTensorDataset uses it
+automatically when a directory contains shards.json.
+
+Convert an existing per-file directory (shards are written next to the .pt
+files unless --output-dir is given):
+    python -m acestep.training.tensor_shards ./datasets/preprocessed_tensors
+"""
+
+import argparse
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from loguru import logger
+
+SHARD_INDEX_FILE = "shards.json"
+SHARD_FORMAT = "acestep-tensor-shards"
+SHARD_FORMAT_VERSION = 1
+
+# Tensors stored per sample (everything PreprocessedTensorDataset returns besides metadata)
+TENSOR_KEYS = (
+    "target_latents",
+    "attention_mask",
+    "encoder_hidden_states",
+    "encoder_attention_mask",
+    "context_latents",
+)
+
+_ALIGNMENT = 64
+DEFAULT_SHARD_SIZE_BYTES = 1024 * 1024 * 1024
+
+
+def is_sharded_tensor_dir(tensor_dir: str) -> bool:
+    """Whether tensor_dir holds a sharded tensor dataset."""
+    return os.path.isfile(os.path.join(tensor_dir, SHARD_INDEX_FILE))
+
+
+def _shard_name(shard_idx: int) -> str:
+    return f"shard-{shard_idx:05d}.bin"
+
+
+def _dtype_name(dtype: torch.dtype) -> str:
+    return str(dtype).replace("torch.", "")
+
+
+class TensorShardWriter:
+    """Packs preprocessed samples into shard files and writes the index on close()."""
+
+    def __init__(
+        self,
+        output_dir: str,
+        shard_size_bytes: int = DEFAULT_SHARD_SIZE_BYTES,
+        metadata: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Args:
+            output_dir: Directory for shards.json and the shard files (existing shards are replaced)
+            shard_size_bytes: A new shard is started once the current one reaches this size
+            metadata: Dataset metadata stored in the index (as in manifest.json)
+        """
+        self.output_dir = output_dir
+        self.shard_size_bytes = max(_ALIGNMENT, int(shard_size_bytes))
+        self.metadata = metadata or {}
+        self._samples: List[Dict[str, Any]] = []
+        self._shards: List[str] = []
+        self._file = None
+        self._offset = 0
+
+        os.makedirs(output_dir, exist_ok=True)
+        # Drop the old index first: until close() the directory is not a valid sharded dataset
+        index_path = os.path.join(output_dir, SHARD_INDEX_FILE)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+    def __enter__(self) -> "TensorShardWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def num_shards(self) -> int:
+        return len(self._shards)
+
+    def _start_shard(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        name = _shard_name(len(self._shards))
+        self._shards.append(name)
+        self._file = open(os.path.join(self.output_dir, name), "wb")
+        self._offset = 0
+
+    def add(self, sample: Dict[str, Any], sample_id: str = "") -> None:
+        """
+        Append one preprocessed sample.
+
+        Args:
+            sample: Dict with the TENSOR_KEYS tensors (as saved by preprocess_to_tensors) and "metadata"
+            sample_id: Sample identifier kept in the index (e.g. the .pt file stem)
+        """
+        tensors = {key: sample[key].detach().cpu().contiguous() for key in TENSOR_KEYS}
+        nbytes = sum(t.numel() * t.element_size() + _ALIGNMENT for t in tensors.values())
+        if self._file is None or (self._offset > 0 and self._offset + nbytes > self.shard_size_bytes):
+            self._start_shard()
+
+        entries = {}
+        for key, tensor in tensors.items():
+            pad = -self._offset % _ALIGNMENT
+            if pad:
+                self._file.write(b"\0" * pad)
+                self._offset += pad
+            data = tensor.reshape(-1).view(torch.uint8).numpy()
+            self._file.write(memoryview(data))
+            entries[key] = {
+                "shard": len(self._shards) - 1,
+                "offset": self._offset,
+                "dtype": _dtype_name(tensor.dtype),
+                "shape": list(tensor.shape),
+            }
+            self._offset += data.nbytes
+
+        self._samples.append({
+            "id": sample_id,
+            "latent_length": int(tensors["target_latents"].shape[0]),
+            "metadata": sample.get("metadata", {}),
+            "tensors": entries,
+        })
+
+    def close(self) -> str:
+        """
+        Finish the last shard and write the index.
+
+        Returns:
+            Path of shards.json
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        # Remove shards left over from a previous, larger conversion
+        for name in os.listdir(self.output_dir):
+            if name.startswith("shard-") and name.endswith(".bin") and name not in self._shards:
+                os.remove(os.path.join(self.output_dir, name))
+
+        index = {
+            "format": SHARD_FORMAT,
+            "version": SHARD_FORMAT_VERSION,
+            "metadata": self.metadata,
+            "shards": self._shards,
+            "num_samples": len(self._samples),
+            "samples": self._samples,
+        }
+        index_path = os.path.join(self.output_dir, SHARD_INDEX_FILE)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, index_path)
+        return index_path
+
+
+class TensorShardReader:
+    """Random access to the samples of a sharded tensor directory via memory-mapped shards."""
+
+    def __init__(self, tensor_dir: str):
+        """
+        Args:
+            tensor_dir: Directory containing shards.json and its shard files
+        """
+        self.tensor_dir = tensor_dir
+        with open(os.path.join(tensor_dir, SHARD_INDEX_FILE), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("format") != SHARD_FORMAT or index.get("version", 0) > SHARD_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported shard index in {tensor_dir}: {index.get('format')} v{index.get('version')}"
+            )
+        self.metadata: Dict[str, Any] = index.get("metadata", {})
+        self.shards: List[str] = index["shards"]
+        self.samples: List[Dict[str, Any]] = index["samples"]
+        # Opened lazily so every DataLoader worker maps the shards itself
+        self._maps: Dict[int, np.memmap] = {}
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    @property
+    def latent_lengths(self) -> List[int]:
+        """Latent frames of every sample, in index order."""
+        return [s["latent_length"] for s in self.samples]
+
+    def _shard(self, shard_idx: int) -> np.memmap:
+        mapped = self._maps.get(shard_idx)
+        if mapped is None:
+            # Copy-on-write: pages are shared with the page cache and never written back
+            mapped = np.memmap(os.path.join(self.tensor_dir, self.shards[shard_idx]), dtype=np.uint8, mode="c")
+            self._maps[shard_idx] = mapped
+        return mapped
+
+    def _tensor(self, entry: Dict[str, Any]) -> torch.Tensor:
+        dtype = getattr(torch, entry["dtype"])
+        shape = entry["shape"]
+        numel = 1
+        for dim in shape:
+            numel *= dim
+        if numel == 0:
+            return torch.empty(shape, dtype=dtype)
+        nbytes = numel * torch.empty((), dtype=dtype).element_size()
+        offset = entry["offset"]
+        raw = torch.from_numpy(self._shard(entry["shard"])[offset:offset + nbytes])
+        return raw.view(dtype).view(shape)
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        """Tensors of a sample (views into the mapped shard) plus its metadata."""
+        sample = self.samples[idx]
+        data = {key: self._tensor(entry) for key, entry in sample["tensors"].items()}
+        data["metadata"] = sample.get("metadata", {})
+        return data
+
+
+def convert_tensor_dir_to_shards(
+    tensor_dir: str,
+    output_dir: Optional[str] = None,
+    shard_size_bytes: int = DEFAULT_SHARD_SIZE_BYTES,
+    progress_callback: Optional[Callable[[str], None]] = None,
+) -> Tuple[str, str]:
+    """Convert a per-file preprocessed tensor directory (.pt files + manifest.json) to shards.
+
+    Args:
+        tensor_dir: Directory written by DatasetBuilder.preprocess_to_tensors
+        output_dir: Where to write the shards (default: tensor_dir itself)
+        shard_size_bytes: Target size of each shard file
+        progress_callback: Optional callback for progress updates
+
+    Returns:
+        Tuple of (path of shards.json, status message)
+    """
+    output_dir = output_dir or tensor_dir
+    manifest_path = os.path.join(tensor_dir, "manifest.json")
+    metadata: Dict[str, Any] = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        metadata = manifest.get("metadata", {})
+        paths = manifest.get("samples", [])
+    else:
+        paths = sorted(os.path.join(tensor_dir, f) for f in os.listdir(tensor_dir) if f.endswith(".pt"))
+
+    written = 0
+    missing = 0
+    with TensorShardWriter(output_dir, shard_size_bytes=shard_size_bytes, metadata=metadata) as writer:
+        for i, path in enumerate(paths):
+            if not os.path.exists(path):
+                missing += 1
+                continue
+            if progress_callback:
+                progress_callback(f"Packing {i + 1}/{len(paths)}: {os.path.basename(path)}")
+            writer.add(torch.load(path, map_location="cpu"), sample_id=os.path.splitext(os.path.basename(path))[0])
+            written += 1
+    index_path = os.path.join(output_dir, SHARD_INDEX_FILE)
+
+    status = f"✅ Packed {written} samples into {writer.num_shards} shard(s) in {output_dir}"
+    if missing:
+        status += f" ({missing} tensor files missing)"
+    logger.info(status)
+    return index_path, status
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert a preprocessed tensor directory to memory-mapped shards")
+    parser.add_argument("tensor_dir", help="Directory with preprocessed .pt files and manifest.json")
+    parser.add_argument("--output-dir", default=None, help="Output directory (default: tensor_dir)")
+    parser.add_argument("--shard-size-mb", type=float, default=DEFAULT_SHARD_SIZE_BYTES / 1024**2,
+                        help="Target size of each shard file in MB")
+    args = parser.parse_args()
+    _, status = convert_tensor_dir_to_shards(
+        args.tensor_dir, args.output_dir, shard_size_bytes=int(args.shard_size_mb * 1024**2)
+    )
+    print(status)
+
+
+if __name__ == "__main__":
+    main()
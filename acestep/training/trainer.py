@@ -248,6 +248,9 @@ class LoRATrainer:
                 batch_size=self.training_config.batch_size,
                 num_workers=self.training_config.num_workers,
                 pin_memory=self.training_config.pin_memory,
+                bucket_by_length=self.training_config.bucket_by_length,
+                max_latent_frames=self.training_config.max_latent_frames,
+                seed=self.training_config.seed,
             )
             
             # Setup data
@@ -417,6 +420,9 @@ class LoRATrainer:
         self.module.model.decoder.train()
 
         for epoch in range(start_epoch, self.training_config.max_epochs):
+            # Length-bucketed batches are reshuffled per epoch
+            if hasattr(train_loader.batch_sampler, "set_epoch"):
+                train_loader.batch_sampler.set_epoch(epoch)
             epoch_loss = 0.0
             num_batches = 0
             epoch_start_time = time.time()
@@ -528,6 +534,9 @@ class LoRATrainer:
         self.module.model.decoder.train()
         
         for epoch in range(self.training_config.max_epochs):
+            # Length-bucketed batches are reshuffled per epoch
+            if hasattr(train_loader.batch_sampler, "set_epoch"):
+                train_loader.batch_sampler.set_epoch(epoch)
             epoch_loss = 0.0
             num_batches = 0
             epoch_start_time = time.time()
@@ -19,6 +19,10 @@ Usage:
     python profile_inference.py --thinking                        # Enable CoT for code generation
     python profile_inference.py --use-constrained-decoding        # Use FSM constrained decoding
     python profile_inference.py --use-cot-metas                  # Enable LM to generate metadata via CoT
+    
+    Constrained decoding overhead only (tokenizer + random logits, no models loaded):
+    python profile_inference.py --constrained-step-bench          # Per-step FSM overhead
+    python profile_inference.py --constrained-step-bench --bench-batch-size 8 --bench-steps 500
 """
 
 import time
@@ -547,6 +551,97 @@ def load_example_config(example_file: str) -> Tuple[GenerationParams, Generation
         return None, None
 
 
+def run_constrained_step_benchmark(checkpoint_dir: str, lm_model: str, device: str,
+                                   batch_size: int = 2, steps: int = 200):
+    """
+    Measure the per-step overhead of FSM constrained decoding, without any model forward.
+
+    Feeds random logits through MetadataConstrainedLogitsProcessor in the three ways the
+    LM backends use it: metadata (CoT) steps via __call__, codes steps via __call__ (PT
+    backend, batch = CFG rows) and codes steps via process_batch (nano-vllm). On CUDA it
+    also checks that codes steps run without GPU->CPU synchronization.
+    """
+    from transformers import AutoTokenizer
+    from acestep.constrained_logits_processor import MetadataConstrainedLogitsProcessor, FSMState
+
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    tokenizer = AutoTokenizer.from_pretrained(os.path.join(checkpoint_dir, lm_model))
+    vocab_size = len(tokenizer)
+
+    print("=" * 100)
+    print("⏱️  CONSTRAINED DECODING STEP BENCHMARK")
+    print("=" * 100)
+    print(f"  Tokenizer: {lm_model} ({vocab_size} tokens), Device: {device}, "
+          f"Batch: {batch_size}, Steps: {steps}")
+
+    start = time.perf_counter()
+    processor = MetadataConstrainedLogitsProcessor(tokenizer, enabled=True, debug=False)
+    print(f"  Processor init: {(time.perf_counter() - start) * 1000:.1f} ms")
+    start = time.perf_counter()
+    MetadataConstrainedLogitsProcessor(tokenizer, enabled=True, debug=False)
+    print(f"  Processor init (tables shared): {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    bench_timer = PreciseTimer(device=device)
+    torch.manual_seed(0)
+    codes_prompt = torch.tensor([tokenizer.encode("<think>\n</think>\n", add_special_tokens=False)] * batch_size)
+    # Long enough that EOS stays blocked for the whole run
+    target_duration = steps / 5 + 1
+
+    # Metadata steps: one row, greedy on random logits through the FSM
+    processor.reset()
+    processor.set_generation_phase("cot")
+    for _ in range(steps):
+        if processor.state in (FSMState.CODES_GENERATION, FSMState.COMPLETED):
+            break
+        scores = torch.randn(1, vocab_size, device=device)
+        with bench_timer.time("metadata (__call__)"):
+            scores = processor(codes_prompt[:1], scores)
+        processor.update_state(int(scores.argmax()))
+
+    # Codes steps, PT backend style: all rows share one FSM state
+    processor.reset()
+    processor.set_generation_phase("codes")
+    processor.set_target_duration(target_duration)
+    for _ in range(steps):
+        scores = torch.randn(batch_size, vocab_size, device=device)
+        with bench_timer.time("codes (__call__)"):
+            scores = processor(codes_prompt, scores)
+        processor.update_state(int(scores[0].argmax()))
+
+    # Codes steps, nano-vllm style: one FSM state per row
+    processor.reset()
+    seq_ids = list(range(batch_size))
+    token_ids = codes_prompt.tolist()
+    for _ in range(steps):
+        scores = torch.randn(batch_size, vocab_size, device=device)
+        with bench_timer.time("codes (process_batch)"):
+            scores = processor.process_batch(seq_ids, token_ids, scores)
+        processor.update_state_batch(seq_ids, scores.argmax(dim=-1).tolist())
+
+    print(f"\n{'Mode':<28} {'Steps':>6} {'Mean (us)':>12} {'P50 (us)':>12} {'Max (us)':>12}")
+    for name in ("metadata (__call__)", "codes (__call__)", "codes (process_batch)"):
+        samples = sorted(bench_timer.get_all(name))
+        if not samples:
+            continue
+        print(f"{name:<28} {len(samples):>6} {bench_timer.get_mean(name) * 1e6:>12.1f} "
+              f"{samples[len(samples) // 2] * 1e6:>12.1f} {samples[-1] * 1e6:>12.1f}")
+
+    if device.startswith("cuda"):
+        # Any synchronizing call inside a codes step raises in "error" mode
+        scores = torch.randn(batch_size, vocab_size, device=device)
+        torch.cuda.synchronize()
+        torch.cuda.set_sync_debug_mode("error")
+        try:
+            processor(codes_prompt, scores.clone())
+            processor.process_batch(seq_ids, token_ids, scores.clone())
+            print("\n  Host syncs in codes steps: none")
+        except RuntimeError as e:
+            print(f"\n  Host syncs in codes steps: {e}")
+        finally:
+            torch.cuda.set_sync_debug_mode("default")
+
+
 def main():
     global timer, llm_debugger
     
@@ -579,8 +674,23 @@ def main():
     parser.add_argument("--use-cot-metas", action="store_true",
                        help="Enable LLM to generate music metadata via CoT reasoning")
     
+    # Constrained decoding step benchmark (tokenizer only, no models)
+    parser.add_argument("--constrained-step-bench", action="store_true",
+                       help="Benchmark per-step constrained decoding overhead on random logits and exit")
+    parser.add_argument("--bench-batch-size", type=int, default=2,
+                       help="Rows per step in --constrained-step-bench (2 = one CFG pair)")
+    parser.add_argument("--bench-steps", type=int, default=200,
+                       help="Steps per mode in --constrained-step-bench")
+    
     args = parser.parse_args()
     
+    if args.constrained_step_bench:
+        run_constrained_step_benchmark(
+            args.checkpoint_dir, args.lm_model, args.device,
+            batch_size=args.bench_batch_size, steps=args.bench_steps,
+        )
+        return
+    
     # Initialize
     timer = PreciseTimer(device=args.device)
     llm_debugger = LLMDebugger()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the DTW backends used by lyric alignment.
+
+Compares the compiled (numba) kernel and the anti-diagonal wavefront kernel
+(CPU and, when available, CUDA) on cost matrices sized like real songs:
+lyric tokens x DiT latent frames (25 frames per second).
+
+Usage:
+    python scripts/benchmark_dtw.py
+    python scripts/benchmark_dtw.py --batch 8 --band 200
+    python scripts/benchmark_dtw.py --sizes 120x750 300x6000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from acestep.dit_alignment_score import dtw_batch
+
+DEFAULT_SIZES = ["80x750", "200x3000", "300x6000"]
+
+
+def make_cost(batch, n_tokens, n_frames, seed=0):
+    """Build a noisy, roughly diagonal cost matrix similar to processed attention."""
+    rng = np.random.default_rng(seed)
+    rows = np.arange(n_tokens)[:, None] / max(n_tokens - 1, 1)
+    cols = np.arange(n_frames)[None, :] / max(n_frames - 1, 1)
+    diagonal = np.exp(-((rows - cols) ** 2) / 0.002)
+    noise = rng.random((batch, n_tokens, n_frames)) * 0.3
+    return -(diagonal[None] + noise).astype(np.float32)
+
+
+def time_backend(cost, backend, band, device, repeats):
+    x = torch.from_numpy(cost).to(device) if device != "cpu-numpy" else cost
+    # Warmup (triggers numba compilation / CUDA context init)
+    dtw_batch(x[:1], backend=backend, band=band)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        paths = dtw_batch(x, backend=backend, band=band)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        timings.append(time.perf_counter() - start)
+    return min(timings), paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DTW backends for lyric alignment")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES,
+                        help="Matrix sizes as TOKENSxFRAMES")
+    parser.add_argument("--batch", type=int, default=4,
+                        help="Number of matrices (heads / batch items) per call")
+    parser.add_argument("--band", type=int, default=None,
+                        help="Sakoe-Chiba half-width in frames")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    configs = [("numba", "cpu-numpy"), ("wavefront", "cpu")]
+    if torch.cuda.is_available():
+        configs.append(("wavefront", "cuda"))
+
+    print(f"batch={args.batch} band={args.band} repeats={args.repeats}")
+    print(f"{'size':>12} {'backend':>10} {'device':>10} {'total ms':>10} {'per item ms':>12} {'match':>6}")
+    for size in args.sizes:
+        n_tokens, n_frames = (int(v) for v in size.lower().split("x"))
+        cost = make_cost(args.batch, n_tokens, n_frames)
+        reference = None
+        for backend, device in configs:
+            elapsed, paths = time_backend(cost, backend, args.band, device, args.repeats)
+            if reference is None:
+                reference = paths
+                match = "ref"
+            else:
+                same = all(
+                    np.array_equal(a[0], b[0]) and np.array_equal(a[1], b[1])
+                    for a, b in zip(paths, reference)
+                )
+                match = "yes" if same else "NO"
+            print(f"{size:>12} {backend:>10} {device:>10} {elapsed * 1000:>10.1f} "
+                  f"{elapsed * 1000 / args.batch:>12.2f} {match:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the preprocessed training data loader.
+
+Compares per-file .pt loading (one torch.load per sample) with memory-mapped
+tensor shards (acestep.training.tensor_shards), and the padding overhead of
+random vs length-bucketed batches (LengthBucketBatchSampler). Without
+--tensor-dir a synthetic dataset shaped like real preprocessed clips (25
+latent frames per second, 64-dim latents, bf16) is written to a temporary
+directory.
+
+Usage:
+    python scripts/benchmark_training_loader.py
+    python scripts/benchmark_training_loader.py --samples 2000 --num-workers 4
+    python scripts/benchmark_training_loader.py --batch-size 8 --max-latent-frames 24000
+    python scripts/benchmark_training_loader.py --tensor-dir ./datasets/preprocessed_tensors
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import torch
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from acestep.training.data_module import (
+    LengthBucketBatchSampler,
+    PreprocessedTensorDataset,
+    collate_preprocessed_batch,
+)
+from acestep.training.tensor_shards import convert_tensor_dir_to_shards
+
+
+def make_dataset(tensor_dir, n_samples, min_seconds, max_seconds, hidden_size, seed=0):
+    """Write n_samples synthetic preprocessed .pt files plus manifest.json."""
+    gen = torch.Generator().manual_seed(seed)
+    paths = []
+    for i in range(n_samples):
+        seconds = min_seconds + (max_seconds - min_seconds) * torch.rand(1, generator=gen).item()
+        frames = int(seconds * 25)
+        enc_len = 256 + 512
+        sample = {
+            "target_latents": torch.randn(frames, 64, generator=gen).to(torch.bfloat16),
+            "attention_mask": torch.ones(frames, dtype=torch.bfloat16),
+            "encoder_hidden_states": torch.randn(enc_len, hidden_size, generator=gen).to(torch.bfloat16),
+            "encoder_attention_mask": torch.ones(enc_len, dtype=torch.bfloat16),
+            "context_latents": torch.randn(frames, 128, generator=gen).to(torch.bfloat16),
+            "metadata": {"filename": f"sample_{i:05d}.wav", "duration": round(seconds, 2)},
+        }
+        path = os.path.join(tensor_dir, f"sample_{i:05d}.pt")
+        torch.save(sample, path)
+        paths.append(path)
+    with open(os.path.join(tensor_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"metadata": {"name": "benchmark"}, "samples": paths, "num_samples": len(paths)}, f)
+
+
+def time_loader(tensor_dir, batch_size, num_workers, epochs):
+    """Seconds per epoch (best of epochs) iterating a shuffled DataLoader over tensor_dir."""
+    dataset = PreprocessedTensorDataset(tensor_dir)
+    loader = torch.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=True,
+        num_workers=num_workers,
+        collate_fn=collate_preprocessed_batch,
+        persistent_workers=num_workers > 0,
+    )
+    timings = []
+    for _ in range(epochs):
+        start = time.perf_counter()
+        for batch in loader:
+            # Touch the data as the training step would
+            batch["target_latents"].float().sum()
+        timings.append(time.perf_counter() - start)
+    return min(timings), len(dataset)
+
+
+def padding_stats(lengths, batches):
+    """(padded latent frames / real frames, number of batches) of a batching."""
+    padded = sum(len(b) * max(lengths[i] for i in b) for b in batches)
+    return padded / max(1, sum(lengths[i] for b in batches for i in b)), len(batches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-file vs sharded preprocessed tensor loading")
+    parser.add_argument("--tensor-dir", default=None,
+                        help="Existing preprocessed tensor directory (default: synthetic dataset)")
+    parser.add_argument("--samples", type=int, default=500, help="Synthetic samples")
+    parser.add_argument("--min-seconds", type=float, default=30.0)
+    parser.add_argument("--max-seconds", type=float, default=240.0)
+    parser.add_argument("--hidden-size", type=int, default=2048, help="Encoder hidden size of synthetic samples")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--num-workers", type=int, default=0)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--shard-size-mb", type=float, default=1024.0)
+    parser.add_argument("--max-latent-frames", type=int, default=None,
+                        help="Latent frame budget per bucketed batch (default: fixed --batch-size)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="acestep_loader_bench_")
+    try:
+        files_dir = args.tensor_dir
+        if files_dir is None:
+            files_dir = os.path.join(work_dir, "files")
+            os.makedirs(files_dir)
+            print(f"Writing {args.samples} synthetic samples to {files_dir} ...")
+            make_dataset(files_dir, args.samples, args.min_seconds, args.max_seconds, args.hidden_size)
+        shards_dir = os.path.join(work_dir, "shards")
+        start = time.perf_counter()
+        convert_tensor_dir_to_shards(files_dir, shards_dir, shard_size_bytes=int(args.shard_size_mb * 1024**2))
+        print(f"Conversion: {time.perf_counter() - start:.1f}s")
+
+        print(f"batch_size={args.batch_size} num_workers={args.num_workers} epochs={args.epochs}")
+        print(f"{'layout':>10} {'samples':>8} {'epoch s':>9} {'samples/s':>10}")
+        results = {}
+        for layout, tensor_dir in (("files", files_dir), ("shards", shards_dir)):
+            elapsed, n = time_loader(tensor_dir, args.batch_size, args.num_workers, args.epochs)
+            results[layout] = elapsed
+            print(f"{layout:>10} {n:>8} {elapsed:>9.2f} {n / elapsed:>10.1f}")
+        print(f"Speedup: {results['files'] / results['shards']:.2f}x")
+
+        lengths = PreprocessedTensorDataset(shards_dir).latent_lengths
+        perm = torch.randperm(len(lengths)).tolist()
+        random_batches = [perm[i:i + args.batch_size] for i in range(0, len(perm), args.batch_size)]
+        bucketed = list(LengthBucketBatchSampler(
+            lengths, batch_size=args.batch_size, max_latent_frames=args.max_latent_frames
+        ))
+        print(f"{'batching':>10} {'batches':>8} {'padded/real frames':>19}")
+        for name, batches in (("random", random_batches), ("bucketed", bucketed)):
+            ratio, n_batches = padding_stats(lengths, batches)
+            print(f"{name:>10} {n_batches:>8} {ratio:>19.3f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""A request merged into a DiT batch must get the latent length and mask it gets on its own."""
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from acestep.dit_batching import DiTBatchScheduler
+
+_HANDLER = SimpleNamespace(_has_audio_codes=lambda codes: bool(codes))
+
+
+def _request(duration: float, caption: str = "pop", seed: int = 1) -> dict:
+    return {"captions": caption, "audio_duration": duration, "seed": seed, "inference_steps": 8}
+
+
+def test_only_equal_lengths_share_a_batch_key():
+    scheduler = DiTBatchScheduler(max_batch_size=4)
+    key = scheduler.batch_key(_HANDLER, _request(30.0))
+    assert key is not None
+    assert scheduler.batch_key(_HANDLER, _request(30.0, caption="rock", seed=2)) == key
+    assert scheduler.batch_key(_HANDLER, _request(32.0)) != key
+    assert scheduler.batch_key(_HANDLER, _request(30.4)) != key
+
+
+@pytest.fixture
+def handler():
+    handler_module = pytest.importorskip("acestep.handler")
+    h = handler_module.AceStepHandler.__new__(handler_module.AceStepHandler)
+    h.model = h.vae = h.text_tokenizer = h.text_encoder = object()
+    h.current_offload_cost = 0.0
+    h.sample_rate = 48000
+
+    def prepare(audio_duration=None, captions="", seed=None, **_):
+        return {
+            "batch_size": 1,
+            "target_wavs": h.create_target_wavs(audio_duration).unsqueeze(0),
+            "captions": [captions], "lyrics": [""], "metas": [{}], "vocal_languages": ["en"],
+            "refer_audios": [[]], "seeds": [seed], "instructions": [""], "audio_code_hints": [None],
+            "task_type": "text2music", "seed_value": str(seed),
+        }
+
+    def service_generate(target_wavs, **_):
+        # Latent mask of silent targets, as built by _prepare_batch
+        lengths = [target_wavs.shape[-1] // 1920] * target_wavs.shape[0]
+        max_length = max(128, max(lengths))
+        masks = torch.stack([torch.cat([torch.ones(n), torch.zeros(max_length - n)]) for n in lengths]).long()
+        batch = target_wavs.shape[0]
+        return {
+            "target_latents": torch.zeros(batch, max_length, 64),
+            "latent_masks": masks,
+            "spans": [("full", 0, max_length)] * batch,
+            "time_costs": {"total_time_cost": 0.0},
+        }
+
+    h._prepare_generation_inputs = prepare
+    h.service_generate = service_generate
+    h._decode_pred_latents = lambda latents, *_: (torch.zeros(latents.shape[0], 2, latents.shape[1] * 1920), latents.cpu())
+    return h
+
+
+def test_batched_request_matches_solo_run(handler):
+    solo = handler.generate_music_batch([_request(30.0)])[0]
+    merged = handler.generate_music_batch([_request(30.0), _request(30.0, caption="rock", seed=2)])[0]
+    assert solo["success"] and merged["success"]
+    solo_mask = solo["extra_outputs"]["latent_masks"]
+    merged_mask = merged["extra_outputs"]["latent_masks"]
+    assert merged_mask.shape == solo_mask.shape
+    assert torch.equal(merged_mask, solo_mask)
+    assert merged["audios"][0]["tensor"].shape == solo["audios"][0]["tensor"].shape
+
+
+def test_different_lengths_are_not_merged(handler):
+    results = handler.generate_music_batch([_request(30.0), _request(40.0)])
+    assert not any(r["success"] for r in results)
@@ -0,0 +1,38 @@
+"""Collation and length-bucketed sampling of preprocessed training tensors."""
+import pytest
+import torch
+
+data_module = pytest.importorskip("acestep.training.data_module")
+
+
+def _sample(length: int, encoder_length: int = 4, dtype: torch.dtype = torch.bfloat16) -> dict:
+    return {
+        "target_latents": torch.ones(length, 64, dtype=dtype),
+        "attention_mask": torch.ones(length, dtype=dtype),
+        "encoder_hidden_states": torch.ones(encoder_length, 8, dtype=dtype),
+        "encoder_attention_mask": torch.ones(encoder_length, dtype=dtype),
+        "context_latents": torch.ones(length, 65, dtype=dtype),
+        "metadata": {},
+    }
+
+
+def test_padded_batch_is_promoted_like_concatenated_padding():
+    batch = data_module.collate_preprocessed_batch([_sample(10), _sample(6, encoder_length=4)])
+    # Latents needed padding: bf16 + float32 zeros -> float32, as with torch.cat
+    assert batch["target_latents"].dtype == torch.float32
+    assert batch["target_latents"].shape == (2, 10, 64)
+    assert batch["attention_mask"][1].tolist() == [1.0] * 6 + [0.0] * 4
+    # Encoder states all have the same length: no padding, stored dtype
+    assert batch["encoder_hidden_states"].dtype == torch.bfloat16
+
+
+def test_sampler_epoch_only_advances_through_set_epoch():
+    sampler = data_module.LengthBucketBatchSampler(list(range(100, 2100, 20)), batch_size=3, seed=0)
+    first = list(sampler)
+    assert len(sampler) == len(first)
+    assert list(sampler) == first
+    sampler.set_epoch(1)
+    second = list(sampler)
+    assert len(sampler) == len(second)
+    assert second != first
+    assert sorted(i for b in second for i in b) == sorted(i for b in first for i in b)